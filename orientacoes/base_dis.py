@@ -0,0 +1,380 @@
+"""
+Bases SQLite locais: as DIs parseadas e custeadas (BaseDIs), para consultas entre DIs,
+e o índice de produtos Código → Unid/Caixa aprendido das próprias DIs (IndiceProdutos).
+"""
+import datetime
+import sqlite3
+
+from nucleo_di import converte_ponto_fixo, data_iso, decimal_ou_nulo
+
+
+# === BASE LOCAL DE DIs (SQLite) PARA CONSULTAS ENTRE DIs === #
+
+def _sequencial(dados):
+    """Sequencial de retificação como inteiro (ordem numérica no SQLite); nulo sem adições ou não numérico"""
+    sequencial = str(dados["adicoes"][0].get("sequencial_retificacao", "")) if dados["adicoes"] else ""
+    return int(sequencial) if sequencial.isdigit() else None
+
+
+class BaseDIs:
+    """
+    Base SQLite local com as DIs parseadas e custeadas, para consultas entre DIs.
+
+    As tabelas são normalizadas (dis → adicoes → tributos/custos/itens) e indexadas por
+    NCM, fornecedor, fabricante, data de registro e código do produto. A gravação é
+    idempotente em (número da DI, sequencial de retificação): gravar de novo a mesma
+    DI substitui a versão anterior. As consultas consideram apenas a última
+    retificação de cada DI (coluna vigente, exposta pela visão dis_vigentes).
+    """
+
+    # Colunas gravadas: (coluna, tipo SQLite, extrator). Os extratores das tabelas dis,
+    # adicoes, tributos, custos e itens recebem a DI, a adição e o item, respectivamente.
+    COLUNAS = {
+        "dis": [
+            ("numero_di", "TEXT NOT NULL", lambda d: d["cabecalho"]["DI"]),
+            ("sequencial_retificacao", "INTEGER", _sequencial),
+            ("data_registro", "TEXT", lambda d: data_iso(d["cabecalho"]["Data registro"])),
+            ("urf_despacho", "TEXT", lambda d: d["cabecalho"]["URF despacho"]),
+            ("modalidade", "TEXT", lambda d: d["cabecalho"]["Modalidade"]),
+            ("situacao", "TEXT", lambda d: d["cabecalho"]["Situação"]),
+            ("qtd_adicoes", "INTEGER", lambda d: d["cabecalho"]["Qtd. adições"]),
+            ("cnpj_importador", "TEXT", lambda d: d["importador"]["CNPJ"]),
+            ("nome_importador", "TEXT", lambda d: d["importador"]["Nome"]),
+            ("peso_bruto_kg", "REAL", lambda d: d["carga"]["Peso bruto (kg)"]),
+            ("peso_liquido_kg", "REAL", lambda d: d["carga"]["Peso líquido (kg)"]),
+            ("fob_usd", "REAL", lambda d: d["valores"]["FOB USD"]),
+            ("fob_brl", "REAL", lambda d: d["valores"]["FOB R$"]),
+            ("frete_usd", "REAL", lambda d: d["valores"]["Frete USD"]),
+            ("frete_brl", "REAL", lambda d: d["valores"]["Frete R$"]),
+            ("seguro_brl", "REAL", lambda d: d["valores"]["Seguro R$"]),
+            ("afrmm_brl", "REAL", lambda d: d["valores"].get("AFRMM R$")),
+            ("siscomex_brl", "REAL", lambda d: d["valores"].get("Siscomex R$")),
+            ("valor_aduaneiro_brl", "REAL", lambda d: d["valores"]["Valor Aduaneiro R$"]),
+            ("frete_embutido", "TEXT", lambda d: d.get("configuracao_custos", {}).get("Frete Embutido")),
+            ("seguro_embutido", "TEXT", lambda d: d.get("configuracao_custos", {}).get("Seguro Embutido")),
+            ("custo_total_brl", "REAL", lambda d: d.get("validacao_custos", {}).get("Custo Total Calculado")),
+            ("status_validacao", "TEXT", lambda d: d.get("validacao_custos", {}).get("Status")),
+            ("info_complementar", "TEXT", lambda d: d["info_complementar"]),
+        ],
+        "adicoes": [
+            ("numero", "TEXT", lambda ad: ad["numero"]),
+            ("numero_li", "TEXT", lambda ad: ad["numero_li"]),
+            ("ncm", "TEXT", lambda ad: ad["dados_gerais"]["NCM"]),
+            ("descricao_ncm", "TEXT", lambda ad: ad["dados_gerais"]["Descrição NCM"]),
+            ("incoterm", "TEXT", lambda ad: ad["dados_gerais"]["INCOTERM"]),
+            ("local", "TEXT", lambda ad: ad["dados_gerais"]["Local"]),
+            ("moeda", "TEXT", lambda ad: ad["dados_gerais"]["Moeda"]),
+            ("vcmv_usd", "REAL", lambda ad: ad["dados_gerais"]["VCMV USD"]),
+            ("vcmv_brl", "REAL", lambda ad: ad["dados_gerais"]["VCMV R$"]),
+            ("peso_liquido_kg", "REAL", lambda ad: ad["dados_gerais"]["Peso líq. (kg)"]),
+            ("quantidade", "REAL", lambda ad: ad["dados_gerais"]["Quantidade"]),
+            ("unidade", "TEXT", lambda ad: ad["dados_gerais"]["Unidade"]),
+            ("fornecedor_nome", "TEXT", lambda ad: ad["partes"]["Exportador"]),
+            ("pais_aquisicao", "TEXT", lambda ad: ad["partes"]["País Aquisição"]),
+            ("fabricante_nome", "TEXT", lambda ad: ad["partes"]["Fabricante"]),
+            ("pais_origem", "TEXT", lambda ad: ad["partes"]["País Origem"]),
+        ],
+        "tributos": [
+            ("ii_aliquota", "REAL", lambda ad: ad["tributos"]["II Alíq. (%)"]),
+            ("ii_regime", "TEXT", lambda ad: ad["tributos"]["II Regime"]),
+            ("ii_brl", "REAL", lambda ad: ad["tributos"]["II R$"]),
+            ("ipi_aliquota", "REAL", lambda ad: ad["tributos"]["IPI Alíq. (%)"]),
+            ("ipi_regime", "TEXT", lambda ad: ad["tributos"]["IPI Regime"]),
+            ("ipi_brl", "REAL", lambda ad: ad["tributos"]["IPI R$"]),
+            ("pis_aliquota", "REAL", lambda ad: ad["tributos"]["PIS Alíq. (%)"]),
+            ("pis_brl", "REAL", lambda ad: ad["tributos"]["PIS R$"]),
+            ("cofins_aliquota", "REAL", lambda ad: ad["tributos"]["COFINS Alíq. (%)"]),
+            ("cofins_brl", "REAL", lambda ad: ad["tributos"]["COFINS R$"]),
+            ("base_pis_cofins_brl", "REAL", lambda ad: ad["tributos"]["Base PIS/COFINS R$"]),
+            ("regime_pis_cofins", "TEXT", lambda ad: ad["tributos"]["Regime PIS/COFINS"]),
+        ],
+        "custos": [
+            ("valor_mercadoria_brl", "REAL", lambda ad: ad["custos"].get("Valor Mercadoria R$")),
+            ("frete_rateado_brl", "REAL", lambda ad: ad["custos"].get("Frete Rateado R$")),
+            ("seguro_rateado_brl", "REAL", lambda ad: ad["custos"].get("Seguro Rateado R$")),
+            ("afrmm_rateado_brl", "REAL", lambda ad: ad["custos"].get("AFRMM Rateado R$")),
+            ("siscomex_rateado_brl", "REAL", lambda ad: ad["custos"].get("Siscomex Rateado R$")),
+            ("ii_incorporado_brl", "REAL", lambda ad: ad["custos"].get("II Incorporado R$")),
+            ("custo_total_brl", "REAL", lambda ad: ad["custos"].get("Custo Total Adição R$")),
+            ("participacao_pct", "REAL", lambda ad: ad["custos"].get("% Participação")),
+        ],
+        "itens": [
+            ("seq", "TEXT", lambda it: it["Seq"]),
+            ("codigo", "TEXT", lambda it: it["Código"]),
+            ("descricao", "TEXT", lambda it: it["Descrição"]),
+            ("qtd", "REAL", lambda it: it["Qtd"]),
+            ("unidade", "TEXT", lambda it: it["Unidade"]),
+            ("valor_unit_usd", "REAL", lambda it: it["Valor Unit. USD"]),
+            ("unid_caixa", "INTEGER", lambda it: it["Unid/Caixa"]),
+            ("valor_total_usd", "REAL", lambda it: it["Valor Total USD"]),
+            ("custo_total_brl", "REAL", lambda it: decimal_ou_nulo(it.get("Custo Total Item R$"))),
+            ("custo_unitario_brl", "REAL", lambda it: decimal_ou_nulo(it.get("Custo Unitário R$"))),
+            ("custo_por_peca_brl", "REAL", lambda it: decimal_ou_nulo(it.get("Custo por Peça R$"))),
+        ],
+    }
+
+    # Chave estrangeira de cada tabela filha
+    # (tipo INTEGER explícito: sem ele o SQLite não usa os índices nos JOINs com id)
+    PAIS = {"adicoes": "di_id INTEGER NOT NULL REFERENCES dis(id) ON DELETE CASCADE",
+            "tributos": "adicao_id INTEGER NOT NULL REFERENCES adicoes(id) ON DELETE CASCADE",
+            "custos": "adicao_id INTEGER NOT NULL REFERENCES adicoes(id) ON DELETE CASCADE",
+            "itens": "adicao_id INTEGER NOT NULL REFERENCES adicoes(id) ON DELETE CASCADE"}
+
+    INDICES = [
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_dis_chave ON dis(numero_di, sequencial_retificacao)",
+        "CREATE INDEX IF NOT EXISTS ix_dis_data ON dis(data_registro)",
+        "CREATE INDEX IF NOT EXISTS ix_adicoes_di ON adicoes(di_id)",
+        "CREATE INDEX IF NOT EXISTS ix_adicoes_ncm ON adicoes(ncm)",
+        "CREATE INDEX IF NOT EXISTS ix_adicoes_fornecedor ON adicoes(fornecedor_nome)",
+        "CREATE INDEX IF NOT EXISTS ix_adicoes_fabricante ON adicoes(fabricante_nome)",
+        "CREATE INDEX IF NOT EXISTS ix_tributos_adicao ON tributos(adicao_id)",
+        "CREATE INDEX IF NOT EXISTS ix_custos_adicao ON custos(adicao_id)",
+        "CREATE INDEX IF NOT EXISTS ix_itens_adicao ON itens(adicao_id)",
+        "CREATE INDEX IF NOT EXISTS ix_itens_codigo ON itens(codigo)",
+    ]
+
+    # Agrupamentos aceitos por tributos_por (whitelist das expressões SQL)
+    AGRUPAMENTOS = {
+        "ncm": "a.ncm",
+        "fornecedor": "a.fornecedor_nome",
+        "fabricante": "a.fabricante_nome",
+        "mes": "substr(d.data_registro, 1, 7)",
+        "di": "d.numero_di",
+    }
+
+    def __init__(self, caminho=":memory:"):
+        self.caminho = caminho
+        self.conexao = sqlite3.connect(str(caminho), timeout=60)
+        self.conexao.row_factory = sqlite3.Row
+        self.conexao.execute("PRAGMA foreign_keys = ON")
+        if str(caminho) != ":memory:":
+            # Vários workers do lote podem gravar na mesma base
+            self.conexao.execute("PRAGMA journal_mode = WAL")
+        self._cria_esquema()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fecha()
+
+    def fecha(self):
+        self.conexao.close()
+
+    def _cria_esquema(self):
+        with self.conexao:
+            for tabela, colunas in self.COLUNAS.items():
+                definicoes = ["id INTEGER PRIMARY KEY"]
+                if tabela in self.PAIS:
+                    definicoes.append(self.PAIS[tabela])
+                definicoes += [f"{coluna} {tipo}" for coluna, tipo, _ in colunas]
+                if tabela == "dis":
+                    definicoes.append("vigente INTEGER NOT NULL DEFAULT 1")
+                self.conexao.execute(f"CREATE TABLE IF NOT EXISTS {tabela} ({', '.join(definicoes)})")
+            for indice in self.INDICES:
+                self.conexao.execute(indice)
+            self.conexao.execute("CREATE VIEW IF NOT EXISTS dis_vigentes AS SELECT * FROM dis WHERE vigente = 1")
+
+    def _insere(self, tabela, valores, pai_id=None):
+        colunas = [coluna for coluna, _, _ in self.COLUNAS[tabela]]
+        if pai_id is not None:
+            colunas.insert(0, self.PAIS[tabela].split()[0])
+            valores = [pai_id] + valores
+        sql = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})"
+        return self.conexao.execute(sql, valores).lastrowid
+
+    def grava(self, dados: dict) -> int:
+        """
+        Grava (ou substitui) uma DI custeada; devolve o id da DI na base.
+
+        A DI é identificada por número + sequencial de retificação; a versão anterior,
+        se houver, é apagada com suas adições, tributos, custos e itens na mesma transação.
+        """
+        if dados.get("ponto_fixo"):
+            dados = converte_ponto_fixo(dados)
+        linha_di = [extrator(dados) for _, _, extrator in self.COLUNAS["dis"]]
+        with self.conexao:
+            # IS em vez de =: o sequencial nulo (DI sem adições) também identifica a versão
+            self.conexao.execute("DELETE FROM dis WHERE numero_di = ? AND sequencial_retificacao IS ?",
+                                 linha_di[:2])
+            di_id = self._insere("dis", linha_di)
+            # Só a maior retificação gravada de cada DI fica vigente (a nula só se for a única)
+            self.conexao.execute("""
+                UPDATE dis SET vigente = (sequencial_retificacao IS (
+                    SELECT MAX(sequencial_retificacao) FROM dis WHERE numero_di = ?))
+                WHERE numero_di = ?""", linha_di[:1] * 2)
+            for ad in dados["adicoes"]:
+                adicao_id = self._insere("adicoes", [extrator(ad) for _, _, extrator in self.COLUNAS["adicoes"]],
+                                         di_id)
+                self._insere("tributos", [extrator(ad) for _, _, extrator in self.COLUNAS["tributos"]], adicao_id)
+                if "custos" in ad:
+                    self._insere("custos", [extrator(ad) for _, _, extrator in self.COLUNAS["custos"]], adicao_id)
+                colunas_itens = ["adicao_id"] + [coluna for coluna, _, _ in self.COLUNAS["itens"]]
+                self.conexao.executemany(
+                    f"INSERT INTO itens ({', '.join(colunas_itens)}) VALUES ({', '.join('?' * len(colunas_itens))})",
+                    ([adicao_id] + [extrator(item) for _, _, extrator in self.COLUNAS["itens"]]
+                     for item in ad["itens"]))
+        return di_id
+
+    @staticmethod
+    def _filtros(ncm=None, fornecedor=None, fabricante=None, codigo=None, data_inicio=None, data_fim=None,
+                 codigo_em_itens=False):
+        """
+        Cláusula WHERE (sobre dis_vigentes d, adicoes a e, com codigo_em_itens, itens i)
+        e parâmetros para os filtros informados
+        """
+        for data in (data_inicio, data_fim):
+            if data is not None and data_iso(data) is None:
+                raise ValueError(f"Data inválida: {data} (use AAAA-MM-DD ou AAAAMMDD)")
+        condicoes, parametros = [], []
+        for expressao, valor in (("a.ncm = ?", ncm), ("a.fornecedor_nome = ?", fornecedor),
+                                 ("a.fabricante_nome = ?", fabricante),
+                                 ("d.data_registro >= ?", data_iso(data_inicio)),
+                                 ("d.data_registro <= ?", data_iso(data_fim))):
+            if valor is not None:
+                condicoes.append(expressao)
+                parametros.append(valor)
+        if codigo is not None:
+            condicoes.append("i.codigo = ?" if codigo_em_itens else
+                             "a.id IN (SELECT adicao_id FROM itens WHERE codigo = ?)")
+            parametros.append(codigo)
+        return (" WHERE " + " AND ".join(condicoes) if condicoes else ""), parametros
+
+    def tributos_por(self, agrupar_por="ncm", **filtros) -> list:
+        """
+        Totais de tributos e custos por NCM, fornecedor, fabricante, mês ou DI.
+
+        Ex.: base.tributos_por("fabricante", ncm="73181500", data_inicio="2023-01-01", data_fim="2023-03-31")
+
+        Args:
+            agrupar_por: Uma das chaves de AGRUPAMENTOS
+            filtros: ncm, fornecedor, fabricante, codigo, data_inicio, data_fim (datas em AAAA-MM-DD ou AAAAMMDD)
+        """
+        if agrupar_por not in self.AGRUPAMENTOS:
+            raise ValueError(f"Agrupamento desconhecido: {agrupar_por} (use {', '.join(self.AGRUPAMENTOS)})")
+        grupo = self.AGRUPAMENTOS[agrupar_por]
+        where, parametros = self._filtros(**filtros)
+        sql = f"""
+            SELECT {grupo} AS grupo, COUNT(DISTINCT d.id) AS dis, COUNT(*) AS adicoes,
+                   SUM(a.vcmv_brl) AS vcmv_brl, SUM(t.ii_brl) AS ii_brl, SUM(t.ipi_brl) AS ipi_brl,
+                   SUM(t.pis_brl) AS pis_brl, SUM(t.cofins_brl) AS cofins_brl,
+                   SUM(c.custo_total_brl) AS custo_total_brl
+            FROM dis_vigentes d
+            JOIN adicoes a ON a.di_id = d.id
+            JOIN tributos t ON t.adicao_id = a.id
+            LEFT JOIN custos c ON c.adicao_id = a.id
+            {where}
+            GROUP BY grupo ORDER BY grupo"""
+        return [dict(linha) for linha in self.conexao.execute(sql, parametros)]
+
+    def itens(self, limite=None, **filtros) -> list:
+        """Itens com DI, adição, NCM, fornecedor e fabricante, filtrados como em tributos_por"""
+        where, parametros = self._filtros(**filtros, codigo_em_itens=True)
+        sql = f"""
+            SELECT d.numero_di, d.sequencial_retificacao, d.data_registro, a.numero AS adicao, a.ncm,
+                   a.fornecedor_nome, a.fabricante_nome, i.seq, i.codigo, i.descricao, i.qtd, i.unidade,
+                   i.valor_unit_usd, i.unid_caixa, i.valor_total_usd, i.custo_total_brl,
+                   i.custo_unitario_brl, i.custo_por_peca_brl
+            FROM dis_vigentes d
+            JOIN adicoes a ON a.di_id = d.id
+            JOIN itens i ON i.adicao_id = a.id
+            {where}
+            ORDER BY d.data_registro, d.numero_di, a.numero, i.seq"""
+        if limite:
+            sql += f" LIMIT {int(limite)}"
+        return [dict(linha) for linha in self.conexao.execute(sql, parametros)]
+
+    def dis(self, **filtros) -> list:
+        """DIs vigentes (última retificação) que têm alguma adição dentro dos filtros"""
+        where, parametros = self._filtros(**filtros)
+        sql = f"""
+            SELECT d.id, d.numero_di, d.sequencial_retificacao, d.data_registro, d.nome_importador,
+                   d.valor_aduaneiro_brl, d.custo_total_brl, d.status_validacao
+            FROM dis_vigentes d
+            WHERE d.id IN (SELECT a.di_id FROM adicoes a JOIN dis_vigentes d ON d.id = a.di_id {where})
+            ORDER BY d.data_registro, d.numero_di"""
+        return [dict(linha) for linha in self.conexao.execute(sql, parametros)]
+
+
+# === ÍNDICE DE PRODUTOS (CÓDIGO → UNIDADES POR CAIXA) === #
+
+class IndiceProdutos:
+    """
+    Cadastro SQLite de produtos aprendido das próprias DIs: Código → Unid/Caixa e a
+    última descrição, fornecedor e DI em que o código apareceu.
+
+    Itens cuja descrição traz "EM CX COM" alimentam o índice; itens do mesmo código sem
+    essa informação recebem dele a Unid/Caixa. O índice inteiro é lido na abertura, de
+    modo que cada item conhecido custa uma busca em dicionário.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.conexao = sqlite3.connect(str(caminho), timeout=60)
+        with self.conexao:
+            self.conexao.execute("""
+                CREATE TABLE IF NOT EXISTS produtos (
+                    codigo TEXT PRIMARY KEY, unidades_caixa INTEGER, descricao TEXT, fornecedor TEXT,
+                    numero_di TEXT, atualizado_em TEXT)""")
+        self._unidades = dict(self.conexao.execute(
+            "SELECT codigo, unidades_caixa FROM produtos WHERE unidades_caixa IS NOT NULL"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fecha()
+
+    def fecha(self):
+        self.conexao.close()
+
+    def unidades(self, codigo):
+        """Unid/Caixa conhecida do código (ou "N/A")"""
+        return self._unidades.get(codigo, "N/A")
+
+    def aplica(self, dados) -> int:
+        """
+        Registra os produtos da DI e preenche a Unid/Caixa dos itens que não a trazem na descrição
+
+        Returns:
+            Quantidade de itens preenchidos pelo índice
+        """
+        agora = datetime.datetime.now().isoformat(timespec="seconds")
+        numero_di = dados["cabecalho"]["DI"]
+        produtos = {}
+        sem_unidades = []
+        for ad in dados["adicoes"]:
+            fornecedor = ad["partes"]["Exportador"]
+            for item in ad["itens"]:
+                codigo = item["Código"]
+                if codigo == "N/A":
+                    continue
+                unidades = item["Unid/Caixa"]
+                if unidades == "N/A":
+                    sem_unidades.append(item)
+                    unidades = None
+                else:
+                    self._unidades[codigo] = unidades
+                anterior = produtos.get(codigo)
+                if unidades is None and anterior is not None:
+                    unidades = anterior[1]
+                produtos[codigo] = (codigo, unidades, item["Descrição"], fornecedor, numero_di, agora)
+
+        # Depois de registrar toda a DI: um item pode vir antes de outro do mesmo código que traz a caixa
+        preenchidos = 0
+        for item in sem_unidades:
+            unidades = self._unidades.get(item["Código"])
+            if unidades is not None:
+                item["Unid/Caixa"] = unidades
+                preenchidos += 1
+
+        with self.conexao:
+            self.conexao.executemany("""
+                INSERT INTO produtos (codigo, unidades_caixa, descricao, fornecedor, numero_di, atualizado_em)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(codigo) DO UPDATE SET
+                    unidades_caixa = COALESCE(excluded.unidades_caixa, unidades_caixa),
+                    descricao = excluded.descricao, fornecedor = excluded.fornecedor,
+                    numero_di = excluded.numero_di, atualizado_em = excluded.atualizado_em""",
+                produtos.values())
+        return preenchidos
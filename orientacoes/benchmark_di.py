@@ -0,0 +1,475 @@
+"""
+Benchmark do parse, dos custos e da gravação do extrato com DIs sintéticas de vários
+tamanhos (gera_di_sintetica), com comparação contra uma execução anterior.
+"""
+from pathlib import Path
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import math
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import extrato_excel
+import nucleo_di
+from extrato_excel import gera_excel_completo, importa_xlsxwriter_streaming
+from nucleo_di import (
+    MODULOS_PESADOS, ORCAMENTO_IMPORTACAO_MS, calcula_icms, calcular_custos_unitarios, carrega_di_completo,
+    numpy_disponivel, validar_custos,
+)
+
+log = logging.getLogger("ExtratoDI")
+
+
+# Campos fixos das DIs sintéticas (valores do leiaute real, sem efeito nos cálculos)
+_CAMPOS_FIXOS_ADICAO_SINTETICA = {
+    "cideValorAliquotaEspecifica": "00000000000", "cideValorDevido": "0" * 15, "cideValorRecolher": "0" * 15,
+    "codigoRelacaoCompradorVendedor": "2", "codigoVinculoCompradorVendedor": "1",
+    "cofinsAliquotaEspecificaQuantidadeUnidade": "0" * 9, "cofinsAliquotaEspecificaValor": "0" * 10,
+    "cofinsAliquotaReduzida": "00000", "condicaoVendaIncoterm": "FOB", "condicaoVendaLocal": "PORTO DE SANTOS",
+    "condicaoVendaMetodoValoracaoCodigo": "01",
+    "condicaoVendaMetodoValoracaoNome": "METODO 1 - ART. 1 DO ACORDO (DECRETO 92930/86)",
+    "condicaoVendaMoedaCodigo": "220", "condicaoVendaMoedaNome": "DOLAR DOS EUA",
+    "dadosCambiaisCoberturaCambialCodigo": "1",
+    "dadosCambiaisCoberturaCambialNome": "COM COBERTURA CAMBIAL E PAGAMENTO FINAL A PRAZO DE ATE' 180",
+    "dadosCambiaisInstituicaoFinanciadoraCodigo": "00", "dadosCambiaisInstituicaoFinanciadoraNome": "N/I",
+    "dadosCambiaisMotivoSemCoberturaCodigo": "00", "dadosCambiaisMotivoSemCoberturaNome": "N/I",
+    "dadosCambiaisValorRealCambio": "0" * 15, "dadosCargaPaisProcedenciaCodigo": "000",
+    "dadosCargaUrfEntradaCodigo": "0000000", "dadosCargaViaTransporteCodigo": "00",
+    "dadosMercadoriaAplicacao": "REVENDA", "dadosMercadoriaCodigoNaladiNCCA": "0000000",
+    "dadosMercadoriaCodigoNaladiSH": "00000000", "dadosMercadoriaCondicao": "NOVA",
+    "dadosMercadoriaMedidaEstatisticaUnidade": "QUILOGRAMA LIQUIDO",
+    "dcrCoeficienteReducao": "00000", "dcrIdentificacao": "00000000", "dcrValorDevido": "0" * 15,
+    "dcrValorDolar": "0" * 15, "dcrValorReal": "0" * 15, "dcrValorRecolher": "0" * 15,
+    "fabricanteCidade": "JIANGYIN", "fabricanteEstado": "CHINA", "fabricanteLogradouro": "YANGTZE RIVER DELTA",
+    "fabricanteNome": "FABRICANTE SINTETICO CO.,LTD", "fabricanteNumero": "0000",
+    "fornecedorCidade": "KOWLOON", "fornecedorComplemento": "707", "fornecedorEstado": "HONG KONG, CH",
+    "fornecedorLogradouro": "NATHAN ROAD", "fornecedorNome": "FORNECEDOR SINTETICO LIMITED",
+    "fornecedorNumero": "707", "freteMoedaNegociadaCodigo": "000",
+    "iiAcordoTarifarioTipoCodigo": "0", "iiAliquotaAcordo": "00000", "iiAliquotaAdValorem": "01600",
+    "iiAliquotaPercentualReducao": "00000", "iiAliquotaReduzida": "00000",
+    "iiAliquotaValorReduzido": "0" * 15, "iiFundamentoLegalCodigo": "00",
+    "iiMotivoAdmissaoTemporariaCodigo": "00", "iiRegimeTributacaoCodigo": "1",
+    "iiRegimeTributacaoNome": "RECOLHIMENTO INTEGRAL", "ipiAliquotaAdValorem": "00650",
+    "ipiAliquotaEspecificaCapacidadeRecipciente": "00000",
+    "ipiAliquotaEspecificaQuantidadeUnidadeMedida": "0" * 9, "ipiAliquotaEspecificaTipoRecipienteCodigo": "00",
+    "ipiAliquotaEspecificaValorUnidadeMedida": "0" * 10, "ipiAliquotaNotaComplementarTIPI": "00",
+    "ipiAliquotaReduzida": "00000", "ipiRegimeTributacaoCodigo": "4", "ipiRegimeTributacaoNome": "SEM BENEFICIO",
+    "numeroLI": "0000000000", "paisAquisicaoMercadoriaCodigo": "351", "paisAquisicaoMercadoriaNome": "HONG KONG",
+    "paisOrigemMercadoriaCodigo": "160", "paisOrigemMercadoriaNome": "CHINA, REPUBLICA POPULAR",
+    "pisCofinsBaseCalculoAliquotaICMS": "00000", "pisCofinsBaseCalculoFundamentoLegalCodigo": "00",
+    "pisCofinsBaseCalculoPercentualReducao": "00000", "pisCofinsFundamentoLegalReducaoCodigo": "00",
+    "pisCofinsRegimeTributacaoCodigo": "1", "pisCofinsRegimeTributacaoNome": "RECOLHIMENTO INTEGRAL",
+    "cofinsAliquotaAdValorem": "00965", "pisPasepAliquotaAdValorem": "00210",
+    "pisPasepAliquotaEspecificaQuantidadeUnidade": "0" * 9, "pisPasepAliquotaEspecificaValor": "0" * 10,
+    "pisPasepAliquotaReduzida": "00000", "relacaoCompradorVendedor": "Fabricante não é o Exportador",
+    "seguroMoedaNegociadaCodigo": "000", "seguroValorMoedaNegociada": "0" * 15,
+    "sequencialRetificacao": "00", "valorMultaARecolher": "0" * 15, "valorMultaARecolherAjustado": "0" * 15,
+    "vinculoCompradorVendedor": "Não há vinculação entre comprador e vendedor.",
+}
+
+_PALAVRAS_DESCRICAO_SINTETICA = ("PARAFUSO", "PORCA", "ARRUELA", "ROLAMENTO", "RETENTOR", "JUNTA", "MOLA",
+                                 "PINO", "BUCHA", "CABO", "ACO", "INOX", "ZINCADO", "PARA", "MOTOCICLETA",
+                                 "MARCA", "DURA", "5X16", "M8", "PHILIPS", "SEXTAVADO", "REFORCADO")
+
+
+def _descricao_sintetica(rng, codigo, tamanho):
+    """Descrição no padrão "CÓDIGO - TEXTO ... EM CX COM N UNIDADES" lido pelos extratores"""
+    inicio = f"{codigo:06d} - "
+    fim = f" EM CX COM {rng.choice((10, 20, 50, 100))} UNIDADES"
+    palavras = []
+    restante = tamanho - len(inicio) - len(fim)
+    while restante > 0:
+        palavra = rng.choice(_PALAVRAS_DESCRICAO_SINTETICA)
+        palavras.append(palavra)
+        restante -= len(palavra) + 1
+    return (inicio + " ".join(palavras))[:max(tamanho - len(fim), len(inicio))] + fim
+
+
+def gera_di_sintetica(xml_path: Path, adicoes: int = 10, itens_por_adicao: int = 10, tamanho_descricao: int = 80,
+                      total_itens: int = None, semente: int = 0) -> Path:
+    """
+    Grava um XML ListaDeclaracoes sintético no leiaute da DI (mesmas tags do XML real).
+
+    Os valores são coerentes entre si (FOB = soma dos VCMV, tributos pelas alíquotas),
+    então a validação de custos fecha como em uma DI real. O XML é escrito adição a
+    adição, sem montar a árvore em memória.
+
+    Args:
+        adicoes: Quantidade de adições (ignorado quando total_itens é informado)
+        itens_por_adicao: Mercadorias por adição
+        tamanho_descricao: Tamanho aproximado de cada descricaoMercadoria
+        total_itens: Se informado, distribui esse total em adições de itens_por_adicao (a última com o resto)
+        semente: Semente do gerador pseudoaleatório; a mesma semente gera o mesmo arquivo
+    """
+    rng = random.Random(semente)
+    if total_itens is not None:
+        adicoes = max(math.ceil(total_itens / itens_por_adicao), 1)
+        itens_adicoes = [itens_por_adicao] * (adicoes - 1) + [total_itens - itens_por_adicao * (adicoes - 1)]
+    else:
+        itens_adicoes = [itens_por_adicao] * adicoes
+
+    numero_di = f"99{semente % 10 ** 8:08d}"
+    taxa_cambio = 52177  # R$ por USD, em 1/10000
+    fob_usd = fob_brl = peso_total = 0
+    ii_total = 0
+
+    def campo(tag, valor):
+        return f"<{tag}>{valor}</{tag}>"
+
+    xml_path = Path(xml_path)
+    with open(xml_path, "w", encoding="utf-8", newline="\n") as arq:
+        arq.write('<?xml version="1.0" encoding="UTF-8"?>\n<ListaDeclaracoes><declaracaoImportacao>')
+        codigo = 100000
+        for numero_adicao, qtd_itens in enumerate(itens_adicoes, 1):
+            mercadorias = []
+            vcmv_usd = 0  # centavos
+            for seq in range(1, qtd_itens + 1):
+                codigo += 1
+                qtd = rng.randint(1, 500)
+                valor_unit = rng.randint(10, 50000)  # centavos de USD
+                vcmv_usd += qtd * valor_unit
+                mercadorias.append("<mercadoria>" + "".join((
+                    campo("descricaoMercadoria", _descricao_sintetica(rng, codigo, tamanho_descricao)),
+                    campo("numeroSequencialItem", f"{seq:02d}"),
+                    campo("quantidade", f"{qtd * 100000:014d}"),
+                    campo("unidadeMedida", f"{'CAIXA':<20}"),
+                    campo("valorUnitario", f"{valor_unit * 100000:020d}"),
+                )) + "</mercadoria>")
+            vcmv_brl = vcmv_usd * taxa_cambio // 10000
+            peso = rng.randint(1, 1000) * 1000 * max(qtd_itens, 1)
+            frete_brl, seguro_brl = vcmv_brl * 5 // 100, vcmv_brl // 200
+            base = vcmv_brl + frete_brl + seguro_brl
+            ii = base * 16 // 100
+            fob_usd, fob_brl, peso_total, ii_total = fob_usd + vcmv_usd, fob_brl + vcmv_brl, peso_total + peso, ii_total + ii
+
+            campos = dict(_CAMPOS_FIXOS_ADICAO_SINTETICA)
+            campos.update({
+                "cofinsAliquotaValorDevido": f"{base * 965 // 10000:015d}",
+                "cofinsAliquotaValorRecolher": f"{base * 965 // 10000:015d}",
+                "condicaoVendaValorMoeda": f"{vcmv_usd:015d}",
+                "condicaoVendaValorReais": f"{vcmv_brl:015d}",
+                "dadosMercadoriaCodigoNcm": f"7318{rng.randint(1000, 9999)}",
+                "dadosMercadoriaMedidaEstatisticaQuantidade": f"{peso:014d}",
+                "dadosMercadoriaNomeNcm": "-- Outros parafusos e pinos ou pernos",
+                "dadosMercadoriaPesoLiquido": f"{peso:015d}",
+                "freteValorMoedaNegociada": f"{vcmv_usd * 5 // 100:015d}",
+                "freteValorReais": f"{frete_brl:015d}",
+                "iiAliquotaValorCalculado": f"{ii:015d}",
+                "iiAliquotaValorDevido": f"{ii:015d}",
+                "iiAliquotaValorRecolher": f"{ii:015d}",
+                "iiBaseCalculo": f"{base:015d}",
+                "ipiAliquotaValorDevido": f"{(base + ii) * 65 // 1000:015d}",
+                "ipiAliquotaValorRecolher": f"{(base + ii) * 65 // 1000:015d}",
+                "numeroAdicao": f"{numero_adicao:03d}",
+                "numeroDI": numero_di,
+                "pisCofinsBaseCalculoValor": f"{base:015d}",
+                "pisPasepAliquotaValorDevido": f"{base * 21 // 1000:015d}",
+                "pisPasepAliquotaValorRecolher": f"{base * 21 // 1000:015d}",
+                "seguroValorReais": f"{seguro_brl:015d}",
+                "valorReaisFreteInternacional": f"{frete_brl:015d}",
+                "valorReaisSeguroInternacional": f"{seguro_brl:015d}",
+                "valorTotalCondicaoVenda": f"{vcmv_usd:011d}",
+            })
+            # Mesma ordem do XML real: tags em ordem alfabética, com as mercadorias no lugar de "mercadoria"
+            partes = [campo(tag, valor) for tag, valor in sorted(campos.items())]
+            posicao = sum(1 for tag in campos if tag < "mercadoria")
+            partes[posicao:posicao] = mercadorias
+            arq.write("<adicao>" + "".join(partes) + "</adicao>")
+
+        frete_total_brl, seguro_total_brl = fob_brl * 5 // 100, fob_brl // 200
+        frete_total_usd = fob_usd * 5 // 100
+        arq.write("".join((
+            campo("afrmm", f"{frete_total_brl * 25 // 100:015d}"),
+            "<armazem><nomeArmazem>TECA      </nomeArmazem></armazem>",
+            campo("armazenamentoRecintoAduaneiroNome", "RECINTO SINTETICO LTDA"),
+            campo("cargaDataChegada", "20240110"),
+            campo("cargaPesoBruto", f"{peso_total * 103 // 100:015d}"),
+            campo("cargaPesoLiquido", f"{peso_total:015d}"),
+            campo("dataRegistro", f"2024{semente % 12 + 1:02d}15"),
+            campo("documentoChegadaCargaNome", "DTA"),
+            campo("documentoChegadaCargaNumero", f"24/{semente % 10 ** 8:08d}"),
+            campo("freteTotalDolares", f"{frete_total_usd:015d}"),
+            campo("freteTotalReais", f"{frete_total_brl:015d}"),
+            campo("importadorCpfRepresentanteLegal", "00000000000"),
+            campo("importadorEnderecoBairro", "CENTRO"),
+            campo("importadorEnderecoCep", "74000000"),
+            campo("importadorEnderecoLogradouro", "RUA SINTETICA"),
+            campo("importadorEnderecoMunicipio", "GOIANIA"),
+            campo("importadorEnderecoNumero", "100"),
+            campo("importadorEnderecoUf", "GO"),
+            campo("importadorNome", "IMPORTADOR SINTETICO LTDA"),
+            campo("importadorNomeRepresentanteLegal", "REPRESENTANTE SINTETICO"),
+            campo("importadorNumero", "00000000000191"),
+            campo("informacaoComplementar", "DI SINTETICA GERADA PARA BENCHMARK"),
+            campo("localDescargaTotalReais", f"{fob_brl + frete_total_brl + seguro_total_brl:015d}"),
+            campo("localEmbarqueTotalDolares", f"{fob_usd:015d}"),
+            campo("localEmbarqueTotalReais", f"{fob_brl:015d}"),
+            campo("modalidadeDespachoNome", "Normal"),
+            campo("numeroDI", numero_di),
+            campo("seguroTotalReais", f"{seguro_total_brl:015d}"),
+            campo("sequencialRetificacao", "00"),
+            campo("situacaoEntregaCarga", "ENTREGA NAO AUTORIZADA"),
+            campo("taxaSiscomex", f"{15423 + 2966 * len(itens_adicoes):015d}"),
+            campo("totalAdicoes", f"{len(itens_adicoes):03d}"),
+            campo("urfDespachoNome", "GOIANIA"),
+        )))
+        arq.write("</declaracaoImportacao></ListaDeclaracoes>\n")
+    return xml_path
+
+
+ETAPAS_BENCHMARK = ("carrega_di_completo", "calcular_custos_unitarios", "validar_custos", "calcula_icms",
+                    "gera_excel_completo")
+
+
+def _etapas_benchmark(xml_path, xlsx, excel_streaming, processos_parse=None, vetorizado=False):
+    """Executa as etapas medidas em sequência, gerando o nome de cada uma ao concluí-la"""
+    dados = carrega_di_completo(xml_path, processos=processos_parse)
+    yield "carrega_di_completo"
+    calcular_custos_unitarios(dados, vetorizado=vetorizado)
+    yield "calcular_custos_unitarios"
+    dados["validacao_custos"] = validar_custos(dados)
+    yield "validar_custos"
+    dados["icms"] = calcula_icms(dados)
+    yield "calcula_icms"
+    gera_excel_completo(dados, xlsx, streaming=excel_streaming)
+    yield "gera_excel_completo"
+
+
+def _sha256_codigo():
+    """SHA-256 (12 primeiros dígitos) do código medido: o núcleo e a gravação do extrato"""
+    sha256 = hashlib.sha256()
+    for modulo in (nucleo_di, extrato_excel):
+        sha256.update(Path(modulo.__file__).read_bytes())
+    return sha256.hexdigest()[:12]
+
+
+def executa_benchmark(tamanhos=(10, 100, 1000, 10000, 100000), itens_por_adicao=100, tamanho_descricao=80,
+                      repeticoes=1, memoria=True, excel_streaming=False, pasta_xmls: Path = None,
+                      processos_parse=None, vetorizado=False) -> dict:
+    """
+    Mede parse, custeio, validação, ICMS e Excel sobre DIs sintéticas de tamanhos crescentes.
+
+    Os tempos são os melhores de `repeticoes` execuções sem rastreamento. O pico de
+    memória (alocações Python via tracemalloc, incluindo os dados já carregados pelas
+    etapas anteriores) vem de uma execução extra, pois o rastreamento distorce os tempos.
+
+    Args:
+        tamanhos: Quantidades totais de itens (mercadorias) de cada DI gerada
+        pasta_xmls: Se informada, mantém ali os XMLs gerados (por padrão, pasta temporária)
+        processos_parse: Se maior que 1, mede o parse paralelo das adições (ver carrega_dis_paralelo);
+                         o pico de memória não inclui o dos processos do pool
+        vetorizado: Se True, mede calcular_custos_unitarios com o motor NumPy
+
+    Returns:
+        Dicionário serializável em JSON com ambiente, parâmetros e resultados por tamanho
+    """
+    resultados = []
+    with tempfile.TemporaryDirectory(prefix="benchmark_di_") as temporaria:
+        pasta = Path(pasta_xmls) if pasta_xmls else Path(temporaria)
+        pasta.mkdir(parents=True, exist_ok=True)
+        for total_itens in tamanhos:
+            xml_path = gera_di_sintetica(pasta / f"DI_sintetica_{total_itens}_itens.xml",
+                                         itens_por_adicao=itens_por_adicao, tamanho_descricao=tamanho_descricao,
+                                         total_itens=total_itens)
+            xlsx = Path(temporaria) / f"ExtratoDI_CUSTOS_{total_itens}.xlsx"
+
+            tempos = {etapa: [] for etapa in ETAPAS_BENCHMARK}
+            for _ in range(repeticoes):
+                inicio = time.perf_counter()
+                for etapa in _etapas_benchmark(xml_path, xlsx, excel_streaming, processos_parse, vetorizado):
+                    fim = time.perf_counter()
+                    tempos[etapa].append(fim - inicio)
+                    inicio = fim
+
+            picos = {}
+            if memoria:
+                tracemalloc.start()
+                try:
+                    for etapa in _etapas_benchmark(xml_path, xlsx, excel_streaming, processos_parse, vetorizado):
+                        picos[etapa] = tracemalloc.get_traced_memory()[1]
+                        tracemalloc.reset_peak()
+                finally:
+                    tracemalloc.stop()
+
+            etapas = {
+                etapa: {"tempo_s": round(min(tempos[etapa]), 6),
+                        "tempo_mediano_s": round(statistics.median(tempos[etapa]), 6),
+                        "pico_memoria_mb": round(picos[etapa] / 2 ** 20, 3) if etapa in picos else None}
+                for etapa in ETAPAS_BENCHMARK
+            }
+            resultados.append({
+                "itens": total_itens,
+                "adicoes": max(math.ceil(total_itens / itens_por_adicao), 1),
+                "tamanho_xml_bytes": xml_path.stat().st_size,
+                "etapas": etapas,
+                "tempo_total_s": round(sum(e["tempo_s"] for e in etapas.values()), 6),
+            })
+            log.info("Benchmark %d itens: %s", total_itens,
+                     ", ".join(f"{etapa} {e['tempo_s']:.3f}s" for etapa, e in etapas.items()))
+
+    import pandas as pd
+    import xlsxwriter
+
+    return {
+        "ambiente": {
+            "script_sha256": _sha256_codigo(),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "pandas": pd.__version__,
+            "xlsxwriter": xlsxwriter.__version__,
+            "data": datetime.datetime.now().isoformat(timespec="seconds"),
+        },
+        "parametros": {
+            "tamanhos": list(tamanhos),
+            "itens_por_adicao": itens_por_adicao,
+            "tamanho_descricao": tamanho_descricao,
+            "repeticoes": repeticoes,
+            "excel_streaming": excel_streaming,
+            "processos_parse": processos_parse,
+            "vetorizado": vetorizado,
+        },
+        "resultados": resultados,
+        "importacao_nucleo": mede_importacao_nucleo(),
+    }
+
+
+_CODIGO_IMPORTACAO_NUCLEO = """
+import json, sys, time
+inicio = time.perf_counter()
+import nucleo_di
+print(json.dumps({"ms": (time.perf_counter() - inicio) * 1000,
+                  "pesados": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def mede_importacao_nucleo(repeticoes=5) -> dict:
+    """
+    Mede o tempo de `import nucleo_di` em interpretadores novos (sem cache de módulos)
+
+    Returns:
+        Dicionário com o melhor e o mediano tempo (ms) e os módulos pesados carregados
+        junto com o núcleo (deveria ser sempre vazio)
+    """
+    tempos, pesados = [], set()
+    for _ in range(repeticoes):
+        saida = subprocess.run([sys.executable, "-c", _CODIGO_IMPORTACAO_NUCLEO % (MODULOS_PESADOS,)],
+                               cwd=Path(__file__).resolve().parent, capture_output=True, text=True, check=True)
+        medida = json.loads(saida.stdout)
+        tempos.append(medida["ms"])
+        pesados.update(medida["pesados"])
+    return {"tempo_ms": round(min(tempos), 2), "tempo_mediano_ms": round(statistics.median(tempos), 2),
+            "modulos_pesados": sorted(pesados)}
+
+
+def compara_benchmarks(anterior: dict, atual: dict, tolerancia: float = 0.10, minimo_s: float = 0.001) -> list:
+    """
+    Compara dois resultados de executa_benchmark, etapa a etapa, nos tamanhos em comum
+
+    Pioras de menos de minimo_s segundos não contam como regressão (ruído de medição
+    em etapas de microssegundos).
+
+    Returns:
+        Lista de linhas com tempos antes/depois, variação e se excede a tolerância (regressão)
+    """
+    antes = {r["itens"]: r["etapas"] for r in anterior["resultados"]}
+    comparacao = []
+    for resultado in atual["resultados"]:
+        etapas_antes = antes.get(resultado["itens"])
+        if etapas_antes is None:
+            continue
+        for etapa, medida in resultado["etapas"].items():
+            if etapa not in etapas_antes:
+                continue
+            tempo_antes, tempo_depois = etapas_antes[etapa]["tempo_s"], medida["tempo_s"]
+            variacao = (tempo_depois / tempo_antes - 1) if tempo_antes else 0.0
+            comparacao.append({
+                "Itens": resultado["itens"],
+                "Etapa": etapa,
+                "Antes (s)": tempo_antes,
+                "Depois (s)": tempo_depois,
+                "Variação %": round(variacao * 100, 2),
+                "Regressão": variacao > tolerancia and tempo_depois - tempo_antes > minimo_s,
+            })
+    return comparacao
+
+
+def main_benchmark(argv=None):
+    """Ponto de entrada de linha de comando do benchmark (ver executa_benchmark)"""
+    parser = argparse.ArgumentParser(
+        prog="benchmark",
+        description="Mede parse, custos, validação e Excel sobre DIs sintéticas de tamanhos crescentes.")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000],
+                        help="Quantidades de itens das DIs geradas (padrão: 10 100 1000 10000 100000)")
+    parser.add_argument("--itens-por-adicao", type=int, default=100, help="Mercadorias por adição (padrão: 100)")
+    parser.add_argument("--tamanho-descricao", type=int, default=80,
+                        help="Tamanho aproximado das descrições das mercadorias (padrão: 80)")
+    parser.add_argument("--repeticoes", type=int, default=1, help="Execuções por tamanho; vale o melhor tempo")
+    parser.add_argument("--sem-memoria", action="store_true", help="Não mede o pico de memória (mais rápido)")
+    parser.add_argument("--excel-streaming", action="store_true", help="Mede gera_excel_completo com streaming=True")
+    parser.add_argument("--pasta-xmls", default=None, metavar="PASTA", help="Mantém os XMLs sintéticos nessa pasta")
+    parser.add_argument("--processos-parse", type=int, default=None, metavar="N",
+                        help="Mede o parse paralelo das adições em N processos")
+    parser.add_argument("--vetorizado", action="store_true",
+                        help="Mede calcular_custos_unitarios com o motor NumPy (requer numpy)")
+    parser.add_argument("-o", "--saida", default="benchmark.json", help="JSON de resultados (padrão: benchmark.json)")
+    parser.add_argument("--comparar", default=None, metavar="JSON",
+                        help="Resultado anterior para comparar; sai com código 1 se alguma etapa piorar além da tolerância")
+    parser.add_argument("--tolerancia", type=float, default=10.0, help="Piora aceita na comparação, em %% (padrão: 10)")
+    parser.add_argument("--orcamento-importacao-ms", type=float, default=ORCAMENTO_IMPORTACAO_MS,
+                        help="Tempo máximo de 'import nucleo_di'; sai com código 1 se exceder "
+                             f"(padrão: {ORCAMENTO_IMPORTACAO_MS:g})")
+    args = parser.parse_args(argv)
+    if args.itens_por_adicao < 1 or args.repeticoes < 1 or any(t < 1 for t in args.tamanhos):
+        parser.error("--tamanhos, --itens-por-adicao e --repeticoes devem ser positivos")
+    if args.excel_streaming:
+        try:
+            importa_xlsxwriter_streaming()
+        except (ImportError, RuntimeError) as e:
+            parser.error(f"--excel-streaming: {e}")
+    if args.vetorizado and not numpy_disponivel():
+        parser.error("--vetorizado requer o pacote numpy")
+
+    resultado = executa_benchmark(args.tamanhos, args.itens_por_adicao, args.tamanho_descricao, args.repeticoes,
+                                  memoria=not args.sem_memoria, excel_streaming=args.excel_streaming,
+                                  pasta_xmls=args.pasta_xmls, processos_parse=args.processos_parse,
+                                  vetorizado=args.vetorizado)
+    Path(args.saida).write_text(json.dumps(resultado, ensure_ascii=False, indent=2), encoding="utf-8")
+    log.info("Resultados gravados em %s", args.saida)
+
+    importacao = resultado["importacao_nucleo"]
+    falhas = 0
+    if importacao["modulos_pesados"]:
+        log.warning("import nucleo_di carregou módulos pesados: %s", ", ".join(importacao["modulos_pesados"]))
+        falhas += 1
+    if importacao["tempo_ms"] > args.orcamento_importacao_ms:
+        log.warning("import nucleo_di levou %.1f ms (orçamento: %.1f ms)",
+                    importacao["tempo_ms"], args.orcamento_importacao_ms)
+        falhas += 1
+    else:
+        log.info("import nucleo_di: %.1f ms", importacao["tempo_ms"])
+
+    if not args.comparar:
+        return 1 if falhas else 0
+    anterior = json.loads(Path(args.comparar).read_text(encoding="utf-8"))
+    for parametro in ("itens_por_adicao", "tamanho_descricao", "excel_streaming", "processos_parse", "vetorizado"):
+        if anterior["parametros"].get(parametro) != resultado["parametros"][parametro]:
+            log.warning("Parâmetro %s diferente do resultado anterior (%s → %s); a comparação pode não ser válida",
+                        parametro, anterior["parametros"].get(parametro), resultado["parametros"][parametro])
+    regressoes = 0
+    for linha in compara_benchmarks(anterior, resultado, args.tolerancia / 100):
+        regressoes += linha["Regressão"]
+        (log.warning if linha["Regressão"] else log.info)(
+            "%7d itens %-26s %9.4fs → %9.4fs (%+.1f%%)", linha["Itens"], linha["Etapa"],
+            linha["Antes (s)"], linha["Depois (s)"], linha["Variação %"])
+    if regressoes:
+        log.warning("%d etapa(s) acima da tolerância de %.1f%%", regressoes, args.tolerancia)
+    return 1 if regressoes or falhas else 0
@@ -0,0 +1,218 @@
+"""
+Exportação colunar das DIs (Parquet / Arrow IPC / CSV) para o data warehouse.
+
+pyarrow é importado só na gravação em Parquet ou Arrow; CSV usa só a biblioteca padrão.
+"""
+from pathlib import Path
+import csv
+import os
+import tempfile
+
+from nucleo_di import converte_ponto_fixo, data_aaaammdd, decimal_ou_nulo
+
+
+# === EXPORTAÇÃO COLUNAR (Parquet / Arrow IPC / CSV) PARA O DATA WAREHOUSE === #
+
+def _texto(valor):
+    return None if valor is None else str(valor)
+
+
+def _inteiro(valor):
+    return int(valor) if isinstance(valor, (int, float)) and not isinstance(valor, bool) else None
+
+
+def _sim_nao(valor):
+    return None if valor is None else valor == "Sim"
+
+
+# Colunas de cada tabela: (nome, tipo, extrator). Os extratores recebem (dados, adição, item);
+# adição e item são None nas tabelas de nível superior.
+ESQUEMA_COLUNAR = {
+    "dis": [
+        ("di", "string", lambda d, ad, it: _texto(d["cabecalho"]["DI"])),
+        ("data_registro", "date", lambda d, ad, it: data_aaaammdd(d["cabecalho"]["Data registro"])),
+        ("urf_despacho", "string", lambda d, ad, it: _texto(d["cabecalho"]["URF despacho"])),
+        ("modalidade", "string", lambda d, ad, it: _texto(d["cabecalho"]["Modalidade"])),
+        ("situacao", "string", lambda d, ad, it: _texto(d["cabecalho"]["Situação"])),
+        ("qtd_adicoes", "int64", lambda d, ad, it: _inteiro(d["cabecalho"]["Qtd. adições"])),
+        ("cnpj_importador", "string", lambda d, ad, it: _texto(d["importador"]["CNPJ"])),
+        ("nome_importador", "string", lambda d, ad, it: _texto(d["importador"]["Nome"])),
+        ("peso_bruto_kg", "float64", lambda d, ad, it: decimal_ou_nulo(d["carga"]["Peso bruto (kg)"])),
+        ("peso_liquido_kg", "float64", lambda d, ad, it: decimal_ou_nulo(d["carga"]["Peso líquido (kg)"])),
+        ("fob_usd", "float64", lambda d, ad, it: decimal_ou_nulo(d["valores"]["FOB USD"])),
+        ("fob_brl", "float64", lambda d, ad, it: decimal_ou_nulo(d["valores"]["FOB R$"])),
+        ("frete_usd", "float64", lambda d, ad, it: decimal_ou_nulo(d["valores"]["Frete USD"])),
+        ("frete_brl", "float64", lambda d, ad, it: decimal_ou_nulo(d["valores"]["Frete R$"])),
+        ("seguro_brl", "float64", lambda d, ad, it: decimal_ou_nulo(d["valores"]["Seguro R$"])),
+        ("afrmm_brl", "float64", lambda d, ad, it: decimal_ou_nulo(d["valores"].get("AFRMM R$"))),
+        ("siscomex_brl", "float64", lambda d, ad, it: decimal_ou_nulo(d["valores"].get("Siscomex R$"))),
+        ("valor_aduaneiro_brl", "float64", lambda d, ad, it: decimal_ou_nulo(d["valores"]["Valor Aduaneiro R$"])),
+        ("ii_brl", "float64", lambda d, ad, it: decimal_ou_nulo(d["tributos"]["II R$"])),
+        ("ipi_brl", "float64", lambda d, ad, it: decimal_ou_nulo(d["tributos"]["IPI R$"])),
+        ("pis_brl", "float64", lambda d, ad, it: decimal_ou_nulo(d["tributos"]["PIS R$"])),
+        ("cofins_brl", "float64", lambda d, ad, it: decimal_ou_nulo(d["tributos"]["COFINS R$"])),
+        ("frete_embutido", "bool",
+         lambda d, ad, it: _sim_nao(d.get("configuracao_custos", {}).get("Frete Embutido"))),
+        ("seguro_embutido", "bool",
+         lambda d, ad, it: _sim_nao(d.get("configuracao_custos", {}).get("Seguro Embutido"))),
+        ("custo_total_brl", "float64",
+         lambda d, ad, it: decimal_ou_nulo(d.get("validacao_custos", {}).get("Custo Total Calculado"))),
+        ("valor_esperado_brl", "float64",
+         lambda d, ad, it: decimal_ou_nulo(d.get("validacao_custos", {}).get("Valor Esperado"))),
+        ("diferenca_pct", "float64",
+         lambda d, ad, it: decimal_ou_nulo(d.get("validacao_custos", {}).get("% Diferença"))),
+        ("status_validacao", "string", lambda d, ad, it: _texto(d.get("validacao_custos", {}).get("Status"))),
+    ],
+    "adicoes": [
+        ("di", "string", lambda d, ad, it: _texto(d["cabecalho"]["DI"])),
+        ("data_registro", "date", lambda d, ad, it: data_aaaammdd(d["cabecalho"]["Data registro"])),
+        ("adicao", "string", lambda d, ad, it: _texto(ad["numero"])),
+        ("ncm", "string", lambda d, ad, it: _texto(ad["dados_gerais"]["NCM"])),
+        ("descricao_ncm", "string", lambda d, ad, it: _texto(ad["dados_gerais"]["Descrição NCM"])),
+        ("incoterm", "string", lambda d, ad, it: _texto(ad["dados_gerais"]["INCOTERM"])),
+        ("moeda", "string", lambda d, ad, it: _texto(ad["dados_gerais"]["Moeda"])),
+        ("vcmv_usd", "float64", lambda d, ad, it: decimal_ou_nulo(ad["dados_gerais"]["VCMV USD"])),
+        ("vcmv_brl", "float64", lambda d, ad, it: decimal_ou_nulo(ad["dados_gerais"]["VCMV R$"])),
+        ("peso_liquido_kg", "float64", lambda d, ad, it: decimal_ou_nulo(ad["dados_gerais"]["Peso líq. (kg)"])),
+        ("quantidade", "float64", lambda d, ad, it: decimal_ou_nulo(ad["dados_gerais"]["Quantidade"])),
+        ("unidade", "string", lambda d, ad, it: _texto(ad["dados_gerais"]["Unidade"])),
+        ("exportador", "string", lambda d, ad, it: _texto(ad["partes"]["Exportador"])),
+        ("pais_aquisicao", "string", lambda d, ad, it: _texto(ad["partes"]["País Aquisição"])),
+        ("fabricante", "string", lambda d, ad, it: _texto(ad["partes"]["Fabricante"])),
+        ("pais_origem", "string", lambda d, ad, it: _texto(ad["partes"]["País Origem"])),
+        ("ii_aliquota", "float64", lambda d, ad, it: decimal_ou_nulo(ad["tributos"]["II Alíq. (%)"])),
+        ("ii_brl", "float64", lambda d, ad, it: decimal_ou_nulo(ad["tributos"]["II R$"])),
+        ("ipi_aliquota", "float64", lambda d, ad, it: decimal_ou_nulo(ad["tributos"]["IPI Alíq. (%)"])),
+        ("ipi_brl", "float64", lambda d, ad, it: decimal_ou_nulo(ad["tributos"]["IPI R$"])),
+        ("pis_aliquota", "float64", lambda d, ad, it: decimal_ou_nulo(ad["tributos"]["PIS Alíq. (%)"])),
+        ("pis_brl", "float64", lambda d, ad, it: decimal_ou_nulo(ad["tributos"]["PIS R$"])),
+        ("cofins_aliquota", "float64", lambda d, ad, it: decimal_ou_nulo(ad["tributos"]["COFINS Alíq. (%)"])),
+        ("cofins_brl", "float64", lambda d, ad, it: decimal_ou_nulo(ad["tributos"]["COFINS R$"])),
+        ("base_pis_cofins_brl", "float64", lambda d, ad, it: decimal_ou_nulo(ad["tributos"]["Base PIS/COFINS R$"])),
+        ("frete_rateado_brl", "float64", lambda d, ad, it: decimal_ou_nulo(ad.get("custos", {}).get("Frete Rateado R$"))),
+        ("seguro_rateado_brl", "float64", lambda d, ad, it: decimal_ou_nulo(ad.get("custos", {}).get("Seguro Rateado R$"))),
+        ("afrmm_rateado_brl", "float64", lambda d, ad, it: decimal_ou_nulo(ad.get("custos", {}).get("AFRMM Rateado R$"))),
+        ("siscomex_rateado_brl", "float64",
+         lambda d, ad, it: decimal_ou_nulo(ad.get("custos", {}).get("Siscomex Rateado R$"))),
+        ("ii_incorporado_brl", "float64", lambda d, ad, it: decimal_ou_nulo(ad.get("custos", {}).get("II Incorporado R$"))),
+        ("custo_total_brl", "float64", lambda d, ad, it: decimal_ou_nulo(ad.get("custos", {}).get("Custo Total Adição R$"))),
+        ("participacao_pct", "float64", lambda d, ad, it: decimal_ou_nulo(ad.get("custos", {}).get("% Participação"))),
+    ],
+    "itens": [
+        ("di", "string", lambda d, ad, it: _texto(d["cabecalho"]["DI"])),
+        ("data_registro", "date", lambda d, ad, it: data_aaaammdd(d["cabecalho"]["Data registro"])),
+        ("adicao", "string", lambda d, ad, it: _texto(ad["numero"])),
+        ("seq", "string", lambda d, ad, it: _texto(it["Seq"])),
+        ("ncm", "string", lambda d, ad, it: _texto(ad["dados_gerais"]["NCM"])),
+        ("codigo", "string", lambda d, ad, it: _texto(it["Código"])),
+        ("descricao", "string", lambda d, ad, it: _texto(it["Descrição"])),
+        ("qtd", "float64", lambda d, ad, it: decimal_ou_nulo(it["Qtd"])),
+        ("unidade", "string", lambda d, ad, it: _texto(it["Unidade"])),
+        ("valor_unit_usd", "float64", lambda d, ad, it: decimal_ou_nulo(it["Valor Unit. USD"])),
+        ("unid_caixa", "int64", lambda d, ad, it: _inteiro(it["Unid/Caixa"])),
+        ("valor_total_usd", "float64", lambda d, ad, it: decimal_ou_nulo(it["Valor Total USD"])),
+        ("custo_total_brl", "float64", lambda d, ad, it: decimal_ou_nulo(it.get("Custo Total Item R$"))),
+        ("custo_unitario_brl", "float64", lambda d, ad, it: decimal_ou_nulo(it.get("Custo Unitário R$"))),
+        ("custo_por_peca_brl", "float64", lambda d, ad, it: decimal_ou_nulo(it.get("Custo por Peça R$"))),
+    ],
+}
+
+FORMATOS_COLUNARES = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+
+def tabelas_colunares(dados: dict) -> dict:
+    """
+    Achata uma DI (já custeada) nas tabelas dis, adicoes e itens do ESQUEMA_COLUNAR.
+
+    Returns:
+        {tabela: {coluna: [valores]}}, com as colunas na ordem do esquema
+    """
+    if dados.get("ponto_fixo"):
+        dados = converte_ponto_fixo(dados)
+    linhas = {
+        "dis": [(dados, None, None)],
+        "adicoes": [(dados, ad, None) for ad in dados["adicoes"]],
+        "itens": [(dados, ad, item) for ad in dados["adicoes"] for item in ad["itens"]],
+    }
+    return {
+        tabela: {coluna: [extrator(*linha) for linha in linhas[tabela]] for coluna, _, extrator in colunas}
+        for tabela, colunas in ESQUEMA_COLUNAR.items()
+    }
+
+
+def importa_pyarrow():
+    """pyarrow e pyarrow.parquet, importados só na exportação Parquet/Arrow; (None, None) se ausentes"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:  # Necessário apenas para a exportação colunar Parquet/Arrow
+        return None, None
+    return pa, pq
+
+
+def _tabela_arrow(tabela, colunas):
+    pa, _ = importa_pyarrow()
+    tipos = {"string": pa.string(), "float64": pa.float64(), "int64": pa.int64(),
+             "date": pa.date32(), "bool": pa.bool_()}
+    esquema = pa.schema([(coluna, tipos[tipo]) for coluna, tipo, _ in ESQUEMA_COLUNAR[tabela]])
+    return pa.table(colunas, schema=esquema)
+
+
+def _grava_colunar(caminho: Path, tabela: str, colunas: dict, formato: str):
+    """Grava uma tabela em arquivo temporário e renomeia, para leitores nunca verem um arquivo pela metade"""
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    fd, temporario = tempfile.mkstemp(dir=caminho.parent, suffix=".tmp")
+    try:
+        if formato == "csv":
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                escritor = csv.writer(f)
+                escritor.writerow(list(colunas))
+                escritor.writerows(zip(*colunas.values()))
+        else:
+            os.close(fd)
+            pa, pq = importa_pyarrow()
+            tabela_arrow = _tabela_arrow(tabela, colunas)
+            if formato == "parquet":
+                pq.write_table(tabela_arrow, temporario)
+            else:
+                with pa.OSFile(temporario, "wb") as sink, pa.ipc.new_file(sink, tabela_arrow.schema) as escritor:
+                    escritor.write_table(tabela_arrow)
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.unlink(temporario)
+        raise
+
+
+def exporta_colunar(dados: dict, pasta: Path, formato: str = "parquet", nome: str = None) -> list:
+    """
+    Exporta uma DI custeada para tabelas colunares particionadas por mês de registro.
+
+    Cada tabela fica em pasta/<tabela>/ano_mes=AAAA-MM/<DI>.<ext> (particionamento
+    estilo Hive), então um lote só acrescenta arquivos e a reexportação de uma DI
+    substitui o arquivo dela. Um mês inteiro é lido com uma única varredura, ex.:
+    pyarrow.dataset.dataset(pasta / "itens", format="parquet", partitioning="hive").
+
+    Args:
+        formato: "parquet", "arrow" (Arrow IPC) ou "csv"; os dois primeiros exigem pyarrow
+        nome: Nome base dos arquivos; por padrão, o número da DI
+
+    Returns:
+        Caminhos gravados, um por tabela
+    """
+    if formato not in FORMATOS_COLUNARES:
+        raise ValueError(f"Formato colunar desconhecido: {formato} (use {', '.join(FORMATOS_COLUNARES)})")
+    if formato != "csv" and importa_pyarrow()[0] is None:
+        raise RuntimeError(f"A exportação {formato} requer o pacote pyarrow")
+
+    tabelas = tabelas_colunares(dados)
+    data_registro = tabelas["dis"]["data_registro"][0]
+    particao = f"ano_mes={data_registro:%Y-%m}" if data_registro else "ano_mes=desconhecido"
+    nome = nome or tabelas["dis"]["di"][0]
+
+    caminhos = []
+    for tabela, colunas in tabelas.items():
+        caminho = Path(pasta) / tabela / particao / f"{nome}{FORMATOS_COLUNARES[formato]}"
+        _grava_colunar(caminho, tabela, colunas, formato)
+        caminhos.append(caminho)
+    return caminhos
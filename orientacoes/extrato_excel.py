@@ -0,0 +1,1088 @@
+"""
+Extrato de custos da DI em Excel: abas de resumo, custos, adições/itens e croqui da
+NF-e de entrada, gravadas com pandas (DataFrames) ou linha a linha em memória constante.
+
+pandas e xlsxwriter são importados só ao gravar um extrato.
+"""
+from pathlib import Path
+from contextlib import contextmanager
+import os
+import re
+import tempfile
+
+from nucleo_di import (
+    SEM_MEDICAO, com_icms, contagens_di, converte_ponto_fixo,
+)
+
+
+COLUNAS_ITENS_ADICAO = ["Seq", "Código", "Descrição", "Qtd", "Unidade", "Valor Unit. USD",
+                        "Unid/Caixa", "Valor Total USD", "Custo Total R$", "Custo Unit. R$", "Custo/Peça R$"]
+
+
+def _linhas_resumo_adicoes(d):
+    """Linhas da aba 06_Resumo_Adicoes"""
+    resumo_adicoes = []
+    for ad in d["adicoes"]:
+        descricao = ad["dados_gerais"]["Descrição NCM"] or "N/A"
+        if len(descricao) > 50:
+            descricao = descricao[:50] + "..."
+
+        custos = ad.get("custos", {})
+        resumo_adicoes.append({
+            "Nº": ad["numero"],
+            "NCM": ad["dados_gerais"]["NCM"],
+            "Descrição": descricao,
+            "INCOTERM": ad["dados_gerais"]["INCOTERM"],
+            "VCMV R$": ad["dados_gerais"]["VCMV R$"],
+            "Custo Total R$": custos.get("Custo Total Adição R$", 0),
+            "II R$": ad["tributos"]["II R$"],
+            "Total Tributos R$": (ad["tributos"]["II R$"] + ad["tributos"]["IPI R$"] +
+                                  ad["tributos"]["PIS R$"] + ad["tributos"]["COFINS R$"])
+        })
+    return resumo_adicoes
+
+
+def _linhas_resumo_custos(d):
+    """Linhas da aba 06A_Resumo_Custos (apenas adições com custos calculados)"""
+    resumo_custos = []
+    for ad in d["adicoes"]:
+        custos = ad.get("custos", {})
+        if custos:
+            resumo_custos.append({
+                "Adição": ad["numero"],
+                "NCM": ad["dados_gerais"]["NCM"],
+                "INCOTERM": ad["dados_gerais"]["INCOTERM"],
+                "Valor Mercadoria R$": custos.get("Valor Mercadoria R$", 0),
+                "Frete Rateado R$": custos.get("Frete Rateado R$", 0),
+                "Seguro Rateado R$": custos.get("Seguro Rateado R$", 0),
+                "AFRMM Rateado R$": custos.get("AFRMM Rateado R$", 0),
+                "Siscomex Rateado R$": custos.get("Siscomex Rateado R$", 0),
+                "II Incorporado R$": custos.get("II Incorporado R$", 0),
+                "Custo Total R$": custos.get("Custo Total Adição R$", 0),
+                "% Participação": custos.get("% Participação", 0)
+            })
+    return resumo_custos
+
+
+def _linhas_itens_adicao(ad):
+    """Linhas da tabela de itens da aba Add_NNN, na ordem de COLUNAS_ITENS_ADICAO"""
+    for item in ad["itens"]:
+        yield [item["Seq"], item["Código"], item["Descrição"], item["Qtd"], item["Unidade"],
+               item["Valor Unit. USD"], item["Unid/Caixa"], item["Valor Total USD"],
+               item.get("Custo Total Item R$", 0), item.get("Custo Unitário R$", 0),
+               item.get("Custo por Peça R$", "N/A")]
+
+
+def _escreve_totais_itens(ws, linha, ad, hdr, money):
+    """Linha de totais abaixo da tabela de itens da aba Add_NNN"""
+    ws.write(linha, 2, "TOTAL:", hdr)
+    total_qtd = sum(item["Qtd"] for item in ad["itens"])
+    total_valor_usd = sum(item["Valor Total USD"] for item in ad["itens"])
+    total_custo_brl = sum(item.get("Custo Total Item R$", 0) for item in ad["itens"])
+
+    ws.write(linha, 3, total_qtd, hdr)
+    ws.write(linha, 7, total_valor_usd, money)
+    ws.write(linha, 8, total_custo_brl, money)
+
+
+def _larguras_aba_adicao(ws):
+    """Configura as larguras das colunas da aba Add_NNN"""
+    ws.set_column(0, 0, 8)  # Seq
+    ws.set_column(1, 1, 12)  # Código
+    ws.set_column(2, 2, 60)  # Descrição
+    ws.set_column(3, 3, 10)  # Qtd
+    ws.set_column(4, 4, 12)  # Unidade
+    ws.set_column(5, 5, 15)  # Valor Unit.
+    ws.set_column(6, 6, 12)  # Unid/Caixa
+    ws.set_column(7, 7, 15)  # Valor Total
+    ws.set_column(8, 8, 15)  # Custo Total
+    ws.set_column(9, 9, 15)  # Custo Unit.
+    ws.set_column(10, 10, 15)  # Custo/Peça
+
+
+# Layout consolidado: acima de LIMITE_ABAS_ADICOES adições, no lugar de uma aba Add_NNN por
+# adição, o extrato tem uma aba com uma linha por adição e outra com os itens de todas elas
+LIMITE_ABAS_ADICOES = 50
+ABA_ADICOES = "08_Adicoes"
+ABA_ITENS = "08A_Itens"
+SECOES_ADICAO = ("dados_gerais", "partes", "tributos", "custos")
+COLUNAS_ITENS_CONSOLIDADOS = ["Adição"] + COLUNAS_ITENS_ADICAO
+
+
+def usa_layout_consolidado(d, limite=LIMITE_ABAS_ADICOES) -> bool:
+    """True se a DI tem mais adições que limite; limite None ou negativo mantém uma aba por adição"""
+    return limite is not None and limite >= 0 and len(d["adicoes"]) > limite
+
+
+def _link_interno(aba, linha):
+    """URL de hyperlink para a coluna A da linha (base 0) da aba informada"""
+    return f"internal:'{aba}'!A{linha + 1}"
+
+
+def _colunas_adicoes_consolidadas(d):
+    """Colunas da aba 08_Adicoes: número e os campos das seções de todas as adições, na ordem em que aparecem"""
+    colunas = {"Adição": None}
+    for ad in d["adicoes"]:
+        for secao in SECOES_ADICAO:
+            colunas.update(dict.fromkeys(ad.get(secao, ())))
+    return list(colunas)
+
+
+def _linhas_adicoes_consolidadas(d, colunas):
+    """Linhas da aba 08_Adicoes; percentuais divididos por 100, como nas abas Add_NNN"""
+    for i, ad in enumerate(d["adicoes"], 1):
+        campos = {"Adição": ad["numero"] or str(i).zfill(3)}
+        for secao in SECOES_ADICAO:
+            campos.update(ad.get(secao, {}))
+        linha = []
+        for coluna in colunas:
+            valor = campos.get(coluna)
+            if "%" in coluna and isinstance(valor, (int, float)):
+                valor = valor / 100
+            linha.append(valor)
+        yield linha
+
+
+def _config_colunas_adicoes_consolidadas(colunas, money, percent):
+    """Argumentos de set_column da aba 08_Adicoes, com formato pelo nome da coluna"""
+    config = []
+    for col, coluna in enumerate(colunas):
+        largura = 8 if col == 0 else 50 if coluna.startswith("Descrição") else 16
+        formato = percent if "%" in coluna else money if "R$" in coluna else None
+        config.append((col, col, largura, formato))
+    return config
+
+
+def _linhas_itens_consolidados(d, progresso=None):
+    """
+    Linhas da aba 08A_Itens: número da adição seguido das colunas de COLUNAS_ITENS_ADICAO.
+    progresso(feitas, total) é chamado após os itens de cada adição, como nas abas Add_NNN.
+    """
+    for i, ad in enumerate(d["adicoes"], 1):
+        numero = ad["numero"] or str(i).zfill(3)
+        for linha in _linhas_itens_adicao(ad):
+            yield [numero] + linha
+        if progresso:
+            progresso(i, len(d["adicoes"]))
+
+
+def _primeiras_linhas_itens(d):
+    """Linha (base 0) do primeiro item de cada adição na aba 08A_Itens, ou None se a adição não tem itens"""
+    primeiras = []
+    linha = 1
+    for ad in d["adicoes"]:
+        primeiras.append(linha if ad["itens"] else None)
+        linha += len(ad["itens"])
+    return primeiras
+
+
+def _config_colunas_itens_consolidados(money):
+    """Argumentos de set_column da aba 08A_Itens (larguras das abas Add_NNN deslocadas pela coluna Adição)"""
+    larguras = [8, 8, 12, 60, 10, 12, 15, 12, 15, 15, 15, 15]
+    return [(col, col, largura, money if col in (6, 8, 9, 10, 11) else None)
+            for col, largura in enumerate(larguras)]
+
+
+def _escreve_totais_itens_consolidados(ws, linha, d, hdr, money):
+    """Linha de totais abaixo da tabela da aba 08A_Itens"""
+    ws.write(linha, 3, "TOTAL:", hdr)
+    ws.write(linha, 4, sum(item["Qtd"] for ad in d["adicoes"] for item in ad["itens"]), hdr)
+    ws.write(linha, 8, sum(item["Valor Total USD"] for ad in d["adicoes"] for item in ad["itens"]), money)
+    ws.write(linha, 9, sum(item.get("Custo Total Item R$", 0) for ad in d["adicoes"] for item in ad["itens"]),
+             money)
+
+
+def _linhas_itens_croqui(d):
+    """Itens do croqui da NF-e de entrada, numerados em sequência única para a nota (ICMS de calcula_icms)"""
+    itens_nfe = []
+    seq_nota = 1
+    for ad in d["adicoes"]:
+        for item in ad["itens"]:
+            itens_nfe.append({
+                "Seq": seq_nota,
+                "Descrição": item["Descrição"],
+                "NCM": ad["dados_gerais"]["NCM"],
+                "Quantidade": item["Qtd"],
+                "Unidade": item["Unidade"],
+                "Valor Unit. (R$)": item.get("Custo Unitário R$", 0),
+                "Valor Total (R$)": item.get("Custo Total Item R$", 0),
+                "CFOP": "3102",
+                "Origem": "3", # Estrangeira
+                "CST ICMS": item["CST ICMS"],
+                "Alq. ICMS (%)": item["Alq. ICMS (%)"],
+                "Base ICMS (R$)": item["Base ICMS R$"],
+                "ICMS (R$)": item["ICMS R$"],
+                "IPI CST": "00",
+                "IPI Alíq. (%)": round(ad["tributos"].get("IPI Alíq. (%)", 0)*100, 2),
+                "Fabricante": ad["partes"]["Fabricante"]
+            })
+            seq_nota += 1
+    return itens_nfe
+
+
+def _escreve_croqui_cabecalho(ws_croqui, d, hdr_secao):
+    """Seções do croqui anteriores aos produtos; retorna a linha onde começa a tabela de itens"""
+    linha = 0
+
+    def secao(titulo):
+        nonlocal linha
+        ws_croqui.merge_range(linha, 0, linha, 13, titulo, hdr_secao)
+        linha += 1
+
+    secao("CABEÇALHO DA NOTA")
+    ws_croqui.write_row(linha, 0, ["Série", "Modelo", "Tipo de Operação", "Natureza da Operação", "Finalidade",
+                                "Data de Emissão", "Chave de Acesso"])
+    ws_croqui.write_row(linha+1, 0, [1, 55, "0 (entrada)", "Importação do exterior (CFOP 3102)", 1,  "", ""])
+    linha += 3
+
+    # EMITENTE/IMPORTADOR
+    secao("EMITENTE / IMPORTADOR")
+    ws_croqui.write_row(linha, 0, ["CNPJ", "Razão Social", "Endereço"])
+    ws_croqui.write_row(linha+1, 0, [d["importador"]["CNPJ"], d["importador"]["Nome"], d["importador"]["Endereço"]])
+    linha += 3
+
+    # REMETENTE/EXPORTADOR (EXTERIOR)
+    secao("REMETENTE / EXPORTADOR (EXTERIOR)")
+    primeira_ad = d["adicoes"][0]
+    ws_croqui.write_row(linha, 0, ["Nome Exportador", "País de Aquisição"])
+    ws_croqui.write_row(linha+1, 0, [primeira_ad["partes"]["Exportador"], primeira_ad["partes"]["País Aquisição"]])
+    linha += 3
+
+    # DADOS DA DI
+    secao("DADOS DA DECLARAÇÃO DE IMPORTAÇÃO")
+    ws_croqui.write_row(linha, 0, ["Número DI", "Registro", "URF", "Modalidade"])
+    ws_croqui.write_row(linha+1, 0, [d["cabecalho"]["DI"], d["cabecalho"]["Data registro"], d["cabecalho"]["URF despacho"], d["cabecalho"]["Modalidade"]])
+    linha += 3
+
+    # PRODUTOS E SERVIÇOS
+    secao("PRODUTOS E SERVIÇOS")
+    return linha
+
+
+def _escreve_croqui_rodape(ws_croqui, d, linha, hdr_secao):
+    """Seções do croqui posteriores aos produtos: base do ICMS, observações e legendas"""
+    def secao(titulo):
+        nonlocal linha
+        ws_croqui.merge_range(linha, 0, linha, 13, titulo, hdr_secao)
+        linha += 1
+
+    # BASE E CÁLCULO DO ICMS
+    secao("BASE DE CÁLCULO DO ICMS IMPORTAÇÃO")
+    base_icms_data = {
+        "Valor Aduaneiro": d["valores"]["Valor Aduaneiro R$"],
+        "II": d["tributos"]["II R$"],
+        "IPI": d["tributos"]["IPI R$"],
+        "PIS": d["tributos"]["PIS R$"],
+        "COFINS": d["tributos"]["COFINS R$"],
+        "Outras despesas": d["valores"].get("Siscomex R$", 0) + d["valores"].get("AFRMM R$", 0)
+    }
+    for k,v in base_icms_data.items(): ws_croqui.write_row(linha, 0, [k, v]); linha += 1
+    
+    # Totais de calcula_icms: somas exatas das bases e valores dos itens
+    icms = d["icms"]
+    linha += 1
+    ws_croqui.write_row(linha, 0, ["Base ICMS Sem ICMS", icms["Base sem ICMS (DI) R$"]]); linha += 1
+    ws_croqui.write_row(linha, 0, ["UF / Regime", f"{icms['UF']} / {icms['Regime']}"]); linha += 1
+    ws_croqui.write_row(linha, 0, ["Base Final do ICMS", icms["Base ICMS R$"]]); linha += 1
+    ws_croqui.write_row(linha, 0, ["ICMS Calculado", icms["ICMS R$"]]); linha += 1
+    if icms["ICMS Diferido R$"]:
+        ws_croqui.write_row(linha, 0, ["ICMS Diferido", icms["ICMS Diferido R$"]]); linha += 1
+    ws_croqui.write_row(linha, 0, ["ICMS a Recolher", icms["ICMS a Recolher R$"]]); linha += 1
+    ws_croqui.write_row(linha, 0, ["Conciliação itens × DI", icms["Conciliação"], icms["Diferença R$"]]); linha += 2
+
+    # Regras da tabela de ICMS aplicadas
+    colunas = list(icms["regras"][0]) if icms["regras"] else []
+    if colunas:
+        ws_croqui.write_row(linha, 0, colunas, hdr_secao); linha += 1
+        for regra in icms["regras"]:
+            ws_croqui.write_row(linha, 0, [regra[c] for c in colunas]); linha += 1
+        linha += 1
+
+    # SEÇÃO EXTRA: INFORMAÇÕES COMPLEMENTARES
+    secao("INFORMAÇÕES COMPLEMENTARES / OBSERVAÇÕES OBRIGATÓRIAS")
+    info_extra = f"DI: {d['cabecalho']['DI']} - Data Registro: {d['cabecalho']['Data registro']}\n"
+    info_extra += d["info_complementar"]
+    ws_croqui.merge_range(linha, 0, linha + 2, 13, info_extra)
+    linha += 4
+
+    # Ajuste visual
+    for col_idx, width in enumerate([5,50,12,9,8,18,18,8,6,10,14,16,14,8,8,30]):
+        ws_croqui.set_column(col_idx, col_idx, width)
+
+    ws_croqui.write(linha+2, 0, "LEGENDAS: CFOP 3102=Compra p/ comercialização; CST ICMS 00=tributada integralmente, "
+                                "20=com redução de base, 51=diferimento; Origem=3(estrangeira)")
+
+
+# Versões do xlsxwriter (mínima, limite) em que _adiciona_tabela foi conferido em constant_memory:
+# o teste de igualdade do extrato em streaming com o de DataFrames cobre a troca do atributo
+VERSOES_XLSXWRITER_STREAMING = ((3, 0), (4, 0))
+
+
+def importa_xlsxwriter_streaming():
+    """xlsxwriter para os extratos em constant_memory; RuntimeError fora de VERSOES_XLSXWRITER_STREAMING"""
+    import xlsxwriter
+
+    versao = tuple(int(parte) for parte in re.findall(r"\d+", xlsxwriter.__version__)[:2])
+    minima, limite = VERSOES_XLSXWRITER_STREAMING
+    if not minima <= versao < limite:
+        raise RuntimeError(f"Extrato em streaming conferido só com xlsxwriter {minima[0]}.x "
+                           f"(instalado: {xlsxwriter.__version__}); gere o extrato sem streaming")
+    return xlsxwriter
+
+
+def _adiciona_tabela(ws, linha, colunas, ultima_linha, estilo, col=0):
+    """
+    Escreve o cabeçalho e registra uma tabela do Excel que vai de linha até ultima_linha.
+
+    Também funciona em planilhas constant_memory, desde que as linhas de dados
+    sejam escritas depois, em ordem: o xlsxwriter recusa add_table() nesse modo,
+    então a tabela é registrada com o modo desligado e o cabeçalho é reescrito
+    como string in-line. O atributo constant_memory da planilha não é API pública:
+    só é usado nas VERSOES_XLSXWRITER_STREAMING, e uma recusa levanta RuntimeError
+    em vez de gerar o extrato sem a tabela.
+    """
+    ws.write_row(linha, col, colunas)
+    memoria_constante = ws.constant_memory
+    ws.constant_memory = 0
+    try:
+        retorno = ws.add_table(linha, col, ultima_linha, col + len(colunas) - 1, {
+            'style': estilo,
+            'columns': [{'header': c} for c in colunas]
+        })
+    finally:
+        ws.constant_memory = memoria_constante
+    if retorno:
+        raise RuntimeError(f"xlsxwriter recusou a tabela da aba {ws.get_name()} (código {retorno})")
+    ws.write_row(linha, col, colunas)
+
+
+class ProcessamentoCancelado(Exception):
+    """Levantada pelo callback de progresso para interromper a geração do extrato"""
+
+
+@contextmanager
+def gravacao_atomica(caminho: Path):
+    """
+    Caminho temporário na pasta de destino, renomeado para caminho só se o bloco terminar
+    sem erro: um cancelamento ou falha no meio da gravação não deixa um .xlsx pela metade
+    """
+    caminho = Path(caminho)
+    # Mantém a extensão: o pandas escolhe/valida o formato pela extensão do arquivo
+    fd, temporario = tempfile.mkstemp(dir=caminho.parent, prefix=f".{caminho.stem}.", suffix=caminho.suffix)
+    os.close(fd)
+    try:
+        yield temporario
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.unlink(temporario)
+        raise
+
+
+def gera_excel_completo(d: dict, xlsx: Path, streaming: bool = False, medidor=None, aba_perf: bool = False,
+                        progresso=None, limite_abas_adicoes=LIMITE_ABAS_ADICOES):
+    """
+    Gera Excel com aba para cada adição - COM CONFIGURAÇÃO DE CUSTOS
+
+    DIs com mais de limite_abas_adicoes adições usam o layout consolidado: no lugar das
+    abas Add_NNN, a aba 08_Adicoes (uma linha por adição, com dados gerais, partes,
+    tributos e custos em colunas) e a aba 08A_Itens (todos os itens, com a coluna Adição
+    e filtro), ligadas por hyperlinks a partir da 06_Resumo_Adicoes. Assim o tempo e o
+    tamanho do arquivo acompanham a quantidade de itens, não a de abas. Com None (ou
+    negativo), mantém sempre uma aba por adição.
+
+    O croqui usa o ICMS de custeia_di (d["icms"]); se a DI ainda não o tiver, ele é
+    calculado aqui por calcula_icms, com a tabela, a UF e o regime padrão, sobre uma
+    cópia (com_icms): d não é alterado.
+
+    Com streaming=True as linhas vão direto do dicionário para o xlsxwriter em modo
+    constant_memory (sem DataFrames), mantendo a memória constante em DIs grandes.
+
+    Com medidor (MedidorEtapas), registra a etapa "Excel" e suas partes (resumos, abas
+    das adições, croqui, gravação do arquivo); com aba_perf, inclui a aba 00_Perf com
+    as medições feitas até o momento da escrita.
+
+    progresso(feitas, total) é chamado após cada adição; se levantar uma exceção
+    (ex.: ProcessamentoCancelado), a gravação é interrompida e xlsx não é criado nem alterado.
+    """
+    import pandas as pd
+
+    medidor = medidor or SEM_MEDICAO
+    consolidado = usa_layout_consolidado(d, limite_abas_adicoes)
+    with medidor.etapa("Excel", **contagens_di(d)), gravacao_atomica(xlsx) as temporario:
+        if streaming:
+            xlsxwriter = importa_xlsxwriter_streaming()
+            with xlsxwriter.Workbook(temporario, {"constant_memory": True}) as wb:
+                ws_perf = wb.add_worksheet("00_Perf") if aba_perf else None
+                _escreve_extrato_streaming(wb, d, medidor=medidor, progresso=progresso, consolidado=consolidado)
+                if ws_perf:
+                    _escreve_aba_perf(wb, ws_perf, medidor)
+                medidor.marca("Excel/Gravação")
+            return
+        with pd.ExcelWriter(temporario, engine="xlsxwriter") as wr:
+            ws_perf = wr.book.add_worksheet("00_Perf") if aba_perf else None
+            _escreve_extrato(wr, d, medidor=medidor, progresso=progresso, consolidado=consolidado)
+            if ws_perf:
+                _escreve_aba_perf(wr.book, ws_perf, medidor)
+            medidor.marca("Excel/Gravação")
+
+
+def _escreve_aba_perf(wb, ws, medidor):
+    """
+    Aba 00_Perf com as etapas medidas. Etapas ainda abertas (a própria "Excel") e a
+    gravação do arquivo ficam de fora; constam no log e no JSON de desempenho.
+    """
+    medidor.marca()
+    colunas = ["Etapa", "Tempo (s)", "CPU (s)", "Pico alocações (MB)", "Adições", "Itens"]
+    etapas = [e for e in medidor.etapas if e["Tempo (s)"] is not None]
+    segundos = wb.add_format({"num_format": "0.000"})
+    ws.set_column(0, 0, 24)
+    ws.set_column(1, 2, 12, segundos)
+    ws.set_column(3, 3, 20, wb.add_format({"num_format": "#,##0.0"}))
+    ws.set_column(4, 5, 10)
+    ws.freeze_panes(1, 0)
+    _adiciona_tabela(ws, 0, colunas, len(etapas), "Table Style Medium 2")
+    for i, registro in enumerate(etapas, 1):
+        ws.write_row(i, 0, [registro[c] for c in colunas])
+
+
+def _linhas_indice_dis(lista_dados):
+    """Linhas da aba 00_DIs do extrato combinado"""
+    indice = []
+    for i, d in enumerate(lista_dados, 1):
+        validacao = d.get("validacao_custos", {})
+        if d.get("ponto_fixo"):
+            validacao = converte_ponto_fixo(validacao)
+        indice.append({
+            "Prefixo": f"DI{i:03d}",
+            "DI": d["cabecalho"]["DI"],
+            "Data registro": d["cabecalho"]["Data registro"],
+            "Adições": len(d["adicoes"]),
+            "Itens": sum(len(ad["itens"]) for ad in d["adicoes"]),
+            "Custo Total R$": validacao.get("Custo Total Calculado", 0),
+            "Status": validacao.get("Status", "N/A"),
+            "% Diferença": validacao.get("% Diferença", 0),
+        })
+    return indice
+
+
+def gera_excel_combinado(lista_dados: list, xlsx: Path, streaming: bool = False, progresso=None,
+                         limite_abas_adicoes=LIMITE_ABAS_ADICOES, medidor=None, aba_perf: bool = False):
+    """
+    Gera um único Excel com o extrato de várias DIs.
+
+    Cada DI recebe suas abas com o prefixo "DInnn_" e a aba 00_DIs relaciona
+    os prefixos aos números das DIs. Com streaming=True, grava como gera_excel_completo.
+    progresso(feitas, total) é chamado após cada DI, como em gera_excel_completo.
+    O layout consolidado é escolhido por DI, pelo limite_abas_adicoes de gera_excel_completo,
+    e o ICMS do croqui que faltar é calculado como lá.
+
+    Com medidor (MedidorEtapas), registra a etapa "Excel", com uma parte por DI
+    ("Excel/DInnn") e a gravação do arquivo; aba_perf funciona como em gera_excel_completo.
+    """
+    medidor = medidor or SEM_MEDICAO
+    contagens = [contagens_di(d) for d in lista_dados]
+    with medidor.etapa("Excel", adicoes=sum(c["adicoes"] for c in contagens),
+                       itens=sum(c["itens"] for c in contagens)), gravacao_atomica(xlsx) as temporario:
+        _grava_excel_combinado(lista_dados, temporario, streaming, progresso, limite_abas_adicoes, medidor, aba_perf)
+
+
+def _grava_excel_combinado(lista_dados, xlsx, streaming, progresso, limite_abas_adicoes, medidor, aba_perf):
+    """Corpo de gera_excel_combinado, gravando no caminho (temporário) informado"""
+    import pandas as pd
+
+    if streaming:
+        xlsxwriter = importa_xlsxwriter_streaming()
+        with xlsxwriter.Workbook(str(xlsx), {"constant_memory": True}) as wb:
+            ws_perf = wb.add_worksheet("00_Perf") if aba_perf else None
+            indice = _linhas_indice_dis(lista_dados)
+            ws = wb.add_worksheet("00_DIs")
+            ws.freeze_panes(1, 0)
+            for col, width in enumerate([8, 14, 14, 9, 9, 16, 14, 12]):
+                ws.set_column(col, col, width)
+            ws.set_column(5, 5, None, wb.add_format({"num_format": "#,##0.00"}))
+            _adiciona_tabela(ws, 0, list(indice[0]), len(indice), 'Table Style Medium 9')
+            for i, linha in enumerate(indice, 1):
+                ws.write_row(i, 0, list(linha.values()))
+            for i, d in enumerate(lista_dados, 1):
+                medidor.marca(f"Excel/DI{i:03d}", **contagens_di(d))
+                _escreve_extrato_streaming(wb, d, prefixo=f"DI{i:03d}_",
+                                           consolidado=usa_layout_consolidado(d, limite_abas_adicoes))
+                if progresso:
+                    progresso(i, len(lista_dados))
+            if ws_perf:
+                _escreve_aba_perf(wb, ws_perf, medidor)
+            medidor.marca("Excel/Gravação")
+        return
+
+    with pd.ExcelWriter(xlsx, engine="xlsxwriter") as wr:
+        ws_perf = wr.book.add_worksheet("00_Perf") if aba_perf else None
+        indice = _linhas_indice_dis(lista_dados)
+        df_indice = pd.DataFrame(indice)
+        df_indice.to_excel(wr, sheet_name="00_DIs", index=False)
+        ws = wr.sheets["00_DIs"]
+        ws.freeze_panes(1, 0)
+        (rows, cols) = df_indice.shape
+        ws.add_table(0, 0, rows, cols - 1, {
+            'style': 'Table Style Medium 9',
+            'columns': [{'header': c} for c in df_indice.columns]
+        })
+        for col, width in enumerate([8, 14, 14, 9, 9, 16, 14, 12]):
+            ws.set_column(col, col, width)
+        ws.set_column(5, 5, None, wr.book.add_format({"num_format": "#,##0.00"}))
+
+        for i, d in enumerate(lista_dados, 1):
+            medidor.marca(f"Excel/DI{i:03d}", **contagens_di(d))
+            _escreve_extrato(wr, d, prefixo=f"DI{i:03d}_", consolidado=usa_layout_consolidado(d, limite_abas_adicoes))
+            if progresso:
+                progresso(i, len(lista_dados))
+        if ws_perf:
+            _escreve_aba_perf(wr.book, ws_perf, medidor)
+        medidor.marca("Excel/Gravação")
+
+
+def escreve_comparativo_cenarios(wb, d, aba, hdr_grupo, hdr, money, percent):
+    """
+    Aba com um resumo por cenário e os custos de cada item com um grupo de colunas por cenário.
+
+    As linhas são escritas em ordem, então a aba também pode ser gerada em modo constant_memory.
+    """
+    cenarios = d["cenarios_custos"]["cenarios"]
+    validacoes = d.get("validacao_cenarios") or [{} for _ in cenarios]
+    ws = wb.add_worksheet(aba)
+    linha = 0
+
+    # Resumo por cenário
+    ws.merge_range(linha, 0, linha, 7, "COMPARATIVO DE CENÁRIOS DE CUSTO", hdr_grupo)
+    linha += 1
+    colunas_resumo = ["Cenário", "Frete Embutido", "Seguro Embutido", "Base de Cálculo",
+                      "Custo Total R$", "Valor Esperado R$", "% Diferença", "Status"]
+    _adiciona_tabela(ws, linha, colunas_resumo, linha + len(cenarios), 'Table Style Medium 3')
+    linha += 1
+    for config, validacao in zip(cenarios, validacoes):
+        ws.write_row(linha, 0, [config["Cenário"], config["Frete Embutido"], config["Seguro Embutido"],
+                                config["Base de Cálculo"]])
+        ws.write(linha, 4, validacao.get("Custo Total Calculado", 0), money)
+        ws.write(linha, 5, validacao.get("Valor Esperado", 0), money)
+        ws.write(linha, 6, validacao.get("% Diferença", 0) / 100, percent)
+        ws.write(linha, 7, validacao.get("Status", "N/A"))
+        linha += 1
+    linha += 1
+
+    # Itens: colunas fixas + grupo (total, unitário, por peça) por cenário
+    colunas_fixas = ["Adição", "Seq", "Código", "Descrição", "Qtd"]
+    n_fixas = len(colunas_fixas)
+    for i, config in enumerate(cenarios):
+        col = n_fixas + 3 * i
+        ws.merge_range(linha, col, linha, col + 2, config["Cenário"], hdr_grupo)
+    linha += 1
+
+    colunas = list(colunas_fixas)
+    for config in cenarios:
+        nome = config["Cenário"]
+        colunas += [f"{nome}: Custo Total R$", f"{nome}: Custo Unit. R$", f"{nome}: Custo/Peça R$"]
+
+    inicio_itens = linha
+    n_itens = sum(len(ad["itens"]) for ad in d["adicoes"])
+    if n_itens:
+        _adiciona_tabela(ws, inicio_itens, colunas, inicio_itens + n_itens, 'Table Style Medium 9')
+        ws.freeze_panes(inicio_itens + 1, n_fixas)
+    linha += 1
+    custos_itens = iter(d["cenarios_custos"]["itens"])
+    for ad in d["adicoes"]:
+        for item in ad["itens"]:
+            ws.write_row(linha, 0, [ad["numero"], item["Seq"], item["Código"], item["Descrição"], item["Qtd"]])
+            col = n_fixas
+            for custo_total, custo_unit, custo_peca in next(custos_itens):
+                ws.write(linha, col, custo_total, money)
+                ws.write(linha, col + 1, custo_unit, money)
+                ws.write(linha, col + 2, custo_peca, money)
+                col += 3
+            linha += 1
+
+    if n_itens:
+        # Linha de totais por cenário
+        ws.write(linha, 3, "TOTAL:", hdr)
+        for i, totais in enumerate(zip(*d["cenarios_custos"]["adicoes"])):
+            ws.write(linha, n_fixas + 3 * i, sum(totais), money)
+
+    for col, width in enumerate([8, 6, 12, 50, 10]):
+        ws.set_column(col, col, width)
+    ws.set_column(n_fixas, len(colunas) - 1, 16)
+
+
+def escreve_alteracoes(wb, d, aba, hdr_grupo, hdr):
+    """
+    Aba com o relatório de alterações em relação à retificação anterior (custeia_retificacao):
+    resumo do recálculo e uma linha por diferença. Larguras antes das linhas (constant_memory).
+    """
+    relatorio = d["alteracoes"]
+    ws = wb.add_worksheet(aba)
+    for col, width in enumerate([10, 10, 8, 28, 10, 40, 40]):
+        ws.set_column(col, col, width)
+    ws.merge_range(0, 0, 0, 6, f"ALTERAÇÕES DA RETIFICAÇÃO {relatorio['Retificação anterior']} → "
+                                f"{relatorio['Retificação atual']}", hdr_grupo)
+    resumo = [("Recálculo", relatorio["Recálculo"]), ("Motivo", relatorio["Motivo"] or "-"),
+              ("Adições recalculadas", relatorio["Adições recalculadas"]),
+              ("Adições alteradas", ", ".join(relatorio["Adições alteradas"]) or "nenhuma")]
+    for linha, (campo, valor) in enumerate(resumo, 1):
+        ws.write(linha, 0, campo, hdr)
+        ws.write(linha, 3, valor)
+
+    colunas = ["Nível", "Adição", "Item", "Campo", "Tipo", "Antes", "Depois"]
+    inicio = len(resumo) + 2
+    alteracoes = relatorio["Alterações"]
+    _adiciona_tabela(ws, inicio, colunas, inicio + max(len(alteracoes), 1), "Table Style Medium 7")
+    ws.freeze_panes(inicio + 1, 0)
+    for linha, alteracao in enumerate(alteracoes, inicio + 1):
+        ws.write_row(linha, 0, [alteracao[c] for c in colunas])
+    if not alteracoes:
+        ws.write(inicio + 1, 0, "Sem alterações")
+
+
+def _escreve_extrato(wr, d: dict, prefixo: str = "", medidor=None, progresso=None, consolidado=False):
+    """
+    Escreve as abas do extrato de uma DI no ExcelWriter informado; com consolidado, as
+    abas 08_Adicoes e 08A_Itens no lugar das abas Add_NNN (ver gera_excel_completo)
+    """
+    import pandas as pd
+
+    medidor = medidor or SEM_MEDICAO
+    contagens = contagens_di(d)
+    medidor.marca("Excel/Resumos", **contagens)
+    if "icms" not in d:
+        d = com_icms(d)
+    if d.get("ponto_fixo"):
+        d = converte_ponto_fixo(d)
+    wb = wr.book
+    hdr = wb.add_format({"bold": True, "bg_color": "#D7E4BC"})
+    hdr_secao = wb.add_format({"bold": True, "bg_color": "#4F81BD", "font_color": "white"})
+    hdr_custo = wb.add_format({"bold": True, "bg_color": "#FFA500", "font_color": "white"})
+    hdr_config = wb.add_format({"bold": True, "bg_color": "#9932CC", "font_color": "white"})
+    money = wb.add_format({"num_format": "#,##0.00"})
+    percent = wb.add_format({"num_format": "0.00%"})
+
+    def add_table(worksheet, df, style="Table Style Medium 2"):
+        """Adiciona uma tabela do Excel à planilha."""
+        (rows, cols) = df.shape
+        # O cabeçalho é adicionado por to_excel, então a tabela tem 'rows' linhas de dados.
+        # O intervalo da tabela inclui a linha do cabeçalho.
+        worksheet.add_table(0, 0, rows, cols - 1, {
+            'style': style,
+            'columns': [{'header': str(c)} for c in df.columns]
+        })
+
+    def simples(dic, aba, larg0=26, larg1=50):
+        # Converte o dicionário para um DataFrame com as colunas corretas
+        df_data = pd.DataFrame(list(dic.items()), columns=["Campo", "Valor"])
+        df_data.to_excel(wr, sheet_name=aba, index=False, header=True)
+        ws = wr.sheets[aba]
+        ws.set_column(0, 0, larg0)
+        ws.set_column(1, 1, larg1)
+        # Adiciona a formatação de tabela
+        add_table(ws, df_data)
+
+    # Abas gerais
+    simples(d["cabecalho"], f"{prefixo}01_Capa")
+    simples(d["importador"], f"{prefixo}02_Importador")
+    simples(d["carga"], f"{prefixo}03_Carga")
+    simples(d["valores"], f"{prefixo}04_Valores")
+
+    # NOVA ABA: Configuração de Custos
+    if "configuracao_custos" in d:
+        config_df = pd.DataFrame(list(d["configuracao_custos"].items()), columns=["Configuração", "Valor"])
+        config_df.to_excel(wr, sheet_name=f"{prefixo}04A_Config_Custos", index=False)
+        ws = wr.sheets[f"{prefixo}04A_Config_Custos"]
+        ws.set_column(0, 0, 25)
+        ws.set_column(1, 1, 25, money)
+        add_table(ws, config_df, style="Table Style Medium 3")
+
+    # Tributos totais
+    tributos_df = pd.Series(d["tributos"]).rename("Total (R$)").to_frame().reset_index()
+    tributos_df.columns = ["Imposto", "Total (R$)"]
+    tributos_df.to_excel(wr, sheet_name=f"{prefixo}05_Tributos_Totais", index=False)
+    ws = wr.sheets[f"{prefixo}05_Tributos_Totais"]
+    ws.set_column(0, 0, 20)
+    ws.set_column(1, 1, 14, money)
+    add_table(ws, tributos_df)
+
+    # Validação de custos
+    if "validacao_custos" in d:
+        validacao_df = pd.DataFrame(list(d["validacao_custos"].items()), columns=["Métrica", "Valor"])
+        validacao_df.to_excel(wr, sheet_name=f"{prefixo}05A_Validacao_Custos", index=False)
+        ws = wr.sheets[f"{prefixo}05A_Validacao_Custos"]
+        ws.set_column(0, 0, 25)
+        ws.set_column(1, 1, 25)
+
+        # Colorir status
+        for i, row in validacao_df.iterrows():
+            if row["Métrica"] == "Status":
+                status_format = wb.add_format(
+                    {"bold": True, "bg_color": "#90EE90" if row["Valor"] == "OK" else "#FFB6C1"})
+                ws.write(i + 1, 1, row["Valor"], status_format)
+            elif "R$" in str(row["Métrica"]) or row["Métrica"] in ["Custo Total Calculado", "Valor Esperado", "Diferença"]:
+                 ws.write(i + 1, 1, row["Valor"], money)
+
+        add_table(ws, validacao_df, style="Table Style Medium 4")
+
+    # Resumo de adições COM CUSTOS
+    resumo_adicoes = _linhas_resumo_adicoes(d)
+    if resumo_adicoes:
+        df_resumo = pd.DataFrame(resumo_adicoes)
+        df_resumo.to_excel(wr, sheet_name=f"{prefixo}06_Resumo_Adicoes", index=False)
+        ws = wr.sheets[f"{prefixo}06_Resumo_Adicoes"]
+        ws.freeze_panes(1, 0)
+        add_table(ws, df_resumo, style="Table Style Medium 9")
+
+
+        # Configurar colunas
+        for col, width in enumerate([5, 12, 50, 10, 12, 15, 12, 16]):
+            ws.set_column(col, col, width)
+
+        # Formatar colunas monetárias
+        for c in [4, 5, 6, 7]:
+            ws.set_column(c, c, None, money)
+
+        # Layout consolidado: o Nº leva à linha da adição na aba 08_Adicoes
+        if consolidado:
+            for linha, resumo in enumerate(resumo_adicoes, 1):
+                ws.write_url(linha, 0, _link_interno(f"{prefixo}{ABA_ADICOES}", linha),
+                             string=str(resumo["Nº"]))
+
+    # Resumo de custos por adição
+    resumo_custos = _linhas_resumo_custos(d)
+    if resumo_custos:
+        df_custos = pd.DataFrame(resumo_custos)
+        df_custos.to_excel(wr, sheet_name=f"{prefixo}06A_Resumo_Custos", index=False)
+        ws = wr.sheets[f"{prefixo}06A_Resumo_Custos"]
+        ws.freeze_panes(1, 0)
+        add_table(ws, df_custos, style="Table Style Medium 10")
+
+        # Configurar larguras
+        for col, width in enumerate([8, 12, 10, 15, 12, 12, 12, 12, 15, 15, 12]):
+            ws.set_column(col, col, width)
+
+        # Formatar colunas
+        for c in range(3, 10):  # Colunas monetárias
+            ws.set_column(c, c, None, money)
+        ws.set_column(10, 10, None, percent)  # % Participação
+
+    # Comparativo de cenários (calcular_custos_cenarios)
+    if "cenarios_custos" in d:
+        escreve_comparativo_cenarios(wb, d, f"{prefixo}07_Cenarios", hdr_config, hdr, money, percent)
+
+    # Alterações em relação à retificação anterior (custeia_retificacao)
+    if "alteracoes" in d:
+        escreve_alteracoes(wb, d, f"{prefixo}07A_Alteracoes", hdr_config, hdr)
+
+    # Criar aba para cada adição com custos
+    medidor.marca("Excel/Adições", **contagens)
+    if consolidado:
+        aba_adicoes, aba_itens = f"{prefixo}{ABA_ADICOES}", f"{prefixo}{ABA_ITENS}"
+
+        # Uma linha por adição, com as seções em colunas; o Nº leva ao primeiro item na aba 08A_Itens
+        colunas = _colunas_adicoes_consolidadas(d)
+        df_adicoes = pd.DataFrame(list(_linhas_adicoes_consolidadas(d, colunas)), columns=colunas)
+        df_adicoes.to_excel(wr, sheet_name=aba_adicoes, index=False)
+        ws = wr.sheets[aba_adicoes]
+        ws.freeze_panes(1, 1)
+        add_table(ws, df_adicoes, style="Table Style Medium 9")
+        for args in _config_colunas_adicoes_consolidadas(colunas, money, percent):
+            ws.set_column(*args)
+        for linha, (numero, primeira) in enumerate(zip(df_adicoes["Adição"], _primeiras_linhas_itens(d)), 1):
+            if primeira is not None:
+                ws.write_url(linha, 0, _link_interno(aba_itens, primeira), string=str(numero))
+
+        # Itens de todas as adições em uma única tabela, filtrável pela coluna Adição
+        df_itens = pd.DataFrame(list(_linhas_itens_consolidados(d, progresso)), columns=COLUNAS_ITENS_CONSOLIDADOS)
+        df_itens.to_excel(wr, sheet_name=aba_itens, index=False)
+        ws = wr.sheets[aba_itens]
+        ws.freeze_panes(1, 0)
+        for args in _config_colunas_itens_consolidados(money):
+            ws.set_column(*args)
+        if len(df_itens):
+            add_table(ws, df_itens, style="Table Style Medium 9")
+            _escreve_totais_itens_consolidados(ws, len(df_itens) + 2, d, hdr, money)
+        else:
+            ws.write(1, 0, "Nenhum item detalhado encontrado", hdr)
+    else:
+        for i, ad in enumerate(d["adicoes"], 1):
+            numero_adicao = ad["numero"] or str(i).zfill(3)
+            aba_nome = f"{prefixo}Add_{numero_adicao}"
+
+            ws = wb.add_worksheet(aba_nome)
+            current_row = 0
+
+            def write_section_as_table(title, data_dict, header_format, col1_name="Campo", col2_name="Valor"):
+                nonlocal current_row
+                ws.merge_range(current_row, 0, current_row, 1, title, header_format)
+                current_row += 1
+            
+                start_table_row = current_row
+                ws.write(current_row, 0, col1_name, hdr)
+                ws.write(current_row, 1, col2_name, hdr)
+                current_row += 1
+
+                for campo, valor in data_dict.items():
+                    ws.write(current_row, 0, campo)
+                    # Aplica formatação customizada
+                    if isinstance(valor, (int, float)):
+                        if "%" in campo: ws.write(current_row, 1, valor / 100, percent)
+                        elif "R$" in campo: ws.write(current_row, 1, valor, money)
+                        else: ws.write(current_row, 1, valor)
+                    else: ws.write(current_row, 1, valor)
+                    current_row += 1
+            
+                # Adiciona a tabela
+                ws.add_table(start_table_row, 0, current_row - 1, 1, 
+                             {'style': 'Table Style Medium 2', 'columns': [{'header': col1_name}, {'header': col2_name}]})
+                current_row += 1 # Espaçador
+
+            # SEÇÕES COMO TABELAS
+            write_section_as_table("DADOS GERAIS", ad["dados_gerais"], hdr_secao)
+            write_section_as_table("PARTES ENVOLVIDAS", ad["partes"], hdr_secao)
+            write_section_as_table("TRIBUTOS", ad["tributos"], hdr_secao)
+            if "custos" in ad:
+                write_section_as_table("ANÁLISE DE CUSTOS", ad["custos"], hdr_custo, col1_name="Componente", col2_name="Valor (R$)")
+
+            # SEÇÃO 5: ITENS DETALHADOS COM CUSTOS
+            ws.merge_range(current_row, 0, current_row, 10, "ITENS DETALHADOS COM CUSTOS", hdr_secao)
+            current_row += 1
+
+            if ad["itens"]:
+                df_itens = pd.DataFrame(list(_linhas_itens_adicao(ad)), columns=COLUNAS_ITENS_ADICAO)
+
+                start_table_row = current_row
+                df_itens.to_excel(wr, sheet_name=aba_nome, startrow=start_table_row, index=False)
+            
+                # Adicionar tabela
+                (rows, cols) = df_itens.shape
+                ws.add_table(start_table_row, 0, start_table_row + rows, cols - 1,
+                             {'style': 'Table Style Medium 9', 'columns': [{'header': c} for c in df_itens.columns]})
+            
+                current_row += rows + 2 # Avança a linha
+
+                # Formatação de colunas sobre a tabela
+                money_cols = [5, 7, 8, 9, 10]
+                for c_idx in money_cols:
+                    # Aplica o formato para todas as linhas de dados da tabela
+                    ws.set_column(c_idx, c_idx, None, money)
+
+                # Linha de totais
+                _escreve_totais_itens(ws, current_row, ad, hdr, money)
+
+            else:
+                ws.write(current_row, 0, "Nenhum item detalhado encontrado", hdr)
+                current_row += 1
+
+            _larguras_aba_adicao(ws)
+            if progresso:
+                progresso(i, len(d["adicoes"]))
+
+    # Dados complementares
+    medidor.marca("Excel/Croqui", **contagens)
+    df_comp = pd.DataFrame({"Dados Complementares": [d["info_complementar"]]})
+    df_comp.to_excel(wr, sheet_name=f"{prefixo}99_Complementar", index=False)
+    ws = wr.sheets[f"{prefixo}99_Complementar"]
+    ws.set_column(0, 0, 120)
+    add_table(ws, df_comp)
+
+
+    # === CROQUI DE NOTA FISCAL DE ENTRADA DE IMPORTAÇÃO - MODELO 55 === #
+    ws_croqui = wb.add_worksheet(f"{prefixo}Croqui_NFe_Entrada")
+    linha = _escreve_croqui_cabecalho(ws_croqui, d, hdr_secao)
+
+    itens_nfe = _linhas_itens_croqui(d)
+    if itens_nfe:
+        df_nfe = pd.DataFrame(itens_nfe)
+        df_nfe.to_excel(wr, sheet_name=f"{prefixo}Croqui_NFe_Entrada", startrow=linha, index=False)
+        
+        (rows, cols) = df_nfe.shape
+        ws_croqui.add_table(linha, 0, linha + rows, cols - 1,
+                            {'style': 'Table Style Medium 9', 'columns': [{'header': c} for c in df_nfe.columns]})
+        linha += rows + 2
+
+    _escreve_croqui_rodape(ws_croqui, d, linha, hdr_secao)
+
+def _escreve_extrato_streaming(wb, d: dict, prefixo: str = "", medidor=None, progresso=None, consolidado=False):
+    """
+    Escreve as abas do extrato direto no Workbook do xlsxwriter, sem DataFrames.
+
+    Gera o mesmo layout de _escreve_extrato (inclusive o consolidado), mas cada aba é
+    escrita linha a linha, em ordem, para funcionar com Workbook(..., {"constant_memory": True}).
+    """
+    medidor = medidor or SEM_MEDICAO
+    contagens = contagens_di(d)
+    medidor.marca("Excel/Resumos", **contagens)
+    if "icms" not in d:
+        d = com_icms(d)
+    if d.get("ponto_fixo"):
+        d = converte_ponto_fixo(d)
+    hdr = wb.add_format({"bold": True, "bg_color": "#D7E4BC"})
+    hdr_secao = wb.add_format({"bold": True, "bg_color": "#4F81BD", "font_color": "white"})
+    hdr_custo = wb.add_format({"bold": True, "bg_color": "#FFA500", "font_color": "white"})
+    hdr_config = wb.add_format({"bold": True, "bg_color": "#9932CC", "font_color": "white"})
+    money = wb.add_format({"num_format": "#,##0.00"})
+    percent = wb.add_format({"num_format": "0.00%"})
+
+    # Em constant_memory cada linha é gravada assim que a próxima começa, então larguras
+    # e formatos de coluna precisam ser configurados antes das linhas de dados.
+    def tabela(aba, colunas, linhas, style="Table Style Medium 2", config_colunas=(), links=None):
+        """
+        Aba com uma única tabela a partir da linha 0; config_colunas são argumentos de set_column
+        e links, se informado, as URLs (ou None) da primeira coluna de cada linha
+        """
+        linhas = list(linhas)
+        ws = wb.add_worksheet(aba)
+        for args in config_colunas:
+            ws.set_column(*args)
+        _adiciona_tabela(ws, 0, colunas, len(linhas), style)
+        for i, valores in enumerate(linhas, 1):
+            ws.write_row(i, 0, valores)
+            if links and links[i - 1]:
+                ws.write_url(i, 0, links[i - 1], string=str(valores[0]))
+        return ws
+
+    def simples(dic, aba, larg0=26, larg1=50):
+        tabela(aba, ["Campo", "Valor"], dic.items(), config_colunas=[(0, 0, larg0), (1, 1, larg1)])
+
+    # Abas gerais
+    simples(d["cabecalho"], f"{prefixo}01_Capa")
+    simples(d["importador"], f"{prefixo}02_Importador")
+    simples(d["carga"], f"{prefixo}03_Carga")
+    simples(d["valores"], f"{prefixo}04_Valores")
+
+    if "configuracao_custos" in d:
+        tabela(f"{prefixo}04A_Config_Custos", ["Configuração", "Valor"], d["configuracao_custos"].items(),
+               style="Table Style Medium 3", config_colunas=[(0, 0, 25), (1, 1, 25, money)])
+
+    tabela(f"{prefixo}05_Tributos_Totais", ["Imposto", "Total (R$)"], d["tributos"].items(),
+           config_colunas=[(0, 0, 20), (1, 1, 14, money)])
+
+    if "validacao_custos" in d:
+        ws = wb.add_worksheet(f"{prefixo}05A_Validacao_Custos")
+        ws.set_column(0, 0, 25)
+        ws.set_column(1, 1, 25)
+        _adiciona_tabela(ws, 0, ["Métrica", "Valor"], len(d["validacao_custos"]), "Table Style Medium 4")
+        for i, (metrica, valor) in enumerate(d["validacao_custos"].items(), 1):
+            ws.write(i, 0, metrica)
+            if metrica == "Status":
+                status_format = wb.add_format({"bold": True, "bg_color": "#90EE90" if valor == "OK" else "#FFB6C1"})
+                ws.write(i, 1, valor, status_format)
+            elif "R$" in str(metrica) or metrica in ["Custo Total Calculado", "Valor Esperado", "Diferença"]:
+                ws.write(i, 1, valor, money)
+            else:
+                ws.write(i, 1, valor)
+
+    resumo_adicoes = _linhas_resumo_adicoes(d)
+    if resumo_adicoes:
+        links = [_link_interno(f"{prefixo}{ABA_ADICOES}", linha)
+                 for linha in range(1, len(resumo_adicoes) + 1)] if consolidado else None
+        ws = tabela(f"{prefixo}06_Resumo_Adicoes", list(resumo_adicoes[0]),
+                    (list(r.values()) for r in resumo_adicoes), style="Table Style Medium 9",
+                    config_colunas=[(col, col, width) for col, width in enumerate([5, 12, 50, 10, 12, 15, 12, 16])] +
+                                   [(c, c, None, money) for c in [4, 5, 6, 7]], links=links)
+        ws.freeze_panes(1, 0)
+
+    resumo_custos = _linhas_resumo_custos(d)
+    if resumo_custos:
+        ws = tabela(f"{prefixo}06A_Resumo_Custos", list(resumo_custos[0]),
+                    (list(r.values()) for r in resumo_custos), style="Table Style Medium 10",
+                    config_colunas=[(col, col, width) for col, width in
+                                    enumerate([8, 12, 10, 15, 12, 12, 12, 12, 15, 15, 12])] +
+                                   [(c, c, None, money) for c in range(3, 10)] + [(10, 10, None, percent)])
+        ws.freeze_panes(1, 0)
+
+    if "cenarios_custos" in d:
+        escreve_comparativo_cenarios(wb, d, f"{prefixo}07_Cenarios", hdr_config, hdr, money, percent)
+
+    if "alteracoes" in d:
+        escreve_alteracoes(wb, d, f"{prefixo}07A_Alteracoes", hdr_config, hdr)
+
+    medidor.marca("Excel/Adições", **contagens)
+    if consolidado:
+        aba_adicoes, aba_itens = f"{prefixo}{ABA_ADICOES}", f"{prefixo}{ABA_ITENS}"
+        colunas = _colunas_adicoes_consolidadas(d)
+        links = [_link_interno(aba_itens, primeira) if primeira is not None else None
+                 for primeira in _primeiras_linhas_itens(d)]
+        ws = tabela(aba_adicoes, colunas, _linhas_adicoes_consolidadas(d, colunas), style="Table Style Medium 9",
+                    config_colunas=_config_colunas_adicoes_consolidadas(colunas, money, percent), links=links)
+        ws.freeze_panes(1, 1)
+
+        ws = wb.add_worksheet(aba_itens)
+        for args in _config_colunas_itens_consolidados(money):
+            ws.set_column(*args)
+        ws.freeze_panes(1, 0)
+        n_itens = sum(len(ad["itens"]) for ad in d["adicoes"])
+        if n_itens:
+            _adiciona_tabela(ws, 0, COLUNAS_ITENS_CONSOLIDADOS, n_itens, "Table Style Medium 9")
+        else:
+            ws.write_row(0, 0, COLUNAS_ITENS_CONSOLIDADOS)
+        for linha, valores in enumerate(_linhas_itens_consolidados(d, progresso), 1):
+            ws.write_row(linha, 0, valores)
+        if n_itens:
+            _escreve_totais_itens_consolidados(ws, n_itens + 2, d, hdr, money)
+        else:
+            ws.write(1, 0, "Nenhum item detalhado encontrado", hdr)
+    else:
+        for i, ad in enumerate(d["adicoes"], 1):
+            numero_adicao = ad["numero"] or str(i).zfill(3)
+            ws = wb.add_worksheet(f"{prefixo}Add_{numero_adicao}")
+            # As larguras redefinem o formato das colunas, como no extrato via pandas
+            _larguras_aba_adicao(ws)
+            current_row = 0
+
+            def write_section_as_table(title, data_dict, header_format, col1_name="Campo", col2_name="Valor"):
+                nonlocal current_row
+                ws.merge_range(current_row, 0, current_row, 1, title, header_format)
+                current_row += 1
+                _adiciona_tabela(ws, current_row, [col1_name, col2_name], current_row + len(data_dict),
+                                 "Table Style Medium 2")
+                current_row += 1
+                for campo, valor in data_dict.items():
+                    ws.write(current_row, 0, campo)
+                    if isinstance(valor, (int, float)):
+                        if "%" in campo: ws.write(current_row, 1, valor / 100, percent)
+                        elif "R$" in campo: ws.write(current_row, 1, valor, money)
+                        else: ws.write(current_row, 1, valor)
+                    else: ws.write(current_row, 1, valor)
+                    current_row += 1
+                current_row += 1  # Espaçador
+
+            write_section_as_table("DADOS GERAIS", ad["dados_gerais"], hdr_secao)
+            write_section_as_table("PARTES ENVOLVIDAS", ad["partes"], hdr_secao)
+            write_section_as_table("TRIBUTOS", ad["tributos"], hdr_secao)
+            if "custos" in ad:
+                write_section_as_table("ANÁLISE DE CUSTOS", ad["custos"], hdr_custo, col1_name="Componente", col2_name="Valor (R$)")
+
+            ws.merge_range(current_row, 0, current_row, 10, "ITENS DETALHADOS COM CUSTOS", hdr_secao)
+            current_row += 1
+
+            if ad["itens"]:
+                _adiciona_tabela(ws, current_row, COLUNAS_ITENS_ADICAO, current_row + len(ad["itens"]),
+                                 "Table Style Medium 9")
+                for linha_item in _linhas_itens_adicao(ad):
+                    current_row += 1
+                    ws.write_row(current_row, 0, linha_item)
+                current_row += 2
+                _escreve_totais_itens(ws, current_row, ad, hdr, money)
+            else:
+                ws.write(current_row, 0, "Nenhum item detalhado encontrado", hdr)
+            if progresso:
+                progresso(i, len(d["adicoes"]))
+
+    medidor.marca("Excel/Croqui", **contagens)
+    tabela(f"{prefixo}99_Complementar", ["Dados Complementares"], [[d["info_complementar"]]],
+           config_colunas=[(0, 0, 120)])
+
+    # Croqui da NF-e de entrada
+    ws_croqui = wb.add_worksheet(f"{prefixo}Croqui_NFe_Entrada")
+    linha = _escreve_croqui_cabecalho(ws_croqui, d, hdr_secao)
+    itens_nfe = _linhas_itens_croqui(d)
+    if itens_nfe:
+        _adiciona_tabela(ws_croqui, linha, list(itens_nfe[0]), linha + len(itens_nfe), "Table Style Medium 9")
+        for item in itens_nfe:
+            linha += 1
+            ws_croqui.write_row(linha, 0, list(item.values()))
+        linha += 2
+    _escreve_croqui_rodape(ws_croqui, d, linha, hdr_secao)
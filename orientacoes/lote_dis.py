@@ -0,0 +1,970 @@
+"""
+Processamento sem interface gráfica: várias DIs em um pool de processos, o lote de XMLs
+com manifesto (main_lote) e o modo vigia, que ingere continuamente uma pasta (main_vigia).
+"""
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import deque
+from dataclasses import dataclass
+import argparse
+import datetime
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import sqlite3
+import threading
+import time
+
+from base_dis import BaseDIs, IndiceProdutos
+from exportacao_colunar import FORMATOS_COLUNARES, exporta_colunar, importa_pyarrow
+from extrato_excel import (
+    LIMITE_ABAS_ADICOES, gera_excel_combinado, gera_excel_completo, importa_xlsxwriter_streaming,
+)
+from nfe_entrada import campos_emitente_faltando, carrega_config_nfe, gera_nfe_entrada, importa_lxml, valida_nfe
+from nucleo_di import (
+    SEM_MEDICAO, CacheParseDI, ExtratorDescricao, HistoricoDIs, MedidorEtapas, agrega_desempenho,
+    caminho_json_desempenho, carrega_dis_completo, compacta_di, configuracao_por_incoterm, contagens_di,
+    converte_ponto_fixo, custeia_di, custeia_retificacao, detecta_cabecalho_di, nome_pasta, numpy_disponivel,
+    tabela_icms, usa_padroes_descricao,
+)
+
+log = logging.getLogger("ExtratoDI")
+
+
+def contexto_sem_fork():
+    """
+    Contexto de multiprocessing para pools criados por um processo que já tem outras threads
+    (Tk, observador do vigia, serviço): fork copiaria locks presos por elas e os workers
+    poderiam travar. Usa forkserver e, onde não houver, spawn.
+    """
+    metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(metodo)
+
+
+def _executa_por_di(pool, funcao, argumentos, progresso=None):
+    """
+    Submete funcao(*args) para cada DI e devolve os resultados na ordem de argumentos.
+
+    progresso(feitas, total) é chamado a cada DI concluída; se ele (ex.: ProcessamentoCancelado)
+    ou um worker levantar uma exceção, as DIs ainda não iniciadas são canceladas.
+    """
+    futuros = [pool.submit(funcao, *args) for args in argumentos]
+    try:
+        for feitas, futuro in enumerate(as_completed(futuros), 1):
+            futuro.result()
+            if progresso:
+                progresso(feitas, len(futuros))
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    return [futuro.result() for futuro in futuros]
+
+
+def _custeia_e_grava_di(dados, frete_embutido, seguro_embutido, xlsx, vetorizado=False, comparar_cenarios=False,
+                        memoria=False, aba_perf=False):
+    """Calcula, valida e grava o extrato de uma DI; devolve a validação e as etapas medidas"""
+    with MedidorEtapas(memoria=memoria) as medidor:
+        custeia_di(dados, frete_embutido, seguro_embutido, comparar_cenarios=comparar_cenarios, medidor=medidor,
+                   vetorizado=vetorizado)
+        gera_excel_completo(dados, Path(xlsx), medidor=medidor, aba_perf=aba_perf)
+    return dados["validacao_custos"], medidor.etapas
+
+
+def _custeia_e_compacta_di(dados, frete_embutido, seguro_embutido, vetorizado=False, comparar_cenarios=False,
+                           memoria=False):
+    """
+    Calcula e valida no worker; a DI volta compacta (compacta_di), com menos bytes no retorno
+    e menos memória, junto com as etapas medidas
+    """
+    with MedidorEtapas(memoria=memoria) as medidor:
+        custeia_di(dados, frete_embutido, seguro_embutido, comparar_cenarios=comparar_cenarios, medidor=medidor,
+                   vetorizado=vetorizado)
+    return compacta_di(dados), medidor.etapas
+
+
+def _contagens_lista(lista_dados):
+    """Adições e itens de várias DIs somados, como em contagens_di"""
+    contagens = [contagens_di(d) for d in lista_dados]
+    return {"adicoes": sum(c["adicoes"] for c in contagens), "itens": sum(c["itens"] for c in contagens)}
+
+
+def _registra_etapas_workers(medidor, listas_etapas):
+    """Etapas medidas nos workers, uma lista por DI, como subetapas Custos/DInnn/ do medidor"""
+    if not medidor.ativo:
+        return
+    for i, etapas in enumerate(listas_etapas, 1):
+        medidor.etapas.extend(dict(registro, Etapa=f"Custos/DI{i:03d}/{registro['Etapa']}") for registro in etapas)
+
+
+def processa_lista_dis(lista_dados: list, destino: Path, frete_embutido=False, seguro_embutido=False,
+                       combinado=False, max_workers=None, progresso=None, vetorizado=False,
+                       comparar_cenarios=False, medidor=None, aba_perf=False, progresso_custos=None,
+                       mp_context=None):
+    """
+    Calcula custos, valida e gera os extratos de várias DIs em um pool de processos.
+
+    Args:
+        lista_dados: DIs carregadas por carrega_dis_completo
+        destino: Pasta onde gravar um extrato por DI, ou caminho do .xlsx quando combinado=True
+        combinado: Se True, grava todas as DIs em um único extrato (gera_excel_combinado)
+        max_workers: Quantidade de processos; por padrão, um por núcleo da máquina
+        progresso: Com combinado=True, repassado a gera_excel_combinado
+        vetorizado: Se True, custeia com o motor NumPy (ver calcular_custos_unitarios)
+        comparar_cenarios: Se True, inclui no extrato de cada DI a aba comparativa dos CENARIOS_PADRAO
+        medidor: MedidorEtapas que recebe a etapa "Custos", com as etapas de cada worker como
+                 "Custos/DInnn/<etapa>", e a etapa "Excel" do extrato combinado; com
+                 medidor.memoria, os workers medem também as alocações
+        aba_perf: Se True, inclui a aba 00_Perf em cada extrato (ou no combinado)
+        progresso_custos: progresso(feitas, total) a cada DI concluída nos workers; se levantar
+                          uma exceção, as DIs ainda não iniciadas são canceladas
+        mp_context: Contexto de multiprocessing do pool; chamadas de um processo com outras
+                    threads devem passar contexto_sem_fork()
+
+    Returns:
+        Lista com um resumo por DI (DI, Arquivo, Status, % Diferença), na ordem do XML
+    """
+    destino = Path(destino)
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(lista_dados), 1))
+    medidor = medidor or SEM_MEDICAO
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as pool:
+        if combinado:
+            # Todas as DIs ficam em memória até o extrato combinado: voltam dos workers compactas
+            with medidor.etapa("Custos", **_contagens_lista(lista_dados)):
+                resultados = _executa_por_di(pool, _custeia_e_compacta_di, [
+                    (d, frete_embutido, seguro_embutido, vetorizado, comparar_cenarios, medidor.memoria)
+                    for d in lista_dados], progresso_custos)
+            lista_dados = [d for d, _ in resultados]
+            _registra_etapas_workers(medidor, [etapas for _, etapas in resultados])
+            gera_excel_combinado(lista_dados, destino, progresso=progresso, medidor=medidor, aba_perf=aba_perf)
+            arquivos = [destino] * len(lista_dados)
+            validacoes = [d["validacao_custos"] for d in lista_dados]
+        else:
+            destino.mkdir(parents=True, exist_ok=True)
+            arquivos = []
+            for i, d in enumerate(lista_dados, 1):
+                nome = f"ExtratoDI_CUSTOS_{d['cabecalho']['DI']}.xlsx"
+                if destino / nome in arquivos:
+                    nome = f"ExtratoDI_CUSTOS_{d['cabecalho']['DI']}_{i:03d}.xlsx"
+                arquivos.append(destino / nome)
+            with medidor.etapa("Custos", **_contagens_lista(lista_dados)):
+                resultados = _executa_por_di(pool, _custeia_e_grava_di, [
+                    (d, frete_embutido, seguro_embutido, xlsx, vetorizado, comparar_cenarios, medidor.memoria,
+                     aba_perf)
+                    for d, xlsx in zip(lista_dados, arquivos)], progresso_custos)
+            validacoes = [validacao for validacao, _ in resultados]
+            _registra_etapas_workers(medidor, [etapas for _, etapas in resultados])
+
+    return [
+        {
+            "DI": d["cabecalho"]["DI"],
+            "Arquivo": str(arquivo),
+            "Status": validacao.get("Status", "N/A"),
+            "% Diferença": validacao.get("% Diferença", 0),
+        }
+        for d, arquivo, validacao in zip(lista_dados, arquivos, validacoes)
+    ]
+
+
+@dataclass
+class OpcoesProcessamento:
+    """
+    Opções de processamento de cada XML, comuns ao lote, ao vigia e à linha de comando.
+
+    Atributos:
+        frete_embutido, seguro_embutido: Frete/seguro já embutidos no valor aduaneiro
+        auto_incoterm: Se True, define frete/seguro embutidos pelo INCOTERM de cada DI
+        pasta_cache: Pasta do cache de parse em disco (CacheParseDI), compartilhada pelos workers
+        ponto_fixo: Se True, parse e custos em inteiros escalados (ver carrega_di_completo)
+        comparar_cenarios: Se True, inclui no extrato a aba comparativa dos CENARIOS_PADRAO
+        excel_streaming: Se True, grava os extratos linha a linha em memória constante
+        pasta_colunar: Se informada, também exporta cada DI em tabelas colunares (ver exporta_colunar)
+        formato_colunar: "parquet", "arrow" ou "csv"
+        base_sqlite: Se informado, também grava cada DI nessa base SQLite (ver BaseDIs)
+        perf: Se True, mede também alocações e grava a aba 00_Perf e o JSON de desempenho
+              de cada extrato; os percentis por etapa vão para o resumo em qualquer caso
+        pasta_historico: Se informada, compara cada DI com a versão anterior registrada ali e
+                         recalcula só as adições alteradas (ver HistoricoDIs e custeia_retificacao)
+        padroes_descricao: JSON com os padrões de extração de Código e Unid/Caixa (ver ExtratorDescricao)
+        indice_produtos: Base SQLite do IndiceProdutos, alimentada e consultada a cada DI
+        tabela_icms_csv: CSV com as regras de ICMS (ver TabelaICMS.carrega); por padrão, TABELA_ICMS_PADRAO
+        uf_icms: UF do ICMS na importação; por padrão, a do importador de cada DI
+        regime_icms: Regime de incentivo da tabela de ICMS (ex.: "normal", "TTD410")
+        limite_abas_adicoes: Acima dessa quantidade de adições, o extrato usa as abas consolidadas
+                             08_Adicoes e 08A_Itens no lugar de uma aba por adição (None: nunca)
+        pasta_nfe: Se informada, grava ali o XML da NF-e de entrada de cada DI, validado offline
+        config_nfe: JSON com emitente, série, numeração etc. da NF-e (ver carrega_config_nfe)
+        processos_parse: Se maior que 1, cada worker parseia as adições de XMLs grandes nesse
+                         número de processos (ver carrega_dis_paralelo); útil com poucos XMLs enormes
+        vetorizado: Se True, custeia com o motor NumPy (ver calcular_custos_unitarios)
+    """
+    frete_embutido: bool = False
+    seguro_embutido: bool = False
+    auto_incoterm: bool = False
+    pasta_cache: Path = None
+    ponto_fixo: bool = False
+    comparar_cenarios: bool = False
+    excel_streaming: bool = False
+    pasta_colunar: Path = None
+    formato_colunar: str = "parquet"
+    base_sqlite: Path = None
+    perf: bool = False
+    pasta_historico: Path = None
+    padroes_descricao: Path = None
+    indice_produtos: Path = None
+    tabela_icms_csv: Path = None
+    uf_icms: str = None
+    regime_icms: str = "normal"
+    limite_abas_adicoes: int = LIMITE_ABAS_ADICOES
+    pasta_nfe: Path = None
+    config_nfe: Path = None
+    processos_parse: int = None
+    vetorizado: bool = False
+
+
+def _processa_arquivo_lote(xml_path, saida, opcoes: OpcoesProcessamento):
+    """
+    Executa parse → custos → validação → Excel (e NF-e) para um XML, nos workers do lote
+
+    As etapas de cada DI são medidas (MedidorEtapas) e vão para o campo "Etapas" da entrada.
+    opcoes: ver OpcoesProcessamento.
+
+    Returns:
+        Lista de entradas do manifesto, uma por DI do arquivo (ou uma única entrada de erro)
+    """
+    with MedidorEtapas(memoria=opcoes.perf) as medidor_arquivo:
+        return _processa_arquivo_lote_medido(xml_path, saida, opcoes, medidor_arquivo)
+
+
+def _processa_arquivo_lote_medido(xml_path, saida, opcoes: OpcoesProcessamento, medidor_arquivo):
+    """Corpo de _processa_arquivo_lote, com o tracemalloc já ligado quando perf=True"""
+    xml_path = Path(xml_path)
+    inicio = time.perf_counter()
+    try:
+        usa_padroes_descricao(opcoes.padroes_descricao)
+        with medidor_arquivo.etapa("Parse"):
+            if opcoes.pasta_cache:
+                lista_dados = CacheParseDI(pasta_disco=opcoes.pasta_cache).carrega(
+                    xml_path, ponto_fixo=opcoes.ponto_fixo, processos=opcoes.processos_parse)
+            else:
+                lista_dados = carrega_dis_completo(xml_path, ponto_fixo=opcoes.ponto_fixo,
+                                                   processos=opcoes.processos_parse)
+        tempo_parse = time.perf_counter() - inicio
+    except Exception as e:
+        return [{"Arquivo XML": str(xml_path), "Status": "ERRO", "Erro": str(e),
+                 "Tempo total (s)": round(time.perf_counter() - inicio, 4)}]
+    # O parse é do arquivo inteiro: como em "Tempo parse (s)", cada DI fica com uma fração dos tempos
+    parse = medidor_arquivo.etapas[0]
+    for medida in ("Tempo (s)", "CPU (s)"):
+        parse[medida] = round(parse[medida] / len(lista_dados), 6)
+
+    historico = HistoricoDIs(opcoes.pasta_historico) if opcoes.pasta_historico else None
+    indice = IndiceProdutos(opcoes.indice_produtos) if opcoes.indice_produtos else None
+    config = carrega_config_nfe(opcoes.config_nfe) if opcoes.pasta_nfe else None
+    entradas = []
+    for i, dados in enumerate(lista_dados, 1):
+        numero_di = dados["cabecalho"]["DI"]
+        nome_colunar = numero_di
+        if len(lista_dados) > 1:
+            xlsx = Path(saida) / f"ExtratoDI_CUSTOS_{xml_path.stem}_{numero_di}.xlsx"
+            if any(entrada.get("Extrato") == str(xlsx) for entrada in entradas):
+                xlsx = xlsx.with_name(f"{xlsx.stem}_{i:03d}.xlsx")
+                nome_colunar = f"{numero_di}_{i:03d}"
+        else:
+            xlsx = Path(saida) / f"ExtratoDI_CUSTOS_{xml_path.stem}.xlsx"
+
+        frete, seguro = opcoes.frete_embutido, opcoes.seguro_embutido
+        if opcoes.auto_incoterm and dados["adicoes"]:
+            frete, seguro = configuracao_por_incoterm(dados["adicoes"][0]["dados_gerais"]["INCOTERM"])
+
+        entrada = {
+            "Arquivo XML": str(xml_path),
+            "DI": numero_di,
+            "Retificação": dados["adicoes"][0].get("sequencial_retificacao", "N/A") if dados["adicoes"] else "N/A",
+            "Frete Embutido": frete,
+            "Seguro Embutido": seguro,
+            "Tempo parse (s)": round(tempo_parse / len(lista_dados), 4),
+        }
+        medidor = MedidorEtapas()
+        medidor.etapas.append(dict(parse, **{"Adições": len(dados["adicoes"]),
+                                            "Itens": sum(len(ad["itens"]) for ad in dados["adicoes"])}))
+        try:
+            if indice:
+                entrada["Unid/Caixa pelo índice"] = indice.aplica(dados)
+            tabela = tabela_icms(opcoes.tabela_icms_csv)
+            t0 = time.perf_counter()
+            versao_anterior = historico.anterior(numero_di, entrada["Retificação"]) if historico else None
+            if versao_anterior:
+                relatorio = custeia_retificacao(dados, versao_anterior, frete, seguro,
+                                                comparar_cenarios=opcoes.comparar_cenarios, medidor=medidor,
+                                                vetorizado=opcoes.vetorizado, tabela=tabela, uf=opcoes.uf_icms,
+                                                regime=opcoes.regime_icms)
+                entrada.update({"Retificação anterior": relatorio["Retificação anterior"],
+                                "Recálculo": relatorio["Recálculo"],
+                                "Adições alteradas": len(relatorio["Adições alteradas"]),
+                                "Alterações": len(relatorio["Alterações"])})
+            else:
+                custeia_di(dados, frete, seguro, comparar_cenarios=opcoes.comparar_cenarios, medidor=medidor,
+                            vetorizado=opcoes.vetorizado, tabela=tabela, uf=opcoes.uf_icms, regime=opcoes.regime_icms)
+            t1 = time.perf_counter()
+            gera_excel_completo(dados, xlsx, streaming=opcoes.excel_streaming, medidor=medidor,
+                                aba_perf=opcoes.perf, limite_abas_adicoes=opcoes.limite_abas_adicoes)
+            t2 = time.perf_counter()
+            if opcoes.pasta_nfe:
+                with medidor.etapa("NF-e", **contagens_di(dados)):
+                    # O ICMS (e a regra de cada item) é o gravado acima pelo custeio, com a mesma tabela
+                    notas = gera_nfe_entrada(dados, Path(opcoes.pasta_nfe), config,
+                                             nome=xlsx.stem.replace("ExtratoDI_CUSTOS_", "", 1))
+                    erros_nfe = [erro for nota in notas for erro in valida_nfe(nota, config["xsd"] or None)]
+                entrada.update({"NF-e": [str(nota) for nota in notas],
+                                "Validação NF-e": ("Sem itens" if not notas else "OK" if not erros_nfe
+                                                   else f"{len(erros_nfe)} erro(s)"),
+                                "Erros NF-e": erros_nfe[:20]})
+            if historico:
+                historico.grava(dados, frete, seguro)
+            if opcoes.perf:
+                medidor.grava_json(caminho_json_desempenho(xlsx), **{"Arquivo XML": str(xml_path), "DI": numero_di})
+            if opcoes.pasta_colunar:
+                exporta_colunar(dados, opcoes.pasta_colunar, opcoes.formato_colunar, nome=nome_colunar)
+            if opcoes.base_sqlite:
+                with BaseDIs(opcoes.base_sqlite) as base:
+                    base.grava(dados)
+
+            validacao = dados["validacao_custos"]
+            icms = converte_ponto_fixo(dados["icms"]) if dados.get("ponto_fixo") else dados["icms"]
+            entrada.update({
+                "Status": "OK",
+                "Extrato": str(xlsx),
+                "Adições": len(dados["adicoes"]),
+                "Itens": sum(len(ad["itens"]) for ad in dados["adicoes"]),
+                "Validação": validacao["Status"],
+                "% Diferença": validacao["% Diferença"],
+                "ICMS a Recolher R$": icms["ICMS a Recolher R$"],
+                "Conciliação ICMS": icms["Conciliação"],
+                "Tempo custos (s)": round(t1 - t0, 4),
+                "Tempo Excel (s)": round(t2 - t1, 4),
+            })
+        except Exception as e:
+            entrada.update({"Status": "ERRO", "Erro": str(e)})
+        entrada["Tempo total (s)"] = round(time.perf_counter() - inicio, 4)
+        entrada["Etapas"] = medidor.etapas
+        if opcoes.perf:
+            medidor.registra_log(**{"Arquivo XML": str(xml_path), "DI": numero_di})
+        entradas.append(entrada)
+
+    if indice:
+        indice.fecha()
+    return entradas
+
+
+def lista_xmls_lote(entradas, recursivo=False):
+    """Expande arquivos, pastas e padrões glob na lista ordenada de XMLs a processar"""
+    arquivos = []
+    for entrada in entradas:
+        caminho = Path(entrada)
+        if caminho.is_dir():
+            padrao = "**/*.xml" if recursivo else "*.xml"
+            arquivos.extend(p for p in caminho.glob(padrao) if p.is_file())
+        elif caminho.is_file():
+            arquivos.append(caminho)
+        else:
+            arquivos.extend(Path(p) for p in glob.glob(entrada, recursive=recursivo) if Path(p).is_file())
+
+    # Remove duplicados preservando a ordem
+    return list(dict.fromkeys(p.resolve() for p in arquivos))
+
+
+def processa_lote(xmls, saida: Path, opcoes: OpcoesProcessamento = None, max_workers=None,
+                  manifesto: Path = None, mp_context=None):
+    """
+    Processa vários XMLs de DI em um pool de processos e grava o manifesto do lote.
+
+    Args:
+        xmls: Caminhos dos XMLs (ver lista_xmls_lote)
+        saida: Pasta onde os extratos serão gravados
+        opcoes: Opções de processamento de cada XML (ver OpcoesProcessamento); por padrão, as padrões
+        max_workers: Quantidade de processos; por padrão, um por núcleo da máquina
+        manifesto: Caminho do JSON de resumo; por padrão, saida/manifesto_lote.json
+        mp_context: Contexto de multiprocessing do pool (ver contexto_sem_fork)
+
+    Returns:
+        Dicionário do manifesto (resumo, percentis por etapa e entradas por DI/arquivo)
+    """
+    saida = Path(saida)
+    opcoes = opcoes or OpcoesProcessamento()
+    saida.mkdir(parents=True, exist_ok=True)
+    manifesto = Path(manifesto) if manifesto else saida / "manifesto_lote.json"
+    inicio = time.perf_counter()
+
+    resultados = {}
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), mp_context=mp_context) as pool:
+        futuros = {
+            pool.submit(_processa_arquivo_lote, str(xml), str(saida), opcoes): xml
+            for xml in xmls
+        }
+        for futuro in as_completed(futuros):
+            xml = futuros[futuro]
+            try:
+                resultados[xml] = futuro.result()
+            except Exception as e:
+                resultados[xml] = [{"Arquivo XML": str(xml), "Status": "ERRO", "Erro": str(e)}]
+            for entrada in resultados[xml]:
+                if entrada["Status"] == "OK":
+                    log.info("%s DI %s: %s (%.4f%%)", Path(entrada["Arquivo XML"]).name, entrada["DI"],
+                             entrada["Validação"], entrada["% Diferença"])
+                else:
+                    log.error("%s: %s", Path(entrada["Arquivo XML"]).name, entrada["Erro"])
+
+    entradas = [entrada for xml in xmls for entrada in resultados[xml]]
+    falhas = sum(1 for entrada in entradas if entrada["Status"] != "OK")
+    dados_manifesto = {
+        "resumo": {
+            "Arquivos": len(xmls),
+            "DIs": sum(1 for entrada in entradas if "DI" in entrada),
+            "Falhas": falhas,
+            "Divergências": sum(1 for entrada in entradas if entrada.get("Validação") == "DIVERGÊNCIA"),
+            "Tempo total (s)": round(time.perf_counter() - inicio, 4),
+        },
+        "desempenho": agrega_desempenho(entrada["Etapas"] for entrada in entradas if "Etapas" in entrada),
+        "entradas": entradas,
+    }
+    manifesto.write_text(json.dumps(dados_manifesto, ensure_ascii=False, indent=2), encoding="utf-8")
+    return dados_manifesto
+
+
+def _adiciona_opcoes_processamento(parser):
+    """Opções de custeio e gravação comuns ao lote e ao modo vigia"""
+    parser.add_argument("--frete-embutido", action="store_true", help="Frete embutido no VCMV")
+    parser.add_argument("--seguro-embutido", action="store_true", help="Seguro embutido no VCMV")
+    parser.add_argument("--auto-incoterm", action="store_true",
+                        help="Define frete/seguro embutidos pelo INCOTERM de cada DI (CFR/CIF)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Quantidade de processos (padrão: número de núcleos)")
+    parser.add_argument("-r", "--recursivo", action="store_true", help="Busca XMLs também nas subpastas")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Pasta do cache de parse; reexecuções sobre os mesmos XMLs não os parseiam de novo")
+    parser.add_argument("--ponto-fixo", action="store_true",
+                        help="Calcula em inteiros escalados (centavos); a validação só é OK se fechar no centavo")
+    parser.add_argument("--cenarios", action="store_true",
+                        help="Inclui a aba 07_Cenarios comparando as quatro combinações de frete/seguro")
+    parser.add_argument("--excel-streaming", action="store_true",
+                        help="Grava os extratos linha a linha (constant_memory), sem DataFrames; indicado para DIs grandes")
+    parser.add_argument("--colunar", default=None, metavar="PASTA",
+                        help="Também exporta DIs, adições e itens em tabelas colunares particionadas por mês")
+    parser.add_argument("--formato-colunar", choices=list(FORMATOS_COLUNARES), default="parquet",
+                        help="Formato da exportação colunar (padrão: parquet)")
+    parser.add_argument("--base-sqlite", default=None, metavar="ARQUIVO",
+                        help="Também grava as DIs custeadas nessa base SQLite para consultas entre DIs")
+    parser.add_argument("--perf", action="store_true",
+                        help="Mede também as alocações (mais lento) e grava a aba 00_Perf e um .perf.json por extrato")
+    parser.add_argument("--historico", default=None, metavar="PASTA",
+                        help="Guarda cada DI custeada; retificações são comparadas com a versão anterior "
+                             "(aba 07A_Alteracoes) e só as adições alteradas são recalculadas")
+    parser.add_argument("--padroes-descricao", default=None, metavar="ARQUIVO",
+                        help="JSON com expressões regulares de Código e Unid/Caixa, gerais e por fornecedor")
+    parser.add_argument("--indice-produtos", default=None, metavar="ARQUIVO",
+                        help="Base SQLite de produtos (Código → Unid/Caixa); completa itens sem \"EM CX COM\"")
+    parser.add_argument("--tabela-icms", default=None, metavar="CSV",
+                        help="Regras de ICMS (uf;ncm;regime;aliquota;reducao_base;diferimento;descricao) "
+                             "no lugar da tabela padrão")
+    parser.add_argument("--uf", default=None, help="UF do ICMS na importação (padrão: UF do importador na DI)")
+    parser.add_argument("--regime-icms", default="normal",
+                        help="Regime de incentivo na tabela de ICMS: normal, COMEXPRODUZIR (GO), TTD409, "
+                             "TTD409_APOS_36M ou TTD410 (SC) na tabela padrão (padrão: normal)")
+    parser.add_argument("--limite-abas-adicoes", type=int, default=LIMITE_ABAS_ADICOES, metavar="N",
+                        help="Acima de N adições, o extrato traz as abas consolidadas 08_Adicoes e 08A_Itens "
+                             f"no lugar de uma aba por adição (padrão: {LIMITE_ABAS_ADICOES}; -1: sempre uma aba por adição)")
+    parser.add_argument("--nfe", default=None, metavar="PASTA",
+                        help="Também grava nessa pasta o XML da NF-e de entrada (modelo 55) de cada DI, validado "
+                             "offline (requer em --nfe-config o emitente: IE, endereço e cMun)")
+    parser.add_argument("--nfe-config", default=None, metavar="ARQUIVO",
+                        help="JSON com emitente (IE, endereço, cMun), série, numeração e CSTs da NF-e; "
+                             "\"xsd\" aponta o schema oficial em disco para validar também por ele (requer lxml)")
+    parser.add_argument("--processos-parse", type=int, default=None, metavar="N",
+                        help="Parseia as adições de cada XML grande em N processos; para DIs enormes, "
+                             "combine com -j pequeno (padrão: parse em um processo)")
+    parser.add_argument("--vetorizado", action="store_true",
+                        help="Custeia com o motor NumPy (requer numpy; cenários e ponto fixo usam motor próprio)")
+
+
+def _valida_opcoes_processamento(parser, args):
+    if args.padroes_descricao:
+        try:
+            ExtratorDescricao.carrega(args.padroes_descricao)
+        except (OSError, ValueError) as e:
+            parser.error(f"--padroes-descricao: {e}")
+    try:
+        tabela = tabela_icms(args.tabela_icms)
+    except (OSError, ValueError, KeyError) as e:
+        parser.error(f"--tabela-icms: {e}")
+    regimes = tabela.regimes(args.uf)
+    if args.regime_icms not in regimes:
+        parser.error(f"--regime-icms: '{args.regime_icms}' não está na tabela de ICMS"
+                     f"{' para ' + args.uf.upper() if args.uf else ''} (regimes: {', '.join(sorted(regimes))})")
+    if args.nfe or args.nfe_config:
+        try:
+            config = carrega_config_nfe(args.nfe_config)
+        except (OSError, ValueError) as e:
+            parser.error(f"--nfe-config: {e}")
+        if config["xsd"] and importa_lxml() is None:
+            parser.error("--nfe-config: a validação pelo xsd requer o pacote lxml")
+        faltando = campos_emitente_faltando(config)
+        if args.nfe and faltando:
+            parser.error(f"--nfe: emitente sem {', '.join(faltando)}; informe-os no JSON de --nfe-config")
+    if args.excel_streaming:
+        try:
+            importa_xlsxwriter_streaming()
+        except (ImportError, RuntimeError) as e:
+            parser.error(f"--excel-streaming: {e}")
+    if args.vetorizado and not numpy_disponivel():
+        parser.error("--vetorizado requer o pacote numpy")
+    if args.processos_parse is not None and args.processos_parse < 1:
+        parser.error("--processos-parse deve ser pelo menos 1")
+    if args.colunar and args.formato_colunar != "csv" and importa_pyarrow()[0] is None:
+        parser.error(f"--formato-colunar {args.formato_colunar} requer o pacote pyarrow (ou use csv)")
+
+
+def _opcoes_processamento(args) -> OpcoesProcessamento:
+    """Opções de processamento de processa_lote / VigiaPastaDIs a partir das opções de linha de comando"""
+    return OpcoesProcessamento(
+        frete_embutido=args.frete_embutido,
+        seguro_embutido=args.seguro_embutido,
+        auto_incoterm=args.auto_incoterm,
+        pasta_cache=args.cache_dir,
+        ponto_fixo=args.ponto_fixo,
+        comparar_cenarios=args.cenarios,
+        excel_streaming=args.excel_streaming,
+        pasta_colunar=args.colunar,
+        formato_colunar=args.formato_colunar,
+        base_sqlite=args.base_sqlite,
+        perf=args.perf,
+        pasta_historico=args.historico,
+        padroes_descricao=args.padroes_descricao,
+        indice_produtos=args.indice_produtos,
+        tabela_icms_csv=args.tabela_icms,
+        uf_icms=args.uf.upper() if args.uf else None,
+        regime_icms=args.regime_icms,
+        limite_abas_adicoes=args.limite_abas_adicoes,
+        pasta_nfe=args.nfe,
+        config_nfe=args.nfe_config,
+        processos_parse=args.processos_parse,
+        vetorizado=args.vetorizado,
+    )
+
+
+def main_lote(argv=None):
+    """Ponto de entrada de linha de comando para processamento em lote, sem interface gráfica"""
+    parser = argparse.ArgumentParser(
+        description="Gera extratos de custos a partir de XMLs de DI, em lote e sem interface gráfica.")
+    parser.add_argument("entradas", nargs="+", help="Arquivos XML, pastas ou padrões glob (ex.: 'dis/*.xml')")
+    parser.add_argument("-o", "--saida", default=".", help="Pasta onde gravar os extratos (padrão: atual)")
+    _adiciona_opcoes_processamento(parser)
+    parser.add_argument("--manifesto", default=None,
+                        help="Caminho do manifesto JSON (padrão: <saida>/manifesto_lote.json)")
+    parser.add_argument("--classificar", action="store_true",
+                        help="Apenas lista DI, INCOTERM, retificação e adições de cada XML (leitura parcial), sem gerar extratos")
+    args = parser.parse_args(argv)
+    _valida_opcoes_processamento(parser, args)
+
+    xmls = lista_xmls_lote(args.entradas, recursivo=args.recursivo)
+    if not xmls:
+        log.error("Nenhum XML encontrado em: %s", ", ".join(args.entradas))
+        return 2
+
+    if args.classificar:
+        falhas = 0
+        for xml in xmls:
+            try:
+                cabecalho = detecta_cabecalho_di(xml)
+            except Exception as e:
+                falhas += 1
+                cabecalho = {"Erro": str(e)}
+            print(json.dumps({"Arquivo XML": str(xml), **cabecalho}, ensure_ascii=False))
+        return 1 if falhas else 0
+
+    manifesto = processa_lote(xmls, Path(args.saida), _opcoes_processamento(args), max_workers=args.workers,
+                              manifesto=args.manifesto)
+
+    resumo = manifesto["resumo"]
+    log.info("Lote concluído: %d arquivos, %d DIs, %d falhas, %d divergências em %.1fs",
+             resumo["Arquivos"], resumo["DIs"], resumo["Falhas"], resumo["Divergências"], resumo["Tempo total (s)"])
+    return 1 if resumo["Falhas"] else 0
+
+
+# === MODO VIGIA: INGESTÃO CONTÍNUA DE UMA PASTA DE ENTRADA === #
+
+class RegistroIngestao:
+    """
+    Registro SQLite dos XMLs já tratados pelo modo vigia, para não reprocessá-los.
+
+    Cada arquivo é identificado pelo SHA-256 do conteúdo e pela DI/retificação do
+    cabeçalho. Caminho, tamanho e mtime também são guardados: na reinicialização, os
+    arquivos da pasta que não mudaram são descartados sem nem serem relidos.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.conexao = sqlite3.connect(str(caminho), timeout=60)
+        self.conexao.row_factory = sqlite3.Row
+        with self.conexao:
+            self.conexao.execute("""
+                CREATE TABLE IF NOT EXISTS arquivos (
+                    id INTEGER PRIMARY KEY, caminho TEXT NOT NULL, tamanho INTEGER, mtime_ns INTEGER,
+                    sha256 TEXT NOT NULL, numero_di TEXT, sequencial_retificacao TEXT,
+                    status TEXT NOT NULL, erro TEXT, extratos TEXT, processado_em TEXT)""")
+            self.conexao.execute("CREATE INDEX IF NOT EXISTS ix_arquivos_sha256 ON arquivos(sha256)")
+            self.conexao.execute(
+                "CREATE INDEX IF NOT EXISTS ix_arquivos_di ON arquivos(numero_di, sequencial_retificacao)")
+        # Versão mais recente vista de cada caminho: (tamanho, mtime_ns)
+        self._versoes = {
+            linha["caminho"]: (linha["tamanho"], linha["mtime_ns"])
+            for linha in self.conexao.execute("SELECT caminho, tamanho, mtime_ns FROM arquivos ORDER BY id")
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fecha()
+
+    def fecha(self):
+        self.conexao.close()
+
+    def conhecido(self, caminho, tamanho, mtime_ns) -> bool:
+        """True se essa versão do arquivo (mesmo tamanho e mtime) já foi registrada"""
+        return self._versoes.get(str(caminho)) == (tamanho, mtime_ns)
+
+    def por_hash(self, sha256):
+        """Registro anterior de um arquivo com o mesmo conteúdo (ou None)"""
+        return self.conexao.execute(
+            "SELECT * FROM arquivos WHERE sha256 = ? AND status != 'DUPLICADO' ORDER BY id LIMIT 1",
+            (sha256,)).fetchone()
+
+    def por_di(self, numero_di, sequencial_retificacao):
+        """Último processamento bem-sucedido da mesma DI e retificação (ou None)"""
+        return self.conexao.execute(
+            "SELECT * FROM arquivos WHERE numero_di = ? AND sequencial_retificacao = ? AND status = 'OK' "
+            "ORDER BY id DESC LIMIT 1", (numero_di, sequencial_retificacao)).fetchone()
+
+    def registra(self, caminho, tamanho, mtime_ns, sha256, numero_di, sequencial_retificacao, status,
+                 erro=None, extratos=()):
+        with self.conexao:
+            self.conexao.execute(
+                "INSERT INTO arquivos (caminho, tamanho, mtime_ns, sha256, numero_di, sequencial_retificacao, "
+                "status, erro, extratos, processado_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(caminho), tamanho, mtime_ns, sha256, numero_di, sequencial_retificacao, status, erro,
+                 json.dumps(list(extratos), ensure_ascii=False),
+                 datetime.datetime.now().isoformat(timespec="seconds")))
+        self._versoes[str(caminho)] = (tamanho, mtime_ns)
+
+
+def _importa_watchdog():
+    """Devolve (Observer, FileSystemEventHandler) do watchdog, ou (None, None) se não instalado"""
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        return None, None
+    return Observer, FileSystemEventHandler
+
+
+def ignora_sigint():
+    # Ctrl+C chega a todo o grupo de processos; só o processo principal encerra o vigia
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class VigiaPastaDIs:
+    """
+    Vigia uma pasta de entrada e gera os extratos de cada XML de DI novo ou alterado.
+
+    A pasta é varrida a cada `intervalo` segundos; com o pacote watchdog instalado
+    (inotify no Linux, ReadDirectoryChangesW no Windows), cada alteração antecipa a
+    varredura e a periódica passa a ser só uma garantia (eventos não chegam de pastas
+    de rede, por exemplo). Um XML só é lido depois de ficar `estabilidade` segundos
+    sem mudar de tamanho nem de data, para não pegar arquivos ainda sendo copiados.
+
+    Arquivos com o mesmo conteúdo (SHA-256) de um já tratado, ou com a mesma DI e
+    retificação de um já processado com sucesso a partir de outro arquivo, são
+    descartados como duplicados. Os demais vão para um pool de `max_workers`
+    processos (_processa_arquivo_lote, com as `opcoes`, ver OpcoesProcessamento), e os
+    extratos são movidos para saida/<número da DI>/ret_<sequencial de retificação>/. Tudo fica em um
+    RegistroIngestao (saida/ingestao.sqlite), de modo que reiniciar o vigia não
+    reprocessa o que já está na pasta.
+    """
+
+    PASTA_TEMPORARIA = ".processando"
+
+    def __init__(self, entrada: Path, saida: Path, intervalo: float = 2.0, estabilidade: float = 1.0,
+                 recursivo=False, arquivar=False, registro: Path = None, notificacoes=True, max_workers=None,
+                 opcoes: OpcoesProcessamento = None):
+        self.entrada = Path(entrada).resolve()
+        self.saida = Path(saida).resolve()
+        self.intervalo = intervalo
+        self.estabilidade = estabilidade
+        self.recursivo = recursivo
+        self.arquivar = arquivar
+        self.registro_path = Path(registro) if registro else self.saida / "ingestao.sqlite"
+        self.notificacoes = notificacoes
+        self.max_workers = max_workers or os.cpu_count()
+        self.opcoes = opcoes or OpcoesProcessamento()
+        self.contagem = {"OK": 0, "ERRO": 0, "DUPLICADO": 0}
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._observados = {}   # caminho → (tamanho, mtime_ns, instante em que essa versão foi vista)
+        self._fila = deque()    # arquivos estáveis aguardando vaga no pool
+        self._em_andamento = {}  # futuro → dados do arquivo
+
+    def para(self):
+        """Pede o encerramento; os arquivos em processamento são concluídos antes"""
+        self._parar.set()
+        self._acordar.set()
+
+    def executa(self, uma_vez=False):
+        """
+        Laço principal do vigia (bloqueante) até para() ou Ctrl+C.
+
+        Args:
+            uma_vez: Se True, trata os XMLs presentes na pasta e retorna, sem esperar novos
+
+        Returns:
+            Contagem de arquivos por situação ("OK", "ERRO", "DUPLICADO")
+        """
+        self.saida.mkdir(parents=True, exist_ok=True)
+        temporaria = self.saida / self.PASTA_TEMPORARIA
+        # Sobras de uma execução interrompida: esses arquivos não foram registrados e serão refeitos
+        shutil.rmtree(temporaria, ignore_errors=True)
+
+        observador = self._inicia_observador() if self.notificacoes and not uma_vez else None
+        intervalo = self.intervalo if observador is None else max(self.intervalo, 30.0)
+        log.info("Vigiando %s (%s) → %s", self.entrada,
+                 "notificações do sistema" if observador else f"varredura a cada {self.intervalo:g}s", self.saida)
+
+        with RegistroIngestao(self.registro_path) as self.registro, \
+                ProcessPoolExecutor(max_workers=self.max_workers, mp_context=contexto_sem_fork(),
+                                    initializer=ignora_sigint) as pool:
+            ultima_varredura = 0.0
+            try:
+                while not self._parar.is_set():
+                    agora = time.monotonic()
+                    if self._acordar.is_set() or agora - ultima_varredura >= intervalo or self._observados:
+                        self._acordar.clear()
+                        self._varre(agora)
+                        ultima_varredura = agora
+                    self._colhe()
+                    self._submete(pool)
+                    if uma_vez and not (self._observados or self._fila or self._em_andamento):
+                        break
+                    # Com arquivos aguardando estabilizar, a próxima varredura vem mais cedo
+                    espera = min(self.estabilidade, intervalo) if self._observados else intervalo
+                    self._acordar.wait(max(espera - (time.monotonic() - agora), 0.05))
+            except KeyboardInterrupt:
+                log.info("Interrompido; aguardando %d arquivo(s) em processamento", len(self._em_andamento))
+            finally:
+                if observador is not None:
+                    observador.stop()
+                    observador.join()
+                for futuro in list(self._em_andamento):
+                    futuro.exception()
+                self._colhe()
+        log.info("Vigia encerrado: %d processados, %d com erro, %d duplicados",
+                 self.contagem["OK"], self.contagem["ERRO"], self.contagem["DUPLICADO"])
+        return dict(self.contagem)
+
+    def _inicia_observador(self):
+        Observer, FileSystemEventHandler = _importa_watchdog()
+        if Observer is None:
+            log.info("Pacote watchdog não instalado; usando varredura periódica da pasta")
+            return None
+        acordar = self._acordar
+
+        class _Acorda(FileSystemEventHandler):
+            def on_any_event(self, evento):
+                acordar.set()
+
+        observador = Observer()
+        observador.schedule(_Acorda(), str(self.entrada), recursive=self.recursivo)
+        observador.start()
+        return observador
+
+    def _lista_xmls(self):
+        padrao = "**/*" if self.recursivo else "*"
+        for caminho in self.entrada.glob(padrao):
+            if caminho.suffix.lower() != ".xml" or caminho.name.startswith("."):
+                continue
+            if self.saida in caminho.parents:
+                continue
+            yield caminho
+
+    def _varre(self, agora):
+        """Atualiza os arquivos observados e enfileira os que ficaram estáveis"""
+        em_uso = {item["caminho"] for item in self._fila}
+        em_uso.update(item["caminho"] for item in self._em_andamento.values())
+        presentes = set()
+        for caminho in self._lista_xmls():
+            try:
+                estado = caminho.stat()
+            except OSError:
+                continue  # Removido ou renomeado durante a varredura
+            presentes.add(caminho)
+            versao = (estado.st_size, estado.st_mtime_ns)
+            if caminho in em_uso or self.registro.conhecido(caminho, *versao):
+                self._observados.pop(caminho, None)
+                continue
+            anterior = self._observados.get(caminho)
+            if anterior is None or anterior[:2] != versao:
+                self._observados[caminho] = (*versao, agora)
+            elif agora - anterior[2] >= self.estabilidade:
+                del self._observados[caminho]
+                self._fila.append({"caminho": caminho, "tamanho": versao[0], "mtime_ns": versao[1]})
+        for caminho in set(self._observados) - presentes:
+            del self._observados[caminho]
+
+    def _submete(self, pool):
+        adiados = []
+        while self._fila and len(self._em_andamento) < self.max_workers:
+            item = self._fila.popleft()
+            if "sha256" not in item:
+                try:
+                    self._identifica(item)
+                except FileNotFoundError:
+                    continue
+                except Exception as e:
+                    self._conclui(item, "ERRO", erro=f"XML ilegível: {e}")
+                    continue
+
+            if self._chave_di(item) and any(self._chave_di(outro) == self._chave_di(item)
+                                            for outro in self._em_andamento.values()):
+                adiados.append(item)  # Espera o resultado do outro arquivo da mesma DI/retificação
+                continue
+            duplicado = self._duplicado(item)
+            if duplicado:
+                log.info("%s: duplicado de %s (%s), ignorado", item["caminho"].name,
+                         Path(duplicado["caminho"]).name, duplicado["motivo"])
+                self._conclui(item, "DUPLICADO", erro=f"{duplicado['motivo']}: {duplicado['caminho']}")
+                continue
+
+            item["temporaria"] = self.saida / self.PASTA_TEMPORARIA / item["sha256"][:16]
+            item["temporaria"].mkdir(parents=True, exist_ok=True)
+            futuro = pool.submit(_processa_arquivo_lote, str(item["caminho"]), str(item["temporaria"]),
+                                 self.opcoes)
+            futuro.add_done_callback(lambda _: self._acordar.set())
+            self._em_andamento[futuro] = item
+        self._fila.extendleft(reversed(adiados))
+
+    @staticmethod
+    def _identifica(item):
+        """Preenche SHA-256, quantidade de DIs e DI/retificação (do cabeçalho) do arquivo"""
+        item.update(sha256="", dis_no_arquivo=0, numero_di=None, sequencial_retificacao=None)
+        sha256, marca, cauda = hashlib.sha256(), b"<declaracaoImportacao>", b""
+        with open(item["caminho"], "rb") as f:
+            for bloco in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(bloco)
+                item["dis_no_arquivo"] += (cauda + bloco).count(marca)
+                cauda = bloco[1 - len(marca):]
+        item["sha256"] = sha256.hexdigest()
+        cabecalho = detecta_cabecalho_di(item["caminho"])
+        item["numero_di"] = cabecalho["DI"]
+        item["sequencial_retificacao"] = cabecalho["Sequencial retificação"] or "N/A"
+
+    @staticmethod
+    def _chave_di(item):
+        # Só arquivos de uma única DI são comparados por DI/retificação; os de várias, só pelo conteúdo
+        if item["dis_no_arquivo"] == 1 and item["numero_di"]:
+            return item["numero_di"], item["sequencial_retificacao"]
+        return None
+
+    def _duplicado(self, item):
+        anterior = self.registro.por_hash(item["sha256"])
+        if anterior is not None:
+            return {"caminho": anterior["caminho"], "motivo": "mesmo conteúdo"}
+        if self._chave_di(item):
+            anterior = self.registro.por_di(*self._chave_di(item))
+            # O mesmo arquivo regravado com outro conteúdo é uma substituição, não uma cópia
+            if anterior is not None and anterior["caminho"] != str(item["caminho"]):
+                return {"caminho": anterior["caminho"],
+                        "motivo": f"mesma DI {item['numero_di']} e retificação {item['sequencial_retificacao']}"}
+        return None
+
+    def _colhe(self):
+        for futuro in [f for f in self._em_andamento if f.done()]:
+            item = self._em_andamento.pop(futuro)
+            try:
+                entradas = futuro.result()
+            except Exception as e:
+                entradas = [{"Arquivo XML": str(item["caminho"]), "Status": "ERRO", "Erro": str(e)}]
+            extratos, erros = [], []
+            for entrada in entradas:
+                if entrada["Status"] == "OK":
+                    extratos.append(self._move_resultados(entrada))
+                    log.info("%s DI %s: %s (%.4f%%) → %s", item["caminho"].name, entrada["DI"],
+                             entrada["Validação"], entrada["% Diferença"], extratos[-1])
+                else:
+                    erros.append(entrada["Erro"])
+                    log.error("%s: %s", item["caminho"].name, entrada["Erro"])
+            shutil.rmtree(item["temporaria"], ignore_errors=True)
+            self._conclui(item, "ERRO" if erros else "OK", erro="; ".join(erros) or None, extratos=extratos)
+
+    def _move_resultados(self, entrada):
+        """Move o extrato (e o .perf.json, se houver) para a pasta da DI; devolve o novo caminho"""
+        extrato = Path(entrada["Extrato"])
+        destino = self.saida / nome_pasta(entrada["DI"]) / f"ret_{nome_pasta(entrada['Retificação'])}"
+        destino.mkdir(parents=True, exist_ok=True)
+        for arquivo in (extrato, caminho_json_desempenho(extrato)):
+            if arquivo.exists():
+                os.replace(arquivo, destino / arquivo.name)
+        return str(destino / extrato.name)
+
+    def _conclui(self, item, status, erro=None, extratos=()):
+        self.registro.registra(item["caminho"], item["tamanho"], item["mtime_ns"], item["sha256"],
+                               item["numero_di"], item["sequencial_retificacao"], status, erro, extratos)
+        self.contagem[status] += 1
+        if self.arquivar and item["caminho"].exists():
+            if status == "OK":
+                destino = Path(extratos[0]).parent
+            else:
+                destino = self.saida / ("_duplicados" if status == "DUPLICADO" else "_erros")
+            destino.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(item["caminho"]), str(destino / item["caminho"].name))
+
+
+def main_vigia(argv=None):
+    """Ponto de entrada de linha de comando do modo vigia (ver VigiaPastaDIs)"""
+    parser = argparse.ArgumentParser(
+        prog="vigiar",
+        description="Vigia uma pasta e gera os extratos de cada XML de DI novo ou alterado, sem duplicar.")
+    parser.add_argument("entrada", help="Pasta de entrada onde chegam os XMLs das DIs")
+    parser.add_argument("-o", "--saida", required=True,
+                        help="Pasta dos extratos, organizados em <DI>/ret_<retificação>/")
+    parser.add_argument("--intervalo", type=float, default=2.0,
+                        help="Segundos entre varreduras da pasta (padrão: 2; com watchdog, no máximo 30)")
+    parser.add_argument("--estabilidade", type=float, default=1.0,
+                        help="Segundos sem alteração para considerar um XML completo (padrão: 1)")
+    parser.add_argument("--registro", default=None, metavar="ARQUIVO",
+                        help="Base SQLite dos arquivos já tratados (padrão: <saida>/ingestao.sqlite)")
+    parser.add_argument("--arquivar", action="store_true",
+                        help="Move cada XML tratado para a pasta do extrato (ou <saida>/_erros, <saida>/_duplicados)")
+    parser.add_argument("--sem-notificacoes", action="store_true",
+                        help="Não usa as notificações do sistema (watchdog), só a varredura periódica")
+    parser.add_argument("--uma-vez", action="store_true",
+                        help="Trata os XMLs presentes e encerra, sem ficar vigiando")
+    _adiciona_opcoes_processamento(parser)
+    args = parser.parse_args(argv)
+    _valida_opcoes_processamento(parser, args)
+    if not Path(args.entrada).is_dir():
+        parser.error(f"pasta de entrada não encontrada: {args.entrada}")
+    if args.intervalo <= 0 or args.estabilidade < 0:
+        parser.error("--intervalo deve ser positivo e --estabilidade não pode ser negativa")
+
+    vigia = VigiaPastaDIs(args.entrada, args.saida, intervalo=args.intervalo, estabilidade=args.estabilidade,
+                          recursivo=args.recursivo, arquivar=args.arquivar, registro=args.registro,
+                          notificacoes=not args.sem_notificacoes, max_workers=args.workers,
+                          opcoes=_opcoes_processamento(args))
+    # SIGTERM (serviço do sistema) encerra como Ctrl+C: conclui o que está em andamento
+    signal.signal(signal.SIGTERM, lambda *_: vigia.para())
+    contagem = vigia.executa(uma_vez=args.uma_vez)
+    return 1 if contagem["ERRO"] else 0
@@ -0,0 +1,554 @@
+"""
+NF-e de entrada (modelo 55) em XML, gerada direto da DI custeada, e sua validação offline
+(leiaute embutido ou, com lxml, o XSD oficial).
+"""
+from pathlib import Path
+from contextlib import contextmanager
+import datetime
+import hashlib
+import itertools
+import json
+import math
+import re
+import xml.etree.ElementTree as ET
+
+from extrato_excel import gravacao_atomica
+from nucleo_di import (
+    com_icms, converte_ponto_fixo, data_iso, rateia_centavos, rateia_valor_aduaneiro,
+)
+
+
+# === NF-e DE ENTRADA (MODELO 55) EM XML, DIRETO DA DI CUSTEADA === #
+
+NAMESPACE_NFE = "http://www.portalfiscal.inf.br/nfe"
+VERSAO_NFE = "4.00"
+MAX_ITENS_NFE = 990
+
+# Código IBGE de cada UF (cUF da chave de acesso)
+CODIGOS_UF = {
+    "RO": "11", "AC": "12", "AM": "13", "RR": "14", "PA": "15", "AP": "16", "TO": "17", "MA": "21",
+    "PI": "22", "CE": "23", "RN": "24", "PB": "25", "PE": "26", "AL": "27", "SE": "28", "BA": "29",
+    "MG": "31", "ES": "32", "RJ": "33", "SP": "35", "PR": "41", "SC": "42", "RS": "43", "MS": "50",
+    "MT": "51", "GO": "52", "DF": "53",
+}
+
+# Parâmetros da nota que a DI não traz; o JSON de carrega_config_nfe sobrepõe as chaves
+# informadas (em "emitente", campo a campo). Origem, CFOP e CST do IPI seguem o croqui.
+CONFIG_NFE_PADRAO = {
+    "serie": 1,
+    "numero_inicial": 1,  # nNF da primeira nota de cada DI; a numeração definitiva é a do emissor que assina
+    "ambiente": 2,  # tpAmb: 1 = produção, 2 = homologação
+    "natureza_operacao": "Importação do exterior",
+    "cfop": "3102",
+    "origem": "3",
+    "cst_ipi": "00",
+    "enquadramento_ipi": "999",
+    "cst_pis_cofins": "50",
+    "modalidade_frete": "9",
+    "uf_desembaraco": "",    # padrão: UF do importador
+    "data_desembaraco": "",  # AAAA-MM-DD; padrão: data de registro da DI
+    "itens_por_nota": MAX_ITENS_NFE,
+    "xsd": "",  # nfe_v4.00.xsd local; se informado, valida_nfe também valida pelo schema (requer lxml)
+    "emitente": {"IE": "", "CRT": "3", "xLgr": "", "nro": "", "xBairro": "", "cMun": "", "xMun": "", "CEP": ""},
+}
+# Sem eles nenhuma nota passa em valida_nfe (cMun também é o cMunFG da ide)
+CAMPOS_EMITENTE_OBRIGATORIOS = ("IE", "xLgr", "nro", "xBairro", "cMun", "xMun")
+
+
+def carrega_config_nfe(arquivo=None) -> dict:
+    """CONFIG_NFE_PADRAO com as chaves do JSON informado; chaves desconhecidas levantam ValueError"""
+    config = dict(CONFIG_NFE_PADRAO, emitente=dict(CONFIG_NFE_PADRAO["emitente"]))
+    if not arquivo:
+        return config
+    with open(arquivo, encoding="utf-8") as f:
+        lido = json.load(f)
+    desconhecidas = set(lido) - set(config) | set(lido.get("emitente", {})) - set(config["emitente"]) - {"UF"}
+    if desconhecidas:
+        raise ValueError(f"Configuração da NF-e com chaves desconhecidas: {', '.join(sorted(desconhecidas))}")
+    config["emitente"].update(lido.pop("emitente", {}))
+    config.update(lido)
+    itens = int(config["itens_por_nota"])
+    if not 1 <= itens <= MAX_ITENS_NFE:
+        raise ValueError(f"itens_por_nota deve estar entre 1 e {MAX_ITENS_NFE}")
+    return config
+
+
+def campos_emitente_faltando(config: dict) -> list:
+    """CAMPOS_EMITENTE_OBRIGATORIOS vazios no emitente da configuração da NF-e"""
+    return [campo for campo in CAMPOS_EMITENTE_OBRIGATORIOS if not str(config["emitente"].get(campo) or "").strip()]
+
+
+def importa_lxml():
+    """lxml.etree, importado só na validação da NF-e pelo XSD; None se ausente"""
+    try:
+        from lxml import etree
+    except ImportError:  # Necessário apenas para validar pelo schema oficial
+        return None
+    return etree
+
+
+def _texto_nfe(valor, maximo):
+    """Texto no alfabeto do leiaute (Latin-1, sem quebras nem espaços nas pontas), cortado em maximo"""
+    texto = " ".join(str(valor if valor is not None else "").split())
+    if not texto.isascii():
+        texto = texto.encode("latin-1", "replace").decode("latin-1")
+    return texto[:maximo].strip()
+
+
+def _reais(centavos):
+    return f"{'-' if centavos < 0 else ''}{abs(centavos) // 100}.{abs(centavos) % 100:02d}"
+
+
+def _percentual(valor):
+    return f"{valor:.4f}"
+
+
+def _digito_chave(chave43):
+    """Dígito verificador (módulo 11, pesos 2 a 9 da direita para a esquerda) da chave de acesso"""
+    soma = sum(int(digito) * (2 + i % 8) for i, digito in enumerate(reversed(chave43)))
+    resto = soma % 11
+    return "0" if resto < 2 else str(11 - resto)
+
+
+def chave_acesso_nfe(uf, emissao, cnpj, serie, numero, codigo, tipo_emissao=1) -> str:
+    """Chave de acesso de 44 dígitos: cUF, AAMM, CNPJ, modelo 55, série, número, tpEmis, cNF e DV"""
+    chave = (f"{CODIGOS_UF.get(uf, '00')}{emissao:%y%m}{''.join(c for c in str(cnpj) if c.isdigit()):0>14}"
+             f"55{int(serie):03d}{int(numero):09d}{tipo_emissao}{int(codigo):08d}")
+    return chave + _digito_chave(chave)
+
+
+# Escape de texto e de atributos (entre aspas duplas) por str.translate: xml.sax.saxutils
+# importaria urllib.request, http.client e email só para isto
+_ESCAPE_TEXTO = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+_ESCAPE_ATRIBUTO = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;",
+                                  "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"})
+
+
+def _escape(texto):
+    """Texto de elemento com &, < e > escapados"""
+    return texto.translate(_ESCAPE_TEXTO)
+
+
+def _quoteattr(texto):
+    """Valor de atributo escapado e entre aspas duplas"""
+    return f'"{texto.translate(_ESCAPE_ATRIBUTO)}"'
+
+
+class _EscritorXML:
+    """
+    XML gravado no arquivo à medida que os elementos são abertos e fechados, sem montar a
+    árvore; trechos que se repetem (o bloco DI de cada item) podem ser montados uma vez com
+    trecho() e gravados com bruto()
+    """
+
+    def __init__(self, arquivo):
+        self._grava = arquivo.write
+        self._grava('<?xml version="1.0" encoding="UTF-8"?>')
+
+    def abre(self, tag, **atributos):
+        self._grava(f"<{tag}{''.join(f' {nome}={_quoteattr(str(valor))}' for nome, valor in atributos.items())}>")
+
+    def fecha(self, tag):
+        self._grava(f"</{tag}>")
+
+    @staticmethod
+    def trecho(*pares):
+        return "".join(f"<{tag}>{_escape(str(valor))}</{tag}>" for tag, valor in pares)
+
+    def campo(self, tag, valor):
+        self._grava(f"<{tag}>{_escape(str(valor))}</{tag}>")
+
+    def campos(self, *pares):
+        self._grava(self.trecho(*pares))
+
+    def bruto(self, texto):
+        self._grava(texto)
+
+    @contextmanager
+    def elemento(self, tag, **atributos):
+        self.abre(tag, **atributos)
+        yield
+        self.fecha(tag)
+
+
+def _itens_nfe(dados):
+    """
+    (adição, item, valores em centavos) de cada item, na ordem da DI.
+
+    Valor aduaneiro e despesas aduaneiras (Siscomex + AFRMM) da DI vão para as adições
+    como em calcula_icms; II, IPI, PIS e COFINS são os da adição. Dentro da adição, cada
+    valor vai para os itens pela quantidade, em centavos pelos maiores restos, de modo que
+    os itens somem exatamente os valores da adição.
+    """
+    valores = dados["valores"]
+    adicoes = dados["adicoes"]
+    valores_aduaneiros = rateia_valor_aduaneiro(dados)
+    afrmm_adicoes = rateia_centavos(round(valores.get("AFRMM R$", 0) * 100), valores_aduaneiros)
+    siscomex_adicoes = rateia_centavos(round(valores.get("Siscomex R$", 0) * 100), valores_aduaneiros)
+    for ad, valor_aduaneiro, afrmm, siscomex in zip(adicoes, valores_aduaneiros, afrmm_adicoes, siscomex_adicoes):
+        if not ad["itens"]:
+            continue
+        trib = ad["tributos"]
+        totais = {
+            "vProd": valor_aduaneiro,
+            "vAFRMM": afrmm,
+            "vDespAdu": afrmm + siscomex,
+            "vII": round(trib["II R$"] * 100),
+            "vIPI": round(trib["IPI R$"] * 100),
+            "vPIS": round(trib["PIS R$"] * 100),
+            "vCOFINS": round(trib["COFINS R$"] * 100),
+            "vBCPISCOFINS": round((trib.get("Base PIS/COFINS R$") or 0) * 100) or valor_aduaneiro,
+        }
+        quantidades = [item["Qtd"] for item in ad["itens"]]
+        rateados = {campo: rateia_centavos(total, quantidades) for campo, total in totais.items()}
+        for i, item in enumerate(ad["itens"]):
+            yield ad, item, {campo: partes[i] for campo, partes in rateados.items()}
+
+
+def gera_nfe_entrada(dados, pasta: Path, config: dict = None, tabela=None, uf=None, regime=None,
+                     emissao: datetime.datetime = None, nome: str = None) -> list:
+    """
+    Grava o XML da NF-e de entrada (modelo 55, leiaute 4.00, sem assinatura) a partir da DI
+    custeada, com uma nota a cada config["itens_por_nota"] itens (no máximo 990).
+
+    Cada item (det) leva NCM, quantidades, valores, os grupos de ICMS, IPI, II, PIS e COFINS e
+    o bloco DI/adição. vProd é a parte do valor aduaneiro do item e vOutro soma PIS, COFINS,
+    despesas aduaneiras e o ICMS devido, de modo que vNF feche com o custo de entrada na nota.
+    O ICMS de cada item, com a alíquota, a redução e o diferimento da regra aplicada, vem de
+    calcula_icms: o gravado na DI por custeia_di ou, se a DI não o tiver ou se tabela, uf ou
+    regime forem informados, o calculado aqui sobre uma cópia (com_icms), sem alterar dados.
+    Os elementos são gravados à medida que são gerados (_EscritorXML), sem montar a árvore
+    de nenhuma nota; cada arquivo aparece só depois de completo.
+
+    Args:
+        config: carrega_config_nfe(); por padrão, CONFIG_NFE_PADRAO
+        tabela, uf, regime: como em calcula_icms (regime "normal" se só tabela ou uf for informado)
+        emissao: dhEmi (com fuso); por padrão, agora
+        nome: Nome dos arquivos (NFe_<nome>.xml ou NFe_<nome>_NNN.xml); por padrão, o número da DI
+
+    Returns:
+        Caminhos dos XMLs gravados, na ordem das notas; vazia se a DI não tem itens
+        (a NF-e exige ao menos um det)
+    """
+    n_itens = sum(len(ad["itens"]) for ad in dados["adicoes"])
+    if not n_itens:
+        return []
+    config = config or carrega_config_nfe()
+    if dados.get("ponto_fixo"):
+        dados = converte_ponto_fixo(dados)
+    if "icms" not in dados or tabela or uf or regime:
+        dados = com_icms(dados, tabela, uf, regime or "normal")
+    emissao = emissao or datetime.datetime.now().astimezone()
+    pasta = Path(pasta)
+    pasta.mkdir(parents=True, exist_ok=True)
+
+    nome = nome or dados["cabecalho"]["DI"]
+    itens_por_nota = int(config["itens_por_nota"])
+    n_notas = math.ceil(n_itens / itens_por_nota)
+    itens = _itens_nfe(dados)
+    arquivos = []
+    for indice in range(n_notas):
+        numero = int(config["numero_inicial"]) + indice
+        arquivo = pasta / (f"NFe_{nome}.xml" if n_notas == 1 else f"NFe_{nome}_{indice + 1:03d}.xml")
+        with gravacao_atomica(arquivo) as temporario, open(temporario, "w", encoding="utf-8") as f:
+            _escreve_nfe(f, dados, itertools.islice(itens, itens_por_nota), numero, config, emissao)
+        arquivos.append(arquivo)
+    return arquivos
+
+
+def _escreve_nfe(f, dados, itens, numero, config, emissao):
+    """Uma NF-e no arquivo f com os itens informados (saída de _itens_nfe)"""
+    cab, imp = dados["cabecalho"], dados["importador"]
+    emitente = config["emitente"]
+    uf_importador = dados.get("fiscal", {}).get("UF", "N/A")
+    uf_emitente = emitente.get("UF") or ("" if uf_importador == "N/A" else uf_importador)
+    # cNF: 8 dígitos derivados da DI e do número, diferentes do nNF
+    codigo = int(hashlib.sha256(f"{cab['DI']}-{numero}".encode()).hexdigest(), 16) % 10 ** 8
+    if codigo == numero:
+        codigo = (codigo + 1) % 10 ** 8
+    chave = chave_acesso_nfe(uf_emitente, emissao, imp["CNPJ"], config["serie"], numero, codigo)
+    data_registro = data_iso(cab["Data registro"]) or ""
+    primeira = dados["adicoes"][0] if dados["adicoes"] else {"partes": {}, "fiscal": {}}
+    exportador = primeira["partes"].get("Exportador", "N/A")
+
+    x = _EscritorXML(f)
+    x.abre("NFe", xmlns=NAMESPACE_NFE)
+    x.abre("infNFe", versao=VERSAO_NFE, Id=f"NFe{chave}")
+    with x.elemento("ide"):
+        x.campos(("cUF", chave[:2]), ("cNF", chave[35:43]), ("natOp", _texto_nfe(config["natureza_operacao"], 60)),
+                 ("mod", "55"), ("serie", int(config["serie"])), ("nNF", numero),
+                 ("dhEmi", emissao.isoformat(timespec="seconds")), ("tpNF", "0"), ("idDest", "3"),
+                 ("cMunFG", emitente["cMun"]), ("tpImp", "1"), ("tpEmis", "1"), ("cDV", chave[-1]),
+                 ("tpAmb", config["ambiente"]), ("finNFe", "1"), ("indFinal", "0"), ("indPres", "0"),
+                 ("procEmi", "0"), ("verProc", "ExtratoDI"))
+    with x.elemento("emit"):
+        x.campos(("CNPJ", imp["CNPJ"]), ("xNome", _texto_nfe(imp["Nome"], 60)))
+        with x.elemento("enderEmit"):
+            x.campos(("xLgr", _texto_nfe(emitente["xLgr"], 60)), ("nro", _texto_nfe(emitente["nro"], 60)),
+                     ("xBairro", _texto_nfe(emitente["xBairro"], 60)), ("cMun", emitente["cMun"]),
+                     ("xMun", _texto_nfe(emitente["xMun"], 60)), ("UF", uf_emitente))
+            if emitente["CEP"]:
+                x.campo("CEP", emitente["CEP"])
+        x.campos(("IE", emitente["IE"]), ("CRT", emitente["CRT"]))
+    with x.elemento("dest"):
+        x.campos(("idEstrangeiro", ""), ("xNome", _texto_nfe(exportador, 60)))
+        with x.elemento("enderDest"):
+            endereco = primeira.get("fiscal", {}).get("Endereço Exportador", "N/A")
+            x.campos(("xLgr", _texto_nfe(endereco if endereco != "N/A" else "EXTERIOR", 60)), ("nro", "S/N"),
+                     ("xBairro", "EXTERIOR"), ("cMun", "9999999"), ("xMun", "EXTERIOR"), ("UF", "EX"),
+                     ("xPais", _texto_nfe(primeira["partes"].get("País Aquisição", "EXTERIOR"), 60)))
+        x.campo("indIEDest", "9")
+
+    fiscal = dados.get("fiscal", {})
+    via = fiscal.get("Via transporte", "N/A")
+    # Bloco DI até tpViaTransp: igual em todos os itens da nota, montado uma vez
+    bloco_di = x.trecho(("nDI", _texto_nfe(cab["DI"], 15)), ("dDI", data_registro),
+                        ("xLocDesemb", _texto_nfe(cab["URF despacho"], 60)),
+                        ("UFDesemb", config["uf_desembaraco"] or uf_emitente),
+                        ("dDesemb", config["data_desembaraco"] or data_registro),
+                        ("tpViaTransp", int(via) if via.isdigit() else via))
+    intermedio = x.trecho(("tpIntermedio", fiscal.get("Tipo operação", "N/A")),
+                          ("cExportador", _texto_nfe(exportador, 60)))
+    totais = dict.fromkeys(("vBC", "vICMS", "vProd", "vII", "vIPI", "vPIS", "vCOFINS", "vOutro"), 0)
+    n_item = 0
+    adicao_atual = None
+    for ad, item, v in itens:
+        if ad is not adicao_atual:
+            # Campos de texto da adição, montados uma vez por adição
+            adicao_atual = ad
+            trib = ad["tributos"]
+            ncm = _escape(str(ad["dados_gerais"]["NCM"]))
+            numero_adicao = int(ad["numero"]) if str(ad["numero"]).isdigit() else ad["numero"]
+            fabricante = x.trecho(("cFabricante", _texto_nfe(ad["partes"]["Fabricante"], 60)))
+            aliquotas = {"IPI": _percentual(trib["IPI Alíq. (%)"] * 100), "PIS": _percentual(trib["PIS Alíq. (%)"] * 100),
+                         "COFINS": _percentual(trib["COFINS Alíq. (%)"] * 100)}
+        n_item += 1
+        aliquota, reducao, diferimento = item["Alq. ICMS (%)"], item["Red. BC ICMS (%)"], item["Dif. ICMS (%)"]
+        cst = item["CST ICMS"]
+        base_icms, icms_operacao = round(item["Base ICMS R$"] * 100), round(item["ICMS R$"] * 100)
+        icms_diferido = round(item["ICMS Diferido R$"] * 100)
+        icms = icms_operacao - icms_diferido
+        outras = v["vPIS"] + v["vCOFINS"] + v["vDespAdu"] + icms
+        qtd = item["Qtd"]
+        codigo_item = item["Código"] if item["Código"] not in (None, "", "N/A") else f"{ad['numero']}-{item['Seq']}"
+        unidade = _texto_nfe(item["Unidade"], 6)
+        valor_unitario = f"{v['vProd'] / 100 / qtd:.10f}" if qtd else "0"
+        x.abre("det", nItem=n_item)
+        x.abre("prod")
+        x.campos(("cProd", _texto_nfe(codigo_item, 60)), ("cEAN", "SEM GTIN"),
+                 ("xProd", _texto_nfe(item["Descrição"], 120)))
+        x.bruto(f"<NCM>{ncm}</NCM>")
+        x.campos(("CFOP", config["cfop"]), ("uCom", unidade), ("qCom", f"{qtd:.4f}"), ("vUnCom", valor_unitario),
+                 ("vProd", _reais(v["vProd"])), ("cEANTrib", "SEM GTIN"), ("uTrib", unidade),
+                 ("qTrib", f"{qtd:.4f}"), ("vUnTrib", valor_unitario))
+        if outras:
+            x.campo("vOutro", _reais(outras))
+        x.campo("indTot", "1")
+        x.abre("DI")
+        x.bruto(bloco_di)
+        if via == "01":
+            x.campo("vAFRMM", _reais(v["vAFRMM"]))
+        x.bruto(intermedio)
+        x.abre("adi")
+        x.campos(("nAdicao", numero_adicao), ("nSeqAdic", int(item["Seq"]) if str(item["Seq"]).isdigit() else item["Seq"]))
+        x.bruto(fabricante)
+        x.fecha("adi")
+        x.fecha("DI")
+        x.fecha("prod")
+
+        x.abre("imposto")
+        x.abre("ICMS")
+        x.abre(f"ICMS{cst}")
+        x.campos(("orig", config["origem"]), ("CST", cst), ("modBC", "3"))
+        if reducao:
+            x.campo("pRedBC", _percentual(reducao))
+        x.campos(("vBC", _reais(base_icms)), ("pICMS", _percentual(aliquota)))
+        if cst == "51":
+            x.campos(("vICMSOp", _reais(icms_operacao)), ("pDif", _percentual(diferimento)),
+                     ("vICMSDif", _reais(icms_diferido)))
+        x.campo("vICMS", _reais(icms))
+        x.fecha(f"ICMS{cst}")
+        x.fecha("ICMS")
+        x.abre("IPI")
+        x.campo("cEnq", config["enquadramento_ipi"])
+        x.abre("IPITrib")
+        x.campos(("CST", config["cst_ipi"]), ("vBC", _reais(v["vProd"] + v["vII"])), ("pIPI", aliquotas["IPI"]),
+                 ("vIPI", _reais(v["vIPI"])))
+        x.fecha("IPITrib")
+        x.fecha("IPI")
+        x.abre("II")
+        x.campos(("vBC", _reais(v["vProd"])), ("vDespAdu", _reais(v["vDespAdu"])), ("vII", _reais(v["vII"])),
+                 ("vIOF", "0.00"))
+        x.fecha("II")
+        for grupo in ("PIS", "COFINS"):
+            x.abre(grupo)
+            x.abre(f"{grupo}Outr")
+            x.campos(("CST", config["cst_pis_cofins"]), ("vBC", _reais(v["vBCPISCOFINS"])),
+                     (f"p{grupo}", aliquotas[grupo]), (f"v{grupo}", _reais(v[f"v{grupo}"])))
+            x.fecha(f"{grupo}Outr")
+            x.fecha(grupo)
+        x.fecha("imposto")
+        x.fecha("det")
+
+        for campo, valor in (("vBC", base_icms), ("vICMS", icms), ("vProd", v["vProd"]), ("vII", v["vII"]),
+                             ("vIPI", v["vIPI"]), ("vPIS", v["vPIS"]), ("vCOFINS", v["vCOFINS"]),
+                             ("vOutro", outras)):
+            totais[campo] += valor
+
+    total_nota = totais["vProd"] + totais["vII"] + totais["vIPI"] + totais["vOutro"]
+    with x.elemento("total"), x.elemento("ICMSTot"):
+        x.campos(("vBC", _reais(totais["vBC"])), ("vICMS", _reais(totais["vICMS"])), ("vICMSDeson", "0.00"),
+                 ("vFCP", "0.00"), ("vBCST", "0.00"), ("vST", "0.00"), ("vFCPST", "0.00"), ("vFCPSTRet", "0.00"),
+                 ("vProd", _reais(totais["vProd"])), ("vFrete", "0.00"), ("vSeg", "0.00"), ("vDesc", "0.00"),
+                 ("vII", _reais(totais["vII"])), ("vIPI", _reais(totais["vIPI"])), ("vIPIDevol", "0.00"),
+                 ("vPIS", _reais(totais["vPIS"])), ("vCOFINS", _reais(totais["vCOFINS"])),
+                 ("vOutro", _reais(totais["vOutro"])), ("vNF", _reais(total_nota)))
+    with x.elemento("transp"):
+        x.campo("modFrete", config["modalidade_frete"])
+    with x.elemento("pag"), x.elemento("detPag"):
+        x.campos(("tPag", "90"), ("vPag", "0.00"))
+    with x.elemento("infAdic"):
+        x.campo("infCpl", _texto_nfe(f"DI: {cab['DI']} - Data Registro: {cab['Data registro']} "
+                                     f"{dados['info_complementar']}", 5000))
+    x.fecha("infNFe")
+    x.fecha("NFe")
+
+
+def _texto_leiaute(minimo, maximo):
+    """Expressão do tipo TString do leiaute com minimo a maximo caracteres"""
+    return rf"[!-ÿ][ -ÿ]{{{max(minimo - 2, 0)},{maximo - 2}}}[!-ÿ]" + ("|[!-ÿ]" if minimo <= 1 else "")
+
+
+_DECIMAL_1302 = r"0|0\.[0-9]{2}|[1-9][0-9]{0,12}(\.[0-9]{2})?"
+
+# Formato de cada campo folha da NF-e gerada (expressões dos tipos do schema 4.00)
+TIPOS_LEIAUTE_NFE = {
+    **{campo: _DECIMAL_1302 for campo in (
+        "vProd", "vOutro", "vAFRMM", "vBC", "vICMS", "vICMSOp", "vICMSDif", "vIPI", "vDespAdu", "vII", "vIOF",
+        "vPIS", "vCOFINS", "vICMSDeson", "vFCP", "vBCST", "vST", "vFCPST", "vFCPSTRet", "vFrete", "vSeg",
+        "vDesc", "vIPIDevol", "vNF", "vPag")},
+    **{campo: r"0|0\.[0-9]{2,4}|[1-9][0-9]{0,2}(\.[0-9]{2,4})?" for campo in (
+        "pRedBC", "pICMS", "pDif", "pIPI", "pPIS", "pCOFINS")},
+    **{campo: r"0|0\.[0-9]{1,4}|[1-9][0-9]{0,10}(\.[0-9]{1,4})?" for campo in ("qCom", "qTrib")},
+    **{campo: r"0|0\.[0-9]{1,10}|[1-9][0-9]{0,10}(\.[0-9]{1,10})?" for campo in ("vUnCom", "vUnTrib")},
+    **{campo: _texto_leiaute(2, 60) for campo in ("xNome", "xLgr", "xBairro", "xMun", "xPais")},
+    **{campo: _texto_leiaute(1, 60) for campo in ("natOp", "nro", "cProd", "xLocDesemb", "cExportador",
+                                                    "cFabricante")},
+    "xProd": _texto_leiaute(1, 120), "uCom": _texto_leiaute(1, 6), "uTrib": _texto_leiaute(1, 6),
+    "nDI": _texto_leiaute(1, 15), "infCpl": _texto_leiaute(1, 5000), "verProc": _texto_leiaute(1, 20),
+    "idEstrangeiro": r"([!-ÿ]{0}|[!-ÿ]{5,20})?",
+    "cUF": "|".join(CODIGOS_UF.values()), "cNF": r"[0-9]{8}", "mod": "55", "serie": r"0|[1-9][0-9]{0,2}",
+    "nNF": r"[1-9][0-9]{0,8}", "dhEmi": r"[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}[-+][0-9]{2}:[0-9]{2}",
+    "tpNF": "0|1", "idDest": "1|2|3", "cMunFG": r"[0-9]{7}", "cMun": r"[0-9]{7}", "tpImp": "[0-5]",
+    "tpEmis": "[1-9]", "cDV": "[0-9]", "tpAmb": "1|2", "finNFe": "[1-4]", "indFinal": "0|1",
+    "indPres": "0|1|2|3|4|5|9", "procEmi": "[0-3]", "CNPJ": r"[0-9]{14}", "IE": r"[0-9]{2,14}|ISENTO",
+    "CRT": "[1-4]", "CEP": r"[0-9]{8}", "UF": "|".join(CODIGOS_UF) + "|EX", "indIEDest": "1|2|9",
+    "cEAN": "SEM GTIN", "cEANTrib": "SEM GTIN", "NCM": r"[0-9]{2}|[0-9]{8}", "CFOP": r"[1235-7][0-9]{3}",
+    "indTot": "0|1", "dDI": r"[0-9]{4}-[0-9]{2}-[0-9]{2}", "dDesemb": r"[0-9]{4}-[0-9]{2}-[0-9]{2}",
+    "UFDesemb": "|".join(CODIGOS_UF), "tpViaTransp": r"[1-9]|1[0-3]", "tpIntermedio": "1|2|3",
+    "nAdicao": r"[1-9][0-9]{0,2}", "nSeqAdic": r"[1-9][0-9]{0,4}", "orig": "[0-8]", "CST": r"[0-9]{2}",
+    "modBC": "[0-3]", "cEnq": r"[0-9A-Za-z]{1,3}", "modFrete": "[0-49]", "tPag": r"[0-9]{2}",
+}
+
+# Campos sem os quais um det não vale (os demais são opcionais ou condicionais no leiaute)
+CAMPOS_OBRIGATORIOS_DET = ("cProd", "cEAN", "xProd", "NCM", "CFOP", "uCom", "qCom", "vUnCom", "vProd", "cEANTrib",
+                           "uTrib", "qTrib", "vUnTrib", "indTot", "nDI", "dDI", "xLocDesemb", "UFDesemb", "dDesemb",
+                           "tpViaTransp", "tpIntermedio", "cExportador", "nSeqAdic", "cFabricante", "orig", "CST")
+
+
+def valida_nfe(caminho: Path, xsd=None) -> list:
+    """
+    Valida offline o XML de uma NF-e gerada por gera_nfe_entrada; devolve os erros (vazia se OK).
+
+    Confere, lendo o arquivo em streaming (iterparse, det a det): o formato de cada campo
+    (TIPOS_LEIAUTE_NFE), os campos obrigatórios de cada item, a quantidade e a numeração
+    dos itens, a chave de acesso (Id, cDV e campos do ide) e os totais do ICMSTot contra a
+    soma dos itens, inclusive vNF. Com xsd (o nfe_v4.00.xsd do pacote de schemas, em disco),
+    valida também pelo schema oficial, o que requer lxml.
+    """
+    padroes = {campo: re.compile(expressao).fullmatch for campo, expressao in TIPOS_LEIAUTE_NFE.items()}
+    erros = []
+    somas = dict.fromkeys(("vProd", "vII", "vIPI", "vPIS", "vCOFINS", "vOutro", "vBC", "vICMS"), 0)
+    # Grupos do det cujos valores entram nos totais (vBC só o do ICMS)
+    grupos_soma = {"prod": ("vProd", "vOutro"), "II": ("vII",), "IPITrib": ("vIPI",), "PISOutr": ("vPIS",),
+                   "COFINSOutr": ("vCOFINS",), **{f"ICMS{cst}": ("vBC", "vICMS") for cst in ("00", "20", "51")}}
+    secoes = {"ide": {}, "ICMSTot": {}}
+    ide, totais = secoes["ide"], secoes["ICMSTot"]
+    pilha = []
+    id_nota = ""
+    n_itens = 0
+    no_det = False
+    campos_det = set()
+    for evento, elem in ET.iterparse(str(caminho), events=("start", "end")):
+        tag = elem.tag.rpartition("}")[2]
+        if evento == "start":
+            pilha.append(tag)
+            if tag == "det":
+                n_itens += 1
+                no_det = True
+                campos_det = set()
+                if elem.get("nItem") != str(n_itens):
+                    erros.append(f"det {n_itens}: nItem '{elem.get('nItem')}' fora de sequência")
+            elif tag == "infNFe":
+                id_nota = elem.get("Id", "")
+            continue
+        pilha.pop()
+        if tag == "det":
+            faltando = [campo for campo in CAMPOS_OBRIGATORIOS_DET if campo not in campos_det]
+            if faltando:
+                erros.append(f"det {n_itens}: faltam {', '.join(faltando)}")
+            no_det = False
+            elem.clear()
+            continue
+        if len(elem):
+            continue
+        texto = elem.text or ""
+        confere = padroes.get(tag)
+        if confere is not None and not confere(texto):
+            onde = f"det {n_itens}/{tag}" if no_det else "/".join(pilha[2:] + [tag])
+            erros.append(f"{onde}: valor '{texto[:40]}' fora do leiaute")
+        grupo = pilha[-1] if pilha else ""
+        if no_det:
+            campos_det.add(tag)
+            if tag in grupos_soma.get(grupo, ()):
+                somas[tag] += _centavos_nfe(texto)
+        elif grupo in secoes:
+            secoes[grupo][tag] = texto if grupo == "ide" else _centavos_nfe(texto)
+
+    if not 1 <= n_itens <= MAX_ITENS_NFE:
+        erros.append(f"{n_itens} itens (o leiaute admite de 1 a {MAX_ITENS_NFE})")
+    chave = id_nota[3:]
+    if not re.fullmatch(r"NFe[0-9]{44}", id_nota):
+        erros.append(f"Id '{id_nota}' fora do leiaute")
+    elif _digito_chave(chave[:43]) != chave[43]:
+        erros.append(f"Chave de acesso {chave} com dígito verificador inválido")
+    elif (chave[:2], chave[35:43], chave[43], chave[20:22]) != (ide.get("cUF"), ide.get("cNF"), ide.get("cDV"),
+                                                                  ide.get("mod")) or \
+            int(chave[22:25]) != int(ide.get("serie") or -1) or int(chave[25:34]) != int(ide.get("nNF") or -1):
+        erros.append(f"Chave de acesso {chave} não confere com o ide")
+    for campo, soma in somas.items():
+        if totais.get(campo) != soma:
+            erros.append(f"ICMSTot/{campo} {_reais(totais.get(campo, 0))} ≠ soma dos itens {_reais(soma)}")
+    if totais:
+        esperado = (totais["vProd"] - totais["vDesc"] - totais["vICMSDeson"] + totais["vST"] + totais["vFCPST"] +
+                    totais["vFrete"] + totais["vSeg"] + totais["vOutro"] + totais["vII"] + totais["vIPI"] +
+                    totais["vIPIDevol"])
+        if totais["vNF"] != esperado:
+            erros.append(f"ICMSTot/vNF {_reais(totais['vNF'])} ≠ {_reais(esperado)} calculado pelos totais")
+
+    if xsd:
+        etree = importa_lxml()
+        if etree is None:
+            raise RuntimeError("A validação pelo XSD da NF-e requer o pacote lxml")
+        schema = etree.XMLSchema(etree.parse(str(xsd)))
+        if not schema.validate(etree.parse(str(caminho))):
+            erros.extend(f"XSD linha {e.line}: {e.message}" for e in schema.error_log)
+    return erros
+
+
+def _centavos_nfe(texto):
+    try:
+        reais, _, centavos = texto.partition(".")
+        return int(reais) * 100 + int((centavos + "00")[:2])
+    except ValueError:
+        return 0
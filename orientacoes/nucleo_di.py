@@ -0,0 +1,2571 @@
+"""
+Núcleo do extrato de DI: leitura do XML, cálculo e validação de custos, cache de parse e
+medição de etapas.
+
+Não importa tkinter nem pandas (nem numpy, carregado só pelo motor vetorizado), para que
+workers, serviços e o uso headless iniciem rápido. A geração do Excel fica em
+extrato_excel.py, o lote e o vigia em lote_dis.py, o serviço HTTP em servico_di.py e a
+interface gráfica em importador-xml-di-nf-entrada-jules.py.
+"""
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from collections import OrderedDict
+from array import array
+from collections.abc import Mapping, MutableMapping, Sequence
+from contextlib import contextmanager
+from functools import lru_cache
+from operator import itemgetter
+import csv
+import datetime
+import hashlib
+import importlib.util
+import io
+import itertools
+import json
+import logging
+import math
+import mmap
+import os
+import pickle
+import re
+import tempfile
+import time
+import tracemalloc
+
+log = logging.getLogger("ExtratoDI")
+
+# Módulos que `import nucleo_di` não pode carregar, e o tempo máximo dessa importação
+# (conferidos pelo benchmark e por tests/test_nucleo_di.py)
+MODULOS_PESADOS = ("tkinter", "pandas", "numpy", "xlsxwriter", "pyarrow")
+ORCAMENTO_IMPORTACAO_MS = 250.0
+
+
+def parse_numeric_field(value, divisor=100):
+    """Converte campos numéricos do XML que vêm com zeros à esquerda"""
+    if not value:
+        return 0.0
+    try:
+        clean_value = value.lstrip('0') or '0'
+        return float(clean_value) / divisor
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def parse_numeric_field_fixo(value):
+    """
+    Versão em ponto fixo de parse_numeric_field: devolve o inteiro na escala
+    implícita do campo (ex.: centavos para valores em R$), sem construir float
+    """
+    if not value:
+        return 0
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+
+# Escala dos campos numéricos em ponto fixo (valor real = inteiro / escala).
+# Campos que não estão aqui e contêm "R$" ou "USD" no nome estão em centavos (100).
+ESCALAS_PONTO_FIXO = {
+    "Peso bruto (kg)": 1000,
+    "Peso líquido (kg)": 1000,
+    "Peso líq. (kg)": 1000,
+    "Quantidade": 1000,
+    "II Alíq. (%)": 10000,
+    "IPI Alíq. (%)": 10000,
+    "PIS Alíq. (%)": 10000,
+    "COFINS Alíq. (%)": 10000,
+    "Qtd": 100000,
+    "Valor Unit. USD": 10000000,
+    "Valor Total USD": 100000 * 10000000,
+    "Custo Unitário R$": 10000000,
+    "Custo por Peça R$": 10000000,
+    "Custo Total Calculado": 100,
+    "Valor Esperado": 100,
+    "Diferença": 100,
+}
+
+
+def _escala_ponto_fixo(campo):
+    escala = ESCALAS_PONTO_FIXO.get(campo)
+    if escala is None and ("R$" in campo or "USD" in campo):
+        escala = 100
+    return escala
+
+
+def converte_ponto_fixo(dados):
+    """
+    Converte uma estrutura carregada com ponto_fixo=True para valores decimais (float),
+    para saída (Excel, relatórios). Devolve uma cópia; a estrutura original não é alterada.
+    """
+    if isinstance(dados, (dict, RegistroCompacto, ItemDI)):
+        convertido = {}
+        for campo, valor in dados.items():
+            if campo == "ponto_fixo":
+                continue
+            escala = _escala_ponto_fixo(campo) if isinstance(campo, str) else None
+            if escala and type(valor) is int:
+                convertido[campo] = valor / escala
+            elif campo == "cenarios_custos":
+                convertido[campo] = _converte_cenarios_ponto_fixo(valor)
+            else:
+                convertido[campo] = converte_ponto_fixo(valor)
+        return convertido
+    if isinstance(dados, (list, ItensCompactos)):
+        return [converte_ponto_fixo(v) for v in dados]
+    return dados
+
+
+def _converte_cenarios_ponto_fixo(cenarios_custos):
+    """A matriz de calcular_custos_cenarios não tem nomes de campo: converte pela posição"""
+    escala_total = _escala_ponto_fixo("Custo Total Item R$")
+    escala_unitario = _escala_ponto_fixo("Custo Unitário R$")
+    escala_peca = _escala_ponto_fixo("Custo por Peça R$")
+    return {
+        "cenarios": converte_ponto_fixo(cenarios_custos["cenarios"]),
+        "adicoes": [[total / escala_total for total in totais] for totais in cenarios_custos["adicoes"]],
+        "itens": [[(total / escala_total, unitario / escala_unitario,
+                    peca / escala_peca if type(peca) is int else peca)
+                   for total, unitario, peca in custos_item]
+                  for custos_item in cenarios_custos["itens"]],
+    }
+
+
+def decimal_ou_nulo(valor):
+    """Número como float; textos como "N/A" viram nulo"""
+    return float(valor) if isinstance(valor, (int, float)) and not isinstance(valor, bool) else None
+
+
+def data_aaaammdd(valor):
+    """Data de registro da DI (AAAAMMDD) como datetime.date; inválida vira nulo"""
+    try:
+        return datetime.datetime.strptime(str(valor), "%Y%m%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def data_iso(valor):
+    """Data em AAAA-MM-DD a partir de AAAAMMDD, AAAA-MM-DD ou datetime.date; None se ausente ou inválida"""
+    if valor is None or isinstance(valor, datetime.date):
+        return valor.isoformat() if valor else None
+    data = data_aaaammdd(str(valor).replace("-", ""))
+    return data.isoformat() if data else None
+
+
+# === EXTRAÇÃO DE CÓDIGO E UNIDADES POR CAIXA DA DESCRIÇÃO === #
+
+# Padrões padrão de extração: o primeiro grupo de cada expressão é o valor extraído
+PADROES_DESCRICAO = {
+    # "ABC-123 - PRODUTO ...": o código é o trecho antes do primeiro " - "
+    "codigo": r"^(.*?) - ",
+    # "... EM CX COM 12 UNIDADES"
+    "unidades": r"EM CX COM\s*(\d+)\s*(?:UNIDADES|$)",
+}
+
+
+class ExtratorDescricao:
+    """
+    Extrai Código e Unid/Caixa de descricaoMercadoria com padrões pré-compilados.
+
+    Os padrões podem ser trocados por fornecedor (nome do exportador da adição, sem
+    diferenciar maiúsculas). Como as mesmas descrições se repetem entre itens e DIs, o
+    resultado de cada (perfil, descrição) fica em um memo LRU limitado a tamanho_memo.
+    """
+
+    def __init__(self, padroes=None, fornecedores=None, tamanho_memo=65536, origem=None):
+        self._argumentos = (padroes, fornecedores, tamanho_memo, origem)
+        padroes = dict(PADROES_DESCRICAO, **(padroes or {}))
+        self.origem = origem
+        self.perfis = {None: self._compila(padroes)}
+        for fornecedor, padroes_fornecedor in (fornecedores or {}).items():
+            self.perfis[self._chave_fornecedor(fornecedor)] = self._compila(dict(padroes, **padroes_fornecedor))
+        # Identifica a configuração no cache de parse; vazia com os padrões padrão
+        configuracao = {"padroes": padroes, "fornecedores": fornecedores or {}}
+        self.assinatura = "" if configuracao == {"padroes": PADROES_DESCRICAO, "fornecedores": {}} else \
+            hashlib.sha256(json.dumps(configuracao, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        self.extrai = lru_cache(maxsize=tamanho_memo)(self._extrai)
+
+    @classmethod
+    def carrega(cls, arquivo: Path) -> "ExtratorDescricao":
+        """
+        Lê a configuração de um JSON no formato
+        {"padroes": {"codigo": ..., "unidades": ...}, "fornecedores": {"NOME": {...}}, "tamanho_memo": N}
+        """
+        configuracao = json.loads(Path(arquivo).read_text(encoding="utf-8"))
+        return cls(configuracao.get("padroes"), configuracao.get("fornecedores"),
+                   configuracao.get("tamanho_memo", 65536), origem=str(arquivo))
+
+    def __reduce__(self):
+        # O memo (lru_cache) não é serializável: os workers do parse paralelo recompilam a partir da configuração
+        return type(self), self._argumentos
+
+    @staticmethod
+    def _chave_fornecedor(fornecedor):
+        return (fornecedor or "").strip().upper()
+
+    @staticmethod
+    def _compila(padroes):
+        compilados = []
+        for campo in ("codigo", "unidades"):
+            try:
+                compilados.append(re.compile(padroes[campo], re.DOTALL))
+            except re.error as e:
+                raise ValueError(f"Padrão de extração '{campo}' inválido ({padroes[campo]!r}): {e}")
+        return tuple(compilados)
+
+    def perfil(self, fornecedor):
+        """Chave do perfil específico do fornecedor, ou None se ele usa os padrões gerais"""
+        chave = self._chave_fornecedor(fornecedor)
+        return chave if chave in self.perfis else None
+
+    def _extrai(self, descricao, perfil=None):
+        """(Código, Unid/Caixa) de uma descrição; "N/A" no que não for encontrado"""
+        if not descricao:
+            return "N/A", "N/A"
+        padrao_codigo, padrao_unidades = self.perfis[perfil]
+        m = padrao_codigo.search(descricao)
+        codigo = m.group(1).strip() if m else "N/A"
+        m = padrao_unidades.search(descricao)
+        try:
+            unidades = int(m.group(1)) if m else "N/A"
+        except ValueError:
+            unidades = "N/A"
+        return codigo, unidades
+
+
+_extrator = ExtratorDescricao()
+
+
+def extrator_descricao() -> ExtratorDescricao:
+    """Extrator usado pelo parse (ver configura_extrator)"""
+    return _extrator
+
+
+def configura_extrator(extrator: ExtratorDescricao = None):
+    """Troca o extrator usado pelo parse neste processo; None volta aos padrões padrão"""
+    global _extrator
+    _extrator = extrator or ExtratorDescricao()
+
+
+def usa_padroes_descricao(arquivo):
+    """Configura o extrator a partir de um JSON, reaproveitando o memo se já foi carregado dele"""
+    if arquivo and _extrator.origem != str(arquivo):
+        configura_extrator(ExtratorDescricao.carrega(arquivo))
+    elif not arquivo and _extrator.origem:
+        configura_extrator()
+
+
+def extrair_codigo_produto(descricao):
+    """Extrai o código do produto da descrição"""
+    return _extrator.extrai(descricao)[0]
+
+
+def extrair_unidades_por_caixa(descricao):
+    """Extrai quantidade de unidades por caixa da descrição"""
+    return _extrator.extrai(descricao)[1]
+
+
+def calcular_custos_unitarios(dados, frete_embutido=False, seguro_embutido=False, vetorizado=False,
+                              cenarios=None):
+    """
+    Calcula o custo unitário de cada item importado considerando:
+    1. Valor da mercadoria (VCMV)
+    2. Custos proporcionais (frete, seguro, AFRMM, Siscomex)
+    3. Impostos incorporáveis (II - Imposto de Importação)
+
+    Args:
+        dados: Dicionário com os dados da DI
+        frete_embutido: Boolean - Se True, considera que frete já está no VCMV
+        seguro_embutido: Boolean - Se True, considera que seguro já está no VCMV
+        vetorizado: Boolean - Se True, usa o motor NumPy (calcular_custos_unitarios_vetorizado)
+        cenarios: Lista opcional de cenários (ver calcular_custos_cenarios); quando informada,
+                  frete_embutido/seguro_embutido são ignorados e o primeiro cenário é o principal
+    """
+    if cenarios:
+        return calcular_custos_cenarios(dados, cenarios)
+    if dados.get("ponto_fixo"):
+        return calcular_custos_unitarios_ponto_fixo(dados, frete_embutido, seguro_embutido)
+    if vetorizado:
+        return calcular_custos_unitarios_vetorizado(dados, frete_embutido, seguro_embutido)
+
+    # Extrair totais da DI
+    valor_total_di = dados["valores"]["FOB R$"]
+    frete_total = dados["valores"]["Frete R$"] if not frete_embutido else 0.0
+    seguro_total = dados.get("valores", {}).get("Seguro R$", 0.0) if not seguro_embutido else 0.0
+    afrmm_total = dados.get("valores", {}).get("AFRMM R$", 0.0)
+    siscomex_total = dados.get("valores", {}).get("Siscomex R$", 0.0)
+
+    # Se frete/seguro estão embutidos, usar valor aduaneiro como base
+    if frete_embutido or seguro_embutido:
+        valor_base_calculo = dados["valores"]["Valor Aduaneiro R$"]
+    else:
+        valor_base_calculo = valor_total_di
+
+    # Adicionar informações sobre configuração de custos
+    dados["configuracao_custos"] = {
+        "Frete Embutido": "Sim" if frete_embutido else "Não",
+        "Seguro Embutido": "Sim" if seguro_embutido else "Não",
+        "Base de Cálculo": "Valor Aduaneiro" if (frete_embutido or seguro_embutido) else "FOB",
+        "Valor Base R$": valor_base_calculo,
+        "Frete Considerado R$": frete_total,
+        "Seguro Considerado R$": seguro_total,
+        "AFRMM R$": afrmm_total,
+        "Siscomex R$": siscomex_total
+    }
+
+    # Processar cada adição
+    for adicao in dados["adicoes"]:
+        valor_adicao = adicao["dados_gerais"]["VCMV R$"]
+
+        # Calcular percentual da adição sobre a base correta
+        if valor_base_calculo > 0:
+            percentual_adicao = valor_adicao / valor_base_calculo
+        else:
+            percentual_adicao = 0
+
+        # Ratear custos proporcionais (apenas os não embutidos)
+        custo_frete_adicao = percentual_adicao * frete_total
+        custo_seguro_adicao = percentual_adicao * seguro_total
+        custo_afrmm_adicao = percentual_adicao * afrmm_total
+        custo_siscomex_adicao = percentual_adicao * siscomex_total
+
+        # Impostos incorporáveis (principalmente II)
+        ii_adicao = adicao["tributos"]["II R$"]
+
+        # Custo total da adição
+        custo_total_adicao = (
+                valor_adicao +
+                custo_frete_adicao +
+                custo_seguro_adicao +
+                custo_afrmm_adicao +
+                custo_siscomex_adicao +
+                ii_adicao
+        )
+
+        # Adicionar dados de custo à adição
+        adicao["custos"] = {
+            "Valor Mercadoria R$": valor_adicao,
+            "Frete Rateado R$": custo_frete_adicao,
+            "Seguro Rateado R$": custo_seguro_adicao,
+            "AFRMM Rateado R$": custo_afrmm_adicao,
+            "Siscomex Rateado R$": custo_siscomex_adicao,
+            "II Incorporado R$": ii_adicao,
+            "Custo Total Adição R$": custo_total_adicao,
+            "% Participação": percentual_adicao * 100,
+            "Observações": f"Base: {'Valor Aduaneiro' if (frete_embutido or seguro_embutido) else 'FOB'}"
+        }
+
+        # Calcular custo unitário para cada item
+        if adicao["itens"]:
+            qtd_total_adicao = sum(item["Qtd"] for item in adicao["itens"])
+
+            for item in adicao["itens"]:
+                if qtd_total_adicao > 0:
+                    proporcao_item = item["Qtd"] / qtd_total_adicao
+                    custo_unitario_item = custo_total_adicao * proporcao_item
+
+                    if item["Qtd"] > 0:
+                        custo_por_unidade = custo_unitario_item / item["Qtd"]
+                    else:
+                        custo_por_unidade = 0
+
+                    item["Custo Total Item R$"] = custo_unitario_item
+                    item["Custo Unitário R$"] = custo_por_unidade
+
+                    unid_caixa = item.get("Unid/Caixa", "N/A")
+                    if isinstance(unid_caixa, int) and unid_caixa > 0:
+                        custo_por_peca = custo_unitario_item / (item["Qtd"] * unid_caixa)
+                        item["Custo por Peça R$"] = custo_por_peca
+                    else:
+                        item["Custo por Peça R$"] = "N/A"
+                else:
+                    item["Custo Total Item R$"] = 0
+                    item["Custo Unitário R$"] = 0
+                    item["Custo por Peça R$"] = 0
+
+
+def _rateia_inteiro(total, pesos, divisor):
+    """
+    Rateia o inteiro total na proporção peso/divisor pelo método dos maiores restos.
+
+    A soma das partes é exatamente total * sum(pesos) / divisor arredondado, ou seja,
+    igual a total quando os pesos somam o divisor.
+    """
+    if divisor <= 0 or not pesos:
+        return [0] * len(pesos)
+    produtos = [total * peso for peso in pesos]
+    partes = [produto // divisor for produto in produtos]
+    alvo = (2 * sum(produtos) + divisor) // (2 * divisor)
+    falta = alvo - sum(partes)
+    if falta > 0:
+        restos = sorted(range(len(pesos)), key=lambda i: produtos[i] % divisor, reverse=True)
+        for i in restos[:falta]:
+            partes[i] += 1
+    return partes
+
+
+def _divide_arredondado(numerador, denominador):
+    """Divisão inteira com arredondamento meio para cima"""
+    return (2 * numerador + denominador) // (2 * denominador)
+
+
+def calcular_custos_unitarios_ponto_fixo(dados, frete_embutido=False, seguro_embutido=False):
+    """
+    Cálculo de custos para DIs carregadas com ponto_fixo=True, somente com inteiros.
+
+    Valores em R$ ficam em centavos e são rateados pelo método dos maiores restos,
+    de modo que a soma dos itens de cada adição é exatamente o custo da adição.
+    Custo unitário e custo por peça ficam na escala de valorUnitario (1e-7).
+    """
+    valores = dados["valores"]
+    frete_total = valores["Frete R$"] if not frete_embutido else 0
+    seguro_total = valores.get("Seguro R$", 0) if not seguro_embutido else 0
+    afrmm_total = valores.get("AFRMM R$", 0)
+    siscomex_total = valores.get("Siscomex R$", 0)
+
+    if frete_embutido or seguro_embutido:
+        valor_base_calculo = valores["Valor Aduaneiro R$"]
+    else:
+        valor_base_calculo = valores["FOB R$"]
+
+    base_descricao = "Valor Aduaneiro" if (frete_embutido or seguro_embutido) else "FOB"
+    dados["configuracao_custos"] = {
+        "Frete Embutido": "Sim" if frete_embutido else "Não",
+        "Seguro Embutido": "Sim" if seguro_embutido else "Não",
+        "Base de Cálculo": base_descricao,
+        "Valor Base R$": valor_base_calculo,
+        "Frete Considerado R$": frete_total,
+        "Seguro Considerado R$": seguro_total,
+        "AFRMM R$": afrmm_total,
+        "Siscomex R$": siscomex_total
+    }
+
+    for adicao, (custos, custos_itens) in zip(dados["adicoes"], _custos_adicoes_ponto_fixo(
+            dados["adicoes"], base_descricao, valor_base_calculo, frete_total, seguro_total, afrmm_total,
+            siscomex_total)):
+        adicao["custos"] = custos
+        for item, (custo_item, custo_unit, custo_peca) in zip(adicao["itens"], custos_itens):
+            item["Custo Total Item R$"] = custo_item
+            item["Custo Unitário R$"] = custo_unit
+            item["Custo por Peça R$"] = custo_peca
+
+
+def _custos_adicoes_ponto_fixo(adicoes, base_descricao, valor_base_calculo, frete_total, seguro_total,
+                               afrmm_total, siscomex_total):
+    """
+    Rateio em inteiros de um conjunto de totais: gera, para cada adição, o dicionário "custos"
+    e a lista (custo total, unitário, por peça) dos itens, sem gravar nada nos dicionários
+    """
+    vcmv = [ad["dados_gerais"]["VCMV R$"] for ad in adicoes]
+    rateios = [_rateia_inteiro(total, vcmv, valor_base_calculo)
+               for total in (frete_total, seguro_total, afrmm_total, siscomex_total)]
+
+    for i, adicao in enumerate(adicoes):
+        frete, seguro, afrmm, siscomex = (rateio[i] for rateio in rateios)
+        ii_adicao = adicao["tributos"]["II R$"]
+        custo_total_adicao = vcmv[i] + frete + seguro + afrmm + siscomex + ii_adicao
+
+        custos = {
+            "Valor Mercadoria R$": vcmv[i],
+            "Frete Rateado R$": frete,
+            "Seguro Rateado R$": seguro,
+            "AFRMM Rateado R$": afrmm,
+            "Siscomex Rateado R$": siscomex,
+            "II Incorporado R$": ii_adicao,
+            "Custo Total Adição R$": custo_total_adicao,
+            "% Participação": vcmv[i] * 100 / valor_base_calculo if valor_base_calculo > 0 else 0,
+            "Observações": f"Base: {base_descricao}"
+        }
+
+        custos_itens = []
+        if adicao["itens"]:
+            qtds = [item["Qtd"] for item in adicao["itens"]]
+            qtd_total_adicao = sum(qtds)
+            totais_itens = _rateia_inteiro(custo_total_adicao, qtds, qtd_total_adicao)
+
+            # O custo unitário é o mesmo para todos os itens da adição (custo / quantidade total).
+            # Centavos / quantidade na escala 1e-5 dá o custo unitário na escala 1e-7 com fator 1e10.
+            for item, qtd, custo_item in zip(adicao["itens"], qtds, totais_itens):
+                if qtd > 0:
+                    custo_unit = _divide_arredondado(custo_total_adicao * 10 ** 10, qtd_total_adicao)
+                else:
+                    custo_unit = 0
+
+                unid_caixa = item.get("Unid/Caixa", "N/A")
+                if isinstance(unid_caixa, int) and unid_caixa > 0:
+                    custo_peca = (
+                        _divide_arredondado(custo_total_adicao * 10 ** 10, qtd_total_adicao * unid_caixa)
+                        if qtd > 0 else 0)
+                else:
+                    custo_peca = "N/A"
+                custos_itens.append((custo_item, custo_unit, custo_peca))
+        yield custos, custos_itens
+
+
+def numpy_disponivel():
+    """Se o motor vetorizado de custos pode ser usado, sem importar o numpy"""
+    return importlib.util.find_spec("numpy") is not None
+
+
+def calcular_custos_unitarios_vetorizado(dados, frete_embutido=False, seguro_embutido=False, grava_itens=True):
+    """
+    Mesmo cálculo de calcular_custos_unitarios, executado com arrays NumPy.
+
+    VCMV e II ficam em arrays por adição; quantidades, unidades por caixa e o índice
+    da adição ficam em arrays contíguos por item. O rateio e os custos por item são
+    calculados em operações em lote, na mesma ordem de operações do motor em Python,
+    de modo que os resultados são idênticos.
+
+    Args:
+        grava_itens: Se False, os custos por item não são gravados nos dicionários
+                     dos itens (apenas "custos" de cada adição); use os arrays devolvidos
+
+    Returns:
+        Dicionário de arrays por item: "idx_adicao", "qtd", "custo_total_item",
+        "custo_unitario" e "custo_por_peca" (NaN onde não há Unid/Caixa)
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("O motor vetorizado de custos requer o pacote numpy") from None
+
+    valores = dados.get("valores", {})
+    valor_total_di = dados["valores"]["FOB R$"]
+    frete_total = dados["valores"]["Frete R$"] if not frete_embutido else 0.0
+    seguro_total = valores.get("Seguro R$", 0.0) if not seguro_embutido else 0.0
+    afrmm_total = valores.get("AFRMM R$", 0.0)
+    siscomex_total = valores.get("Siscomex R$", 0.0)
+
+    if frete_embutido or seguro_embutido:
+        valor_base_calculo = dados["valores"]["Valor Aduaneiro R$"]
+    else:
+        valor_base_calculo = valor_total_di
+
+    base_descricao = "Valor Aduaneiro" if (frete_embutido or seguro_embutido) else "FOB"
+    dados["configuracao_custos"] = {
+        "Frete Embutido": "Sim" if frete_embutido else "Não",
+        "Seguro Embutido": "Sim" if seguro_embutido else "Não",
+        "Base de Cálculo": base_descricao,
+        "Valor Base R$": valor_base_calculo,
+        "Frete Considerado R$": frete_total,
+        "Seguro Considerado R$": seguro_total,
+        "AFRMM R$": afrmm_total,
+        "Siscomex R$": siscomex_total
+    }
+
+    adicoes = dados["adicoes"]
+
+    # Arrays por adição
+    vcmv = np.array([ad["dados_gerais"]["VCMV R$"] for ad in adicoes], dtype=np.float64)
+    ii = np.array([ad["tributos"]["II R$"] for ad in adicoes], dtype=np.float64)
+
+    if valor_base_calculo > 0:
+        percentual = vcmv / valor_base_calculo
+    else:
+        percentual = np.zeros_like(vcmv)
+
+    frete_rateado = percentual * frete_total
+    seguro_rateado = percentual * seguro_total
+    afrmm_rateado = percentual * afrmm_total
+    siscomex_rateado = percentual * siscomex_total
+    custo_total = vcmv + frete_rateado + seguro_rateado + afrmm_rateado + siscomex_rateado + ii
+
+    # Arrays por item (struct-of-arrays), com o índice da adição de cada item
+    itens = [item for ad in adicoes for item in ad["itens"]]
+    qtd_lista = [item["Qtd"] for item in itens]
+    unid_lista = [item.get("Unid/Caixa", "N/A") for item in itens]
+    limites = [0, *itertools.accumulate(len(ad["itens"]) for ad in adicoes)]
+
+    # Soma sequencial por adição, igual a sum() do motor em Python (np.add.reduceat soma em pares)
+    qtd_total = np.array([sum(qtd_lista[a:b]) for a, b in zip(limites, limites[1:])], dtype=np.float64)
+    qtd = np.array(qtd_lista, dtype=np.float64)
+    unid = np.array([u if isinstance(u, int) and u > 0 else 0 for u in unid_lista], dtype=np.float64)
+    idx_adicao = np.repeat(np.arange(len(adicoes)), np.diff(limites))
+
+    qtd_total_item = qtd_total[idx_adicao]
+    com_qtd_adicao = qtd_total_item > 0
+    tem_unid = com_qtd_adicao & (unid > 0)
+    if np.any(tem_unid & (qtd == 0)):
+        # Mesmo comportamento do motor em Python para item sem quantidade com Unid/Caixa
+        raise ZeroDivisionError("float division by zero")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        proporcao = np.where(com_qtd_adicao, qtd / qtd_total_item, 0.0)
+        custo_item = np.where(com_qtd_adicao, custo_total[idx_adicao] * proporcao, 0.0)
+        custo_unit = np.where(com_qtd_adicao & (qtd > 0), custo_item / qtd, 0.0)
+        custo_peca = np.where(tem_unid, custo_item / (qtd * unid), np.nan)
+
+    # Gravar resultados nos dicionários existentes
+    observacao = f"Base: {base_descricao}"
+    colunas_adicao = zip(adicoes, vcmv.tolist(), frete_rateado.tolist(), seguro_rateado.tolist(),
+                         afrmm_rateado.tolist(), siscomex_rateado.tolist(), ii.tolist(),
+                         custo_total.tolist(), (percentual * 100).tolist())
+    for ad, valor, frete, seguro, afrmm, siscomex, ii_ad, total, pct in colunas_adicao:
+        ad["custos"] = {
+            "Valor Mercadoria R$": valor,
+            "Frete Rateado R$": frete,
+            "Seguro Rateado R$": seguro,
+            "AFRMM Rateado R$": afrmm,
+            "Siscomex Rateado R$": siscomex,
+            "II Incorporado R$": ii_ad,
+            "Custo Total Adição R$": total,
+            "% Participação": pct,
+            "Observações": observacao
+        }
+
+    if grava_itens and itens:
+        # Os casos sem quantidade recebem 0 inteiro, como no motor em Python
+        totais = custo_item.tolist()
+        unitarios = custo_unit.tolist()
+        if not (com_qtd_adicao.all() and (qtd > 0).all()):
+            sem_qtd_item = (~com_qtd_adicao | (qtd <= 0)).tolist()
+            totais = [0 if not c else t for t, c in zip(totais, com_qtd_adicao.tolist())]
+            unitarios = [0 if z else u for u, z in zip(unitarios, sem_qtd_item)]
+        pecas = [p if t else ("N/A" if c else 0)
+                 for p, t, c in zip(custo_peca.tolist(), tem_unid.tolist(), com_qtd_adicao.tolist())]
+
+        for item, total, unitario, peca in zip(itens, totais, unitarios, pecas):
+            item["Custo Total Item R$"] = total
+            item["Custo Unitário R$"] = unitario
+            item["Custo por Peça R$"] = peca
+
+    return {
+        "idx_adicao": idx_adicao,
+        "qtd": qtd,
+        "custo_total_item": custo_item,
+        "custo_unitario": custo_unit,
+        "custo_por_peca": custo_peca,
+    }
+
+
+# Combinações de frete/seguro comparadas no extrato; "base" None segue a regra padrão
+# (Valor Aduaneiro quando há algo embutido, FOB caso contrário)
+CENARIOS_PADRAO = [
+    {"nome": "Separados", "frete_embutido": False, "seguro_embutido": False, "base": None},
+    {"nome": "Frete embutido", "frete_embutido": True, "seguro_embutido": False, "base": None},
+    {"nome": "Seguro embutido", "frete_embutido": False, "seguro_embutido": True, "base": None},
+    {"nome": "Frete e seguro embutidos", "frete_embutido": True, "seguro_embutido": True, "base": None},
+]
+
+
+def cenarios_com_principal(frete_embutido=False, seguro_embutido=False):
+    """CENARIOS_PADRAO reordenados para que a configuração escolhida seja o primeiro (principal)"""
+    return sorted(CENARIOS_PADRAO, key=lambda c: (c["frete_embutido"], c["seguro_embutido"]) !=
+                                                 (frete_embutido, seguro_embutido))
+
+
+def _parametros_cenario(dados, cenario):
+    """Totais usados no rateio de um cenário: (base, valor base, frete, seguro, AFRMM, Siscomex)"""
+    valores = dados.get("valores", {})
+    frete_embutido = cenario.get("frete_embutido", False)
+    seguro_embutido = cenario.get("seguro_embutido", False)
+    base = cenario.get("base") or ("Valor Aduaneiro" if (frete_embutido or seguro_embutido) else "FOB")
+    valor_base = dados["valores"]["Valor Aduaneiro R$"] if base == "Valor Aduaneiro" else dados["valores"]["FOB R$"]
+    # Em ponto fixo, o que não entra no rateio é 0 inteiro, para os totais continuarem em centavos
+    zero = 0 if dados.get("ponto_fixo") else 0.0
+    return (
+        base,
+        valor_base,
+        dados["valores"]["Frete R$"] if not frete_embutido else zero,
+        valores.get("Seguro R$", zero) if not seguro_embutido else zero,
+        valores.get("AFRMM R$", zero),
+        valores.get("Siscomex R$", zero),
+    )
+
+
+def calcular_custos_cenarios(dados, cenarios=None):
+    """
+    Calcula os custos de vários cenários de frete/seguro/base em uma única passagem.
+
+    Cada cenário é um dicionário com "nome", "frete_embutido", "seguro_embutido" e
+    "base" ("FOB", "Valor Aduaneiro" ou None para a regra padrão). Totais da DI e
+    quantidades por adição são calculados uma vez e compartilhados entre os cenários.
+
+    O primeiro cenário é o principal: seus resultados são gravados nos mesmos campos
+    de calcular_custos_unitarios ("configuracao_custos", "custos" e custos dos itens).
+    A matriz completa fica em dados["cenarios_custos"]:
+        "cenarios": configuração de cada cenário
+        "adicoes": custo total da adição por cenário, uma lista por adição
+        "itens": (custo total, unitário, por peça) por cenário, uma lista por item
+    Em ponto fixo, cada cenário é rateado em inteiros como em calcular_custos_unitarios_ponto_fixo.
+    """
+    cenarios = cenarios or CENARIOS_PADRAO
+    parametros = [_parametros_cenario(dados, c) for c in cenarios]
+
+    configuracoes = []
+    for cenario, (base, valor_base, frete, seguro, afrmm, siscomex) in zip(cenarios, parametros):
+        configuracoes.append({
+            "Cenário": cenario.get("nome") or base,
+            "Frete Embutido": "Sim" if cenario.get("frete_embutido") else "Não",
+            "Seguro Embutido": "Sim" if cenario.get("seguro_embutido") else "Não",
+            "Base de Cálculo": base,
+            "Valor Base R$": valor_base,
+            "Frete Considerado R$": frete,
+            "Seguro Considerado R$": seguro,
+            "AFRMM R$": afrmm,
+            "Siscomex R$": siscomex
+        })
+    dados["configuracao_custos"] = {k: v for k, v in configuracoes[0].items() if k != "Cenário"}
+
+    custos_adicoes = []
+    custos_itens = []
+    if dados.get("ponto_fixo"):
+        # Cada cenário tem o próprio rateio pelos maiores restos, como em calcular_custos_unitarios_ponto_fixo
+        por_cenario = zip(*(_custos_adicoes_ponto_fixo(dados["adicoes"], *p) for p in parametros))
+        for adicao, resultados in zip(dados["adicoes"], por_cenario):
+            adicao["custos"] = resultados[0][0]
+            custos_adicoes.append([custos["Custo Total Adição R$"] for custos, _ in resultados])
+            for item, custos_item in zip(adicao["itens"], zip(*(itens for _, itens in resultados))):
+                custos_itens.append(list(custos_item))
+                item["Custo Total Item R$"], item["Custo Unitário R$"], item["Custo por Peça R$"] = custos_item[0]
+    else:
+        for adicao in dados["adicoes"]:
+            valor_adicao = adicao["dados_gerais"]["VCMV R$"]
+            ii_adicao = adicao["tributos"]["II R$"]
+
+            totais_adicao = []
+            for i, (base, valor_base, frete, seguro, afrmm, siscomex) in enumerate(parametros):
+                percentual_adicao = valor_adicao / valor_base if valor_base > 0 else 0
+                custo_frete = percentual_adicao * frete
+                custo_seguro = percentual_adicao * seguro
+                custo_afrmm = percentual_adicao * afrmm
+                custo_siscomex = percentual_adicao * siscomex
+                custo_total_adicao = (valor_adicao + custo_frete + custo_seguro + custo_afrmm +
+                                      custo_siscomex + ii_adicao)
+                totais_adicao.append(custo_total_adicao)
+
+                if i == 0:
+                    adicao["custos"] = {
+                        "Valor Mercadoria R$": valor_adicao,
+                        "Frete Rateado R$": custo_frete,
+                        "Seguro Rateado R$": custo_seguro,
+                        "AFRMM Rateado R$": custo_afrmm,
+                        "Siscomex Rateado R$": custo_siscomex,
+                        "II Incorporado R$": ii_adicao,
+                        "Custo Total Adição R$": custo_total_adicao,
+                        "% Participação": percentual_adicao * 100,
+                        "Observações": f"Base: {base}"
+                    }
+            custos_adicoes.append(totais_adicao)
+
+            if not adicao["itens"]:
+                continue
+
+            # Quantidade total compartilhada por todos os cenários
+            qtd_total_adicao = sum(item["Qtd"] for item in adicao["itens"])
+            for item in adicao["itens"]:
+                qtd = item["Qtd"]
+                unid_caixa = item.get("Unid/Caixa", "N/A")
+                tem_unid = isinstance(unid_caixa, int) and unid_caixa > 0
+
+                custos_item = []
+                for custo_total_adicao in totais_adicao:
+                    if qtd_total_adicao > 0:
+                        custo_item = custo_total_adicao * (qtd / qtd_total_adicao)
+                        custo_unit = custo_item / qtd if qtd > 0 else 0
+                        custo_peca = custo_item / (qtd * unid_caixa) if tem_unid else "N/A"
+                    else:
+                        custo_item = custo_unit = custo_peca = 0
+                    custos_item.append((custo_item, custo_unit, custo_peca))
+                custos_itens.append(custos_item)
+
+                item["Custo Total Item R$"], item["Custo Unitário R$"], item["Custo por Peça R$"] = custos_item[0]
+
+    dados["cenarios_custos"] = {
+        "cenarios": configuracoes,
+        "adicoes": custos_adicoes,
+        "itens": custos_itens,
+    }
+    return dados["cenarios_custos"]
+
+
+def configuracao_por_incoterm(incoterm):
+    """
+    Sugere a configuração de custos a partir do INCOTERM da DI
+
+    Returns:
+        Tupla (frete_embutido, seguro_embutido): CFR embute o frete; CIF, frete e seguro
+    """
+    incoterm = (incoterm or "").strip().upper()
+    return incoterm in ("CFR", "CIF"), incoterm == "CIF"
+
+
+def validar_custos(dados, frete_embutido=False, seguro_embutido=False, cenarios=None):
+    """
+    Valida se os custos calculados estão coerentes com os totais da DI
+
+    Com cenarios (após calcular_custos_cenarios), devolve uma validação por cenário.
+    """
+    if cenarios:
+        totais_por_cenario = list(zip(*dados["cenarios_custos"]["adicoes"])) or [()] * len(cenarios)
+        return [_valida_cenario(dados, cenario, totais) for cenario, totais in zip(cenarios, totais_por_cenario)]
+
+    # Somar custos de todas as adições
+    custo_total_calculado = sum(
+        adicao.get("custos", {}).get("Custo Total Adição R$", 0)
+        for adicao in dados["adicoes"]
+    )
+
+    # Valor esperado baseado na configuração
+    if frete_embutido or seguro_embutido:
+        # Base: Valor Aduaneiro + despesas não embutidas + II
+        valor_esperado = dados["valores"]["Valor Aduaneiro R$"]
+        if not frete_embutido:
+            valor_esperado += dados["valores"]["Frete R$"]
+        if not seguro_embutido:
+            valor_esperado += dados.get("valores", {}).get("Seguro R$", 0)
+    else:
+        # Base tradicional: FOB + todas as despesas
+        valor_esperado = (
+                dados["valores"]["FOB R$"] +
+                dados["valores"]["Frete R$"] +
+                dados.get("valores", {}).get("Seguro R$", 0)
+        )
+
+    # Adicionar despesas extras e impostos
+    valor_esperado += (
+            dados.get("valores", {}).get("AFRMM R$", 0) +
+            dados.get("valores", {}).get("Siscomex R$", 0) +
+            dados["tributos"]["II R$"]
+    )
+
+    diferenca = abs(custo_total_calculado - valor_esperado)
+    percentual_diferenca = (diferenca / valor_esperado * 100) if valor_esperado > 0 else 0
+
+    # Em ponto fixo os valores são centavos exatos: só é OK se fechar no centavo
+    if dados.get("ponto_fixo"):
+        status = "OK" if diferenca == 0 else "DIVERGÊNCIA"
+    else:
+        status = "OK" if percentual_diferenca < 0.01 else "DIVERGÊNCIA"
+
+    validacao = {
+        "Custo Total Calculado": custo_total_calculado,
+        "Valor Esperado": valor_esperado,
+        "Diferença": diferenca,
+        "% Diferença": percentual_diferenca,
+        "Status": status,
+        "Configuração": f"Frete: {'Embutido' if frete_embutido else 'Separado'}, Seguro: {'Embutido' if seguro_embutido else 'Separado'}"
+    }
+
+    return validacao
+
+
+def _valida_cenario(dados, cenario, custos_adicoes):
+    """Validação de um cenário de calcular_custos_cenarios, nos moldes de validar_custos"""
+    base, valor_base, frete, seguro, afrmm, siscomex = _parametros_cenario(dados, cenario)
+    custo_total_calculado = sum(custos_adicoes)
+    valor_esperado = valor_base + frete + seguro + afrmm + siscomex + dados["tributos"]["II R$"]
+
+    diferenca = abs(custo_total_calculado - valor_esperado)
+    percentual_diferenca = (diferenca / valor_esperado * 100) if valor_esperado > 0 else 0
+    if dados.get("ponto_fixo"):
+        status = "OK" if diferenca == 0 else "DIVERGÊNCIA"
+    else:
+        status = "OK" if percentual_diferenca < 0.01 else "DIVERGÊNCIA"
+
+    return {
+        "Cenário": cenario.get("nome") or base,
+        "Custo Total Calculado": custo_total_calculado,
+        "Valor Esperado": valor_esperado,
+        "Diferença": diferenca,
+        "% Diferença": percentual_diferenca,
+        "Status": status,
+    }
+
+
+# Campos lidos do XML, por seção: (tag, chave de saída, conversão, padrão).
+# Conversões: "texto" (vazio vira o padrão), "limpo" (texto com strip), "inteiro",
+# um divisor numérico (campo numérico, ver parse_numeric_field) ou uma função
+# (get, secao) para campos derivados. A ordem das entradas é a ordem das chaves
+# no dicionário e, portanto, das linhas no extrato. Um campo novo do XML
+# (ex.: valorReaisFreteInternacional) é só mais uma entrada aqui.
+CAMPOS_DI = {
+    "cabecalho": [
+        ("numeroDI", "DI", "texto", "N/A"),
+        ("dataRegistro", "Data registro", "texto", "N/A"),
+        ("urfDespachoNome", "URF despacho", "texto", "N/A"),
+        ("modalidadeDespachoNome", "Modalidade", "texto", "N/A"),
+        ("totalAdicoes", "Qtd. adições", "inteiro", "0"),
+        ("situacaoEntregaCarga", "Situação", "texto", "N/A"),
+    ],
+    "importador": [
+        ("importadorNumero", "CNPJ", "texto", "N/A"),
+        ("importadorNome", "Nome", "texto", "N/A"),
+        ("importadorNomeRepresentanteLegal", "Representante", "texto", "N/A"),
+        ("importadorCpfRepresentanteLegal", "CPF repr.", "texto", "N/A"),
+        (None, "Endereço", lambda get, s: ", ".join(filter(None, [
+            get("importadorEnderecoLogradouro", ""),
+            get("importadorEnderecoNumero", ""),
+            get("importadorEnderecoBairro", ""),
+            get("importadorEnderecoMunicipio", ""),
+            get("importadorEnderecoUf", ""),
+            get("importadorEnderecoCep", "")
+        ])) or "N/A", None),
+    ],
+    "carga": [
+        (None, "Manifesto", lambda get, s: f"{get('documentoChegadaCargaNome', 'N/A')} "
+                                           f"{get('documentoChegadaCargaNumero', '')}".strip(), None),
+        ("armazenamentoRecintoAduaneiroNome", "Recinto", "texto", "N/A"),
+        ("armazem", "Armazém", "limpo", "N/A"),
+        ("cargaPesoBruto", "Peso bruto (kg)", 1000, None),
+        ("cargaPesoLiquido", "Peso líquido (kg)", 1000, None),
+    ],
+    "valores": [
+        ("localEmbarqueTotalDolares", "FOB USD", 100, None),
+        ("localEmbarqueTotalReais", "FOB R$", 100, None),
+        ("freteTotalDolares", "Frete USD", 100, None),
+        ("freteTotalReais", "Frete R$", 100, None),
+        ("seguroTotalReais", "Seguro R$", 100, None),
+        ("afrmm", "AFRMM R$", 100, None),
+        ("taxaSiscomex", "Siscomex R$", 100, None),
+        ("localDescargaTotalReais", "Valor Aduaneiro R$", 100, None),
+    ],
+    # Só para o ICMS e a NF-e de entrada: fora das seções escritas no extrato
+    "fiscal": [
+        ("importadorEnderecoUf", "UF", "texto", "N/A"),
+        ("viaTransporteCodigo", "Via transporte", "texto", "N/A"),
+        ("caracterizacaoOperacaoCodigoTipo", "Tipo operação", "texto", "N/A"),
+    ],
+    # Campos no nível da própria DI, gravados depois das adições
+    None: [
+        ("informacaoComplementar", "info_complementar", "limpo", "—"),
+    ],
+}
+
+CAMPOS_ADICAO = {
+    None: [
+        ("numeroAdicao", "numero", "texto", "N/A"),
+        ("numeroLI", "numero_li", "texto", "N/A"),
+        ("sequencialRetificacao", "sequencial_retificacao", "texto", "N/A"),
+    ],
+    "dados_gerais": [
+        ("dadosMercadoriaCodigoNcm", "NCM", "texto", "N/A"),
+        ("dadosMercadoriaCodigoNcm", "NBM", "texto", "N/A"),
+        ("dadosMercadoriaNomeNcm", "Descrição NCM", "texto", "N/A"),
+        ("condicaoVendaValorMoeda", "VCMV USD", 100, None),
+        ("condicaoVendaValorReais", "VCMV R$", 100, None),
+        ("condicaoVendaIncoterm", "INCOTERM", "texto", "N/A"),
+        ("condicaoVendaLocal", "Local", "texto", "N/A"),
+        ("condicaoVendaMoedaNome", "Moeda", "texto", "N/A"),
+        ("dadosMercadoriaPesoLiquido", "Peso líq. (kg)", 1000, None),
+        ("dadosMercadoriaMedidaEstatisticaQuantidade", "Quantidade", 1000, None),
+        ("dadosMercadoriaMedidaEstatisticaUnidade", "Unidade", "limpo", "N/A"),
+    ],
+    "partes": [
+        ("fornecedorNome", "Exportador", "texto", "N/A"),
+        ("paisAquisicaoMercadoriaNome", "País Aquisição", "texto", "N/A"),
+        ("fabricanteNome", "Fabricante", "texto", "N/A"),
+        ("paisOrigemMercadoriaNome", "País Origem", "texto", "N/A"),
+    ],
+    "tributos": [
+        ("iiAliquotaAdValorem", "II Alíq. (%)", 10000, None),
+        ("iiRegimeTributacaoNome", "II Regime", "texto", "N/A"),
+        ("iiAliquotaValorRecolher", "II R$", 100, None),
+        ("ipiAliquotaAdValorem", "IPI Alíq. (%)", 10000, None),
+        ("ipiRegimeTributacaoNome", "IPI Regime", "texto", "N/A"),
+        ("ipiAliquotaValorRecolher", "IPI R$", 100, None),
+        ("pisPasepAliquotaAdValorem", "PIS Alíq. (%)", 10000, None),
+        ("pisPasepAliquotaValorRecolher", "PIS R$", 100, None),
+        ("cofinsAliquotaAdValorem", "COFINS Alíq. (%)", 10000, None),
+        ("cofinsAliquotaValorRecolher", "COFINS R$", 100, None),
+        ("pisCofinsBaseCalculoValor", "Base PIS/COFINS R$", 100, None),
+        ("pisCofinsRegimeTributacaoNome", "Regime PIS/COFINS", "texto", "N/A"),
+    ],
+    # Só para o ICMS e a NF-e de entrada: fora das seções escritas no extrato
+    "fiscal": [
+        ("iiBaseCalculo", "Base II R$", 100, None),
+        (None, "Endereço Exportador", lambda get, s: ", ".join(filter(None, [
+            get("fornecedorLogradouro", ""),
+            get("fornecedorNumero", ""),
+            get("fornecedorComplemento", ""),
+            get("fornecedorCidade", ""),
+            get("fornecedorEstado", "")
+        ])) or "N/A", None),
+    ],
+}
+
+CAMPOS_ITEM = [
+    ("numeroSequencialItem", "Seq", "texto", "N/A"),
+    # Os extratores não dependem de espaços nas pontas, então recebem a descrição sem strip
+    (None, "Código", lambda get, s: extrair_codigo_produto(get("descricaoMercadoria")), None),
+    ("descricaoMercadoria", "Descrição", "limpo", "N/A"),
+    ("quantidade", "Qtd", 100000, None),
+    ("unidadeMedida", "Unidade", "limpo", "N/A"),
+    ("valorUnitario", "Valor Unit. USD", 10000000, None),
+    (None, "Unid/Caixa", lambda get, s: extrair_unidades_por_caixa(get("descricaoMercadoria")), None),
+    (None, "Valor Total USD", lambda get, s: s["Qtd"] * s["Valor Unit. USD"], None),
+]
+
+
+def _confere_escalas_ponto_fixo():
+    """
+    Em ponto fixo os campos numéricos guardam o inteiro do XML, e a saída divide pela escala
+    de ESCALAS_PONTO_FIXO (pelo nome do campo): ela precisa ser o divisor do esquema
+    """
+    for campos in (*CAMPOS_DI.values(), *CAMPOS_ADICAO.values(), CAMPOS_ITEM):
+        for _, chave, conversao, _ in campos:
+            if type(conversao) is int and _escala_ponto_fixo(chave) != conversao:
+                raise ValueError(f"Escala em ponto fixo de '{chave}' ({_escala_ponto_fixo(chave)}) "
+                                 f"difere do divisor do esquema ({conversao})")
+
+
+_confere_escalas_ponto_fixo()
+
+
+def _textos_filhos(elem):
+    """
+    Uma passada pelos filhos de elem: tag → texto do primeiro filho com a tag (como findtext).
+
+    Substitui dezenas de findtext, cada um percorrendo a lista de filhos, por uma
+    leitura só; os campos do esquema passam a ser buscas em dicionário.
+    """
+    # Percorre de trás para frente para que a primeira ocorrência de cada tag prevaleça
+    return {filho.tag: filho.text or "" for filho in reversed(elem)}
+
+
+def _preenche_campos(destino, campos, get, ponto_fixo=False):
+    """
+    Preenche destino com os campos de uma seção do esquema.
+
+    get é um leitor no estilo findtext: o get do dicionário de _textos_filhos para
+    elementos com muitos filhos, ou o próprio elem.findtext para os pequenos.
+    """
+    for tag, chave, conversao, padrao in campos:
+        if conversao == "texto":
+            destino[chave] = get(tag) or padrao
+        elif type(conversao) is int:
+            # Em ponto fixo o divisor fica implícito: é a escala do campo em ESCALAS_PONTO_FIXO
+            destino[chave] = (parse_numeric_field_fixo(get(tag, "0")) if ponto_fixo
+                              else parse_numeric_field(get(tag, "0"), conversao))
+        elif conversao == "limpo":
+            destino[chave] = (get(tag) or "").strip() or padrao
+        elif conversao == "inteiro":
+            destino[chave] = int(get(tag, padrao))
+        else:
+            destino[chave] = conversao(get, destino)
+    return destino
+
+
+def _monta_item(mercadoria, ponto_fixo=False):
+    """Converte um elemento <mercadoria> no dicionário de item usado no extrato"""
+    # <mercadoria> tem poucos filhos: findtext (em C) sai mais barato que montar um dicionário
+    return _preenche_campos({}, CAMPOS_ITEM, mercadoria.findtext, ponto_fixo)
+
+
+def _monta_adicao(adicao_elem, ponto_fixo=False):
+    """Converte um elemento <adicao> (já completo) no dicionário da adição, com uma passada pelos filhos"""
+    get = _textos_filhos(adicao_elem).get
+
+    adicao = {}
+    for secao, campos in CAMPOS_ADICAO.items():
+        _preenche_campos(adicao if secao is None else adicao.setdefault(secao, {}), campos, get, ponto_fixo)
+    adicao["itens"] = [_monta_item(mercadoria, ponto_fixo) for mercadoria in adicao_elem.iterfind("mercadoria")]
+    # Fornecedor com padrões próprios: refaz a extração (os extratores não dependem de espaços nas pontas)
+    perfil = _extrator.perfil(adicao["partes"]["Exportador"])
+    if perfil is not None:
+        for item in adicao["itens"]:
+            item["Código"], item["Unid/Caixa"] = _extrator.extrai(
+                item["Descrição"] if item["Descrição"] != "N/A" else None, perfil)
+    return adicao
+
+
+def _monta_dados_di(get, adicoes, ponto_fixo=False):
+    """Monta o dicionário da DI a partir de um leitor de campos no estilo findtext"""
+    dados = {}
+    for secao, campos in CAMPOS_DI.items():
+        if secao is not None:
+            _preenche_campos(dados.setdefault(secao, {}), campos, get, ponto_fixo)
+    dados["adicoes"] = adicoes
+    _preenche_campos(dados, CAMPOS_DI[None], get, ponto_fixo)
+
+    # Calcular totais de tributos
+    tributos_totais = {"II R$": 0, "IPI R$": 0, "PIS R$": 0, "COFINS R$": 0}
+    for adicao in dados["adicoes"]:
+        tributos_totais["II R$"] += adicao["tributos"]["II R$"]
+        tributos_totais["IPI R$"] += adicao["tributos"]["IPI R$"]
+        tributos_totais["PIS R$"] += adicao["tributos"]["PIS R$"]
+        tributos_totais["COFINS R$"] += adicao["tributos"]["COFINS R$"]
+    dados["tributos"] = tributos_totais
+
+    if ponto_fixo:
+        dados["ponto_fixo"] = True
+
+    return dados
+
+
+def _monta_dados_di_elem(di, ponto_fixo=False):
+    """Monta a DI a partir do elemento <declaracaoImportacao>, com uma passada pelos filhos"""
+    adicoes = [_monta_adicao(adicao_elem, ponto_fixo) for adicao_elem in di.iterfind("adicao")]
+    return _monta_dados_di(_textos_filhos(di).get, adicoes, ponto_fixo)
+
+
+def _eventos_streaming(xml_path: Path, ponto_fixo: bool = False):
+    """
+    Percorre o XML com iterparse, gerando ("adicao", adicao) assim que cada
+    <adicao> é fechada e ("di", campos_di) ao fim de cada declaracaoImportacao.
+
+    Cada subárvore é descartada logo após ser processada, de modo que a memória
+    usada pela leitura não cresce com a quantidade de adições ou de DIs.
+    """
+    profundidade = 0
+    raiz = None
+    di_elem = None
+    campos_di = {}
+    for evento, elem in ET.iterparse(xml_path, events=("start", "end")):
+        if evento == "start":
+            profundidade += 1
+            if profundidade == 1:
+                raiz = elem
+            elif profundidade == 2 and elem.tag == "declaracaoImportacao":
+                di_elem = elem
+                campos_di = {}
+            continue
+
+        if di_elem is not None and profundidade == 3:
+            if elem.tag == "adicao":
+                yield "adicao", _monta_adicao(elem, ponto_fixo)
+            else:
+                campos_di.setdefault(elem.tag, elem.text or "")
+            # Libera a subárvore já processada
+            di_elem.clear()
+        elif elem is di_elem:
+            yield "di", campos_di
+            di_elem = None
+            raiz.clear()
+        profundidade -= 1
+
+
+def iter_adicoes_streaming(xml_path: Path, campos_di: dict = None, ponto_fixo: bool = False):
+    """
+    Entrega cada adição da primeira declaracaoImportacao assim que o elemento
+    <adicao> é fechado, com memória constante durante a leitura.
+
+    Args:
+        xml_path: Caminho do XML da DI
+        campos_di: Dicionário opcional que recebe o texto dos campos de nível DI
+                   (tag → texto), como em di.findtext
+        ponto_fixo: Se True, os campos numéricos ficam como inteiros escalados (ver parse_numeric_field_fixo)
+    """
+    for tipo, valor in _eventos_streaming(xml_path, ponto_fixo):
+        if tipo == "adicao":
+            yield valor
+        else:
+            if campos_di is not None:
+                campos_di.update(valor)
+            return
+
+    raise ValueError("Elemento declaracaoImportacao não encontrado no XML")
+
+
+def iter_dis_streaming(xml_path: Path, ponto_fixo: bool = False):
+    """Entrega o dicionário completo de cada declaracaoImportacao do arquivo, uma por vez"""
+    adicoes = []
+    encontrou = False
+    for tipo, valor in _eventos_streaming(xml_path, ponto_fixo):
+        if tipo == "adicao":
+            adicoes.append(valor)
+        else:
+            encontrou = True
+            yield _monta_dados_di(valor.get, adicoes, ponto_fixo)
+            adicoes = []
+
+    if not encontrou:
+        raise ValueError("Elemento declaracaoImportacao não encontrado no XML")
+
+
+def carrega_di_streaming(xml_path: Path, ponto_fixo: bool = False) -> dict:
+    """Carrega a DI em modo streaming, sem manter a árvore XML inteira em memória"""
+    campos_di = {}
+    adicoes = list(iter_adicoes_streaming(xml_path, campos_di, ponto_fixo))
+    return _monta_dados_di(campos_di.get, adicoes, ponto_fixo)
+
+
+# === REGISTROS COMPACTOS PARA DIs MANTIDAS EM MEMÓRIA === #
+
+class _Ausente:
+    """Marca de campo não preenchido (RegistroCompacto, ItensCompactos); uma classe, para sobreviver ao pickle"""
+
+
+class RegistroCompacto(MutableMapping):
+    """
+    Registro com __slots__ que se comporta como o dicionário equivalente.
+
+    Os campos do esquema (CAMPOS) ficam em slots, sem dicionário por instância; chaves
+    fora do esquema vão para um dicionário de extras, criado só quando necessário. Leitura
+    e escrita por chave, get, in, items, dict(registro), comparação com dicionários e
+    pickle funcionam como no dicionário, de modo que o parser, os motores de custo e os
+    geradores de Excel aceitam os dois indistintamente.
+    """
+
+    __slots__ = ("_extras",)
+    CAMPOS = ()
+    _DESCRITORES = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._DESCRITORES = {campo: cls.__dict__[slot] for campo, slot in zip(cls.CAMPOS, cls.__slots__)}
+
+    @staticmethod
+    def slots(campos):
+        """Nomes dos slots para os campos (as chaves não são identificadores válidos)"""
+        return tuple(f"_c{i}" for i in range(len(campos)))
+
+    def __init__(self, *args, **kwargs):
+        self._extras = None
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    @classmethod
+    def _de_valores(cls, valores, extras):
+        registro = cls.__new__(cls)
+        registro._extras = extras
+        for descritor, valor in zip(cls._DESCRITORES.values(), valores):
+            if valor is not _Ausente:
+                descritor.__set__(registro, valor)
+        return registro
+
+    def __reduce__(self):
+        # Tupla de valores na ordem de CAMPOS: bem menor que o estado padrão (nome de slot → valor)
+        valores = []
+        for descritor in self._DESCRITORES.values():
+            try:
+                valores.append(descritor.__get__(self))
+            except AttributeError:
+                valores.append(_Ausente)
+        return type(self)._de_valores, (tuple(valores), self._extras)
+
+    def __getitem__(self, chave):
+        descritor = self._DESCRITORES.get(chave)
+        if descritor is None:
+            if self._extras is None:
+                raise KeyError(chave)
+            return self._extras[chave]
+        try:
+            return descritor.__get__(self)
+        except AttributeError:
+            raise KeyError(chave) from None
+
+    def get(self, chave, padrao=None):
+        descritor = self._DESCRITORES.get(chave)
+        if descritor is None:
+            return padrao if self._extras is None else self._extras.get(chave, padrao)
+        try:
+            return descritor.__get__(self)
+        except AttributeError:
+            return padrao
+
+    def __setitem__(self, chave, valor):
+        descritor = self._DESCRITORES.get(chave)
+        if descritor is not None:
+            descritor.__set__(self, valor)
+        elif self._extras is None:
+            self._extras = {chave: valor}
+        else:
+            self._extras[chave] = valor
+
+    def __delitem__(self, chave):
+        descritor = self._DESCRITORES.get(chave)
+        try:
+            if descritor is None:
+                if self._extras is None:
+                    raise KeyError(chave)
+                del self._extras[chave]
+            else:
+                descritor.__delete__(self)
+        except AttributeError:
+            raise KeyError(chave) from None
+
+    def __contains__(self, chave):
+        descritor = self._DESCRITORES.get(chave)
+        if descritor is None:
+            return self._extras is not None and chave in self._extras
+        try:
+            descritor.__get__(self)
+        except AttributeError:
+            return False
+        return True
+
+    def __iter__(self):
+        for campo, descritor in self._DESCRITORES.items():
+            try:
+                descritor.__get__(self)
+            except AttributeError:
+                continue
+            yield campo
+        if self._extras:
+            yield from self._extras
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    def copy(self):
+        return type(self)(self)
+
+
+class ItensCompactos(Sequence):
+    """
+    Itens de uma adição guardados por coluna (struct-of-arrays), vistos como ItemDI.
+
+    Cada campo é uma coluna: array("d") quando todos os valores são float, array("q")
+    quando são inteiros de 64 bits e lista nos demais casos, com textos repetidos
+    (unidade, código, CST) compartilhados. Gravar um campo por um ItemDI grava na coluna;
+    uma coluna array que recebe outro tipo de valor volta a ser lista até o próximo
+    compacta().
+    """
+
+    __slots__ = ("colunas", "_n")
+
+    def __init__(self, itens=()):
+        itens = list(itens)
+        self._n = len(itens)
+        self.colunas = {}
+        primeiro = itens[0] if itens else {}
+        if all(item.keys() == primeiro.keys() for item in itens):
+            # Caso comum: todos os itens com os mesmos campos, lidos coluna a coluna em C
+            for campo in primeiro:
+                self.colunas[campo] = list(map(itemgetter(campo), itens))
+        else:
+            for i, item in enumerate(itens):
+                for campo, valor in item.items():
+                    self._coluna_lista(campo)[i] = valor
+        self.compacta()
+
+    def compacta(self):
+        """Converte as colunas homogêneas em arrays e compartilha os textos repetidos"""
+        for campo, coluna in list(self.colunas.items()):
+            if isinstance(coluna, array):
+                continue
+            tipos = set(map(type, coluna))
+            if tipos == {type} and all(v is _Ausente for v in coluna):
+                del self.colunas[campo]  # Campo removido de todos os itens
+            elif tipos == {float}:
+                self.colunas[campo] = array("d", coluna)
+            elif tipos == {int}:
+                try:
+                    self.colunas[campo] = array("q", coluna)
+                except OverflowError:
+                    pass
+            elif str in tipos and len(set(coluna)) <= len(coluna) // 2:
+                unicos = {}
+                self.colunas[campo] = [unicos.setdefault(v, v) if type(v) is str else v for v in coluna]
+        return self
+
+    def _coluna_lista(self, campo):
+        coluna = self.colunas.get(campo)
+        if coluna is None:
+            coluna = self.colunas[campo] = [_Ausente] * self._n
+        elif isinstance(coluna, array):
+            coluna = self.colunas[campo] = coluna.tolist()
+        return coluna
+
+    def _grava(self, i, campo, valor):
+        coluna = self.colunas.get(campo)
+        if coluna is not None and isinstance(coluna, array):
+            if type(valor) is (float if coluna.typecode == "d" else int):
+                try:
+                    coluna[i] = valor
+                    return
+                except OverflowError:
+                    pass
+        elif coluna is not None:
+            coluna[i] = valor
+            return
+        self._coluna_lista(campo)[i] = valor
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ItemDI(self, j) for j in range(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError("índice de item fora do intervalo")
+        return ItemDI(self, i)
+
+    def __iter__(self):
+        return map(ItemDI, itertools.repeat(self, self._n), range(self._n))
+
+    def __eq__(self, outro):
+        if isinstance(outro, Sequence) and not isinstance(outro, (str, bytes)):
+            return len(self) == len(outro) and all(a == b for a, b in zip(self, outro))
+        return NotImplemented
+
+    def __repr__(self):
+        return f"ItensCompactos({list(self)!r})"
+
+
+class ItemDI(MutableMapping):
+    """Visão dict-compatível de um item (linha i) de ItensCompactos"""
+
+    __slots__ = ("_tabela", "_i")
+
+    def __init__(self, tabela, i):
+        self._tabela = tabela
+        self._i = i
+
+    def __getitem__(self, campo):
+        coluna = self._tabela.colunas.get(campo)
+        if coluna is None:
+            raise KeyError(campo)
+        valor = coluna[self._i]
+        if valor is _Ausente:
+            raise KeyError(campo)
+        return valor
+
+    def get(self, campo, padrao=None):
+        coluna = self._tabela.colunas.get(campo)
+        if coluna is None:
+            return padrao
+        valor = coluna[self._i]
+        return padrao if valor is _Ausente else valor
+
+    def __setitem__(self, campo, valor):
+        self._tabela._grava(self._i, campo, valor)
+
+    def __delitem__(self, campo):
+        if campo not in self:
+            raise KeyError(campo)
+        self._tabela._coluna_lista(campo)[self._i] = _Ausente
+
+    def __contains__(self, campo):
+        coluna = self._tabela.colunas.get(campo)
+        return coluna is not None and coluna[self._i] is not _Ausente
+
+    def __iter__(self):
+        i = self._i
+        return (campo for campo, coluna in self._tabela.colunas.items() if coluna[i] is not _Ausente)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"ItemDI({dict(self)!r})"
+
+
+class AdicaoDI(RegistroCompacto):
+    """Adição: campos e seções de CAMPOS_ADICAO, itens (ItensCompactos) e custos"""
+    CAMPOS = tuple(chave for _, chave, _, _ in CAMPOS_ADICAO[None]) + tuple(
+        secao for secao in CAMPOS_ADICAO if secao is not None) + ("itens", "custos")
+    __slots__ = RegistroCompacto.slots(CAMPOS)
+
+
+class DadosDI(RegistroCompacto):
+    """DI: seções de CAMPOS_DI, adições (AdicaoDI) e os resultados de custeio, validação e ICMS"""
+    CAMPOS = tuple(secao for secao in CAMPOS_DI if secao is not None) + ("adicoes",) + tuple(
+        chave for _, chave, _, _ in CAMPOS_DI[None]) + (
+        "tributos", "ponto_fixo", "configuracao_custos", "validacao_custos", "cenarios_custos",
+        "validacao_cenarios", "icms", "alteracoes")
+    __slots__ = RegistroCompacto.slots(CAMPOS)
+
+
+def compacta_di(dados) -> DadosDI:
+    """
+    Converte a DI em DadosDI/AdicaoDI, com os itens de cada adição em ItensCompactos,
+    para manter muitas DIs em memória (ex.: extrato combinado). As seções pequenas
+    (cabeçalho, tributos etc.) continuam dicionários. Pode ser chamada de novo após o
+    custeio, para compactar também as colunas de custo.
+    """
+    compacto = dados if isinstance(dados, DadosDI) else DadosDI(dados)
+    adicoes = []
+    for ad in dados["adicoes"]:
+        ad = ad if isinstance(ad, AdicaoDI) else AdicaoDI(ad)
+        itens = ad["itens"]
+        ad["itens"] = itens.compacta() if isinstance(itens, ItensCompactos) else ItensCompactos(itens)
+        adicoes.append(ad)
+    compacto["adicoes"] = adicoes
+    return compacto
+
+
+def carrega_dis_completo(xml_path: Path, streaming: bool = False, ponto_fixo: bool = False,
+                         processos: int = None) -> list:
+    """
+    Carrega todas as declaracaoImportacao de um arquivo ListaDeclaracoes
+
+    Args:
+        processos: Se maior que 1, as adições são parseadas nesse número de processos
+                   (ver carrega_dis_paralelo); ignorado com streaming=True
+
+    Returns:
+        Lista com um dicionário de dados (como em carrega_di_completo) por DI
+    """
+    if streaming:
+        return list(iter_dis_streaming(xml_path, ponto_fixo))
+    if processos is not None and processos > 1:
+        return carrega_dis_paralelo(xml_path, ponto_fixo, processos)
+
+    root = ET.parse(xml_path).getroot()
+    dis = root.findall("declaracaoImportacao")
+    if not dis:
+        raise ValueError("Elemento declaracaoImportacao não encontrado no XML")
+
+    return [_monta_dados_di_elem(di, ponto_fixo) for di in dis]
+
+
+def carrega_di_completo(xml_path: Path, streaming: bool = False, ponto_fixo: bool = False,
+                        processos: int = None) -> dict:
+    """
+    Carrega o XML da DI com dados completos para cada adição
+
+    Args:
+        xml_path: Caminho do XML da DI
+        streaming: Se True, lê o XML incrementalmente (iterparse), liberando
+                   cada adição da memória após processá-la
+        ponto_fixo: Se True, mantém os campos numéricos como inteiros na escala
+                    implícita do XML (centavos para valores em R$/USD); os custos
+                    são calculados em inteiros e convertidos só na saída
+                    (ver converte_ponto_fixo)
+        processos: Se maior que 1, as adições são parseadas em paralelo nesse número
+                   de processos (ver carrega_dis_paralelo); ignorado com streaming=True
+    """
+    if streaming:
+        return carrega_di_streaming(xml_path, ponto_fixo)
+    if processos is not None and processos > 1:
+        return carrega_dis_paralelo(xml_path, ponto_fixo, processos)[0]
+
+    tree = ET.parse(xml_path)
+    root = tree.getroot()
+
+    di = root.find("declaracaoImportacao")
+    if di is None:
+        raise ValueError("Elemento declaracaoImportacao não encontrado no XML")
+
+    return _monta_dados_di_elem(di, ponto_fixo)
+
+
+# === PARSE PARALELO DAS ADIÇÕES DE UMA DI GRANDE === #
+
+# Abaixo disso, subir o pool custa mais do que o parse economiza: o arquivo é lido em série
+TAMANHO_MINIMO_PARALELO = 8 * 1024 * 1024
+
+# Abertura de <adicao> ou <declaracaoImportacao>; o fechamento da adição é buscado com find
+_ABERTURAS_PARALELO = re.compile(rb"<(adicao|declaracaoImportacao)[\s>]")
+# Declaração XML (com BOM opcional), repetida em cada bloco para que a codificação seja respeitada
+_DECLARACAO_XML = re.compile(rb"(?:\xef\xbb\xbf)?\s*(<\?xml[^>]*\?>)")
+
+
+def _limites_adicoes(conteudo):
+    """
+    Uma passada por conteudo (mmap ou bytes) atrás dos blocos <adicao>…</adicao>.
+
+    Returns:
+        Uma lista por declaracaoImportacao com os offsets (início, fim) de suas adições
+    """
+    limites = []
+    pos = 0
+    while True:
+        m = _ABERTURAS_PARALELO.search(conteudo, pos)
+        if m is None:
+            return limites
+        if m.group(1) == b"declaracaoImportacao":
+            limites.append([])
+            pos = m.end()
+            continue
+        fim = conteudo.find(b"</adicao>", m.end())
+        if fim < 0 or not limites:
+            raise ValueError("Bloco <adicao> sem fechamento ou fora de uma declaracaoImportacao")
+        pos = fim + len(b"</adicao>")
+        limites[-1].append((m.start(), pos))
+
+
+def _esqueleto_sem_adicoes(conteudo, blocos):
+    """O XML com os blocos de adição recortados: sobram só os campos de nível DI, baratos de parsear"""
+    partes = []
+    pos = 0
+    for inicio, fim in blocos:
+        partes.append(conteudo[pos:inicio])
+        pos = fim
+    partes.append(conteudo[pos:])
+    return b"".join(partes)
+
+
+def _faixas_blocos(blocos, quantidade):
+    """Divide os blocos, na ordem do arquivo, em cerca de quantidade faixas de bytes equivalentes"""
+    alvo = (blocos[-1][1] - blocos[0][0]) / quantidade
+    faixas = []
+    faixa = []
+    inicio_faixa = blocos[0][0]
+    for bloco in blocos:
+        faixa.append(bloco)
+        if bloco[1] - inicio_faixa >= alvo:
+            faixas.append(faixa)
+            faixa = []
+            inicio_faixa = bloco[1]
+    if faixa:
+        faixas.append(faixa)
+    return faixas
+
+
+def _parseia_blocos_adicao(fonte, deslocamento, blocos, prologo, ponto_fixo):
+    """
+    Worker do parse paralelo: converte cada bloco (início, fim) no dicionário da adição.
+
+    fonte é o caminho do XML, mapeado em memória pelo próprio worker (entre os processos
+    trafegam só os offsets), ou os bytes do trecho que começa em deslocamento, quando o
+    XML já estava em memória.
+    """
+    def monta(conteudo):
+        return [_monta_adicao(ET.fromstring(prologo + conteudo[inicio - deslocamento:fim - deslocamento]),
+                              ponto_fixo)
+                for inicio, fim in blocos]
+
+    if isinstance(fonte, bytes):
+        return monta(fonte)
+    with open(fonte, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as conteudo:
+        return monta(conteudo)
+
+
+def _parse_paralelo(conteudo, caminho, processos, ponto_fixo):
+    """Corpo de carrega_dis_paralelo; None quando o arquivo deve ser lido em série"""
+    try:
+        limites = _limites_adicoes(conteudo)
+        blocos = [bloco for blocos_di in limites for bloco in blocos_di]
+        if len(blocos) < 2:
+            return None
+        dis = ET.fromstring(_esqueleto_sem_adicoes(conteudo, blocos)).findall("declaracaoImportacao")
+        # O recorte só vale se cada DI encontrada na varredura for uma DI da árvore, sem adições sobrando
+        if len(dis) != len(limites) or any(di.find("adicao") is not None for di in dis):
+            return None
+
+        m = _DECLARACAO_XML.match(conteudo)
+        prologo = m.group(1) if m else b""
+        # Mais faixas que processos, para que um worker não fique ocioso esperando o mais lento
+        faixas = _faixas_blocos(blocos, processos * 4)
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(processos, len(faixas)), initializer=configura_extrator,
+                                 initargs=(_extrator,)) as pool:
+            futuros = [
+                pool.submit(_parseia_blocos_adicao, caminho, 0, faixa, prologo, ponto_fixo) if caminho else
+                pool.submit(_parseia_blocos_adicao, conteudo[faixa[0][0]:faixa[-1][1]], faixa[0][0], faixa,
+                            prologo, ponto_fixo)
+                for faixa in faixas
+            ]
+            adicoes = [adicao for futuro in futuros for adicao in futuro.result()]
+    except (ValueError, ET.ParseError) as e:
+        log.warning(f"Parse paralelo indisponível ({e}); lendo o XML em série")
+        return None
+
+    lista_dados = []
+    pos = 0
+    for di, blocos_di in zip(dis, limites):
+        lista_dados.append(_monta_dados_di(_textos_filhos(di).get, adicoes[pos:pos + len(blocos_di)], ponto_fixo))
+        pos += len(blocos_di)
+    return lista_dados
+
+
+def carrega_dis_paralelo(xml_path: Path, ponto_fixo: bool = False, processos: int = None,
+                         tamanho_minimo: int = TAMANHO_MINIMO_PARALELO) -> list:
+    """
+    Carrega as DIs do arquivo (como carrega_dis_completo) parseando as adições em um pool de processos.
+
+    Uma passada pelo XML mapeado em memória localiza os blocos <adicao>…</adicao>; cada
+    worker recebe uma faixa de offsets e devolve os dicionários das adições, que são
+    juntados, na ordem do arquivo, aos campos de nível DI (parseados do XML sem as
+    adições). O resultado é idêntico ao do parse em série, que continua sendo usado com
+    processos <= 1, arquivos menores que tamanho_minimo, uma adição só ou XML fora do
+    leiaute usual (ex.: <adicao> dentro de comentário).
+
+    Args:
+        xml_path: Caminho do XML ou arquivo binário já aberto (ex.: io.BytesIO do cache de parse)
+        ponto_fixo: Como em carrega_di_completo
+        processos: Tamanho do pool; por padrão, um processo por núcleo da máquina
+        tamanho_minimo: Bytes a partir dos quais vale a pena parsear em paralelo
+    """
+    processos = processos or os.cpu_count() or 1
+    lista_dados = None
+    if hasattr(xml_path, "read"):
+        conteudo = xml_path.read()
+        xml_path = io.BytesIO(conteudo)
+        if processos > 1 and len(conteudo) >= tamanho_minimo:
+            lista_dados = _parse_paralelo(conteudo, None, processos, ponto_fixo)
+    elif processos > 1 and os.path.getsize(xml_path) >= tamanho_minimo:
+        with open(xml_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as conteudo:
+            lista_dados = _parse_paralelo(conteudo, str(xml_path), processos, ponto_fixo)
+
+    if lista_dados is None:
+        lista_dados = carrega_dis_completo(xml_path, ponto_fixo=ponto_fixo)
+    return lista_dados
+
+
+def detecta_cabecalho_di(xml_path: Path, tamanho_bloco: int = 64 * 1024) -> dict:
+    """
+    Identificação rápida de uma DI sem parsear o arquivo inteiro.
+
+    Lê o início do XML só até o fim da primeira <adicao> (INCOTERM, número da DI e
+    sequencialRetificacao). Os campos de nível DI (totalAdicoes) ficam depois da última
+    adição: vêm do trecho entre a última </adicao> e o primeiro </declaracaoImportacao>,
+    achado por busca de bytes no arquivo mapeado, sem parsear as demais adições. Em
+    arquivos com várias DIs, tudo se refere à primeira; uma DI sem adições é lida até o
+    seu fim, sem avançar para a seguinte.
+
+    Returns:
+        Dicionário com "DI", "INCOTERM", "Sequencial retificação" e "Qtd. adições"
+    """
+    info = {"DI": None, "INCOTERM": None, "Sequencial retificação": None, "Qtd. adições": None}
+    campos = {
+        "numeroDI": "DI",
+        "condicaoVendaIncoterm": "INCOTERM",
+        "sequencialRetificacao": "Sequencial retificação",
+    }
+    campos_di = dict(campos, totalAdicoes="Qtd. adições")
+
+    with open(xml_path, "rb") as f:
+        parser = ET.XMLPullParser(events=("start", "end"))
+        profundidade = 0
+        primeira_adicao_lida = di_lida = False
+        while not (primeira_adicao_lida or di_lida):
+            bloco = f.read(tamanho_bloco)
+            if not bloco:
+                parser.close()  # Sem DI completa: confirma que o XML está bem formado
+                break
+            parser.feed(bloco)
+            for evento, elem in parser.read_events():
+                if evento == "start":
+                    profundidade += 1
+                    continue
+                if profundidade == 4 and elem.tag in campos:
+                    info[campos[elem.tag]] = (elem.text or "").strip() or None
+                elif profundidade == 3 and elem.tag == "adicao":
+                    primeira_adicao_lida = True
+                    break
+                elif profundidade == 3 and elem.tag in campos_di:
+                    # DI sem adições: os campos de nível DI vêm antes do seu fim
+                    info[campos_di[elem.tag]] = (elem.text or "").strip() or None
+                elif profundidade == 2:
+                    di_lida = True
+                    break
+                profundidade -= 1
+
+        if primeira_adicao_lida:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+                fim_di = mapa.find(b"</declaracaoImportacao>")
+                if fim_di < 0:
+                    fim_di = len(mapa)
+                final = mapa[mapa.rfind(b"</adicao>", 0, fim_di):fim_di].decode("utf-8", errors="ignore")
+            total = re.search(r"<totalAdicoes>\s*(\d+)\s*</totalAdicoes>", final)
+            numero = re.search(r"<numeroDI>\s*([^<]*?)\s*</numeroDI>", final)
+            if total:
+                info["Qtd. adições"] = total.group(1)
+            if info["DI"] is None and numero:
+                info["DI"] = numero.group(1)
+
+    if info["Qtd. adições"] is not None:
+        info["Qtd. adições"] = int(info["Qtd. adições"])
+    return info
+
+
+class CacheParseDI:
+    """
+    Cache dos dados parseados das DIs (antes do custeio), indexado pelo SHA-256 do XML.
+
+    Os dados ficam serializados (pickle) em um LRU em memória e, opcionalmente, em uma
+    pasta em disco compartilhável entre processos do lote. Cada consulta devolve uma
+    cópia nova, que pode ser passada diretamente a calcular_custos_unitarios.
+    """
+
+    # Incrementar sempre que a estrutura de "dados" mudar, invalidando o cache em disco
+    VERSAO = 5
+
+    def __init__(self, max_bytes_memoria=256 * 1024 * 1024, pasta_disco=None,
+                 max_bytes_disco=2 * 1024 * 1024 * 1024):
+        self.max_bytes_memoria = max_bytes_memoria
+        self.max_bytes_disco = max_bytes_disco
+        self.pasta_disco = Path(pasta_disco) if pasta_disco else None
+        self._memoria = OrderedDict()
+        self._bytes_memoria = 0
+        if self.pasta_disco:
+            self.pasta_disco.mkdir(parents=True, exist_ok=True)
+
+    def chave(self, conteudo: bytes) -> str:
+        """Chave do cache para o conteúdo bruto de um XML"""
+        return self._chave(hashlib.sha256(conteudo))
+
+    def _chave(self, sha256):
+        return sha256.hexdigest() + f"-v{self.VERSAO}"
+
+    def carrega(self, xml_path: Path, streaming: bool = False, ponto_fixo: bool = False,
+                processos: int = None) -> list:
+        """
+        Devolve a lista de DIs do XML (como em carrega_dis_completo), parseando só se necessário
+
+        O hash é calculado em blocos e, sem o XML no cache, o parse lê do próprio arquivo:
+        com streaming, o XML inteiro nunca fica em memória.
+        """
+        sha256 = hashlib.sha256()
+        with open(xml_path, "rb") as f:
+            for bloco in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(bloco)
+        return self._carrega(self._chave(sha256), xml_path, streaming, ponto_fixo, processos)
+
+    def carrega_conteudo(self, conteudo: bytes, streaming: bool = False, ponto_fixo: bool = False,
+                         processos: int = None) -> list:
+        """Como carrega, a partir do conteúdo já lido do XML (ex.: recebido pela rede)"""
+        return self._carrega(self.chave(conteudo), io.BytesIO(conteudo), streaming, ponto_fixo, processos)
+
+    def _carrega(self, chave, origem, streaming, ponto_fixo, processos):
+        chave += "-fixo" if ponto_fixo else ""
+        if _extrator.assinatura:
+            chave += f"-x{_extrator.assinatura}"
+
+        serializado = self._le_memoria(chave)
+        if serializado is None:
+            serializado = self._le_disco(chave)
+            if serializado is None:
+                lista_dados = carrega_dis_completo(origem, streaming=streaming, ponto_fixo=ponto_fixo,
+                                                   processos=processos)
+                serializado = pickle.dumps(lista_dados, protocol=pickle.HIGHEST_PROTOCOL)
+                self._grava_disco(chave, serializado)
+            self._grava_memoria(chave, serializado)
+
+        return pickle.loads(serializado)
+
+    def limpa(self):
+        """Esvazia o cache em memória (o cache em disco é preservado)"""
+        self._memoria.clear()
+        self._bytes_memoria = 0
+
+    def _le_memoria(self, chave):
+        serializado = self._memoria.get(chave)
+        if serializado is not None:
+            self._memoria.move_to_end(chave)
+        return serializado
+
+    def _grava_memoria(self, chave, serializado):
+        if len(serializado) > self.max_bytes_memoria:
+            return
+        self._memoria[chave] = serializado
+        self._bytes_memoria += len(serializado)
+        while self._bytes_memoria > self.max_bytes_memoria:
+            _, antigo = self._memoria.popitem(last=False)
+            self._bytes_memoria -= len(antigo)
+
+    def _le_disco(self, chave):
+        if not self.pasta_disco:
+            return None
+        arquivo = self.pasta_disco / f"{chave}.pickle"
+        try:
+            serializado = arquivo.read_bytes()
+            os.utime(arquivo)  # Marca como usado recentemente para o LRU
+            return serializado
+        except OSError:
+            return None
+
+    def _grava_disco(self, chave, serializado):
+        if not self.pasta_disco or len(serializado) > self.max_bytes_disco:
+            return
+        # Grava em arquivo temporário e renomeia, para que workers concorrentes nunca leiam um arquivo parcial.
+        # O disco só poupa parses: sem espaço ou sem permissão, o parse já feito segue sem ser gravado
+        temporario = None
+        try:
+            fd, temporario = tempfile.mkstemp(dir=self.pasta_disco, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(serializado)
+            os.replace(temporario, self.pasta_disco / f"{chave}.pickle")
+        except BaseException as e:
+            if temporario and os.path.exists(temporario):
+                try:
+                    os.unlink(temporario)
+                except OSError:
+                    pass
+            if not isinstance(e, OSError):
+                raise
+            log.warning(f"Cache de parse em disco indisponível ({e}); seguindo sem gravar")
+            return
+        self._aplica_limite_disco()
+
+    def _aplica_limite_disco(self):
+        arquivos = []
+        for arquivo in self.pasta_disco.glob("*.pickle"):
+            try:
+                st = arquivo.stat()
+            except OSError:
+                continue
+            arquivos.append((st.st_mtime, st.st_size, arquivo))
+
+        total = sum(tamanho for _, tamanho, _ in arquivos)
+        for _, tamanho, arquivo in sorted(arquivos, key=lambda a: a[0]):
+            if total <= self.max_bytes_disco:
+                break
+            try:
+                arquivo.unlink()
+            except OSError:
+                pass
+            total -= tamanho
+
+
+class MedidorEtapas:
+    """
+    Mede as etapas do processamento de uma DI: tempo de parede, tempo de CPU, pico de
+    alocações (tracemalloc, quando ativo) e quantidade de adições/itens.
+
+    Etapas podem ser aninhadas (ex.: "Excel" contém "Excel/Adições"), e o pico de uma
+    etapa inclui o de suas subetapas. Com memoria=True o tracemalloc fica ligado enquanto
+    o medidor estiver aberto (with), o que deixa o processamento sensivelmente mais lento.
+    Um medidor com ativo=False não registra nada e serve de padrão nas funções.
+    """
+
+    def __init__(self, memoria=False, ativo=True):
+        self.memoria = memoria
+        self.ativo = ativo
+        self.etapas = []
+        self._abertas = []  # [registro, início, início CPU, pico das subetapas]
+        self._nivel_marca = None
+        self._ligou_tracemalloc = False
+
+    def __enter__(self):
+        if self.memoria and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._ligou_tracemalloc = True
+        return self
+
+    def __exit__(self, *exc):
+        if self._ligou_tracemalloc:
+            tracemalloc.stop()
+            self._ligou_tracemalloc = False
+
+    def _repassa_pico(self, pico):
+        if self._abertas:
+            self._abertas[-1][3] = max(self._abertas[-1][3], pico)
+        tracemalloc.reset_peak()
+
+    def inicia(self, nome, adicoes=None, itens=None):
+        """Abre uma etapa (dentro da etapa aberta, se houver); prefira etapa() ou marca()"""
+        if not self.ativo:
+            return
+        registro = {"Etapa": nome, "Tempo (s)": None, "CPU (s)": None, "Pico alocações (MB)": None,
+                    "Adições": adicoes, "Itens": itens}
+        self.etapas.append(registro)
+        if tracemalloc.is_tracing():
+            self._repassa_pico(tracemalloc.get_traced_memory()[1])
+        self._abertas.append([registro, time.perf_counter(), time.process_time(), 0])
+
+    def encerra(self):
+        """Fecha a etapa aberta mais interna"""
+        if not self._abertas:
+            return
+        registro, inicio, inicio_cpu, pico = self._abertas.pop()
+        registro["Tempo (s)"] = round(time.perf_counter() - inicio, 6)
+        registro["CPU (s)"] = round(time.process_time() - inicio_cpu, 6)
+        if tracemalloc.is_tracing():
+            pico = max(pico, tracemalloc.get_traced_memory()[1])
+            registro["Pico alocações (MB)"] = round(pico / 2 ** 20, 3)
+            self._repassa_pico(pico)
+
+    @contextmanager
+    def etapa(self, nome, adicoes=None, itens=None):
+        """Mede o bloco with como uma etapa, fechando também as subetapas abertas por marca()"""
+        nivel = len(self._abertas)
+        self.inicia(nome, adicoes, itens)
+        try:
+            yield self
+        finally:
+            while len(self._abertas) > nivel:
+                self.encerra()
+            self._nivel_marca = None
+
+    def marca(self, nome=None, adicoes=None, itens=None):
+        """Encerra a subetapa aberta pela marca anterior e, se nome for informado, inicia outra"""
+        if self._nivel_marca is not None and len(self._abertas) == self._nivel_marca:
+            self.encerra()
+        self._nivel_marca = None
+        if nome and self.ativo:
+            self.inicia(nome, adicoes, itens)
+            self._nivel_marca = len(self._abertas)
+
+    def resumo(self):
+        """Texto curto com os tempos das etapas de primeiro nível (ex.: para a interface)"""
+        return " · ".join(f"{e['Etapa']} {e['Tempo (s)']:.2f}s" for e in self.etapas
+                          if "/" not in e["Etapa"] and e["Tempo (s)"] is not None)
+
+    def registra_log(self, **contexto):
+        """Uma linha de log estruturada (JSON) com o contexto informado e as etapas medidas"""
+        log.info("Desempenho %s", json.dumps({**contexto, "Etapas": self.etapas}, ensure_ascii=False))
+
+    def grava_json(self, caminho: Path, **contexto):
+        """Grava as medições em um JSON ao lado do extrato (ver caminho_json_desempenho)"""
+        Path(caminho).write_text(json.dumps({**contexto, "Etapas": self.etapas}, ensure_ascii=False, indent=2),
+                                 encoding="utf-8")
+
+
+# Medidor desligado, usado quando nenhum é passado
+SEM_MEDICAO = MedidorEtapas(ativo=False)
+
+
+def caminho_json_desempenho(xlsx: Path) -> Path:
+    """JSON de desempenho que acompanha um extrato: ExtratoDI_X.xlsx → ExtratoDI_X.perf.json"""
+    return Path(xlsx).with_suffix(".perf.json")
+
+
+def contagens_di(d):
+    """Adições e itens de uma DI, no formato dos argumentos de MedidorEtapas.etapa"""
+    return {"adicoes": len(d["adicoes"]), "itens": sum(len(ad["itens"]) for ad in d["adicoes"])}
+
+
+def _percentil(valores, p):
+    """Percentil p (0–100) com interpolação linear entre os valores ordenados"""
+    ordenados = sorted(valores)
+    posicao = (len(ordenados) - 1) * p / 100
+    i = int(posicao)
+    if i + 1 < len(ordenados):
+        return ordenados[i] + (ordenados[i + 1] - ordenados[i]) * (posicao - i)
+    return ordenados[i]
+
+
+def agrega_desempenho(listas_etapas) -> dict:
+    """
+    Percentis (p50, p90, p99 e máximo) de tempo, CPU e pico de alocações por etapa,
+    a partir das medições (MedidorEtapas.etapas) de várias DIs
+    """
+    por_etapa = {}
+    for etapas in listas_etapas:
+        for registro in etapas:
+            medidas = por_etapa.setdefault(registro["Etapa"], {"Tempo (s)": [], "CPU (s)": [],
+                                                               "Pico alocações (MB)": []})
+            for medida, valores in medidas.items():
+                if registro.get(medida) is not None:
+                    valores.append(registro[medida])
+
+    return {
+        etapa: {"DIs": len(medidas["Tempo (s)"]), **{
+            medida: {"p50": round(_percentil(valores, 50), 6), "p90": round(_percentil(valores, 90), 6),
+                     "p99": round(_percentil(valores, 99), 6), "máx": max(valores)}
+            for medida, valores in medidas.items() if valores
+        }}
+        for etapa, medidas in por_etapa.items()
+    }
+
+
+def custeia_di(dados, frete_embutido=False, seguro_embutido=False, comparar_cenarios=False, medidor=None,
+                vetorizado=False, tabela=None, uf=None, regime="normal"):
+    """
+    Calcula e valida os custos de uma DI e o ICMS do croqui, devolvendo o próprio dicionário
+
+    Com comparar_cenarios, calcula também os CENARIOS_PADRAO na mesma passagem,
+    tendo a configuração informada como cenário principal. Com medidor (MedidorEtapas),
+    registra as etapas "Custos", "Validação" (e "Validação cenários") e "ICMS". vetorizado
+    escolhe o motor NumPy (ver calcular_custos_unitarios); não se aplica aos cenários
+    nem ao ponto fixo, que têm motor próprio. tabela, uf e regime vão para calcula_icms,
+    cujo resultado fica em dados["icms"] (os extratos só o leem).
+    """
+    medidor = medidor or SEM_MEDICAO
+    contagens = contagens_di(dados)
+    if comparar_cenarios:
+        cenarios = cenarios_com_principal(frete_embutido, seguro_embutido)
+        with medidor.etapa("Custos", **contagens):
+            calcular_custos_unitarios(dados, cenarios=cenarios)
+        with medidor.etapa("Validação cenários", **contagens):
+            dados["validacao_cenarios"] = validar_custos(dados, cenarios=cenarios)
+    else:
+        with medidor.etapa("Custos", **contagens):
+            calcular_custos_unitarios(dados, frete_embutido=frete_embutido, seguro_embutido=seguro_embutido,
+                                      vetorizado=vetorizado)
+    with medidor.etapa("Validação", **contagens):
+        dados["validacao_custos"] = validar_custos(dados, frete_embutido=frete_embutido,
+                                                   seguro_embutido=seguro_embutido)
+    with medidor.etapa("ICMS", **contagens):
+        dados["icms"] = calcula_icms(dados, tabela, uf, regime)
+    return dados
+
+
+# === ICMS NA IMPORTAÇÃO: TABELA POR UF × NCM × REGIME === #
+
+# Regras padrão: (UF, prefixo da NCM, regime, alíquota %, redução da base %, diferimento %, descrição).
+# UF e prefixo vazios valem para qualquer UF/NCM; vale a regra da UF e do prefixo mais longo.
+# Regimes de incentivo conforme beneficios-fiscais-importacao-go-sc.md, só na parte que cabe ao
+# desembaraço: o crédito outorgado do COMEXPRODUZIR (65%) e as alíquotas efetivas de saída ficam
+# na apuração, fora do croqui. O TTD 409 recolhe na importação só a carga efetiva (3% nos primeiros
+# 36 meses, 1,4% depois); o restante é diferido. Regime fora da tabela é erro (TabelaICMS.regra);
+# a tabela inteira pode ser substituída por um CSV (TabelaICMS.carrega).
+TABELA_ICMS_PADRAO = [
+    ("", "", "normal", 18.0, 0.0, 0.0, "Alíquota geral"),
+    ("GO", "", "normal", 19.0, 0.0, 0.0, "Alíquota interna GO"),
+    ("GO", "", "COMEXPRODUZIR", 19.0, 0.0, 100.0,
+     "COMEXPRODUZIR: ICMS da importação diferido para a saída (crédito outorgado de 65% na apuração)"),
+    ("SC", "", "normal", 17.0, 0.0, 0.0, "Alíquota interna SC"),
+    ("SC", "", "TTD409", 17.0, 0.0, 100 * (17 - 3) / 17,
+     "TTD 409 (primeiros 36 meses): carga efetiva de 3% na importação, restante diferido"),
+    ("SC", "", "TTD409_APOS_36M", 17.0, 0.0, 100 * (17 - 1.4) / 17,
+     "TTD 409 (após 36 meses): carga efetiva de 1,4% na importação, restante diferido"),
+    ("SC", "", "TTD410", 17.0, 0.0, 100.0, "TTD 410: diferimento integral do ICMS na importação"),
+]
+
+COLUNAS_TABELA_ICMS = ("uf", "ncm", "regime", "aliquota", "reducao_base", "diferimento", "descricao")
+
+
+class TabelaICMS:
+    """
+    Regras de ICMS na importação indexadas por (UF, regime) e prefixo da NCM.
+
+    A busca de uma NCM tenta os prefixos do mais longo ao vazio, primeiro na UF e depois
+    nas regras sem UF; o resultado de cada (UF, NCM, regime) fica memoizado, de modo que
+    as adições de mesma NCM custam uma busca em dicionário.
+    """
+
+    def __init__(self, regras=None):
+        self.regras = list(TABELA_ICMS_PADRAO if regras is None else regras)
+        self._indice = {}
+        for uf, ncm, regime, aliquota, reducao, diferimento, descricao in self.regras:
+            if not 0 <= float(aliquota) < 100:
+                raise ValueError(f"Alíquota de ICMS inválida ({aliquota}) para {uf or '*'}/{ncm or '*'}/{regime}")
+            regra = (uf.strip().upper(), ncm.strip(), regime.strip(), float(aliquota), float(reducao),
+                     float(diferimento), descricao)
+            self._indice.setdefault((regra[0], regra[2]), {})[regra[1]] = regra
+        self.regra = lru_cache(maxsize=4096)(self._regra)
+
+    def regimes(self, uf=None) -> set:
+        """Regimes com alguma regra na UF (ou nas regras sem UF); sem uf, os de qualquer UF"""
+        uf = (uf or "").strip().upper()
+        return {regime for uf_regra, regime in self._indice if not uf or uf_regra in (uf, "")}
+
+    @classmethod
+    def carrega(cls, arquivo: Path) -> "TabelaICMS":
+        """Lê as regras de um CSV separado por ";" com as colunas de COLUNAS_TABELA_ICMS (vírgula decimal aceita)"""
+        with open(arquivo, encoding="utf-8-sig", newline="") as f:
+            leitor = csv.DictReader(f, delimiter=";")
+            faltando = set(COLUNAS_TABELA_ICMS) - set(leitor.fieldnames or ()) - {"descricao"}
+            if faltando:
+                raise ValueError(f"Tabela de ICMS sem as colunas: {', '.join(sorted(faltando))}")
+
+            def numero(valor):
+                return float((valor or "0").replace(",", "."))
+
+            return cls([(linha["uf"] or "", linha["ncm"] or "", linha["regime"] or "", numero(linha["aliquota"]),
+                         numero(linha["reducao_base"]), numero(linha["diferimento"]), linha.get("descricao") or "")
+                        for linha in leitor])
+
+    def _regra(self, uf, ncm, regime):
+        """(UF, prefixo, regime, alíquota %, redução %, diferimento %, descrição) aplicável à NCM"""
+        ncm = "".join(c for c in str(ncm) if c.isdigit())
+        for chave in ((uf, regime), ("", regime)):
+            por_prefixo = self._indice.get(chave)
+            if por_prefixo:
+                for tamanho in range(len(ncm), -1, -1):
+                    regra = por_prefixo.get(ncm[:tamanho])
+                    if regra is not None:
+                        return regra
+        raise ValueError(f"Sem regra de ICMS para UF {uf or '?'}, NCM {ncm or '?'} e regime '{regime}'")
+
+
+@lru_cache(maxsize=8)
+def tabela_icms(arquivo=None) -> TabelaICMS:
+    """Tabela de ICMS carregada uma vez por processo (a padrão, sem arquivo)"""
+    return TabelaICMS.carrega(arquivo) if arquivo else TabelaICMS()
+
+
+def rateia_centavos(total, pesos):
+    """Divide o inteiro total na proporção dos pesos (maiores restos); as partes somam exatamente total"""
+    if not pesos:
+        return []
+    soma = sum(pesos)
+    if soma <= 0:
+        pesos, soma = [1] * len(pesos), len(pesos)
+    fator = total / soma
+    cotas = [peso * fator for peso in pesos]
+    partes = list(map(math.floor, cotas))
+    falta = total - sum(partes)
+    if falta:
+        restos = [cota - parte for cota, parte in zip(cotas, partes)]
+        # falta < 0 só por erro de ponto flutuante nas cotas: tira dos menores restos
+        ordem = sorted(range(len(restos)), key=restos.__getitem__, reverse=falta > 0)
+        passo = 1 if falta > 0 else -1
+        for i in ordem[:abs(falta)]:
+            partes[i] += passo
+    return partes
+
+
+def rateia_valor_aduaneiro(dados) -> list:
+    """
+    Valor aduaneiro da DI em centavos por adição, rateado pela Base II R$ de cada uma (ou
+    pelo VCMV, se ela faltar): a soma das bases das adições pode diferir do total da DI por
+    arredondamentos, e as partes rateadas somam exatamente o total
+    """
+    fixo = dados.get("ponto_fixo")
+
+    def centavos(valor):
+        return int(valor) if fixo else round(valor * 100)
+
+    adicoes = dados["adicoes"]
+    bases_ii = [centavos(ad.get("fiscal", {}).get("Base II R$", 0)) for ad in adicoes]
+    return rateia_centavos(centavos(dados["valores"]["Valor Aduaneiro R$"]),
+                            bases_ii if any(bases_ii) else [ad["dados_gerais"]["VCMV R$"] for ad in adicoes])
+
+
+def calcula_icms(dados, tabela: TabelaICMS = None, uf=None, regime="normal") -> dict:
+    """
+    Calcula base e valor do ICMS na importação por item, conciliados com os totais da DI.
+
+    A base "sem ICMS" de cada adição é a sua parte do valor aduaneiro e do Siscomex/AFRMM
+    da DI (rateados pela Base II R$ da adição) mais II, IPI, PIS e COFINS da adição;
+    dentro da adição, vai para os itens pela quantidade, como no custeio. Os itens são
+    agrupados pela regra da tabela (UF × NCM × regime) e, em cada grupo, a base "por
+    dentro" (com redução), o ICMS e o diferimento são calculados sobre o total do grupo e
+    rateados em centavos pelos maiores restos, de modo que a soma dos itens feche
+    exatamente com os totais. Funciona também em ponto fixo (valores em centavos).
+
+    Grava em cada item "CST ICMS", "Alq. ICMS (%)", "Red. BC ICMS (%)", "Dif. ICMS (%)",
+    "Base ICMS R$", "ICMS R$" e "ICMS Diferido R$": a regra aplicada fica com o item, e
+    quem grava a NF-e não precisa consultar a tabela de novo.
+
+    Args:
+        tabela: TabelaICMS; por padrão, a TABELA_ICMS_PADRAO
+        uf: UF do importador; por padrão, a do endereço do importador na DI
+        regime: Regime de incentivo (coluna regime da tabela)
+
+    Returns:
+        Dicionário com UF, regime, totais, conciliação e um resumo por regra
+    """
+    tabela = tabela or tabela_icms()
+    uf = (uf or dados.get("fiscal", {}).get("UF") or "").strip().upper()
+    if uf == "N/A":
+        uf = ""
+    fixo = dados.get("ponto_fixo")
+
+    def centavos(valor):
+        return int(valor) if fixo else round(valor * 100)
+
+    adicoes = dados["adicoes"]
+    valores = dados["valores"]
+    despesas = centavos(valores.get("Siscomex R$", 0)) + centavos(valores.get("AFRMM R$", 0))
+    bases_ii = [centavos(ad.get("fiscal", {}).get("Base II R$", 0)) for ad in adicoes]
+    valor_aduaneiro_di = centavos(valores["Valor Aduaneiro R$"])
+    valores_aduaneiros = rateia_valor_aduaneiro(dados)
+    despesas_adicoes = rateia_centavos(despesas, valores_aduaneiros)
+
+    # Uma passada: base sem ICMS de cada item, agrupada pela regra aplicável
+    grupos = {}
+    sem_itens = 0
+    for ad, valor_aduaneiro, despesa in zip(adicoes, valores_aduaneiros, despesas_adicoes):
+        trib = ad["tributos"]
+        base_adicao = valor_aduaneiro + despesa + sum(centavos(trib[t]) for t in ("II R$", "IPI R$", "PIS R$", "COFINS R$"))
+        if not ad["itens"]:
+            sem_itens += base_adicao
+            continue
+        regra = tabela.regra(uf, ad["dados_gerais"]["NCM"], regime)
+        itens, bases = grupos.setdefault(regra, ([], []))
+        itens.extend(ad["itens"])
+        bases.extend(rateia_centavos(base_adicao, [item["Qtd"] for item in ad["itens"]]))
+
+    saida = (lambda c: c) if fixo else (lambda c: c / 100)
+    resumo_regras = []
+    totais = {"Base sem ICMS": 0, "Base ICMS": 0, "ICMS": 0, "ICMS Diferido": 0}
+    for regra, (itens, bases) in grupos.items():
+        uf_regra, prefixo, regime_regra, aliquota, reducao, diferimento, descricao = regra
+        cst = "51" if diferimento else "20" if reducao else "00"
+        base_sem = sum(bases)
+        base_icms = round(base_sem / (1 - aliquota / 100) * (1 - reducao / 100))
+        icms = round(base_icms * aliquota / 100)
+        diferido = round(icms * diferimento / 100)
+        bases_icms = rateia_centavos(base_icms, bases)
+        valores_icms = rateia_centavos(icms, bases_icms)
+        diferidos = rateia_centavos(diferido, valores_icms)
+        for item, b, v, dif in zip(itens, bases_icms, valores_icms, diferidos):
+            item["CST ICMS"] = cst
+            item["Alq. ICMS (%)"] = aliquota
+            item["Red. BC ICMS (%)"] = reducao
+            item["Dif. ICMS (%)"] = diferimento
+            item["Base ICMS R$"] = saida(b)
+            item["ICMS R$"] = saida(v)
+            item["ICMS Diferido R$"] = saida(dif)
+        for chave, valor in zip(totais, (base_sem, base_icms, icms, diferido)):
+            totais[chave] += valor
+        resumo_regras.append({
+            "UF": uf_regra or "*", "NCM": prefixo or "*", "Regime": regime_regra, "Descrição": descricao,
+            "CST": cst, "Alíquota (%)": aliquota, "Redução Base (%)": reducao, "Diferimento (%)": diferimento,
+            "Itens": len(itens), "Base sem ICMS R$": saida(base_sem), "Base ICMS R$": saida(base_icms),
+            "ICMS R$": saida(icms), "ICMS Diferido R$": saida(diferido), "ICMS a Recolher R$": saida(icms - diferido),
+        })
+
+    # Conciliação: base sem ICMS pelos totais da DI × soma das bases dos itens
+    tributos = dados["tributos"]
+    base_di = (valor_aduaneiro_di + despesas +
+               sum(centavos(tributos[t]) for t in ("II R$", "IPI R$", "PIS R$", "COFINS R$")))
+    diferenca = base_di - totais["Base sem ICMS"]
+    return {
+        "UF": uf or "N/A",
+        "Regime": regime,
+        "Base sem ICMS (DI) R$": saida(base_di),
+        "Base sem ICMS (itens) R$": saida(totais["Base sem ICMS"]),
+        "Base ICMS R$": saida(totais["Base ICMS"]),
+        "ICMS R$": saida(totais["ICMS"]),
+        "ICMS Diferido R$": saida(totais["ICMS Diferido"]),
+        "ICMS a Recolher R$": saida(totais["ICMS"] - totais["ICMS Diferido"]),
+        "Adições sem itens R$": saida(sem_itens),
+        "Diferença R$": saida(diferenca),
+        "Conciliação": "OK" if diferenca == 0 else "DIVERGÊNCIA",
+        "Valor aduaneiro adições − DI R$": saida(sum(bases_ii) - valor_aduaneiro_di) if any(bases_ii) else saida(0),
+        "regras": resumo_regras,
+    }
+
+
+def com_icms(dados, tabela: TabelaICMS = None, uf=None, regime="normal"):
+    """
+    Cópia da DI com o ICMS de calcula_icms, para quem só grava (extrato, NF-e) sem alterar
+    dados. Adições e itens são copiados; as demais seções são compartilhadas com dados.
+    """
+    copia = dict(dados)
+    copia["adicoes"] = [dict(ad, itens=[dict(item) for item in ad["itens"]]) for ad in dados["adicoes"]]
+    copia["icms"] = calcula_icms(copia, tabela, uf, regime)
+    return copia
+
+
+# === RETIFICAÇÕES: HISTÓRICO DE VERSÕES, DIFERENÇAS E RECÁLCULO INCREMENTAL === #
+
+def nome_pasta(valor):
+    """Texto seguro para nome de pasta ou arquivo (número da DI, retificação)"""
+    return re.sub(r"[^\w.-]", "_", str(valor or "N_A")) or "N_A"
+
+
+def _ordem_retificacao(sequencial):
+    sequencial = str(sequencial or "")
+    return (0, int(sequencial), "") if sequencial.isdigit() else (1, 0, sequencial)
+
+
+class HistoricoDIs:
+    """
+    Versões já custeadas das DIs, uma por número + sequencial de retificação.
+
+    Cada versão fica em pasta/<DI>/ret_<sequencial>.pickle com os dados custeados e a
+    configuração de frete/seguro usada, para que uma retificação seja comparada com
+    a versão anterior (compara_versoes_di) e custeada só onde mudou (custeia_retificacao).
+    """
+
+    def __init__(self, pasta):
+        self.pasta = Path(pasta)
+        self.pasta.mkdir(parents=True, exist_ok=True)
+
+    def _pasta_di(self, numero_di):
+        return self.pasta / nome_pasta(numero_di)
+
+    def grava(self, dados, frete_embutido=False, seguro_embutido=False):
+        """Grava (ou substitui) a versão custeada da DI"""
+        numero_di = dados["cabecalho"]["DI"]
+        sequencial = _sequencial_retificacao(dados)
+        pasta = self._pasta_di(numero_di)
+        pasta.mkdir(parents=True, exist_ok=True)
+        versao = {"parametros": {"frete_embutido": frete_embutido, "seguro_embutido": seguro_embutido},
+                  "dados": dados}
+        descritor, temporario = tempfile.mkstemp(dir=pasta, suffix=".tmp")
+        with os.fdopen(descritor, "wb") as f:
+            pickle.dump(versao, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporario, pasta / f"ret_{nome_pasta(sequencial)}.pickle")
+
+    def anterior(self, numero_di, sequencial):
+        """
+        Versão mais recente com sequencial de retificação menor que `sequencial`, ou None.
+        Reprocessar uma retificação compara de novo com a anterior, não com ela mesma.
+
+        Returns:
+            Dicionário com "parametros" (frete_embutido, seguro_embutido) e "dados"
+        """
+        limite = _ordem_retificacao(nome_pasta(sequencial))
+        candidatos = [(_ordem_retificacao(arq.stem[len("ret_"):]), arq)
+                      for arq in self._pasta_di(numero_di).glob("ret_*.pickle")]
+        candidatos = [c for c in candidatos if c[0] < limite]
+        if not candidatos:
+            return None
+        with open(max(candidatos)[1], "rb") as f:
+            return pickle.load(f)
+
+
+def _sequencial_retificacao(dados):
+    return dados["adicoes"][0].get("sequencial_retificacao", "N/A") if dados["adicoes"] else "N/A"
+
+
+# Seções de nível DI comparadas entre versões e campos que, se mudarem, alteram o rateio de todas as adições
+SECOES_DI_COMPARADAS = ("cabecalho", "importador", "carga", "valores", "fiscal", "tributos", "info_complementar")
+CAMPOS_RATEIO = ("FOB R$", "Valor Aduaneiro R$", "Frete R$", "Seguro R$", "AFRMM R$", "Siscomex R$")
+SECOES_ADICAO_COMPARADAS = ("numero_li", "dados_gerais", "partes", "tributos", "fiscal")
+# Campos calculados dos itens (custeio e calcula_icms): não fazem parte da comparação dos dados de entrada
+CAMPOS_CUSTO_ITEM = ("Custo Total Item R$", "Custo Unitário R$", "Custo por Peça R$",
+                     "CST ICMS", "Alq. ICMS (%)", "Red. BC ICMS (%)", "Dif. ICMS (%)", "Base ICMS R$", "ICMS R$",
+                     "ICMS Diferido R$")
+
+
+def _compara_campos(antes, depois, linha_base, exibe):
+    """Linhas de alteração campo a campo entre dois dicionários (ou valores simples)"""
+    if not isinstance(antes, Mapping) or not isinstance(depois, Mapping):
+        if antes == depois:
+            return []
+        return [dict(linha_base, Tipo="Alterado", Antes=exibe(linha_base["Campo"], antes),
+                     Depois=exibe(linha_base["Campo"], depois))]
+    linhas = []
+    for campo in list(antes) + [c for c in depois if c not in antes]:
+        if campo in CAMPOS_CUSTO_ITEM:
+            continue
+        valor_antes, valor_depois = antes.get(campo), depois.get(campo)
+        if valor_antes != valor_depois:
+            linhas.append(dict(linha_base, Campo=campo, Tipo="Alterado",
+                               Antes=exibe(campo, valor_antes), Depois=exibe(campo, valor_depois)))
+    return linhas
+
+
+def _adicao_igual(antes, depois):
+    """Comparação rápida (sem detalhar diferenças) dos dados de entrada de uma adição"""
+    if any(antes.get(secao) != depois.get(secao) for secao in SECOES_ADICAO_COMPARADAS):
+        return False
+    if len(antes["itens"]) != len(depois["itens"]):
+        return False
+    if not depois["itens"]:
+        return True
+    # Os itens saem do parser com os mesmos campos (CAMPOS_ITEM); as tuplas de campos de
+    # entrada são comparadas de uma vez, sem um laço Python por campo
+    chaves = [campo for campo in depois["itens"][0] if campo not in CAMPOS_CUSTO_ITEM]
+    if set(chaves) != {campo for campo in antes["itens"][0] if campo not in CAMPOS_CUSTO_ITEM}:
+        return False
+    extrai = itemgetter(*chaves)
+    try:
+        return list(map(extrai, antes["itens"])) == list(map(extrai, depois["itens"]))
+    except KeyError:
+        return False
+
+
+def compara_versoes_di(anterior: dict, atual: dict) -> dict:
+    """
+    Diferenças entre duas versões de uma DI: campos de nível DI, adições (pelo número)
+    e mercadorias (pela sequência dentro da adição). Custos calculados não entram.
+
+    Returns:
+        Dicionário com "DI", "Retificação anterior", "Retificação atual", "Rateio alterado"
+        (algum total da DI usado no rateio mudou), "Adições alteradas" (números das
+        adições incluídas ou com qualquer dado alterado) e "Alterações" (uma linha por
+        diferença: Nível, Adição, Item, Campo, Tipo, Antes, Depois)
+    """
+    def exibe(campo, valor):
+        if atual.get("ponto_fixo") and isinstance(campo, str) and type(valor) is int:
+            escala = _escala_ponto_fixo(campo)
+            return valor / escala if escala else valor
+        return valor
+
+    alteracoes = []
+    for secao in SECOES_DI_COMPARADAS:
+        alteracoes += _compara_campos(anterior.get(secao), atual.get(secao),
+                                      {"Nível": "DI", "Adição": "", "Item": "", "Campo": secao}, exibe)
+    rateio_alterado = any(anterior["valores"].get(c) != atual["valores"].get(c) for c in CAMPOS_RATEIO)
+
+    adicoes_antes = {ad["numero"]: ad for ad in anterior["adicoes"]}
+    adicoes_depois = {ad["numero"]: ad for ad in atual["adicoes"]}
+    alteradas = []
+    for numero, ad in adicoes_depois.items():
+        ad_antes = adicoes_antes.get(numero)
+        base = {"Nível": "Adição", "Adição": numero, "Item": ""}
+        if ad_antes is None:
+            alteracoes.append(dict(base, Campo="", Tipo="Incluída", Antes="", Depois=ad["dados_gerais"].get("NCM")))
+            alteradas.append(numero)
+            continue
+        if _adicao_igual(ad_antes, ad):
+            continue
+        linhas = []
+        for secao in SECOES_ADICAO_COMPARADAS:
+            linhas += _compara_campos(ad_antes.get(secao), ad.get(secao), dict(base, Campo=secao), exibe)
+
+        itens_antes = {item["Seq"]: item for item in ad_antes["itens"]}
+        itens_depois = {item["Seq"]: item for item in ad["itens"]}
+        base_item = dict(base, Nível="Item")
+        for seq, item in itens_depois.items():
+            if seq not in itens_antes:
+                linhas.append(dict(base_item, Item=seq, Campo="", Tipo="Incluído", Antes="",
+                                   Depois=item.get("Descrição")))
+            else:
+                linhas += _compara_campos(itens_antes[seq], item, dict(base_item, Item=seq, Campo=""), exibe)
+        for seq, item in itens_antes.items():
+            if seq not in itens_depois:
+                linhas.append(dict(base_item, Item=seq, Campo="", Tipo="Excluído", Antes=item.get("Descrição"),
+                                   Depois=""))
+        # A ordem dos itens também entra no rateio por quantidade (soma na mesma ordem)
+        if not linhas and list(itens_antes) != list(itens_depois):
+            linhas.append(dict(base, Campo="itens", Tipo="Alterado", Antes="ordem anterior", Depois="nova ordem"))
+        if linhas:
+            alteradas.append(numero)
+            alteracoes += linhas
+    for numero, ad in adicoes_antes.items():
+        if numero not in adicoes_depois:
+            alteracoes.append({"Nível": "Adição", "Adição": numero, "Item": "", "Campo": "", "Tipo": "Excluída",
+                               "Antes": ad["dados_gerais"].get("NCM"), "Depois": ""})
+
+    return {
+        "DI": atual["cabecalho"]["DI"],
+        "Retificação anterior": _sequencial_retificacao(anterior),
+        "Retificação atual": _sequencial_retificacao(atual),
+        "Rateio alterado": rateio_alterado,
+        "Adições alteradas": alteradas,
+        "Alterações": alteracoes,
+    }
+
+
+def custeia_retificacao(dados, versao_anterior, frete_embutido=False, seguro_embutido=False,
+                        comparar_cenarios=False, medidor=None, vetorizado=False, tabela=None, uf=None,
+                        regime="normal"):
+    """
+    Como custeia_di (inclusive o ICMS), reaproveitando os custos da versão anterior da DI (ver HistoricoDIs)
+    nas adições que não mudaram. O relatório de alterações fica em dados["alteracoes"].
+
+    O recálculo é completo se a configuração de frete/seguro for outra, se algum total
+    da DI usado no rateio mudou, com o comparativo de cenários ou em ponto fixo (o
+    rateio pelos maiores restos depende de todas as adições). Caso contrário, só as
+    adições incluídas ou alteradas são custeadas; as demais copiam custos e itens da
+    versão anterior, que são idênticos aos de um recálculo completo.
+
+    Returns:
+        O relatório (compara_versoes_di, mais "Recálculo", "Motivo", "Adições recalculadas"
+        e linhas de Nível "Custo" para as adições cujo custo total mudou)
+    """
+    medidor = medidor or SEM_MEDICAO
+    anterior = versao_anterior["dados"]
+    relatorio = compara_versoes_di(anterior, dados)
+    parametros = {"frete_embutido": frete_embutido, "seguro_embutido": seguro_embutido}
+
+    motivo = None
+    if versao_anterior["parametros"] != parametros:
+        motivo = "Configuração de frete/seguro diferente da versão anterior"
+    elif relatorio["Rateio alterado"]:
+        motivo = "Totais da DI usados no rateio foram alterados"
+    elif comparar_cenarios:
+        motivo = "Comparativo de cenários"
+    elif dados.get("ponto_fixo") or anterior.get("ponto_fixo"):
+        motivo = "Ponto fixo: o rateio pelos maiores restos depende de todas as adições"
+
+    if motivo:
+        custeia_di(dados, frete_embutido, seguro_embutido, comparar_cenarios=comparar_cenarios, medidor=medidor,
+                    vetorizado=vetorizado, tabela=tabela, uf=uf, regime=regime)
+        recalculadas = len(dados["adicoes"])
+    else:
+        alteradas = set(relatorio["Adições alteradas"])
+        adicoes_antes = {ad["numero"]: ad for ad in anterior["adicoes"]}
+        parcial = dict(dados, adicoes=[ad for ad in dados["adicoes"] if ad["numero"] in alteradas])
+        with medidor.etapa("Custos", **contagens_di(parcial)):
+            for ad in dados["adicoes"]:
+                if ad["numero"] not in alteradas:
+                    ad["custos"] = adicoes_antes[ad["numero"]]["custos"]
+                    ad["itens"] = adicoes_antes[ad["numero"]]["itens"]
+            # Cada adição só depende dos próprios dados e dos totais da DI (inalterados)
+            calcular_custos_unitarios(parcial, frete_embutido=frete_embutido, seguro_embutido=seguro_embutido,
+                                      vetorizado=vetorizado)
+            dados["configuracao_custos"] = parcial.get("configuracao_custos", anterior["configuracao_custos"])
+        with medidor.etapa("Validação", **contagens_di(dados)):
+            dados["validacao_custos"] = validar_custos(dados, frete_embutido=frete_embutido,
+                                                       seguro_embutido=seguro_embutido)
+        with medidor.etapa("ICMS", **contagens_di(dados)):
+            dados["icms"] = calcula_icms(dados, tabela, uf, regime)
+        recalculadas = len(parcial["adicoes"])
+
+    custos_antes = {ad["numero"]: ad.get("custos", {}).get("Custo Total Adição R$") for ad in anterior["adicoes"]}
+    exibe = converte_ponto_fixo if dados.get("ponto_fixo") else (lambda valor: valor)
+    for ad in dados["adicoes"]:
+        antes, depois = custos_antes.get(ad["numero"]), ad["custos"]["Custo Total Adição R$"]
+        if antes is not None and antes != depois:
+            campo = "Custo Total Adição R$"
+            relatorio["Alterações"].append({
+                "Nível": "Custo", "Adição": ad["numero"], "Item": "", "Campo": campo, "Tipo": "Alterado",
+                "Antes": exibe({campo: antes})[campo], "Depois": exibe({campo: depois})[campo]})
+
+    relatorio.update({
+        "Recálculo": "Completo" if motivo else "Incremental",
+        "Motivo": motivo or "",
+        "Adições recalculadas": recalculadas,
+    })
+    dados["alteracoes"] = relatorio
+    return relatorio
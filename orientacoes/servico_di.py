@@ -0,0 +1,333 @@
+"""
+Serviço HTTP local com a API JSON do motor de custos: recebe o XML da DI e devolve os
+custos ou o extrato em Excel, com os cálculos em um pool de processos.
+
+asyncio é importado só nos métodos do serviço, para não pesar na abertura da interface e do lote.
+"""
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+import argparse
+import json
+import logging
+import os
+import signal
+import tempfile
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+
+from extrato_excel import gera_excel_combinado, gera_excel_completo
+from lote_dis import contexto_sem_fork, ignora_sigint
+from nucleo_di import (
+    CacheParseDI, configuracao_por_incoterm, converte_ponto_fixo, custeia_di, numpy_disponivel,
+)
+
+log = logging.getLogger("ExtratoDI")
+
+
+# === SERVIÇO HTTP LOCAL (API JSON DO MOTOR DE CUSTOS) === #
+
+# Cache de parse de cada worker do serviço (criado em _inicia_worker_servico)
+_cache_servico = None
+
+
+def _inicia_worker_servico(max_bytes_cache, pasta_cache):
+    global _cache_servico
+    ignora_sigint()
+    _cache_servico = CacheParseDI(max_bytes_memoria=max_bytes_cache, pasta_disco=pasta_cache)
+
+
+def _custeia_conteudo(conteudo, frete_embutido, seguro_embutido, auto_incoterm, ponto_fixo, comparar_cenarios,
+                      vetorizado):
+    """Parse (pelo cache do worker) e custeio de todas as DIs de um XML recebido pelo serviço"""
+    try:
+        lista_dados = _cache_servico.carrega_conteudo(conteudo, ponto_fixo=ponto_fixo)
+    except ET.ParseError as e:
+        raise ValueError(f"XML inválido: {e}") from None
+    for dados in lista_dados:
+        frete, seguro = frete_embutido, seguro_embutido
+        if auto_incoterm and dados["adicoes"]:
+            frete, seguro = configuracao_por_incoterm(dados["adicoes"][0]["dados_gerais"]["INCOTERM"])
+        custeia_di(dados, frete, seguro, comparar_cenarios=comparar_cenarios, vetorizado=vetorizado)
+    return lista_dados
+
+
+def _servico_custos(conteudo, opcoes) -> bytes:
+    """Executado no worker: devolve o JSON (já codificado) das DIs custeadas"""
+    lista_dados = _custeia_conteudo(conteudo, **opcoes)
+    if opcoes["ponto_fixo"]:
+        lista_dados = [converte_ponto_fixo(dados) for dados in lista_dados]
+    return json.dumps({"dis": lista_dados}, ensure_ascii=False).encode("utf-8")
+
+
+def _servico_extrato(conteudo, opcoes):
+    """Executado no worker: devolve (nome do arquivo, bytes do .xlsx); várias DIs vão em um extrato combinado"""
+    lista_dados = _custeia_conteudo(conteudo, **opcoes)
+    if len(lista_dados) == 1:
+        nome = f"ExtratoDI_CUSTOS_{lista_dados[0]['cabecalho']['DI']}.xlsx"
+    else:
+        nome = f"ExtratoDI_CUSTOS_{len(lista_dados)}_DIs.xlsx"
+    with tempfile.TemporaryDirectory(prefix="servico_di_") as pasta:
+        xlsx = Path(pasta) / nome
+        if len(lista_dados) == 1:
+            gera_excel_completo(lista_dados[0], xlsx)
+        else:
+            gera_excel_combinado(lista_dados, xlsx)
+        return nome, xlsx.read_bytes()
+
+
+class _ErroHTTP(Exception):
+    def __init__(self, status, mensagem, cabecalhos=()):
+        super().__init__(mensagem)
+        self.status = HTTPStatus(status)
+        self.cabecalhos = list(cabecalhos)
+
+
+class ServicoDI:
+    """
+    Servidor HTTP local (asyncio, só biblioteca padrão) com o motor de custos como API JSON.
+
+    Rotas:
+        GET  /saude    → situação do serviço (workers, requisições em andamento e na fila)
+        POST /custos   → corpo: XML da DI; resposta: {"dis": [dados custeados, ...]}
+        POST /extrato  → corpo: XML da DI; resposta: extrato .xlsx (combinado se houver várias DIs)
+
+    Opções na query string, como 0/1: frete_embutido, seguro_embutido, auto_incoterm,
+    ponto_fixo, cenarios e vetorizado. Parse, custeio e Excel rodam em um pool de `max_workers`
+    processos, cada um com seu CacheParseDI em memória (reenviar o mesmo XML não o
+    parseia de novo); com pasta_cache, os workers compartilham também o cache em disco.
+    No máximo `max_simultaneos` requisições são processadas ao mesmo tempo; outras
+    `max_fila` aguardam, e as excedentes recebem 503.
+    """
+
+    TIPO_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    OPCOES_BOOLEANAS = ("frete_embutido", "seguro_embutido", "auto_incoterm", "ponto_fixo", "cenarios", "vetorizado")
+
+    def __init__(self, host="127.0.0.1", porta=8765, max_workers=None, max_simultaneos=None, max_fila=64,
+                 max_bytes_upload=200 * 1024 * 1024, pasta_cache: Path = None,
+                 max_bytes_cache=256 * 1024 * 1024, tempo_limite=30.0):
+        self.host = host
+        self.porta = porta
+        self.max_workers = max_workers or os.cpu_count()
+        self.max_simultaneos = max_simultaneos or self.max_workers
+        self.max_fila = max_fila
+        self.max_bytes_upload = max_bytes_upload
+        self.pasta_cache = str(pasta_cache) if pasta_cache else None
+        self.max_bytes_cache = max_bytes_cache
+        self.tempo_limite = tempo_limite
+        self.pool = None
+        self._vagas = None
+        self._em_andamento = 0
+        self._na_fila = 0
+
+    def _cria_pool(self):
+        # Workers bifurcados (fork) do servidor herdariam os sockets das conexões abertas, e o cliente
+        # não veria o fim da resposta com Connection: close; o forkserver os cria sem esses descritores
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=contexto_sem_fork(),
+                                   initializer=_inicia_worker_servico,
+                                   initargs=(self.max_bytes_cache, self.pasta_cache))
+
+    async def executa(self):
+        """Atende até ser cancelado (Ctrl+C / SIGTERM); as requisições em andamento são concluídas"""
+        import asyncio
+        self.pool = self._cria_pool()
+        self._vagas = asyncio.Semaphore(self.max_simultaneos)
+        servidor = await asyncio.start_server(self._atende, self.host, self.porta)
+        enderecos = ", ".join(f"http://{s.getsockname()[0]}:{s.getsockname()[1]}" for s in servidor.sockets)
+        log.info("Serviço DI em %s (%d workers, %d simultâneas)", enderecos, self.max_workers, self.max_simultaneos)
+        try:
+            async with servidor:
+                await servidor.serve_forever()
+        finally:
+            self.pool.shutdown(wait=True)
+            log.info("Serviço DI encerrado")
+
+    async def _atende(self, reader, writer):
+        """Uma conexão: várias requisições em sequência (keep-alive), até o cliente fechar"""
+        import asyncio
+        try:
+            while True:
+                try:
+                    requisicao = await self._le_requisicao(reader)
+                except _ErroHTTP as e:
+                    await self._responde_erro(writer, e, manter=False)
+                    break
+                if requisicao is None:
+                    break
+                metodo, rota, query, cabecalhos, corpo = requisicao
+                manter = cabecalhos.get("connection", "").lower() != "close"
+                inicio = time.perf_counter()
+                try:
+                    status, tipo, resposta, extras = await self._roteia(metodo, rota, query, corpo)
+                except _ErroHTTP as e:
+                    await self._responde_erro(writer, e, manter)
+                    status = e.status
+                else:
+                    await self._responde(writer, status, tipo, resposta, extras, manter)
+                log.info("%s %s → %d (%d bytes, %.3fs)", metodo, rota, status, len(corpo),
+                         time.perf_counter() - inicio)
+                if not manter:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _le_requisicao(self, reader):
+        import asyncio
+        try:
+            bruto = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.tempo_limite)
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise _ErroHTTP(400, "Requisição incompleta") from None
+            return None  # Conexão encerrada entre requisições
+        except asyncio.LimitOverrunError:
+            raise _ErroHTTP(431, "Cabeçalhos grandes demais") from None
+        except asyncio.TimeoutError:
+            return None
+
+        linhas = bruto.decode("latin-1").split("\r\n")
+        try:
+            metodo, alvo, _ = linhas[0].split(" ", 2)
+        except ValueError:
+            raise _ErroHTTP(400, "Linha de requisição inválida") from None
+        cabecalhos = {}
+        for linha in linhas[1:]:
+            if ":" in linha:
+                nome, valor = linha.split(":", 1)
+                cabecalhos[nome.strip().lower()] = valor.strip()
+
+        corpo = b""
+        if metodo == "POST":
+            if "chunked" in cabecalhos.get("transfer-encoding", "").lower():
+                raise _ErroHTTP(411, "Envie o XML com Content-Length (sem chunked)")
+            try:
+                tamanho = int(cabecalhos.get("content-length", ""))
+            except ValueError:
+                raise _ErroHTTP(411, "Content-Length obrigatório") from None
+            if tamanho > self.max_bytes_upload:
+                raise _ErroHTTP(413, f"XML maior que {self.max_bytes_upload // 2 ** 20} MB")
+            try:
+                corpo = await asyncio.wait_for(reader.readexactly(tamanho), self.tempo_limite)
+            except asyncio.TimeoutError:
+                raise _ErroHTTP(408, "Tempo esgotado ao receber o XML") from None
+
+        rota, _, query = alvo.partition("?")
+        return metodo, rota, urllib.parse.parse_qs(query), cabecalhos, corpo
+
+    async def _roteia(self, metodo, rota, query, corpo):
+        if metodo == "OPTIONS":
+            # Pré-verificação CORS do navegador (web-system aberto de outra origem)
+            return 204, None, b"", [("Access-Control-Allow-Methods", "GET, POST, OPTIONS"),
+                                    ("Access-Control-Allow-Headers", "Content-Type"),
+                                    ("Access-Control-Max-Age", "86400")]
+        if rota == "/saude":
+            if metodo != "GET":
+                raise _ErroHTTP(405, "Use GET", [("Allow", "GET")])
+            situacao = {"status": "ok", "workers": self.max_workers, "simultaneas": self.max_simultaneos,
+                        "em_andamento": self._em_andamento, "na_fila": self._na_fila}
+            return 200, "application/json", json.dumps(situacao).encode("utf-8"), []
+        if rota not in ("/custos", "/extrato"):
+            raise _ErroHTTP(404, f"Rota não encontrada: {rota}")
+        if metodo != "POST":
+            raise _ErroHTTP(405, "Envie o XML da DI com POST", [("Allow", "POST")])
+        if not corpo:
+            raise _ErroHTTP(400, "Corpo vazio: envie o XML da DI")
+
+        opcoes = {opcao: query.get(opcao, ["0"])[-1].lower() in ("1", "true", "sim")
+                  for opcao in self.OPCOES_BOOLEANAS}
+        opcoes["comparar_cenarios"] = opcoes.pop("cenarios")
+        if opcoes["vetorizado"] and not numpy_disponivel():
+            raise _ErroHTTP(400, "vetorizado=1 requer o pacote numpy no servidor")
+        if rota == "/custos":
+            resposta = await self._executa_no_pool(_servico_custos, corpo, opcoes)
+            return 200, "application/json", resposta, []
+        nome, resposta = await self._executa_no_pool(_servico_extrato, corpo, opcoes)
+        return 200, self.TIPO_XLSX, resposta, [("Content-Disposition", f'attachment; filename="{nome}"')]
+
+    async def _executa_no_pool(self, funcao, *args):
+        import asyncio
+        if self._vagas.locked() and self._na_fila >= self.max_fila:
+            raise _ErroHTTP(503, "Serviço ocupado; tente novamente", [("Retry-After", "1")])
+        self._na_fila += 1
+        try:
+            await self._vagas.acquire()
+        finally:
+            self._na_fila -= 1
+        self._em_andamento += 1
+        pool = self.pool
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, funcao, *args)
+        except ValueError as e:
+            raise _ErroHTTP(400, str(e)) from None
+        except BrokenProcessPool:
+            # Um worker morreu (ex.: falta de memória): recria o pool para as próximas requisições,
+            # uma vez só, mesmo que várias requisições em andamento recebam o erro
+            if self.pool is pool:
+                log.error("Pool de processos interrompido; recriando")
+                pool.shutdown(wait=False)
+                self.pool = self._cria_pool()
+            raise _ErroHTTP(500, "Falha no processamento; tente novamente") from None
+        except Exception as e:
+            log.exception("Erro ao processar requisição")
+            raise _ErroHTTP(500, f"Erro ao processar: {e}") from None
+        finally:
+            self._em_andamento -= 1
+            self._vagas.release()
+
+    async def _responde(self, writer, status, tipo, corpo, extras=(), manter=True):
+        status = HTTPStatus(status)
+        cabecalhos = [("Content-Length", str(len(corpo))), ("Access-Control-Allow-Origin", "*"),
+                      ("Connection", "keep-alive" if manter else "close")]
+        if tipo:
+            cabecalhos.append(("Content-Type", tipo + ("; charset=utf-8" if tipo == "application/json" else "")))
+        cabecalhos += extras
+        writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n".encode("latin-1")
+                     + "".join(f"{nome}: {valor}\r\n" for nome, valor in cabecalhos).encode("latin-1")
+                     + b"\r\n" + corpo)
+        await writer.drain()
+
+    async def _responde_erro(self, writer, erro, manter):
+        corpo = json.dumps({"erro": str(erro)}, ensure_ascii=False).encode("utf-8")
+        await self._responde(writer, erro.status, "application/json", corpo, erro.cabecalhos, manter)
+
+
+def main_servico(argv=None):
+    """Ponto de entrada de linha de comando do serviço HTTP (ver ServicoDI)"""
+    import asyncio
+    parser = argparse.ArgumentParser(
+        prog="servico",
+        description="Serviço HTTP local que recebe XMLs de DI e devolve os custos em JSON ou o extrato em Excel.")
+    parser.add_argument("--host", default="127.0.0.1", help="Endereço de escuta (padrão: 127.0.0.1)")
+    parser.add_argument("--porta", type=int, default=8765, help="Porta TCP (padrão: 8765)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Processos de cálculo (padrão: número de núcleos)")
+    parser.add_argument("--max-simultaneas", type=int, default=None,
+                        help="Requisições processadas ao mesmo tempo (padrão: igual a --workers)")
+    parser.add_argument("--max-fila", type=int, default=64,
+                        help="Requisições aguardando vaga antes de responder 503 (padrão: 64)")
+    parser.add_argument("--max-upload-mb", type=int, default=200, help="Tamanho máximo do XML (padrão: 200 MB)")
+    parser.add_argument("--cache-mb", type=int, default=256,
+                        help="Cache de parse em memória de cada worker (padrão: 256 MB)")
+    parser.add_argument("--cache-dir", default=None, help="Pasta do cache de parse em disco, compartilhada pelos workers")
+    args = parser.parse_args(argv)
+
+    servico = ServicoDI(args.host, args.porta, max_workers=args.workers, max_simultaneos=args.max_simultaneas,
+                        max_fila=args.max_fila, max_bytes_upload=args.max_upload_mb * 2 ** 20,
+                        pasta_cache=args.cache_dir, max_bytes_cache=args.cache_mb * 2 ** 20)
+
+    async def executa():
+        tarefa = asyncio.current_task()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, tarefa.cancel)
+        except NotImplementedError:
+            pass  # Windows: só Ctrl+C
+        await servico.executa()
+
+    try:
+        asyncio.run(executa())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    return 0
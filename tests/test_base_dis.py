@@ -0,0 +1,124 @@
+"""
+Testes das bases SQLite locais (orientacoes/base_dis.py).
+
+Rodar da raiz do repositório: python -m pytest -q tests
+"""
+import copy
+import sys
+from pathlib import Path
+
+import pytest
+
+PASTA_ORIENTACOES = Path(__file__).resolve().parent.parent / "orientacoes"
+sys.path.insert(0, str(PASTA_ORIENTACOES))
+
+import nucleo_di  # noqa: E402
+from base_dis import BaseDIs, IndiceProdutos  # noqa: E402
+
+XML_EXEMPLO = PASTA_ORIENTACOES / "2300120746.xml"
+
+
+@pytest.fixture
+def dados():
+    return nucleo_di.custeia_di(nucleo_di.carrega_di_completo(XML_EXEMPLO))
+
+
+def _contagens(base):
+    return {tabela: base.conexao.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
+            for tabela in ("dis", "adicoes", "tributos", "custos", "itens")}
+
+
+def _versoes(base):
+    return [tuple(linha) for linha in base.conexao.execute(
+        "SELECT numero_di, sequencial_retificacao, vigente FROM dis ORDER BY sequencial_retificacao")]
+
+
+# === BaseDIs.grava: SUBSTITUIÇÃO DA VERSÃO E RETIFICAÇÃO VIGENTE === #
+
+def test_grava_de_novo_substitui_a_versao(dados):
+    itens = sum(len(ad["itens"]) for ad in dados["adicoes"])
+    with BaseDIs() as base:
+        base.grava(dados)
+        base.grava(dados)
+        # Adições, tributos, custos e itens da versão apagada saem junto (ON DELETE CASCADE)
+        assert _contagens(base) == {"dis": 1, "adicoes": 16, "tributos": 16, "custos": 16, "itens": itens}
+        assert _versoes(base) == [("2300120746", 0, 1)]
+
+
+def test_retificacao_fica_vigente_e_regravar_a_anterior_nao_a_substitui(dados):
+    retificacao = copy.deepcopy(dados)
+    retificacao["adicoes"].pop()
+    for ad in retificacao["adicoes"]:
+        ad["sequencial_retificacao"] = "01"
+    itens_retificacao = sum(len(ad["itens"]) for ad in retificacao["adicoes"])
+
+    with BaseDIs() as base:
+        base.grava(dados)
+        base.grava(retificacao)
+        assert _versoes(base) == [("2300120746", 0, 0), ("2300120746", 1, 1)]
+        # As consultas só enxergam a retificação vigente
+        assert [di["sequencial_retificacao"] for di in base.dis()] == [1]
+        assert len(base.itens()) == itens_retificacao
+        assert sum(grupo["adicoes"] for grupo in base.tributos_por("di")) == 15
+
+        # Reprocessar a versão 00 substitui só ela; a 01 continua vigente
+        base.grava(dados)
+        assert _versoes(base) == [("2300120746", 0, 0), ("2300120746", 1, 1)]
+        assert _contagens(base)["adicoes"] == 16 + 15
+        assert len(base.itens()) == itens_retificacao
+
+
+def test_retificacao_vigente_pela_ordem_numerica(dados):
+    versoes = {}
+    for sequencial in ("09", "10"):
+        versoes[sequencial] = copy.deepcopy(dados)
+        for ad in versoes[sequencial]["adicoes"]:
+            ad["sequencial_retificacao"] = sequencial
+    sem_adicoes = dict(dados, adicoes=[])
+
+    with BaseDIs() as base:
+        base.grava(versoes["10"])
+        base.grava(versoes["09"])
+        # Em texto, "09" > "10"; e uma DI sem adições (sequencial nulo) não passa à frente
+        base.grava(sem_adicoes)
+        assert _versoes(base) == [("2300120746", None, 0), ("2300120746", 9, 0), ("2300120746", 10, 1)]
+        base.grava(sem_adicoes)
+        assert _contagens(base)["dis"] == 3
+
+    with BaseDIs() as base:
+        base.grava(sem_adicoes)
+        assert _versoes(base) == [("2300120746", None, 1)]
+
+
+# === IndiceProdutos.aplica: Unid/Caixa APRENDIDA DAS DIs === #
+
+def _di(numero, *itens, fornecedor="FORNECEDOR"):
+    return {"cabecalho": {"DI": numero},
+            "adicoes": [{"partes": {"Exportador": fornecedor},
+                         "itens": [{"Código": codigo, "Unid/Caixa": unidades, "Descrição": f"{codigo} - PRODUTO"}
+                                   for codigo, unidades in itens]}]}
+
+
+def _unidades(dados):
+    return [item["Unid/Caixa"] for ad in dados["adicoes"] for item in ad["itens"]]
+
+
+def test_indice_preenche_unid_caixa_pela_mesma_di_e_pelas_anteriores(tmp_path):
+    caminho = tmp_path / "produtos.sqlite"
+    # A caixa de A vem depois do item de A sem ela; N/A (sem código) e B ficam como estão
+    primeira = _di("0001", ("A", "N/A"), ("A", 12), ("N/A", "N/A"), ("B", "N/A"))
+    with IndiceProdutos(caminho) as indice:
+        assert indice.aplica(primeira) == 1
+    assert _unidades(primeira) == [12, 12, "N/A", "N/A"]
+
+    # Reaberto, o índice preenche A de outra DI e aprende B
+    segunda = _di("0002", ("A", "N/A"), ("B", 6), ("C", "N/A"), fornecedor="OUTRO")
+    with IndiceProdutos(caminho) as indice:
+        assert indice.aplica(segunda) == 1
+        assert _unidades(segunda) == [12, 6, "N/A"]
+        assert indice.unidades("B") == 6
+        assert indice.unidades("C") == "N/A"
+        produtos = {linha[0]: linha[1:] for linha in indice.conexao.execute(
+            "SELECT codigo, unidades_caixa, fornecedor, numero_di FROM produtos")}
+    # Um item sem caixa não apaga a conhecida; fornecedor e DI são os da última ocorrência
+    assert produtos == {"A": (12, "OUTRO", "0002"), "B": (6, "OUTRO", "0002"), "C": (None, "OUTRO", "0002")}
@@ -0,0 +1,85 @@
+"""
+Testes da exportação colunar (orientacoes/exportacao_colunar.py).
+
+Rodar da raiz do repositório: python -m pytest -q tests
+"""
+import csv
+import sys
+from pathlib import Path
+
+import pytest
+
+PASTA_ORIENTACOES = Path(__file__).resolve().parent.parent / "orientacoes"
+sys.path.insert(0, str(PASTA_ORIENTACOES))
+
+from exportacao_colunar import ESQUEMA_COLUNAR, exporta_colunar, tabelas_colunares  # noqa: E402
+from nucleo_di import carrega_di_completo, custeia_di  # noqa: E402
+
+XML_EXEMPLO = PASTA_ORIENTACOES / "2300120746.xml"
+PARTICAO = "ano_mes=2023-01"
+
+
+def _di_custeada(ponto_fixo=False):
+    return custeia_di(carrega_di_completo(XML_EXEMPLO, ponto_fixo=ponto_fixo))
+
+
+def _linhas_esperadas(dados):
+    return {"dis": 1, "adicoes": len(dados["adicoes"]),
+            "itens": sum(len(ad["itens"]) for ad in dados["adicoes"])}
+
+
+def _arquivos(pasta):
+    return sorted(caminho.relative_to(pasta).as_posix() for caminho in pasta.rglob("*") if caminho.is_file())
+
+
+def test_exporta_csv_particionado_por_mes(tmp_path):
+    dados = _di_custeada()
+    caminhos = exporta_colunar(dados, tmp_path, formato="csv")
+    assert _arquivos(tmp_path) == [f"{tabela}/{PARTICAO}/2300120746.csv" for tabela in ("adicoes", "dis", "itens")]
+
+    for caminho, (tabela, linhas) in zip(caminhos, _linhas_esperadas(dados).items()):
+        with open(caminho, encoding="utf-8", newline="") as f:
+            cabecalho, *registros = list(csv.reader(f))
+        assert cabecalho == [coluna for coluna, _, _ in ESQUEMA_COLUNAR[tabela]]
+        assert len(registros) == linhas
+
+    # Reexportar a mesma DI substitui os arquivos, não acrescenta outros
+    exporta_colunar(dados, tmp_path, formato="csv")
+    assert len(_arquivos(tmp_path)) == 3
+
+
+def test_exporta_parquet_com_os_tipos_do_esquema(tmp_path):
+    pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    dados = _di_custeada()
+    caminhos = exporta_colunar(dados, tmp_path)
+    assert _arquivos(tmp_path) == [f"{tabela}/{PARTICAO}/2300120746.parquet"
+                                   for tabela in ("adicoes", "dis", "itens")]
+
+    tipos_arrow = {"string": "string", "float64": "double", "int64": "int64", "date": "date32[day]", "bool": "bool"}
+    for caminho, (tabela, linhas) in zip(caminhos, _linhas_esperadas(dados).items()):
+        lida = pq.read_table(caminho)
+        assert [(campo.name, str(campo.type)) for campo in lida.schema] == [
+            (coluna, tipos_arrow[tipo]) for coluna, tipo, _ in ESQUEMA_COLUNAR[tabela]]
+        assert lida.num_rows == linhas
+
+    exporta_colunar(dados, tmp_path)
+    assert len(_arquivos(tmp_path)) == 3
+
+
+def test_exporta_ponto_fixo_em_reais(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    decimal = tabelas_colunares(_di_custeada())
+    fixo = tabelas_colunares(_di_custeada(ponto_fixo=True))
+    # Os valores lidos do XML são os mesmos; os custos, calculados em centavos, fecham com os de float
+    for tabela, colunas in fixo.items():
+        for coluna, tipo, _ in ESQUEMA_COLUNAR[tabela]:
+            if tipo == "float64":
+                assert all(valor is None or type(valor) is float for valor in colunas[coluna])
+                assert colunas[coluna] == pytest.approx(decimal[tabela][coluna], abs=0.01), f"{tabela}.{coluna}"
+            else:
+                assert colunas[coluna] == decimal[tabela][coluna], f"{tabela}.{coluna}"
+    assert fixo["dis"]["fob_brl"] == decimal["dis"]["fob_brl"]
+
+    caminhos = exporta_colunar(_di_custeada(ponto_fixo=True), tmp_path)
+    assert pq.read_table(caminhos[0]).column("fob_brl").to_pylist() == decimal["dis"]["fob_brl"]
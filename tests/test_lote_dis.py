@@ -0,0 +1,169 @@
+"""
+Testes do processamento sem interface gráfica (orientacoes/lote_dis.py).
+
+Rodar da raiz do repositório: python -m pytest -q tests
+"""
+import copy
+import json
+import shutil
+import sqlite3
+import subprocess
+import sys
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pytest
+
+PASTA_ORIENTACOES = Path(__file__).resolve().parent.parent / "orientacoes"
+sys.path.insert(0, str(PASTA_ORIENTACOES))
+
+from extrato_excel import ProcessamentoCancelado  # noqa: E402
+from lote_dis import (  # noqa: E402
+    VigiaPastaDIs, contexto_sem_fork, lista_xmls_lote, main_lote, processa_lista_dis,
+)
+from nucleo_di import MedidorEtapas, carrega_dis_completo  # noqa: E402
+
+XML_EXEMPLO = PASTA_ORIENTACOES / "2300120746.xml"
+
+
+# === LOTE: LISTA DE XMLS, MANIFESTO E CÓDIGO DE SAÍDA === #
+
+def test_importacao_do_lote_sem_urllib_nem_email():
+    # nfe_entrada é importado pelo lote mesmo sem --nfe: o escape do XML não pode puxar o saxutils
+    codigo = ("import sys, lote_dis; print([m for m in ('xml.sax.saxutils', 'urllib.request', 'http.client', "
+              "'email.message') if m in sys.modules])")
+    saida = subprocess.run([sys.executable, "-c", codigo], cwd=PASTA_ORIENTACOES, capture_output=True, text=True,
+                           check=True)
+    assert saida.stdout.strip() == "[]"
+
+
+def test_lista_xmls_expande_pastas_e_padroes(tmp_path):
+    for nome in ("b.xml", "a.xml", "sub/c.xml", "notas.txt"):
+        (tmp_path / nome).parent.mkdir(exist_ok=True)
+        (tmp_path / nome).write_text("<x/>")
+    assert sorted(p.name for p in lista_xmls_lote([tmp_path])) == ["a.xml", "b.xml"]
+    assert sorted(p.name for p in lista_xmls_lote([tmp_path], recursivo=True)) == ["a.xml", "b.xml", "c.xml"]
+    assert [p.name for p in lista_xmls_lote([str(tmp_path / "a*.xml"), str(tmp_path / "a.xml")])] == ["a.xml"]
+    assert [p.name for p in lista_xmls_lote([str(tmp_path / "**" / "c.xml")], recursivo=True)] == ["c.xml"]
+    assert lista_xmls_lote([str(tmp_path / "nada*.xml")]) == []
+
+
+def test_lote_com_xml_invalido_sai_com_erro_e_registra_no_manifesto(tmp_path):
+    pytest.importorskip("pandas")
+    entrada, saida = tmp_path / "entrada", tmp_path / "saida"
+    entrada.mkdir()
+    shutil.copy(XML_EXEMPLO, entrada / "valido.xml")
+    (entrada / "quebrado.xml").write_text("<ListaDeclaracoes><declaracaoImportacao>", encoding="utf-8")
+
+    assert main_lote([str(entrada), "-o", str(saida), "-j", "2"]) == 1
+    manifesto = json.loads((saida / "manifesto_lote.json").read_text(encoding="utf-8"))
+    assert manifesto["resumo"]["Arquivos"] == 2
+    assert manifesto["resumo"]["Falhas"] == 1
+    entradas = {Path(e["Arquivo XML"]).name: e for e in manifesto["entradas"]}
+    assert entradas["quebrado.xml"]["Status"] == "ERRO"
+    assert entradas["quebrado.xml"]["Erro"]
+    assert "Tempo total (s)" in entradas["quebrado.xml"]
+    ok = entradas["valido.xml"]
+    assert ok["Status"] == "OK"
+    assert ok["DI"] == "2300120746"
+    assert isinstance(ok["% Diferença"], float)
+    for campo in ("Tempo parse (s)", "Tempo custos (s)", "Tempo Excel (s)", "Tempo total (s)"):
+        assert ok[campo] >= 0
+    assert Path(ok["Extrato"]) == saida / "ExtratoDI_CUSTOS_valido.xlsx"
+    assert Path(ok["Extrato"]).exists()
+    assert "Parse" in manifesto["desempenho"]
+
+
+# === MODO VIGIA: DUPLICADOS POR CONTEÚDO E POR DI/RETIFICAÇÃO === #
+
+def _vigia_uma_vez(entrada, saida):
+    vigia = VigiaPastaDIs(entrada, saida, estabilidade=0, notificacoes=False, max_workers=2)
+    return vigia.executa(uma_vez=True)
+
+
+def _registro(saida):
+    conexao = sqlite3.connect(str(saida / "ingestao.sqlite"))
+    try:
+        return {Path(caminho).name: (status, erro) for caminho, status, erro in conexao.execute(
+            "SELECT caminho, status, erro FROM arquivos ORDER BY id")}
+    finally:
+        conexao.close()
+
+
+def test_vigia_descarta_duplicados_por_conteudo_e_por_di(tmp_path):
+    pytest.importorskip("pandas")
+    entrada, saida = tmp_path / "entrada", tmp_path / "saida"
+    entrada.mkdir()
+    shutil.copy(XML_EXEMPLO, entrada / "original.xml")
+    assert _vigia_uma_vez(entrada, saida) == {"OK": 1, "ERRO": 0, "DUPLICADO": 0}
+    assert (saida / "2300120746" / "ret_00" / "ExtratoDI_CUSTOS_original.xlsx").exists()
+
+    # Reiniciado, o vigia não relê o original; a cópia e o outro arquivo da mesma DI são descartados
+    shutil.copy(XML_EXEMPLO, entrada / "copia.xml")
+    (entrada / "mesma_di.xml").write_bytes(XML_EXEMPLO.read_bytes() + b"\n")
+    assert _vigia_uma_vez(entrada, saida) == {"OK": 0, "ERRO": 0, "DUPLICADO": 2}
+    registro = _registro(saida)
+    assert registro["copia.xml"] == ("DUPLICADO", f"mesmo conteúdo: {(entrada / 'original.xml').resolve()}")
+    assert registro["mesma_di.xml"] == ("DUPLICADO", "mesma DI 2300120746 e retificação 00: "
+                                                     f"{(entrada / 'original.xml').resolve()}")
+    assert not (saida / "2300120746" / "ret_00" / "ExtratoDI_CUSTOS_copia.xlsx").exists()
+
+    # O próprio arquivo regravado com outro conteúdo é uma substituição, processada de novo
+    (entrada / "original.xml").write_bytes(XML_EXEMPLO.read_bytes() + b"\n\n")
+    assert _vigia_uma_vez(entrada, saida) == {"OK": 1, "ERRO": 0, "DUPLICADO": 0}
+
+
+# === LISTADECLARACOES COM VÁRIAS DIS: MESMAS OPÇÕES DE UMA DI SÓ === #
+
+def _xml_duas_dis(tmp_path):
+    """ListaDeclaracoes com duas DIs: a de exemplo e uma cópia com outro número"""
+    raiz = ET.parse(XML_EXEMPLO).getroot()
+    copia = copy.deepcopy(raiz.find("declaracaoImportacao"))
+    copia.find("numeroDI").text = "2300120799"
+    raiz.append(copia)
+    caminho = tmp_path / "duas_dis.xml"
+    ET.ElementTree(raiz).write(caminho, encoding="utf-8", xml_declaration=True)
+    return caminho
+
+
+@pytest.mark.parametrize("combinado", [True, False])
+def test_lista_de_dis_com_cenarios_e_desempenho(combinado, tmp_path):
+    pytest.importorskip("pandas")
+    openpyxl = pytest.importorskip("openpyxl")
+    lista_dados = carrega_dis_completo(_xml_duas_dis(tmp_path))
+    destino = tmp_path / ("combinado.xlsx" if combinado else "extratos")
+    with MedidorEtapas(memoria=True) as medidor:
+        resumo = processa_lista_dis(lista_dados, destino, combinado=combinado, max_workers=2,
+                                    comparar_cenarios=True, medidor=medidor, aba_perf=True,
+                                    mp_context=contexto_sem_fork())
+
+    assert [r["DI"] for r in resumo] == ["2300120746", "2300120799"]
+    etapas = [registro["Etapa"] for registro in medidor.etapas]
+    for prefixo in ("DI001", "DI002"):
+        assert f"Custos/{prefixo}/Validação cenários" in etapas
+        assert medidor.etapas[etapas.index(f"Custos/{prefixo}/Custos")]["Pico alocações (MB)"] is not None
+    if combinado:
+        assert etapas[:1] + etapas[-4:] == ["Custos", "Excel", "Excel/DI001", "Excel/DI002", "Excel/Gravação"]
+        abas = openpyxl.load_workbook(destino, read_only=True).sheetnames
+        assert {"00_Perf", "DI001_07_Cenarios", "DI002_07_Cenarios"} <= set(abas)
+    else:
+        for entrada in resumo:
+            abas = openpyxl.load_workbook(entrada["Arquivo"], read_only=True).sheetnames
+            assert {"00_Perf", "07_Cenarios"} <= set(abas)
+
+
+def test_lista_de_dis_cancelada_nao_inicia_as_dis_restantes(tmp_path):
+    pytest.importorskip("pandas")
+    lista_dados = carrega_dis_completo(XML_EXEMPLO) * 8
+    destino = tmp_path / "extratos"
+    avisos = []
+
+    def cancela(feitas, total):
+        avisos.append((feitas, total))
+        raise ProcessamentoCancelado()
+
+    with pytest.raises(ProcessamentoCancelado):
+        processa_lista_dis(lista_dados, destino, max_workers=1, progresso_custos=cancela)
+    assert avisos == [(1, 8)]
+    # Além da DI concluída, só a que o worker já tinha recebido (e uma na fila dele) chegam a gravar o extrato
+    assert len(list(destino.glob("*.xlsx"))) <= 3
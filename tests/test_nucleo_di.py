@@ -0,0 +1,586 @@
+"""
+Testes do núcleo do extrato de DI (orientacoes/nucleo_di.py).
+
+Rodar da raiz do repositório: python -m pytest -q tests
+"""
+import copy
+import io
+import json
+import sys
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pytest
+
+PASTA_ORIENTACOES = Path(__file__).resolve().parent.parent / "orientacoes"
+sys.path.insert(0, str(PASTA_ORIENTACOES))
+
+import benchmark_di  # noqa: E402
+import extrato_excel  # noqa: E402
+import nfe_entrada  # noqa: E402
+import nucleo_di  # noqa: E402
+
+
+def test_importacao_do_nucleo_sem_modulos_pesados():
+    assert benchmark_di.mede_importacao_nucleo(repeticoes=1)["modulos_pesados"] == []
+
+
+def test_importacao_do_nucleo_dentro_do_orcamento():
+    # Melhor de três: a primeira execução paga o cache de disco
+    assert benchmark_di.mede_importacao_nucleo(repeticoes=3)["tempo_ms"] < nucleo_di.ORCAMENTO_IMPORTACAO_MS
+
+
+# === CAMINHOS ALTERNATIVOS DE PARSE E CUSTEIO: MESMO RESULTADO DO CAMINHO PADRÃO === #
+
+XML_EXEMPLO = PASTA_ORIENTACOES / "2300120746.xml"
+PASTA_DADOS = Path(__file__).resolve().parent / "dados"
+# Parse da DI de exemplo pelo leitor original (findtext campo a campo), antes do esquema declarativo
+PARSE_ORIGINAL = PASTA_DADOS / "2300120746_parse_original.json"
+# Extrato da DI de exemplo gerado pelo código original, aba por aba (valores das células). Fica de
+# fora o croqui, cujo bloco de ICMS passou de propósito a vir da tabela por UF e regime
+EXTRATO_ORIGINAL = PASTA_DADOS / "ExtratoDI_CUSTOS_2300120746_original.json"
+ABA_CROQUI = "Croqui_NFe_Entrada"
+# Campos que o parse ganhou depois do leitor original e que o extrato não escreve
+CAMPOS_FORA_DO_EXTRATO = {"fiscal", "sequencial_retificacao"}
+
+
+def _simples(dados):
+    """Registros compactos (RegistroCompacto, ItensCompactos) como dicionários e listas comuns"""
+    if isinstance(dados, nucleo_di.Mapping):
+        return {campo: _simples(valor) for campo, valor in dados.items()}
+    if isinstance(dados, (list, nucleo_di.ItensCompactos)):
+        return [_simples(valor) for valor in dados]
+    return dados
+
+
+def _confere(esperado, obtido, caminho="dados"):
+    """
+    obtido tem os mesmos campos, na mesma ordem e com os mesmos valores de esperado; só pode
+    ter a mais os CAMPOS_FORA_DO_EXTRATO (um campo a mais numa seção vira uma linha a mais no extrato)
+    """
+    if isinstance(esperado, dict):
+        campos = [campo for campo in obtido if campo not in CAMPOS_FORA_DO_EXTRATO]
+        assert campos == list(esperado), f"{caminho}: campos {campos}, esperados {list(esperado)}"
+        for campo, valor in esperado.items():
+            _confere(valor, obtido[campo], f"{caminho}[{campo!r}]")
+    elif isinstance(esperado, list):
+        assert len(esperado) == len(obtido), f"{caminho}: {len(obtido)} elementos, esperados {len(esperado)}"
+        for i, (a, b) in enumerate(zip(esperado, obtido)):
+            _confere(a, b, f"{caminho}[{i}]")
+    else:
+        assert esperado == obtido, f"{caminho}: {obtido!r}, esperado {esperado!r}"
+
+
+def _tabelas(xlsx):
+    """Tabelas do Excel de cada aba: (intervalo, estilo, cabeçalhos)"""
+    openpyxl = pytest.importorskip("openpyxl")
+    livro = openpyxl.load_workbook(xlsx)
+    return {aba.title: sorted((tabela.ref, tabela.tableStyleInfo.name, tuple(c.name for c in tabela.tableColumns))
+                              for tabela in aba.tables.values())
+            for aba in livro.worksheets}
+
+
+def _celulas(xlsx):
+    """Valores das células de cada aba de um .xlsx, linha a linha"""
+    openpyxl = pytest.importorskip("openpyxl")
+    livro = openpyxl.load_workbook(xlsx, read_only=True)
+    try:
+        return {aba.title: [list(linha) for linha in aba.iter_rows(values_only=True)] for aba in livro.worksheets}
+    finally:
+        livro.close()
+
+
+@pytest.fixture(scope="module")
+def xml_duas_dis(tmp_path_factory):
+    """ListaDeclaracoes com duas DIs: a de exemplo e uma cópia com outro número"""
+    raiz = ET.parse(XML_EXEMPLO).getroot()
+    copia = copy.deepcopy(raiz.find("declaracaoImportacao"))
+    copia.find("numeroDI").text = "2300120799"
+    raiz.append(copia)
+    caminho = tmp_path_factory.mktemp("xml") / "duas_dis.xml"
+    ET.ElementTree(raiz).write(caminho, encoding="utf-8", xml_declaration=True)
+    return caminho
+
+
+def test_esquema_igual_ao_parse_original():
+    original = json.loads(PARSE_ORIGINAL.read_text(encoding="utf-8"))
+    _confere(original, nucleo_di.carrega_di_completo(XML_EXEMPLO))
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_extrato_padrao_igual_ao_original(streaming, tmp_path):
+    pytest.importorskip("pandas")
+    pytest.importorskip("xlsxwriter")
+    original = json.loads(EXTRATO_ORIGINAL.read_text(encoding="utf-8"))
+    xlsx = tmp_path / "extrato.xlsx"
+    extrato_excel.gera_excel_completo(nucleo_di.custeia_di(nucleo_di.carrega_di_completo(XML_EXEMPLO)), xlsx,
+                                      streaming=streaming)
+    abas = _celulas(xlsx)
+    assert [aba for aba in abas if aba != ABA_CROQUI] == list(original)
+    for aba, linhas in original.items():
+        assert abas[aba] == linhas, f"aba {aba} diferente do extrato original"
+
+
+@pytest.mark.parametrize("ponto_fixo", [False, True])
+def test_streaming_igual_ao_dom(ponto_fixo, xml_duas_dis):
+    assert (nucleo_di.carrega_di_completo(XML_EXEMPLO, streaming=True, ponto_fixo=ponto_fixo) ==
+            nucleo_di.carrega_di_completo(XML_EXEMPLO, ponto_fixo=ponto_fixo))
+    assert (nucleo_di.carrega_dis_completo(xml_duas_dis, streaming=True, ponto_fixo=ponto_fixo) ==
+            nucleo_di.carrega_dis_completo(xml_duas_dis, ponto_fixo=ponto_fixo))
+
+
+@pytest.mark.parametrize("frete_embutido, seguro_embutido", [(False, False), (True, False), (True, True)])
+def test_vetorizado_igual_ao_python(frete_embutido, seguro_embutido):
+    pytest.importorskip("numpy")
+    python = nucleo_di.carrega_di_completo(XML_EXEMPLO)
+    vetorizado = copy.deepcopy(python)
+    nucleo_di.calcular_custos_unitarios(python, frete_embutido, seguro_embutido)
+    nucleo_di.calcular_custos_unitarios(vetorizado, frete_embutido, seguro_embutido, vetorizado=True)
+    assert vetorizado == python
+
+
+@pytest.mark.parametrize("ponto_fixo", [False, True])
+def test_registros_compactos_iguais_aos_dicionarios(ponto_fixo):
+    dados = nucleo_di.carrega_di_completo(XML_EXEMPLO, ponto_fixo=ponto_fixo)
+    compacto = nucleo_di.compacta_di(copy.deepcopy(dados))
+    assert _simples(compacto) == dados
+
+    # Custeio sobre os registros compactos grava os mesmos valores
+    nucleo_di.custeia_di(dados, comparar_cenarios=True)
+    nucleo_di.custeia_di(compacto, comparar_cenarios=True)
+    assert _simples(compacto) == dados
+    assert _simples(nucleo_di.compacta_di(dados)) == dados
+
+
+@pytest.mark.parametrize("ponto_fixo", [False, True])
+def test_parse_paralelo_igual_ao_serial(ponto_fixo, xml_duas_dis):
+    for xml_path in (XML_EXEMPLO, xml_duas_dis):
+        serial = nucleo_di.carrega_dis_completo(xml_path, ponto_fixo=ponto_fixo)
+        assert nucleo_di.carrega_dis_paralelo(xml_path, ponto_fixo, processos=2, tamanho_minimo=0) == serial
+        em_memoria = io.BytesIO(Path(xml_path).read_bytes())
+        assert nucleo_di.carrega_dis_paralelo(em_memoria, ponto_fixo, processos=2, tamanho_minimo=0) == serial
+
+
+def test_parse_paralelo_de_di_grande_igual_ao_serial(tmp_path, monkeypatch):
+    xml_path = benchmark_di.gera_di_sintetica(tmp_path / "DI_grande.xml", itens_por_adicao=100, total_itens=25000)
+    assert xml_path.stat().st_size > nucleo_di.TAMANHO_MINIMO_PARALELO
+
+    # Confirma que o limite padrão levou ao caminho paralelo (e não à leitura em série)
+    resultados = []
+    parse_paralelo = nucleo_di._parse_paralelo
+    monkeypatch.setattr(nucleo_di, "_parse_paralelo",
+                        lambda *args: resultados.append(parse_paralelo(*args)) or resultados[-1])
+
+    paralelo = nucleo_di.carrega_di_completo(xml_path, processos=2)
+    assert resultados and resultados[0] is not None
+    assert paralelo == nucleo_di.carrega_di_completo(xml_path)
+
+
+# === ICMS NA IMPORTAÇÃO: REGIMES DA TABELA PADRÃO === #
+
+@pytest.mark.parametrize("uf, regime, carga", [("SC", "normal", 17.0), ("SC", "TTD409", 3.0),
+                                               ("SC", "TTD409_APOS_36M", 1.4), ("SC", "TTD410", 0.0),
+                                               ("GO", "COMEXPRODUZIR", 0.0)])
+def test_icms_do_custeio_pelo_regime(uf, regime, carga):
+    dados = nucleo_di.custeia_di(nucleo_di.carrega_di_completo(XML_EXEMPLO), uf=uf, regime=regime)
+    icms = dados["icms"]
+    assert icms["Conciliação"] == "OK"
+    assert icms["ICMS a Recolher R$"] == pytest.approx(icms["Base ICMS R$"] * carga / 100, abs=0.01)
+
+
+def test_icms_regime_fora_da_tabela():
+    assert nucleo_di.tabela_icms().regimes("GO") == {"normal", "COMEXPRODUZIR"}
+    with pytest.raises(ValueError, match="Sem regra de ICMS"):
+        nucleo_di.custeia_di(nucleo_di.carrega_di_completo(XML_EXEMPLO), uf="GO", regime="TTD410")
+
+
+# === NF-E DE ENTRADA (nfe_entrada) === #
+
+def test_nfe_de_di_sem_itens_nao_gera_nota(tmp_path):
+    dados = nucleo_di.carrega_di_completo(XML_EXEMPLO)
+    for adicao in dados["adicoes"]:
+        adicao["itens"] = []
+    assert nfe_entrada.gera_nfe_entrada(nucleo_di.custeia_di(dados), tmp_path) == []
+    assert not list(tmp_path.iterdir())
+
+
+def test_nfe_emitente_padrao_incompleto():
+    config = nfe_entrada.carrega_config_nfe()
+    assert nfe_entrada.campos_emitente_faltando(config) == list(nfe_entrada.CAMPOS_EMITENTE_OBRIGATORIOS)
+    config["emitente"].update(IE="123456789", xLgr="Rua A", nro="10", xBairro="Centro", cMun="5201108",
+                              xMun="Anapolis")
+    assert nfe_entrada.campos_emitente_faltando(config) == []
+
+
+def test_nfe_escape_igual_ao_do_saxutils():
+    from xml.sax.saxutils import escape, quoteattr
+    for texto in ("A & B <C> \"D\"", "linha\nnova\tcom 'aspas'", "Ação 100%"):
+        assert nfe_entrada._escape(texto) == escape(texto)
+        assert ET.fromstring(f"<a x={nfe_entrada._quoteattr(texto)}/>").get("x") == texto
+
+
+def test_nfe_usa_a_regra_de_icms_do_custeio(tmp_path):
+    # Tabela própria (redução e diferimento) só no custeio: a NF-e lê a regra gravada nos itens
+    tabela = nucleo_di.TabelaICMS([("SC", "", "normal", 12.0, 20.0, 50.0, "Teste")])
+    dados = nucleo_di.custeia_di(nucleo_di.carrega_di_completo(XML_EXEMPLO), tabela=tabela, uf="SC")
+    notas = nfe_entrada.gera_nfe_entrada(dados, tmp_path)
+    icms = [elemento for nota in notas for elemento in ET.parse(nota).iter() if elemento.tag.endswith("ICMS51")]
+    assert len(icms) == sum(len(ad["itens"]) for ad in dados["adicoes"])
+    for elemento in icms:
+        assert [(filho.tag.rsplit("}", 1)[-1], filho.text) for filho in elemento
+                if filho.tag.endswith(("pRedBC", "pICMS", "pDif"))] == [
+            ("pRedBC", "20.0000"), ("pICMS", "12.0000"), ("pDif", "50.0000")]
+
+    # tabela, uf ou regime informados: o ICMS é recalculado numa cópia, sem alterar a DI
+    antes = copy.deepcopy(dados)
+    nfe_entrada.gera_nfe_entrada(dados, tmp_path / "padrao", uf="SC")
+    assert dados == antes
+
+
+# === IDENTIFICAÇÃO RÁPIDA DA DI (detecta_cabecalho_di) === #
+
+def _lista_com_copia(destino, altera_primeira=None):
+    """ListaDeclaracoes com a DI de exemplo (alterada por altera_primeira) e uma cópia com outro número e CIF"""
+    raiz = ET.parse(XML_EXEMPLO).getroot()
+    primeira = raiz.find("declaracaoImportacao")
+    copia = copy.deepcopy(primeira)
+    copia.find("numeroDI").text = "2300120799"
+    for adicao in copia.iterfind("adicao"):
+        adicao.find("numeroDI").text = "2300120799"
+        adicao.find("condicaoVendaIncoterm").text = "CIF"
+    if altera_primeira:
+        altera_primeira(primeira)
+    raiz.append(copia)
+    ET.ElementTree(raiz).write(destino, encoding="utf-8", xml_declaration=True)
+    return destino
+
+
+def test_cabecalho_da_di_de_exemplo():
+    assert nucleo_di.detecta_cabecalho_di(XML_EXEMPLO) == {
+        "DI": "2300120746", "INCOTERM": "CFR", "Sequencial retificação": "00", "Qtd. adições": 16}
+
+
+@pytest.mark.parametrize("tamanho_bloco", [64, 64 * 1024])
+def test_cabecalho_de_varias_dis_vem_da_primeira(tamanho_bloco, tmp_path):
+    xml_path = _lista_com_copia(tmp_path / "duas.xml")
+    assert nucleo_di.detecta_cabecalho_di(xml_path, tamanho_bloco) == {
+        "DI": "2300120746", "INCOTERM": "CFR", "Sequencial retificação": "00", "Qtd. adições": 16}
+
+
+@pytest.mark.parametrize("tamanho_bloco", [64, 64 * 1024])
+def test_cabecalho_de_di_sem_adicoes_nao_le_a_seguinte(tamanho_bloco, tmp_path):
+    def sem_adicoes(di):
+        for adicao in di.findall("adicao"):
+            di.remove(adicao)
+        di.find("totalAdicoes").text = "000"
+
+    xml_path = _lista_com_copia(tmp_path / "sem_adicoes.xml", sem_adicoes)
+    assert nucleo_di.detecta_cabecalho_di(xml_path, tamanho_bloco) == {
+        "DI": "2300120746", "INCOTERM": None, "Sequencial retificação": "00", "Qtd. adições": 0}
+
+
+# === EXTRATO EM STREAMING (constant_memory) IGUAL AO DE DATAFRAMES === #
+
+@pytest.mark.parametrize("ponto_fixo, comparar_cenarios, limite_abas_adicoes", [
+    (False, False, 50), (False, True, 50), (True, True, 50), (False, False, 5)])
+def test_extrato_streaming_igual_ao_de_dataframes(ponto_fixo, comparar_cenarios, limite_abas_adicoes, tmp_path):
+    pytest.importorskip("pandas")
+    pytest.importorskip("xlsxwriter")
+    dados = nucleo_di.custeia_di(nucleo_di.carrega_di_completo(XML_EXEMPLO, ponto_fixo=ponto_fixo),
+                                 comparar_cenarios=comparar_cenarios)
+    extratos = {}
+    for streaming in (False, True):
+        extratos[streaming] = tmp_path / f"extrato_{streaming}.xlsx"
+        extrato_excel.gera_excel_completo(dados, extratos[streaming], streaming=streaming,
+                                          limite_abas_adicoes=limite_abas_adicoes)
+    assert _celulas(extratos[True]) == _celulas(extratos[False])
+    assert _tabelas(extratos[True]) == _tabelas(extratos[False])
+
+
+def test_extrato_combinado_streaming_igual_ao_de_dataframes(xml_duas_dis, tmp_path):
+    pytest.importorskip("pandas")
+    pytest.importorskip("xlsxwriter")
+    lista_dados = [nucleo_di.custeia_di(dados) for dados in nucleo_di.carrega_dis_completo(xml_duas_dis)]
+    extratos = {}
+    for streaming in (False, True):
+        extratos[streaming] = tmp_path / f"combinado_{streaming}.xlsx"
+        extrato_excel.gera_excel_combinado(lista_dados, extratos[streaming], streaming=streaming)
+    assert _celulas(extratos[True]) == _celulas(extratos[False])
+    assert _tabelas(extratos[True]) == _tabelas(extratos[False])
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_extrato_sem_custeia_di_calcula_o_icms(streaming, tmp_path):
+    pytest.importorskip("pandas")
+    pytest.importorskip("xlsxwriter")
+    # Caminho original: calcular_custos_unitarios, validar_custos e gera_excel_completo, sem custeia_di
+    dados = nucleo_di.carrega_di_completo(XML_EXEMPLO)
+    nucleo_di.calcular_custos_unitarios(dados)
+    dados["validacao_custos"] = nucleo_di.validar_custos(dados)
+    sem_custeio = tmp_path / "sem_custeio.xlsx"
+    extrato_excel.gera_excel_completo(dados, sem_custeio, streaming=streaming)
+    combinado = tmp_path / "combinado.xlsx"
+    extrato_excel.gera_excel_combinado([dados], combinado, streaming=streaming)
+    # O ICMS do croqui é calculado numa cópia: a DI de quem chamou não muda
+    assert "icms" not in dados
+    assert not any("CST ICMS" in item for ad in dados["adicoes"] for item in ad["itens"])
+
+    custeio = tmp_path / "custeio.xlsx"
+    extrato_excel.gera_excel_completo(nucleo_di.custeia_di(nucleo_di.carrega_di_completo(XML_EXEMPLO)), custeio,
+                                      streaming=streaming)
+    assert _celulas(sem_custeio) == _celulas(custeio)
+    assert _celulas(combinado)[f"DI001_{ABA_CROQUI}"] == _celulas(custeio)[ABA_CROQUI]
+
+
+# === LAYOUT CONSOLIDADO: 08_Adicoes E 08A_Itens NO LUGAR DAS ABAS Add_NNN === #
+
+def _links(xlsx, aba):
+    """Hyperlinks da coluna A da aba: {linha: (texto, destino)}"""
+    openpyxl = pytest.importorskip("openpyxl")
+    ws = openpyxl.load_workbook(xlsx)[aba]
+    return {celula.row: (celula.value, celula.hyperlink.location)
+            for celula in ws["A"] if celula.hyperlink is not None}
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_extrato_consolidado_acima_do_limite(streaming, tmp_path):
+    pytest.importorskip("pandas")
+    pytest.importorskip("xlsxwriter")
+    dados = nucleo_di.custeia_di(nucleo_di.carrega_di_completo(XML_EXEMPLO))
+    itens = [item for ad in dados["adicoes"] for item in ad["itens"]]
+    xlsx = tmp_path / "extrato.xlsx"
+    extrato_excel.gera_excel_completo(dados, xlsx, streaming=streaming, limite_abas_adicoes=10)
+
+    celulas = _celulas(xlsx)
+    assert not [aba for aba in celulas if aba.startswith("Add_")]
+    numeros = [ad["numero"] for ad in dados["adicoes"]]
+    assert [linha[0] for linha in celulas["08_Adicoes"][1:]] == numeros
+    # Um item por linha, na ordem das adições, e a linha de totais depois de uma linha em branco
+    linhas_itens = celulas["08A_Itens"][1:]
+    assert [linha[0] for linha in linhas_itens[:len(itens)]] == [
+        ad["numero"] for ad in dados["adicoes"] for _ in ad["itens"]]
+    assert linhas_itens[len(itens) + 1][3:5] == ["TOTAL:", sum(item["Qtd"] for item in itens)]
+
+    # Resumo -> linha da adição na 08_Adicoes -> primeiro item da adição na 08A_Itens
+    assert _links(xlsx, "06_Resumo_Adicoes") == {
+        linha: (numero, f"'08_Adicoes'!A{linha}") for linha, numero in enumerate(numeros, 2)}
+    links_itens = _links(xlsx, "08_Adicoes")
+    assert [texto for texto, _ in links_itens.values()] == [ad["numero"] for ad in dados["adicoes"] if ad["itens"]]
+    for linha, (numero, destino) in links_itens.items():
+        assert celulas["08_Adicoes"][linha - 1][0] == numero
+        assert celulas["08A_Itens"][int(destino.rpartition("!A")[2]) - 1][0] == numero
+        assert celulas["08A_Itens"][int(destino.rpartition("!A")[2]) - 2][0] != numero
+
+
+@pytest.mark.parametrize("limite_abas_adicoes", [16, None])
+def test_extrato_ate_o_limite_mantem_abas_por_adicao(limite_abas_adicoes, tmp_path):
+    pytest.importorskip("pandas")
+    pytest.importorskip("xlsxwriter")
+    dados = nucleo_di.custeia_di(nucleo_di.carrega_di_completo(XML_EXEMPLO))
+    xlsx = tmp_path / "extrato.xlsx"
+    extrato_excel.gera_excel_completo(dados, xlsx, limite_abas_adicoes=limite_abas_adicoes)
+    abas = _celulas(xlsx)
+    assert [aba for aba in abas if aba.startswith("Add_")] == [f"Add_{ad['numero']}" for ad in dados["adicoes"]]
+    assert "08_Adicoes" not in abas and "08A_Itens" not in abas
+    assert _links(xlsx, "06_Resumo_Adicoes") == {}
+
+
+# === RETIFICAÇÕES: RECÁLCULO INCREMENTAL IGUAL AO COMPLETO (custeia_retificacao) === #
+
+def _retificacao(destino, altera):
+    """DI de exemplo como retificação 01, alterada por altera(declaracaoImportacao)"""
+    raiz = ET.parse(XML_EXEMPLO).getroot()
+    di = raiz.find("declaracaoImportacao")
+    for sequencial in di.iter("sequencialRetificacao"):
+        sequencial.text = "01"
+    altera(di)
+    ET.ElementTree(raiz).write(destino, encoding="utf-8", xml_declaration=True)
+    return destino
+
+
+def _custeia_retificacao(tmp_path, altera):
+    """Custeia a retificação pela versão 00 registrada e, à parte, do zero"""
+    historico = nucleo_di.HistoricoDIs(tmp_path / "historico")
+    historico.grava(nucleo_di.custeia_di(nucleo_di.carrega_di_completo(XML_EXEMPLO)))
+    xml_path = _retificacao(tmp_path / "retificacao.xml", altera)
+
+    incremental = nucleo_di.carrega_di_completo(xml_path)
+    relatorio = nucleo_di.custeia_retificacao(incremental, historico.anterior("2300120746", "01"))
+    completo = nucleo_di.custeia_di(nucleo_di.carrega_di_completo(xml_path))
+    assert incremental.pop("alteracoes") is relatorio
+    return relatorio, incremental, completo
+
+
+def test_retificacao_incremental_igual_ao_recalculo_completo(tmp_path):
+    def dobra_quantidade(di):
+        quantidade = di.find("adicao/mercadoria/quantidade")
+        quantidade.text = str(int(quantidade.text) * 2).zfill(len(quantidade.text))
+
+    relatorio, incremental, completo = _custeia_retificacao(tmp_path, dobra_quantidade)
+    assert relatorio["Recálculo"] == "Incremental"
+    assert relatorio["Adições alteradas"] == ["001"]
+    assert relatorio["Adições recalculadas"] == 1
+    # Custos de todas as adições, validação e ICMS idênticos aos do recálculo completo
+    assert incremental == completo
+
+
+def test_retificacao_com_rateio_alterado_recalcula_a_di_inteira(tmp_path):
+    def aumenta_frete(di):
+        frete = di.find("freteTotalReais")
+        frete.text = str(int(frete.text) + 100000).zfill(len(frete.text))
+
+    relatorio, incremental, completo = _custeia_retificacao(tmp_path, aumenta_frete)
+    assert relatorio["Rateio alterado"]
+    assert relatorio["Recálculo"] == "Completo"
+    assert relatorio["Motivo"] == "Totais da DI usados no rateio foram alterados"
+    assert relatorio["Adições recalculadas"] == len(completo["adicoes"])
+    assert incremental == completo
+
+
+# === CACHE DE PARSE: CHAVE POR PONTO FIXO E POR EXTRATOR (CacheParseDI) === #
+
+def test_cache_de_parse_separa_ponto_fixo_e_extrator(tmp_path):
+    cache = nucleo_di.CacheParseDI(pasta_disco=tmp_path)
+    padrao = nucleo_di.carrega_dis_completo(XML_EXEMPLO)
+    assert cache.carrega(XML_EXEMPLO) == padrao
+    assert cache.carrega(XML_EXEMPLO, ponto_fixo=True) == nucleo_di.carrega_dis_completo(XML_EXEMPLO, ponto_fixo=True)
+    assert len(list(tmp_path.glob("*.pickle"))) == 2
+
+    nucleo_di.configura_extrator(nucleo_di.ExtratorDescricao({"codigo": r"^(.{3})"}))
+    try:
+        extraido = nucleo_di.carrega_dis_completo(XML_EXEMPLO)
+        assert extraido != padrao
+        cache.limpa()
+        assert cache.carrega(XML_EXEMPLO) == extraido
+    finally:
+        nucleo_di.configura_extrator()
+    assert len(list(tmp_path.glob("*.pickle"))) == 3
+
+    # De volta aos padrões, a entrada gravada antes (lida do disco) continua valendo
+    cache.limpa()
+    assert cache.carrega(XML_EXEMPLO) == padrao
+    assert len(list(tmp_path.glob("*.pickle"))) == 3
+
+
+def test_cache_de_parse_ignora_falha_ao_gravar_no_disco(tmp_path, monkeypatch):
+    def disco_cheio(*args):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(nucleo_di.os, "replace", disco_cheio)
+    cache = nucleo_di.CacheParseDI(pasta_disco=tmp_path)
+    assert cache.carrega(XML_EXEMPLO) == nucleo_di.carrega_dis_completo(XML_EXEMPLO)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_cache_de_parse_le_o_arquivo_em_blocos(monkeypatch):
+    cache = nucleo_di.CacheParseDI()
+    # Nem o hash nem o parse de um XML fora do cache carregam o arquivo inteiro
+    monkeypatch.setattr(Path, "read_bytes", lambda self: pytest.fail("XML lido inteiro"))
+    assert cache.carrega(XML_EXEMPLO, streaming=True) == nucleo_di.carrega_dis_completo(XML_EXEMPLO)
+    monkeypatch.undo()
+    # Mesma chave do conteúdo em memória: a segunda consulta vem do cache
+    assert list(cache._memoria) == [cache.chave(XML_EXEMPLO.read_bytes())]
+    assert cache.carrega_conteudo(XML_EXEMPLO.read_bytes()) == nucleo_di.carrega_dis_completo(XML_EXEMPLO)
+    assert len(cache._memoria) == 1
+
+
+# === DESEMPENHO: PERCENTIS, JSON E ABA 00_Perf === #
+
+def test_agrega_desempenho_percentis():
+    listas_etapas = [[{"Etapa": "Parse", "Tempo (s)": float(t), "CPU (s)": t / 2, "Pico alocações (MB)": None},
+                      {"Etapa": "Custos", "Tempo (s)": 1.0, "CPU (s)": 1.0, "Pico alocações (MB)": float(t)}]
+                     for t in range(1, 11)]
+    agregado = nucleo_di.agrega_desempenho(listas_etapas)
+    assert agregado["Parse"] == {
+        "DIs": 10,
+        "Tempo (s)": {"p50": 5.5, "p90": 9.1, "p99": 9.91, "máx": 10.0},
+        "CPU (s)": {"p50": 2.75, "p90": 4.55, "p99": 4.955, "máx": 5.0},
+    }
+    assert agregado["Custos"]["Pico alocações (MB)"] == {"p50": 5.5, "p90": 9.1, "p99": 9.91, "máx": 10.0}
+    assert nucleo_di.agrega_desempenho([[{"Etapa": "Excel", "Tempo (s)": 2.0}]])["Excel"]["Tempo (s)"] == {
+        "p50": 2.0, "p90": 2.0, "p99": 2.0, "máx": 2.0}
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_aba_perf_e_json_de_desempenho(streaming, tmp_path):
+    pytest.importorskip("pandas")
+    pytest.importorskip("xlsxwriter")
+    xlsx = tmp_path / "extrato.xlsx"
+    with nucleo_di.MedidorEtapas(memoria=True) as medidor:
+        with medidor.etapa("Parse"):
+            dados = nucleo_di.carrega_di_completo(XML_EXEMPLO)
+        nucleo_di.custeia_di(dados, medidor=medidor)
+        extrato_excel.gera_excel_completo(dados, xlsx, streaming=streaming, medidor=medidor, aba_perf=True)
+
+    perf = _celulas(xlsx)["00_Perf"]
+    assert perf[0] == ["Etapa", "Tempo (s)", "CPU (s)", "Pico alocações (MB)", "Adições", "Itens"]
+    etapas = [linha[0] for linha in perf[1:]]
+    assert etapas[:4] == ["Parse", "Custos", "Validação", "ICMS"]
+    assert "Excel" not in etapas and "Excel/Gravação" not in etapas
+    assert {"Excel/Resumos", "Excel/Adições", "Excel/Croqui"} <= set(etapas)
+    assert all(linha[1] >= 0 and linha[3] is not None for linha in perf[1:])
+    assert perf[etapas.index("Custos") + 1][4:] == [len(dados["adicoes"]),
+                                                    sum(len(ad["itens"]) for ad in dados["adicoes"])]
+
+    json_perf = nucleo_di.caminho_json_desempenho(xlsx)
+    assert json_perf == tmp_path / "extrato.perf.json"
+    medidor.grava_json(json_perf, DI=dados["cabecalho"]["DI"])
+    gravado = json.loads(json_perf.read_text(encoding="utf-8"))
+    assert gravado["DI"] == "2300120746"
+    assert [e["Etapa"] for e in gravado["Etapas"]] == [e["Etapa"] for e in medidor.etapas]
+    assert {"Excel", "Excel/Gravação"} <= {e["Etapa"] for e in gravado["Etapas"]}
+
+
+# === CENÁRIOS NUMA PASSAGEM IGUAIS A UM CUSTEIO POR CONFIGURAÇÃO === #
+
+def _custos_itens(dados):
+    return [(item["Custo Total Item R$"], item["Custo Unitário R$"], item["Custo por Peça R$"])
+            for ad in dados["adicoes"] for item in ad["itens"]]
+
+
+@pytest.mark.parametrize("ponto_fixo", [False, True])
+@pytest.mark.parametrize("frete_embutido, seguro_embutido", [(False, False), (True, False), (True, True)])
+def test_cenarios_iguais_a_custeios_separados(ponto_fixo, frete_embutido, seguro_embutido):
+    original = nucleo_di.carrega_di_completo(XML_EXEMPLO, ponto_fixo=ponto_fixo)
+    dados = nucleo_di.custeia_di(copy.deepcopy(original), frete_embutido, seguro_embutido, comparar_cenarios=True)
+    cenarios = nucleo_di.cenarios_com_principal(frete_embutido, seguro_embutido)
+    assert [c["Cenário"] for c in dados["cenarios_custos"]["cenarios"]] == [c["nome"] for c in cenarios]
+    assert sorted(c["nome"] for c in cenarios) == sorted(c["nome"] for c in nucleo_di.CENARIOS_PADRAO)
+
+    for i, cenario in enumerate(cenarios):
+        separado = nucleo_di.custeia_di(copy.deepcopy(original), cenario["frete_embutido"],
+                                        cenario["seguro_embutido"])
+        assert [custos[i] for custos in dados["cenarios_custos"]["itens"]] == _custos_itens(separado), cenario["nome"]
+        validacao = dict(dados["validacao_cenarios"][i])
+        assert validacao.pop("Cenário") == cenario["nome"]
+        esperada = dict(separado["validacao_custos"])
+        esperada.pop("Configuração")
+        assert validacao == esperada, cenario["nome"]
+        if i == 0:
+            # O principal ocupa os campos do custeio de uma configuração só
+            assert dados["configuracao_custos"] == separado["configuracao_custos"]
+            assert dados["validacao_custos"] == separado["validacao_custos"]
+            assert _custos_itens(dados) == _custos_itens(separado)
+
+
+# === PONTO FIXO: VALIDAÇÃO FECHA EM ZERO E ITENS SOMAM A ADIÇÃO === #
+
+# A DI de exemplo é CFR: com frete separado, o frete entra duas vezes e a divergência é real,
+# em ponto fixo e em float; a conciliação exata vale para as configurações com algo embutido
+@pytest.mark.parametrize("frete_embutido, seguro_embutido", [(True, False), (False, True), (True, True)])
+def test_ponto_fixo_concilia_exatamente(frete_embutido, seguro_embutido):
+    dados = nucleo_di.custeia_di(nucleo_di.carrega_di_completo(XML_EXEMPLO, ponto_fixo=True),
+                                 frete_embutido, seguro_embutido)
+    assert dados["validacao_custos"]["Diferença"] == 0
+    assert dados["validacao_custos"]["Status"] == "OK"
+
+
+@pytest.mark.parametrize("frete_embutido, seguro_embutido",
+                         [(False, False), (True, False), (False, True), (True, True)])
+def test_ponto_fixo_itens_somam_a_adicao(frete_embutido, seguro_embutido):
+    dados = nucleo_di.custeia_di(nucleo_di.carrega_di_completo(XML_EXEMPLO, ponto_fixo=True),
+                                 frete_embutido, seguro_embutido)
+    for ad in dados["adicoes"]:
+        total_adicao = ad["custos"]["Custo Total Adição R$"]
+        assert type(total_adicao) is int
+        assert sum(item["Custo Total Item R$"] for item in ad["itens"]) == total_adicao, ad["numero"]
@@ -0,0 +1,150 @@
+"""
+Testes do serviço HTTP local (orientacoes/servico_di.py).
+
+Rodar da raiz do repositório: python -m pytest -q tests
+"""
+import asyncio
+import json
+import socket
+import sys
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pytest
+
+PASTA_ORIENTACOES = Path(__file__).resolve().parent.parent / "orientacoes"
+sys.path.insert(0, str(PASTA_ORIENTACOES))
+
+from benchmark_di import gera_di_sintetica  # noqa: E402
+from servico_di import ServicoDI  # noqa: E402
+
+XML_EXEMPLO = PASTA_ORIENTACOES / "2300120746.xml"
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _requisicao(porta, cabecalho, corpo=b""):
+    """Envia a requisição bruta (com Connection: close) e devolve (status, corpo da resposta)"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", porta)
+    writer.write(cabecalho.encode("latin-1") + b"Connection: close\r\n\r\n" + corpo)
+    await writer.drain()
+    # Sem o fim da conexão (ex.: socket herdado por um worker), falha em vez de travar o teste
+    resposta = await asyncio.wait_for(reader.read(), 60)
+    writer.close()
+    cabecalhos, _, corpo = resposta.partition(b"\r\n\r\n")
+    return int(cabecalhos.split(b" ", 2)[1]), corpo
+
+
+def _post(rota, corpo):
+    return f"POST {rota} HTTP/1.1\r\nContent-Length: {len(corpo)}\r\n", corpo
+
+
+def _com_servico(cenario, **parametros):
+    """Executa cenario(porta) com o serviço atendendo em uma porta livre"""
+    async def executa():
+        servico = ServicoDI(porta=_porta_livre(), **parametros)
+        tarefa = asyncio.create_task(servico.executa())
+        for _ in range(200):
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", servico.porta)
+                writer.close()
+                break
+            except OSError:
+                await asyncio.sleep(0.05)
+        try:
+            return await cenario(servico.porta)
+        finally:
+            tarefa.cancel()
+            await asyncio.gather(tarefa, return_exceptions=True)
+    return asyncio.run(executa())
+
+
+# === RESPOSTAS DE ERRO: 400, 408, 411, 413 E 503 === #
+
+def test_servico_rejeita_requisicoes_invalidas():
+    async def cenario(porta):
+        return [
+            await _requisicao(porta, *_post("/custos", b"")),
+            await _requisicao(porta, *_post("/custos", b"<ListaDeclaracoes><declaracao")),
+            await _requisicao(porta, "GARBAGE\r\n"),
+            await _requisicao(porta, "POST /custos HTTP/1.1\r\n", b"<ListaDeclaracoes/>"),
+            await _requisicao(porta, "POST /custos HTTP/1.1\r\nTransfer-Encoding: chunked\r\n"),
+            await _requisicao(porta, "POST /custos HTTP/1.1\r\nContent-Length: 2000000\r\n"),
+        ]
+
+    respostas = _com_servico(cenario, max_workers=1, max_bytes_upload=2 ** 20)
+    assert [status for status, _ in respostas] == [400, 400, 400, 411, 411, 413]
+    assert json.loads(respostas[0][1]) == {"erro": "Corpo vazio: envie o XML da DI"}
+    assert json.loads(respostas[1][1])["erro"].startswith("XML inválido")
+    assert json.loads(respostas[5][1]) == {"erro": "XML maior que 1 MB"}
+
+
+def test_servico_responde_408_se_o_corpo_nao_chega():
+    async def cenario(porta):
+        # Content-Length maior que o enviado: a leitura do corpo esgota o tempo limite
+        return await _requisicao(porta, "POST /custos HTTP/1.1\r\nContent-Length: 100\r\n", b"<Lista")
+
+    status, corpo = _com_servico(cenario, max_workers=1, tempo_limite=0.2)
+    assert status == 408
+    assert json.loads(corpo) == {"erro": "Tempo esgotado ao receber o XML"}
+
+
+class _PoolQuebrado(Executor):
+    """Pool cujos futuros o teste conclui com BrokenProcessPool"""
+
+    def __init__(self):
+        self.futuros = []
+        self.encerrado = False
+
+    def submit(self, funcao, *args, **kwargs):
+        self.futuros.append(Future())
+        return self.futuros[-1]
+
+    def shutdown(self, wait=True, **kwargs):
+        self.encerrado = True
+
+
+def test_servico_recria_o_pool_quebrado_uma_vez():
+    async def cenario():
+        servico = ServicoDI(max_workers=1, max_simultaneos=2)
+        servico._vagas = asyncio.Semaphore(2)
+        quebrado = servico.pool = _PoolQuebrado()
+        novos = []
+        servico._cria_pool = lambda: novos.append(_PoolQuebrado()) or novos[-1]
+        tarefas = [asyncio.create_task(servico._executa_no_pool(len, b"")) for _ in range(2)]
+        while len(quebrado.futuros) < 2:
+            await asyncio.sleep(0)
+        for futuro in quebrado.futuros:
+            futuro.set_exception(BrokenProcessPool("worker interrompido"))
+        erros = await asyncio.gather(*tarefas, return_exceptions=True)
+        return servico, quebrado, novos, erros
+
+    servico, quebrado, novos, erros = asyncio.run(cenario())
+    # As duas requisições do pool quebrado recebem 500, mas só um pool novo é criado
+    assert [erro.status for erro in erros] == [500, 500]
+    assert quebrado.encerrado
+    assert len(novos) == 1 and servico.pool is novos[0] and not novos[0].encerrado
+
+
+def test_servico_ocupado_responde_503(tmp_path):
+    pytest.importorskip("pandas")
+    xml_grande = gera_di_sintetica(tmp_path / "DI_grande.xml", itens_por_adicao=100, total_itens=20000)
+
+    async def cenario(porta):
+        lenta = asyncio.create_task(_requisicao(porta, *_post("/extrato", xml_grande.read_bytes())))
+        while json.loads((await _requisicao(porta, "GET /saude HTTP/1.1\r\n"))[1])["em_andamento"] == 0:
+            assert not lenta.done()
+            await asyncio.sleep(0.01)
+        # Uma vaga e fila zero: com a vaga ocupada, a próxima é recusada na hora
+        ocupado = await _requisicao(porta, *_post("/custos", XML_EXEMPLO.read_bytes()))
+        return ocupado, await lenta
+
+    (status, corpo), (status_lenta, _) = _com_servico(cenario, max_workers=1, max_simultaneos=1, max_fila=0)
+    assert status == 503
+    assert json.loads(corpo) == {"erro": "Serviço ocupado; tente novamente"}
+    assert status_lenta == 200